@@ -1,7 +1,12 @@
 -- OpenNSA SQL Schema (PostgreSQL) DELETEs
 -- This is mainly for development
 
+DELETE FROM generic_backend_connections_archive;
+DELETE FROM sub_connections_archive;
+DELETE FROM service_connections_archive;
 DELETE FROM generic_backend_connections;
+DELETE FROM notifications;
+DELETE FROM pending_reservations;
 DELETE FROM sub_connections;
 DELETE FROM service_connections;
 
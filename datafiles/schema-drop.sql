@@ -1,9 +1,15 @@
 -- OpenNSA SQL Schema (PostgreSQL) DROPs
 -- This is mainly for development
 
+DROP TABLE generic_backend_connections_archive;
+DROP TABLE sub_connections_archive;
+DROP TABLE service_connections_archive;
 DROP TABLE generic_backend_connections;
+DROP TABLE notifications;
+DROP TABLE pending_reservations;
 DROP TABLE sub_connections;
 DROP TABLE service_connections;
+DROP TABLE schema_version;
 DROP TYPE directionality;
 DROP TYPE security_attribute;
 DROP TYPE parameter;
@@ -20,6 +20,15 @@ CREATE TYPE security_attribute AS (
 CREATE TYPE directionality AS ENUM ('Bidirectional', 'Unidirectional');
 
 
+-- schema migrations applied to the database (see opennsa/migrations)
+-- this schema includes all migrations up to the version inserted at the end
+CREATE TABLE schema_version (
+    version                 integer                     PRIMARY KEY,
+    name                    text                        NOT NULL,
+    applied                 timestamp                   NOT NULL
+);
+
+
 -- publically reachable connections
 CREATE TABLE service_connections (
     id                      serial                      PRIMARY KEY,
@@ -47,9 +56,13 @@ CREATE TABLE service_connections (
     parameter               parameter[],
     security_attributes     security_attribute[],
     connection_trace        text[],
+    terminate_time          timestamp,
     CHECK ( start_time < end_time)
 );
 
+CREATE INDEX service_connections_requester_idx ON service_connections (requester_nsa, connection_id);
+CREATE INDEX service_connections_global_id_idx ON service_connections (requester_nsa, global_reservation_id) WHERE global_reservation_id IS NOT NULL;
+
 -- internal references to connections that are part of a service connection
 CREATE TABLE sub_connections (
     id                      serial                      PRIMARY KEY,
@@ -73,6 +86,41 @@ CREATE TABLE sub_connections (
     UNIQUE (provider_nsa, connection_id)
 );
 
+CREATE INDEX sub_connections_service_connection_idx ON sub_connections (service_connection_id, order_id);
+
+
+-- child reserve requests sent by the aggregator, which have not been confirmed / failed yet
+CREATE TABLE pending_reservations (
+    id                      serial                      PRIMARY KEY,
+    correlation_id          text                        NOT NULL UNIQUE,
+    service_connection_id   integer                     NOT NULL REFERENCES service_connections(id) ON DELETE CASCADE,
+    provider_nsa            text                        NOT NULL,
+    order_id                integer                     NOT NULL,
+    source_network          text                        NOT NULL,
+    source_port             text                        NOT NULL,
+    dest_network            text                        NOT NULL,
+    dest_port               text                        NOT NULL,
+    dispatch_time           timestamp                   NOT NULL
+);
+
+CREATE INDEX pending_reservations_service_connection_idx ON pending_reservations (service_connection_id);
+
+
+-- notifications sent to requesters, for queryNotification
+-- source is the aggregator or backend which sent the notification, notification ids are per source
+CREATE TABLE notifications (
+    id                      serial                      PRIMARY KEY,
+    source                  text                        NOT NULL,
+    connection_id           text                        NOT NULL,
+    notification_id         bigint                      NOT NULL,
+    notification_type       text                        NOT NULL,
+    timestamp               timestamp                   NOT NULL,
+    data                    text                        NOT NULL  -- json
+);
+
+CREATE INDEX notifications_connection_idx ON notifications (source, connection_id, notification_id);
+CREATE INDEX notifications_timestamp_idx ON notifications (source, timestamp);
+
 
 -- move this into the backend sometime
 CREATE TABLE generic_backend_connections (
@@ -100,9 +148,13 @@ CREATE TABLE generic_backend_connections (
     bandwidth               integer                     NOT NULL, -- mbps
     parameter               parameter[],
     allocated               boolean                     NOT NULL, -- indicated if the resources are actually allocated
+    terminate_time          timestamp,
     CHECK ( start_time < end_time)
 );
 
+CREATE INDEX generic_backend_connections_requester_idx ON generic_backend_connections (requester_nsa, id);
+CREATE INDEX generic_backend_connections_active_idx ON generic_backend_connections (id) WHERE lifecycle_state <> 'Terminated';
+
 
 -- Force this to only have a single row
 -- generate new id with:
@@ -115,3 +167,32 @@ CREATE TABLE backend_connection_id (
     connection_id           serial                      NOT NULL
 );
 
+
+-- terminated connections are moved to these after a while (see opennsa/archive.py)
+-- they must have the same columns, in the same order, as the tables they archive
+CREATE TABLE service_connections_archive (
+    LIKE service_connections INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id),
+    UNIQUE (connection_id)
+);
+CREATE INDEX service_connections_archive_global_id_idx ON service_connections_archive (requester_nsa, global_reservation_id) WHERE global_reservation_id IS NOT NULL;
+
+CREATE TABLE sub_connections_archive (
+    LIKE sub_connections INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id),
+    UNIQUE (provider_nsa, connection_id)
+);
+CREATE INDEX sub_connections_archive_service_connection_idx ON sub_connections_archive (service_connection_id, order_id);
+
+CREATE TABLE generic_backend_connections_archive (
+    LIKE generic_backend_connections INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id),
+    UNIQUE (connection_id)
+);
+CREATE INDEX generic_backend_connections_archive_global_id_idx ON generic_backend_connections_archive (requester_nsa, global_reservation_id) WHERE global_reservation_id IS NOT NULL;
+
+
+INSERT INTO schema_version (version, name, applied) VALUES
+    (1, 'pending-reservations-notifications', now() at time zone 'utc'),
+    (2, 'query-indexes',                      now() at time zone 'utc'),
+    (3, 'connection-archive',                 now() at time zone 'utc');
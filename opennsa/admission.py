@@ -0,0 +1,311 @@
+"""
+Admission control for requests to the aggregator.
+
+Sits in front of the aggregator (between it and the protocol layers), so a
+single requester cannot flood it, and starve the other requesters. Requesters
+are identified by the host DN of their certificate, or the requester NSA in the
+header if the request was not done over TLS with client certificates.
+
+Three limits are applied:
+
+- Request rate: Each requester has a token bucket, refilled at the configured
+  rate. Requests arriving when the bucket is empty are rejected.
+
+- In-flight reservations: The number of reservations per requester which have
+  been acked, but for which reserveConfirmed / reserveFailed has not been sent
+  yet. Reserve requests above the limit are rejected.
+
+- Concurrent requests: The number of requests being processed by the aggregator
+  at once. Requests above the limit are queued, with a queue per requester, and
+  the queues are served round-robin, so a requester with many requests queued
+  does not delay the requests of the others. Requests are rejected if the
+  requester queue is full.
+
+Rejected requests fail with RequestThrottledError (RESOURCE_UNAVAILABLE), which
+is sent to the requester as a service exception in the acknowledgement.
+
+Admissions and rejections are recorded in the metrics module as
+admission.admitted, admission.queued, admission.throttled.rate,
+admission.throttled.inflight, and admission.throttled.queue, along with the
+queue wait (admission.queue_wait) and the gauges admission.active,
+admission.queue_length, and admission.inflight_reservations.
+
+Copyright: NORDUnet (2026)
+"""
+
+from collections import OrderedDict, deque
+
+from twisted.python import log
+from twisted.internet import reactor, defer
+
+from opennsa import error
+from opennsa.shared import metrics
+
+
+
+LOG_SYSTEM = 'AdmissionControl'
+
+DEFAULT_RATE                        = 10.0  # requests / second / requester
+DEFAULT_BURST                       = 50    # requests
+DEFAULT_MAX_INFLIGHT_RESERVATIONS   = 50    # per requester
+DEFAULT_MAX_CONCURRENT_REQUESTS     = 100   # total
+DEFAULT_MAX_QUEUED_REQUESTS         = 200   # per requester
+
+INFLIGHT_TIMEOUT = 600 # seconds, in-flight reservations without an outcome are forgotten after this
+
+MAX_BUCKETS = 1000 # when there are more buckets than this, the full (idle) buckets are removed
+
+
+
+def requesterKey(header, request_info):
+    # the host dn is authenticated, the requester nsa is just what the requester claims to be
+    if request_info is not None and request_info.cert_host_dn:
+        return request_info.cert_host_dn
+    return header.requester_nsa
+
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst, now):
+        self.rate   = rate
+        self.burst  = burst
+        self.tokens = burst
+        self.timestamp = now
+
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+
+    def consume(self, now):
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+
+class AdmissionControl:
+
+    def __init__(self, service_provider, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_inflight_reservations=DEFAULT_MAX_INFLIGHT_RESERVATIONS,
+                 max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS, max_queued_requests=DEFAULT_MAX_QUEUED_REQUESTS):
+        # a limit of zero (or None) disables it
+        self.service_provider = service_provider
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight_reservations = max_inflight_reservations
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_queued_requests = max_queued_requests
+
+        self.clock = reactor
+
+        self.buckets = {}               # requester -> token bucket
+        self.queues = OrderedDict()     # requester -> deque of waiting requests, in round-robin order
+        self.active = 0                 # requests being processed by the service provider
+        self.inflight = {}              # requester -> number of in-flight reservations
+        self.reservations = {}          # connection id -> (requester, timeout call)
+
+        metrics.registerGauge('admission.active', lambda : self.active)
+        metrics.registerGauge('admission.queue_length', lambda : sum( len(q) for q in self.queues.values() ))
+        metrics.registerGauge('admission.inflight_reservations', lambda : sum(self.inflight.values()))
+
+
+    def __getattr__(self, attr):
+        # connection lookups and the like are not subject to admission control
+        return getattr(self.service_provider, attr)
+
+
+    def requesterFilter(self, parent_requester):
+        """
+        Returns the requester to use as parent requester for the service
+        provider, so in-flight reservations can be tracked.
+        """
+        return ReservationOutcomeFilter(self, parent_requester)
+
+
+    # limits
+
+    def _consumeToken(self, requester):
+
+        if not self.rate:
+            return True
+
+        now = self.clock.seconds()
+        bucket = self.buckets.get(requester)
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                for key, b in self.buckets.items():
+                    if b.full(now):
+                        del self.buckets[key]
+            bucket = self.buckets[requester] = TokenBucket(self.rate, self.burst, now)
+
+        return bucket.consume(now)
+
+
+    def _admit(self, requester, request_name, f, *args):
+
+        if not self._consumeToken(requester):
+            metrics.increment('admission.throttled.rate')
+            log.msg('Rejecting %s request from %s, request rate limit exceeded' % (request_name, requester), system=LOG_SYSTEM)
+            return defer.fail( error.RequestThrottledError('Request rate limit exceeded (%s requests per second), retry later' % self.rate) )
+
+        if self.max_concurrent_requests and (self.active >= self.max_concurrent_requests or self.queues):
+            queue = self.queues.get(requester)
+            if queue is None:
+                queue = self.queues[requester] = deque()
+            if self.max_queued_requests and len(queue) >= self.max_queued_requests:
+                metrics.increment('admission.throttled.queue')
+                log.msg('Rejecting %s request from %s, too many requests queued' % (request_name, requester), system=LOG_SYSTEM)
+                return defer.fail( error.RequestThrottledError('Too many outstanding requests (%i queued), retry later' % len(queue)) )
+
+            d = defer.Deferred()
+            queue.append( (d, f, args, self.clock.seconds()) )
+            metrics.increment('admission.queued')
+            return d
+
+        return self._run(f, args)
+
+
+    def _run(self, f, args):
+
+        self.active += 1
+        metrics.increment('admission.admitted')
+        d = defer.maybeDeferred(f, *args)
+        d.addBoth(self._requestDone)
+        return d
+
+
+    def _requestDone(self, result):
+        self.active -= 1
+        self._dispatch()
+        return result
+
+
+    def _dispatch(self):
+        # take one request from each requester queue in turn
+        while self.queues and self.active < self.max_concurrent_requests:
+            requester, queue = self.queues.popitem(last=False)
+            d, f, args, queued = queue.popleft()
+            if queue:
+                self.queues[requester] = queue # back of the line
+            metrics.observe('admission.queue_wait', self.clock.seconds() - queued)
+            self._run(f, args).chainDeferred(d)
+
+
+    # in-flight reservations
+
+    def _reservationAcked(self, connection_id, requester):
+        timeout_call = self.clock.callLater(INFLIGHT_TIMEOUT, self.reservationDone, connection_id)
+        self.reservations[connection_id] = (requester, timeout_call)
+        return connection_id
+
+
+    def _releaseInflight(self, requester):
+        self.inflight[requester] -= 1
+        if self.inflight[requester] == 0:
+            del self.inflight[requester]
+
+
+    def reservationDone(self, connection_id):
+        """
+        Called when the outcome of a reservation has been sent to the requester.
+        """
+        try:
+            requester, timeout_call = self.reservations.pop(connection_id)
+        except KeyError:
+            return # not a reservation tracked by us (or timed out)
+
+        if timeout_call.active():
+            timeout_call.cancel()
+        self._releaseInflight(requester)
+
+
+    # provider interface
+
+    def reserve(self, header, connection_id, global_reservation_id, description, criteria, request_info=None):
+
+        requester = requesterKey(header, request_info)
+
+        if self.max_inflight_reservations and self.inflight.get(requester, 0) >= self.max_inflight_reservations:
+            metrics.increment('admission.throttled.inflight')
+            log.msg('Rejecting reserve request from %s, too many reservations in progress' % requester, system=LOG_SYSTEM)
+            return defer.fail( error.RequestThrottledError('Too many reservations in progress (%i), retry later' % self.max_inflight_reservations) )
+
+        def reserveRejected(err):
+            self._releaseInflight(requester)
+            return err
+
+        self.inflight[requester] = self.inflight.get(requester, 0) + 1
+        d = self._admit(requester, 'reserve', self.service_provider.reserve, header, connection_id, global_reservation_id, description, criteria, request_info)
+        d.addCallbacks(self._reservationAcked, reserveRejected, callbackArgs=(requester,))
+        return d
+
+
+    def reserveCommit(self, header, connection_id, request_info=None):
+        return self._admit(requesterKey(header, request_info), 'reserveCommit', self.service_provider.reserveCommit, header, connection_id, request_info)
+
+
+    def reserveAbort(self, header, connection_id, request_info=None):
+        return self._admit(requesterKey(header, request_info), 'reserveAbort', self.service_provider.reserveAbort, header, connection_id, request_info)
+
+
+    def provision(self, header, connection_id, request_info=None):
+        return self._admit(requesterKey(header, request_info), 'provision', self.service_provider.provision, header, connection_id, request_info)
+
+
+    def release(self, header, connection_id, request_info=None):
+        return self._admit(requesterKey(header, request_info), 'release', self.service_provider.release, header, connection_id, request_info)
+
+
+    def terminate(self, header, connection_id, request_info=None):
+        return self._admit(requesterKey(header, request_info), 'terminate', self.service_provider.terminate, header, connection_id, request_info)
+
+
+    def querySummary(self, header, connection_ids=None, global_reservation_ids=None, request_info=None):
+        return self._admit(requesterKey(header, request_info), 'querySummary', self.service_provider.querySummary,
+                           header, connection_ids, global_reservation_ids, request_info)
+
+
+    def queryRecursive(self, header, connection_ids, global_reservation_ids, request_info=None):
+        return self._admit(requesterKey(header, request_info), 'queryRecursive', self.service_provider.queryRecursive,
+                           header, connection_ids, global_reservation_ids, request_info)
+
+
+    def queryNotification(self, header, connection_id, start_notification, end_notification):
+        return self._admit(requesterKey(header, None), 'queryNotification', self.service_provider.queryNotification,
+                           header, connection_id, start_notification, end_notification)
+
+
+
+class ReservationOutcomeFilter:
+    """
+    Parent requester for the service provider, which tells the admission control
+    when the outcome of a reservation is sent, and passes everything through to
+    the actual parent requester.
+    """
+    def __init__(self, admission_control, parent_requester):
+        self.admission_control = admission_control
+        self.parent_requester = parent_requester
+
+
+    def __getattr__(self, attr):
+        return getattr(self.parent_requester, attr)
+
+
+    def reserveConfirmed(self, header, connection_id, global_reservation_id, description, criteria):
+        self.admission_control.reservationDone(connection_id)
+        return self.parent_requester.reserveConfirmed(header, connection_id, global_reservation_id, description, criteria)
+
+
+    def reserveFailed(self, header, connection_id, connection_states, err):
+        self.admission_control.reservationDone(connection_id)
+        return self.parent_requester.reserveFailed(header, connection_id, connection_states, err)
+
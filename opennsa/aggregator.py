@@ -6,18 +6,31 @@ Copyright: NORDUnet (2011-2012)
 """
 import datetime
 
+from collections import OrderedDict
+
 from zope.interface import implements
 
 from twisted.python import log
-from twisted.internet import defer
+from twisted.internet import reactor, defer
 
 from opennsa.interface import INSIProvider, INSIRequester
-from opennsa import error, nsa, state, database, constants as cnt
+from opennsa import error, nsa, state, database, pendingreservations, notificationlog, constants as cnt
+from opennsa.shared import identitymap, querycache
 
 
 
 LOG_SYSTEM = 'Aggregator'
 
+MAX_CONCURRENT_RESERVES = 10 # outstanding reserve requests per child nsa
+
+QUERY_RECURSIVE_TIMEOUT = 60 # seconds, partial results are emitted if not all children have replied by then
+
+INTERRUPTED_RESERVE_AGE = datetime.timedelta(minutes=5) # checking reservations without pending children are considered interrupted after this
+
+# states where the connection is waiting for replies / timeouts, and must stay in the orm cache
+TRANSITIONAL_STATES = ( state.RESERVE_CHECKING, state.RESERVE_HELD, state.RESERVE_COMMITTING, state.RESERVE_ABORTING,
+                        state.PROVISIONING, state.RELEASING, state.TERMINATING )
+
 
 
 def shortLabel(label):
@@ -35,6 +48,11 @@ def shortLabel(label):
 
 
 
+def _inTransition(conn):
+    return conn.reservation_state in TRANSITIONAL_STATES or conn.provision_state in TRANSITIONAL_STATES or conn.lifecycle_state in TRANSITIONAL_STATES
+
+
+
 def _logErrorResponse(err, connection_id, provider_nsa, action):
 
     log.msg('Connection %s: Error during %s request to %s.' % (connection_id, action, provider_nsa), system=LOG_SYSTEM)
@@ -63,11 +81,53 @@ def _createAggregateException(connection_id, action, results, provider_urns, def
 
 
 
+class QueryRecursiveCollector:
+    """
+    Collects the child results for a queryRecursive request, until all children
+    have replied, or the request times out. There is one per request (parent
+    correlation id).
+    """
+    def __init__(self, header, connections):
+        self.header = header
+        self.connections = connections  # service connections, in request order
+        self.children = OrderedDict()   # child correlation id -> service connection key
+        self.results = {}               # child correlation id -> child result
+        self.timeout_call = None
+
+
+    def addChild(self, correlation_id, connection_key):
+        self.children[correlation_id] = connection_key
+
+
+    def addResult(self, correlation_id, result):
+        # returns true if all results are in
+        self.results[correlation_id] = result
+        return self.done()
+
+
+    def hasResult(self, correlation_id):
+        return correlation_id in self.results
+
+
+    def done(self):
+        return len(self.results) == len(self.children)
+
+
+    def missing(self):
+        return [ cid for cid in self.children if not cid in self.results ]
+
+
+    def childResults(self, connection_key):
+        # results for the sub connections of a connection, in sub connection order, missing results are left out
+        return [ self.results[cid] for cid, ck in self.children.items() if ck == connection_key and cid in self.results ]
+
+
+
 class Aggregator:
 
     implements(INSIProvider, INSIRequester)
 
-    def __init__(self, network, nsa_, network_topology, route_vectors, parent_requester, provider_registry, policies, plugin):
+    def __init__(self, network, nsa_, network_topology, route_vectors, parent_requester, provider_registry, policies, plugin, cache_size=None):
         self.network = network
         self.nsa_ = nsa_
         self.network_topology = network_topology
@@ -78,16 +138,78 @@ class Aggregator:
         self.policies           = policies
         self.plugin             = plugin
 
-        self.reservations       = {} # correlation_id -> info
-        self.notification_id    = 0
+        self.reservations       = pendingreservations.PendingReservations() # correlation_id -> info, persisted
+        self.reserve_semaphores = {} # provider urn -> semaphore bounding outstanding reserve requests
+        self.notification_id    = 0 # for query results, notifications get their id from the notification log
+        self.notification_log   = notificationlog.NotificationLog('aggregator')
 
         # db orm cache, needed to avoid concurrent updates stepping on each other
-        self.db_connections = {}
-        self.db_sub_connections = {}
+        self.db_connections     = identitymap.IdentityMap('aggregator.connection_cache',     cache_size, _inTransition) # connection_id -> conn
+        self.db_sub_connections = identitymap.IdentityMap('aggregator.sub_connection_cache', cache_size, _inTransition,
+                                                          index=lambda key : key[1]) # (provider_nsa, connection_id) -> sub conn
+
+        self.query_cache        = querycache.QueryCache('aggregator.query_cache') # querySummary results, invalidated on state changes
 
         # these are for query recursive, due to nsi being extremely crappy design
-        self.query_requests = {}
-        self.query_calls = {}
+        self.query_requests = {} # parent correlation id -> QueryRecursiveCollector
+        self.query_calls = {}    # child correlation id -> parent correlation id
+
+        self.clock = reactor
+
+
+    def restore(self, min_reserve_age=None):
+        """
+        Load child reservations that were pending when the service was stopped,
+        so their confirmations can be handled, and the notification log. Call
+        at startup, after the parent requester has been set.
+
+        Reservations which were acked, but had not sent any child reservations
+        when the service was stopped, are failed. When other processes can be
+        reserving at the same time, min_reserve_age should be given, so only
+        reservations older than that are considered interrupted (a second check
+        is done when that time has passed).
+        """
+        d = self.reservations.load()
+        d.addCallback(lambda _ : self.failInterruptedReservations(min_reserve_age))
+        if min_reserve_age is not None:
+            self.clock.callLater(min_reserve_age.total_seconds(), lambda : self.failInterruptedReservations(min_reserve_age).addErrback(log.err))
+        return defer.gatherResults( [ d, self.notification_log.load() ] )
+
+
+    @defer.inlineCallbacks
+    def failInterruptedReservations(self, min_reserve_age=None):
+        """
+        Fail reservations in ReserveChecking without any pending child
+        reservations. These were acked, but the process stopped before the
+        path was created, so no reply will ever arrive for them.
+        """
+        if min_reserve_age is None:
+            conns = yield database.ServiceConnection.find(where=['reservation_state = ?', state.RESERVE_CHECKING])
+        else:
+            cutoff = datetime.datetime.utcnow() - min_reserve_age
+            conns = yield database.ServiceConnection.find(where=['reservation_state = ? AND reserve_time < ?', state.RESERVE_CHECKING, cutoff])
+
+        for conn in conns:
+            if self.reservations.outstanding(conn.id):
+                continue # children will reply or time out
+            conn = self.db_connections.add(conn.connection_id, conn)
+            if conn.reservation_state != state.RESERVE_CHECKING:
+                continue # cached version has moved on
+
+            log.msg('Connection %s: Reservation was interrupted before child reservations were sent, failing it' % conn.connection_id, system=LOG_SYSTEM)
+            sub_connections = yield self.getSubConnectionsByConnectionKey(conn.id)
+            reserved = [ (sc.connection_id, sc.provider_nsa, None) for sc in sub_connections ]
+            header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn(), reply_to=conn.requester_url, security_attributes=conn.security_attributes)
+            err = error.ConnectionCreateError('Reservation was interrupted by a restart of %s, before it could be completed' % self.nsa_.urn())
+            yield self._reserveFailed(header, conn, err, reserved)
+
+
+    def flush(self):
+        """
+        Write outstanding pending reservations and notifications to the
+        database. Call before shutdown.
+        """
+        return defer.gatherResults( [ self.reservations.flush(), self.notification_log.flush() ] )
 
 
     def getNotificationId(self):
@@ -108,13 +230,13 @@ class Aggregator:
             # we should get 0 or 1 here since connection id is unique
             if len(connections) == 0:
                 return defer.fail( error.ConnectionNonExistentError('No connection with id %s' % connection_id) )
-            self.db_connections[connection_id] = connections[0]
-            return connections[0]
+            return self.db_connections.add(connection_id, connections[0])
 
-        if connection_id in self.db_connections:
-            return defer.succeed(self.db_connections[connection_id])
+        conn = self.db_connections.get(connection_id)
+        if conn is not None:
+            return defer.succeed(conn)
 
-        d = database.ServiceConnection.findBy(connection_id=connection_id)
+        d = database.findByWithArchive(database.ServiceConnection, database.ServiceConnectionArchive, connection_id=connection_id)
         d.addCallback(gotResult)
         return d
 
@@ -128,7 +250,7 @@ class Aggregator:
             conn = connections[0]
             return self.getConnection(conn.connection_id)
 
-        d = database.ServiceConnection.findBy(id=connection_key)
+        d = database.findByWithArchive(database.ServiceConnection, database.ServiceConnectionArchive, id=connection_key)
         d.addCallback(gotResult)
         return d
 
@@ -139,13 +261,13 @@ class Aggregator:
             # we should get 0 or 1 here since provider_nsa + connection id is unique
             if len(connections) == 0:
                 return defer.fail( error.ConnectionNonExistentError('No sub connection with connection id %s at provider %s' % (connection_id, provider_nsa) ) )
-            self.db_sub_connections[connection_id] = connections[0]
-            return connections[0]
+            return self.db_sub_connections.add( (provider_nsa, connection_id), connections[0])
 
-        if connection_id in self.db_sub_connections:
-            return defer.succeed(self.db_sub_connections[connection_id])
+        sub_conn = self.db_sub_connections.get( (provider_nsa, connection_id) )
+        if sub_conn is not None:
+            return defer.succeed(sub_conn)
 
-        d = database.SubConnection.findBy(provider_nsa=provider_nsa, connection_id=connection_id)
+        d = database.findByWithArchive(database.SubConnection, database.SubConnectionArchive, provider_nsa=provider_nsa, connection_id=connection_id)
         d.addCallback(gotResult)
         return d
 
@@ -162,12 +284,63 @@ class Aggregator:
             defs = [ self.getSubConnection(r['provider_nsa'], r['connection_id']) for r in rows ]
             return defer.DeferredList(defs).addCallback(gotSubConns)
 
+        def gotRows(rows, table):
+            if not rows and table == 'sub_connections':
+                return select('sub_connections_archive') # the service connection can be archived
+            return rows
+
+        def select(table):
+            d = dbconfig.select(table, where=['service_connection_id = ?', service_connection_key], select='provider_nsa, connection_id')
+            d.addCallback(gotRows, table)
+            return d
+
         dbconfig = database.Registry.getConfig()
-        d = dbconfig.select('sub_connections', where=['service_connection_id = ?', service_connection_key], select='provider_nsa, connection_id')
+        d = select('sub_connections')
+        d.addCallback(gotResult)
+        return d
+
+
+    def getSubConnectionsByConnectionKeys(self, service_connection_keys):
+        """
+        Bulk version of getSubConnectionsByConnectionKey. Fetches the sub
+        connections for all the service connections in one query. Returns dict:
+        service connection key -> [ sub connections ].
+        """
+        def gotResult(sub_connections):
+            # use the cached orm objects if there are any, as they can have changes not yet written
+            for sub_conns in sub_connections.values():
+                for idx, sc in enumerate(sub_conns):
+                    sub_conns[idx] = self.db_sub_connections.add( (sc.provider_nsa, sc.connection_id), sc)
+            return sub_connections
+
+        d = database.findSubConnections(service_connection_keys)
         d.addCallback(gotResult)
         return d
 
 
+    def connectionChanged(self, event):
+        """
+        Change feed listener for changes made by other processes (workers),
+        which makes the cached orm objects of the connection stale.
+        """
+        connection_id = event['connection_id']
+        if connection_id is None:
+            # events can have been missed, anything can be stale
+            self.db_connections.invalidateAll()
+            self.db_sub_connections.invalidateAll()
+        else:
+            # events have no provider nsa, so sub connections are invalidated by connection id
+            self.db_connections.invalidate(connection_id)
+            self.db_sub_connections.invalidateIndexed(connection_id)
+
+
+    def uncacheConnection(self, conn, sub_connections):
+        # terminated connections will not change anymore, no need to keep them around
+        self.db_connections.remove(conn.connection_id)
+        for sc in sub_connections:
+            self.db_sub_connections.remove( (sc.provider_nsa, sc.connection_id) )
+
+
     @defer.inlineCallbacks
     def reserve(self, header, connection_id, global_reservation_id, description, criteria, request_info=None):
 
@@ -235,6 +408,10 @@ class Aggregator:
                 if port.label().type_ != dest_stp.label.type_:
                     raise error.ConnectionCreateError('Source STP %s label does not match label specified on port %s (%s)' % (dest_stp, port.name, port.label().type_))
 
+        # check for hairpins (unless allowed in policies)
+        if source_stp.network == self.network and dest_stp.network == self.network and not cnt.ALLOW_HAIRPIN in self.policies:
+            if source_stp.port == dest_stp.port:
+                raise error.ServiceError('Hairpin connections not allowed.')
 
         connection_id = yield self.plugin.createConnectionId()
 
@@ -247,50 +424,74 @@ class Aggregator:
                             symmetrical=sd.symmetric, directionality=sd.directionality, bandwidth=sd.capacity,
                             security_attributes=header.security_attributes, connection_trace=header.connection_trace)
         yield conn.save()
+        yield state.reserveChecking(conn) # this also acts a lock
+        conn = self.db_connections.add(connection_id, conn)
 
-        # Here we should return / callback and spawn off the path creation
-
-        # Note: At his point STP Labels are candidates and they will need to be changed later
-
-    #    def reserveRequestsDone(results):
-    #        successes = [ r[0] for r in results ]
-    #        if all(successes):
-    #            state.reserved(conn)
-    #            log.msg('Connection %s: Reserve succeeded' % self.connection_id, system=LOG_SYSTEM)
-    #            self.scheduler.scheduleTransition(self.service_parameters.start_time, scheduled, state.RELEASED)
-    #            return self
-    #
-    #        else:
-    #            # terminate non-failed connections
-    #            # currently we don't try and be too clever about cleaning, just do it, and switch state
-    #            defs = []
-    #            reserved_connections = [ conn for success,conn in results if success ]
-    #            for rc in reserved_connections:
-    #                d = rc.terminate()
-    #                d.addCallbacks(
-    #                    lambda c : log.msg('Succesfully terminated sub connection after partial reservation failure %s %s' % (c.curator(), connPath(c)) , system=LOG_SYSTEM),
-    #                    lambda f : log.msg('Error terminating connection after partial-reservation failure: %s' % str(f), system=LOG_SYSTEM)
-    #                )
-    #                defs.append(d)
-    #            dl = defer.DeferredList(defs)
-    #            dl.addCallback( self.state.terminatedFailed )
-    #
-    #            err = self._createAggregateException(results, 'reservations', error.ConnectionCreateError)
-    #            raise err
+        # the request is persisted, ack it and do path creation and child reservations in the background
+        # the outcome is delivered via reserveConfirmed / reserveFailed, which must not happen before the ack has been sent
+        self.clock.callLater(0, self._reservePath, header, conn, criteria, request_info)
 
-        yield state.reserveChecking(conn) # this also acts a lock
+        log.msg('Connection %s: Reserve acked, creating path' % conn.connection_id, system=LOG_SYSTEM)
+        defer.returnValue(connection_id)
 
-        if conn.source_network == self.network and conn.dest_network == self.network:
-            # check for hairpins (unless allowed in policies)
-            if not cnt.ALLOW_HAIRPIN in self.policies:
-                if conn.source_port == conn.dest_port:
-                    raise error.ServiceError('Hairpin connections not allowed.')
 
+    def _getLocalProvider(self, port):
+        # with multiple backends, each port in the network is managed by one of them
+        try:
+            return self.provider_registry.getProviderByPort(self.network, port)
+        except error.STPResolutionError:
+            return self.nsa_.urn() # single backend, registered as this nsa
+
+
+    def _splitLocalLink(self, link):
+        """
+        Split a link in the local network into a link per backend, if the
+        ports are managed by different backends. The backends must be directly
+        connected, i.e., a port of the source backend must have a port of the
+        destination backend as remote port.
+        """
+        source_provider = self._getLocalProvider(link.src_stp.port)
+        dest_provider   = self._getLocalProvider(link.dst_stp.port)
+        if source_provider == dest_provider:
+            return [ link ]
+
+        ports = self.network_topology.bidirectional_ports
+        for port in ports:
+            if not port.hasRemote() or self._getLocalProvider(port.name) != source_provider:
+                continue
+            for remote_port in ports:
+                if remote_port.inbound_port.id_ == port.outbound_port.remote_port and self._getLocalProvider(remote_port.name) == dest_provider:
+                    log.msg('Link between backends via %s -> %s' % (port.name, remote_port.name), system=LOG_SYSTEM)
+                    # like for demarcation ports, the label is whatever the ports have
+                    return [ nsa.Link( link.src_stp, nsa.STP(self.network, port.name, port.label()) ),
+                             nsa.Link( nsa.STP(self.network, remote_port.name, remote_port.label()), link.dst_stp ) ]
+
+        raise error.STPResolutionError('No link between the backends managing port %s and %s' % (link.src_stp.port, link.dst_stp.port))
+
+
+    def _getReserveSemaphore(self, provider_urn):
+        try:
+            return self.reserve_semaphores[provider_urn]
+        except KeyError:
+            sem = self.reserve_semaphores[provider_urn] = defer.DeferredSemaphore(MAX_CONCURRENT_RESERVES)
+            return sem
+
+
+    @defer.inlineCallbacks
+    def _createPath(self, conn, criteria):
+        # path for a connection, list of links
+
+        sd = criteria.service_def
+        source_stp = sd.source_stp
+        dest_stp   = sd.dest_stp
+
+        if conn.source_network == self.network and conn.dest_network == self.network:
             # setup path
             path_info = ( conn.connection_id, self.network, conn.source_port, shortLabel(conn.source_label), conn.dest_port, shortLabel(conn.dest_label) )
             log.msg('Connection %s: Local link creation: %s %s?%s == %s?%s' % path_info, system=LOG_SYSTEM)
-            paths = [ [ nsa.Link( nsa.STP(self.network, conn.source_port, conn.source_label),
-                                  nsa.STP(self.network, conn.dest_port,   conn.dest_label))  ] ]
+            local_link = nsa.Link( nsa.STP(self.network, conn.source_port, conn.source_label),
+                                   nsa.STP(self.network, conn.dest_port,   conn.dest_label))
+            paths = [ self._splitLocalLink(local_link) ]
 
             # we should probably specify the connection id to the backend,
             # to make it seem like the aggregator isn't here
@@ -329,12 +530,12 @@ class Aggregator:
             local_link  = nsa.Link( local_stp, nsa.STP(local_stp.network, local_demarc_port, ldp.label()) )
             remote_link = nsa.Link( nsa.STP(remote_demarc_network, remote_demarc_port, ldp.label()), remote_stp) # # the ldp label isn't quite correct
 
-            paths = [ [ local_link, remote_link ] ]
+            paths = [ self._splitLocalLink(local_link) + [ remote_link ] ]
             paths = yield self.plugin.prunePaths(paths)
 
         elif cnt.AGGREGATOR in self.policies:
             # both endpoints outside the network, proxy aggregation allowed
-            log.msg('Connection %s: Remote proxy link creation' % connection_id, system=LOG_SYSTEM)
+            log.msg('Connection %s: Remote proxy link creation' % conn.connection_id, system=LOG_SYSTEM)
             paths = [ [ nsa.Link( nsa.STP(conn.source_network, conn.source_port, conn.source_label),
                                   nsa.STP(conn.dest_network,   conn.dest_port,   conn.dest_label))  ] ]
         else:
@@ -343,6 +544,7 @@ class Aggregator:
                 (source_stp.network, dest_stp.network, self.network))
 
 
+
         selected_path = paths[0] # shortest path (legacy structure)
         log_path = ' -> '.join( [ str(p) for p in selected_path ] )
         log.msg('Attempting to create path %s' % log_path, system=LOG_SYSTEM)
@@ -354,60 +556,107 @@ class Aggregator:
             if p is None:
                 raise error.ConnectionCreateError('No provider for network %s. Cannot create link.' % link.src_stp.network)
 
-        conn_trace = (header.connection_trace or []) + [ self.nsa_.urn() + ':' + conn.connection_id ]
-        conn_info = []
+        defer.returnValue(selected_path)
 
-        for idx, link in enumerate(selected_path):
 
-            sub_connection_id = None
+    @defer.inlineCallbacks
+    def _reservePath(self, header, conn, criteria, request_info):
+        # background stage of reserve: path creation and child reservations
+        # the reserve has been acked, so any failure must end in reserveFailed, or the requester never hears back
 
-            if link.src_stp.network == self.network:
-                provider_urn = self.nsa_.urn()
-                sub_connection_id = connection_id
-            else:
-                provider_urn = self.provider_registry.getProviderByNetwork(link.src_stp.network)
+        conn_info = [] # (reserve deferred, provider urn, correlation id) for each child asked
 
-            c_header = nsa.NSIHeader(self.nsa_.urn(), provider_urn, security_attributes=header.security_attributes, connection_trace=conn_trace)
+        try:
+            selected_path = yield self._createPath(conn, criteria)
 
-            sd = nsa.Point2PointService(link.src_stp, link.dst_stp, conn.bandwidth, sd.directionality, sd.symmetric)
+            conn_trace = (header.connection_trace or []) + [ self.nsa_.urn() + ':' + conn.connection_id ]
 
-            # save info for db saving
-            self.reservations[c_header.correlation_id] = {
-                                                        'provider_nsa'  : provider_urn,
-                                                        'service_connection_id' : conn.id,
-                                                        'order_id'       : idx,
-                                                        'source_network' : link.src_stp.network,
-                                                        'source_port'    : link.src_stp.port,
-                                                        'dest_network'   : link.dst_stp.network,
-                                                        'dest_port'      : link.dst_stp.port }
+            # a single local link gets the connection id of the aggregate, with multiple backends they create their own
+            local_links = [ link for link in selected_path if link.src_stp.network == self.network ]
 
-            crt = nsa.Criteria(criteria.revision, criteria.schedule, sd)
+            for idx, link in enumerate(selected_path):
 
-            provider = self.getProvider(provider_urn)
-            # note: request info will only be passed to local backends, remote requester will just ignore it
-            d = provider.reserve(c_header, sub_connection_id, conn.global_reservation_id, conn.description, crt, request_info)
-            d.addErrback(_logErrorResponse, connection_id, provider_urn, 'reserve')
+                sub_connection_id = None
 
-            conn_info.append( (d, provider_urn) )
+                if link.src_stp.network == self.network:
+                    provider_urn = self._getLocalProvider(link.src_stp.port)
+                    if len(local_links) == 1:
+                        sub_connection_id = conn.connection_id
+                else:
+                    provider_urn = self.provider_registry.getProviderByNetwork(link.src_stp.network)
 
-            # Don't bother trying to save connection here, wait for reserveConfirmed
+                c_header = nsa.NSIHeader(self.nsa_.urn(), provider_urn, security_attributes=header.security_attributes, connection_trace=conn_trace)
 
+                sd = nsa.Point2PointService(link.src_stp, link.dst_stp, conn.bandwidth, criteria.service_def.directionality, criteria.service_def.symmetric)
 
-        results = yield defer.DeferredList( [ c[0] for c in conn_info ], consumeErrors=True) # doesn't errback
-        successes = [ r[0] for r in results ]
+                provider = self.getProvider(provider_urn)
 
-        if all(successes):
-            log.msg('Connection %s: Reserve acked' % conn.connection_id, system=LOG_SYSTEM)
-            defer.returnValue(connection_id)
+                # save info for db saving
+                self.reservations[c_header.correlation_id] = {
+                                                            'provider_nsa'  : provider_urn,
+                                                            'service_connection_id' : conn.id,
+                                                            'order_id'       : idx,
+                                                            'source_network' : link.src_stp.network,
+                                                            'source_port'    : link.src_stp.port,
+                                                            'dest_network'   : link.dst_stp.network,
+                                                            'dest_port'      : link.dst_stp.port }
+
+                crt = nsa.Criteria(criteria.revision, criteria.schedule, sd)
+
+                # note: request info will only be passed to local backends, remote requester will just ignore it
+                # number of outstanding reserve requests is bounded per child nsa, so one slow child cannot get swamped
+                d = self._getReserveSemaphore(provider_urn).run(provider.reserve, c_header, sub_connection_id, conn.global_reservation_id, conn.description, crt, request_info)
+                d.addErrback(_logErrorResponse, conn.connection_id, provider_urn, 'reserve')
 
+                conn_info.append( (d, provider_urn, c_header.correlation_id) )
+
+                # Don't bother trying to save connection here, wait for reserveConfirmed
+
+            results = yield defer.DeferredList( [ c[0] for c in conn_info ], consumeErrors=True) # doesn't errback
+
+        except Exception as e:
+            log.msg('Connection %s: Error creating path / reserving: %s' % (conn.connection_id, str(e)), system=LOG_SYSTEM)
+            # children asked before the error can have acked, so wait for them, and terminate those that did
+            results = yield defer.DeferredList( [ c[0] for c in conn_info ], consumeErrors=True)
+            yield self._reservePathFailed(header, conn, conn_info, results, e)
+            return
+
+        if all( [ r[0] for r in results ] ):
+            log.msg('Connection %s: Reserve acked by all children' % conn.connection_id, system=LOG_SYSTEM)
         else:
+            # construct provider nsa urns, so we can produce a good error message
+            provider_urns = [ ci[1] for ci in conn_info ]
+            err = _createAggregateException(conn.connection_id, 'reservations', results, provider_urns, error.ConnectionCreateError)
+            yield self._reservePathFailed(header, conn, conn_info, results, err)
+
+
+    def _reservePathFailed(self, header, conn, conn_info, results, err):
+
+        # failed children will not send any confirmations, so forget about them
+        # the acked ones are terminated, and can reply before the terminate is done, their entries are removed after it
+        reserved_connections = []
+        for (success, sc_id), (_, provider_urn, correlation_id) in zip(results, conn_info):
+            if success:
+                reserved_connections.append( (sc_id, provider_urn, correlation_id) )
+            else:
+                self.reservations.pop(correlation_id, None)
+
+        return self._reserveFailed(header, conn, err, reserved_connections)
+
+
+    @defer.inlineCallbacks
+    def _reserveFailed(self, header, conn, err, reserved_connections=None):
+        # reserve failed before all children could be reserved, clean up, and tell the requester
+
+        try:
+            yield state.reserveFailed(conn)
+
             # I think this is out of spec, the aggregator shouldn't do anything here...
             # terminate non-failed connections
             # currently we don't try and be too clever about cleaning, just do it, and switch state
             yield state.terminating(conn)
             defs = []
-            reserved_connections = [ (sc_id, provider_urn) for (success,sc_id),(_,provider_urn) in zip(results, conn_info) if success ]
-            for (sc_id, provider_urn) in reserved_connections:
+            for (sc_id, provider_urn, _) in reserved_connections or []:
 
                 provider = self.getProvider(provider_urn)
                 t_header = nsa.NSIHeader(self.nsa_.urn(), provider_urn, security_attributes=header.security_attributes)
@@ -421,11 +670,17 @@ class Aggregator:
             dl = defer.DeferredList(defs)
             yield dl
             yield state.terminated(conn)
+            self.uncacheConnection(conn, [])
 
-            # construct provider nsa urns, so we can produce a good error message
-            provider_urns = [ ci[1] for ci in conn_info ]
-            err = _createAggregateException(connection_id, 'reservations', results, provider_urns, error.ConnectionCreateError)
-            raise err
+        except Exception as e:
+            log.msg('Connection %s: Error cleaning up after reserve failure: %s' % (conn.connection_id, str(e)), system=LOG_SYSTEM)
+
+        for (_, _, correlation_id) in reserved_connections or []:
+            self.reservations.pop(correlation_id, None)
+
+        header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn(), reply_to=conn.requester_url)
+        connection_states = (conn.reservation_state, conn.provision_state, conn.lifecycle_state, (False, 0, False))
+        self.parent_requester.reserveFailed(header, conn.connection_id, connection_states, err)
 
 
     @defer.inlineCallbacks
@@ -641,45 +896,52 @@ class Aggregator:
         log.msg('QuerySummary request from %s. CID: %s. GID: %s' % (header.requester_nsa, connection_ids, global_reservation_ids), system=LOG_SYSTEM)
 
         try:
-            if connection_ids:
-                conns = yield database.ServiceConnection.find(where=['requester_nsa = ? AND connection_id IN ?', header.requester_nsa, tuple(connection_ids) ] )
-            elif global_reservation_ids:
-                conns = yield database.ServiceConnection.find(where=['requester_nsa = ? AND global_reservation_ids IN ?', header.requester_nsa, tuple(global_reservation_ids) ] )
-            else:
-                conns = yield database.ServiceConnection.find(where=['requester_nsa = ?', header.requester_nsa ] )
+            # pollers often ask the same thing, so identical queries share the result
+            key = querycache.queryKey(header.requester_nsa, connection_ids, global_reservation_ids)
+            reservations = yield self.query_cache.get(key, lambda : self._querySummary(header.requester_nsa, connection_ids, global_reservation_ids))
+            self.parent_requester.querySummaryConfirmed(header, reservations)
+
+        except Exception as e:
+            log.msg('Error during querySummary request: %s' % str(e), system=LOG_SYSTEM)
+            raise e
 
-            # largely copied from genericbackend, merge later
-            reservations = []
-            for c in conns:
 
-                source_stp  = nsa.STP(c.source_network, c.source_port, c.source_label)
-                dest_stp    = nsa.STP(c.dest_network, c.dest_port, c.dest_label)
-                schedule    = nsa.Schedule(c.start_time, c.end_time)
-                sd          = nsa.Point2PointService(source_stp, dest_stp, c.bandwidth, cnt.BIDIRECTIONAL, False, None)
-                criteria    = nsa.QueryCriteria(c.revision, schedule, sd)
+    @defer.inlineCallbacks
+    def _querySummary(self, requester_nsa, connection_ids, global_reservation_ids):
+
+        # specific connections can be archived, all connections means the ones which are not
+        if connection_ids:
+            conns = yield database.findInWithArchive(database.ServiceConnection, database.ServiceConnectionArchive, 'connection_id', connection_ids,
+                                                     where=['requester_nsa = ?', requester_nsa])
+        elif global_reservation_ids:
+            conns = yield database.findInWithArchive(database.ServiceConnection, database.ServiceConnectionArchive, 'global_reservation_id', global_reservation_ids,
+                                                     where=['requester_nsa = ?', requester_nsa])
+        else:
+            conns = yield database.ServiceConnection.find(where=['requester_nsa = ?', requester_nsa ] )
 
-                sub_conns = yield self.getSubConnectionsByConnectionKey(c.id)
-                if len(sub_conns) == 0: # apparently this can happen
-                    data_plane_status = (False, 0, False)
-                else:
-                    aggr_active     = all( [ sc.data_plane_active     for sc in sub_conns ] )
-                    aggr_version    = max( [ sc.data_plane_version    for sc in sub_conns ] ) or 0 # can be None otherwise
-                    aggr_consistent = all( [ sc.data_plane_consistent for sc in sub_conns ] )
-                    data_plane_status = (aggr_active, aggr_version, aggr_consistent)
+        sub_connections = yield self.getSubConnectionsByConnectionKeys( [ c.id for c in conns ] )
 
-                states = (c.reservation_state, c.provision_state, c.lifecycle_state, data_plane_status)
-                notification_id = self.getNotificationId()
-                result_id = 0
+        # largely copied from genericbackend, merge later
+        reservations = []
+        for c in conns:
 
-                ci = nsa.ConnectionInfo(c.connection_id, c.global_reservation_id, c.description, cnt.EVTS_AGOLE, [ criteria ],
-                                        self.nsa_.urn(), c.requester_nsa, states, notification_id, result_id)
-                reservations.append(ci)
+            source_stp  = nsa.STP(c.source_network, c.source_port, c.source_label)
+            dest_stp    = nsa.STP(c.dest_network, c.dest_port, c.dest_label)
+            schedule    = nsa.Schedule(c.start_time, c.end_time)
+            sd          = nsa.Point2PointService(source_stp, dest_stp, c.bandwidth, cnt.BIDIRECTIONAL, False, None)
+            criteria    = nsa.QueryCriteria(c.revision, schedule, sd)
 
-            self.parent_requester.querySummaryConfirmed(header, reservations)
+            data_plane_status = database.aggregateDataPlaneStatus( sub_connections.get(c.id) )
 
-        except Exception as e:
-            log.msg('Error during querySummary request: %s' % str(e), system=LOG_SYSTEM)
-            raise e
+            states = (c.reservation_state, c.provision_state, c.lifecycle_state, data_plane_status)
+            notification_id = self.getNotificationId()
+            result_id = 0
+
+            ci = nsa.ConnectionInfo(c.connection_id, c.global_reservation_id, c.description, cnt.EVTS_AGOLE, [ criteria ],
+                                    self.nsa_.urn(), c.requester_nsa, states, notification_id, result_id)
+            reservations.append(ci)
+
+        defer.returnValue(reservations)
 
 
     @defer.inlineCallbacks
@@ -695,28 +957,42 @@ class Aggregator:
         if not connection_ids:
             raise error.MissingParameterError("At least one connection id must be specified, refusing to do recursive query for all connections")
 
-        # because segmenting the requests is a PITA
-        if len(connection_ids) > 1:
-            raise error.UnsupportedParameter("Can only perform queryRecursive for a single connection id.")
-
         try:
-            conn = yield self.getConnection(connection_ids[0])
+            conns = []
+            for connection_id in connection_ids:
+                conn = yield self.getConnection(connection_id)
+                conns.append(conn)
 
-            sub_connections = yield self.getSubConnectionsByConnectionKey(conn.id)
+            sub_connections = yield self.getSubConnectionsByConnectionKeys( [ conn.id for conn in conns ] )
 
             cb_header = nsa.NSIHeader(header.requester_nsa, self.nsa_.urn(), header.correlation_id, reply_to=header.reply_to, security_attributes=header.security_attributes)
-            self.query_requests[cb_header.correlation_id]  = (cb_header, conn, len(sub_connections) )
+            collector = QueryRecursiveCollector(cb_header, conns)
+
+            # register all children before sending anything, so early replies can be matched
+            calls = []
+            for conn in conns:
+                for sc in sub_connections.get(conn.id, []):
+                    sch = nsa.NSIHeader(self.nsa_.urn(), sc.provider_nsa, security_attributes=header.security_attributes)
+                    collector.addChild(sch.correlation_id, conn.id)
+                    self.query_calls[sch.correlation_id] = cb_header.correlation_id
+                    calls.append( (sc, sch) )
+
+            self.query_requests[cb_header.correlation_id] = collector
+
+            if collector.done():
+                # no sub connections, nothing to wait for
+                yield self._emitQueryRecursive(cb_header.correlation_id)
+                defer.returnValue(None)
+
+            collector.timeout_call = self.clock.callLater(QUERY_RECURSIVE_TIMEOUT, self._queryRecursiveTimeout, cb_header.correlation_id)
 
             defs = []
-            for sc in sub_connections:
+            for sc, sch in calls:
                 provider = self.getProvider(sc.provider_nsa)
-                sch = nsa.NSIHeader(self.nsa_.urn(), sc.provider_nsa, security_attributes=header.security_attributes)
                 d = provider.queryRecursive(sch, [ sc.connection_id ] , None, request_info)
                 d.addErrback(_logErrorResponse, 'queryRecursive', sc.provider_nsa, 'queryRecursive')
                 defs.append(d)
 
-                self.query_calls[sch.correlation_id] = (cb_header.correlation_id, None)
-
             results = yield defer.DeferredList(defs, consumeErrors=True)
             successes = [ r[0] for r in results ]
             if all(successes):
@@ -726,8 +1002,8 @@ class Aggregator:
             else:
                 n_success = sum( [ 1 for s in successes if s ] )
                 log.msg('QueryRecursive failure. %i of %i connections successfully replied' % (n_success, len(defs)), system=LOG_SYSTEM)
-                # we should really clear out the temporary state here...
-                provider_urns = [ sc.provider_nsa for sc in sub_connections ]
+                self._clearQueryRecursive(cb_header.correlation_id)
+                provider_urns = [ sc.provider_nsa for sc, _ in calls ]
                 raise _createAggregateException('', 'queryRecursive', results, provider_urns, error.ConnectionError)
 
         except ValueError as e:
@@ -735,84 +1011,103 @@ class Aggregator:
             raise e
 
 
-    @defer.inlineCallbacks
-    def queryRecursiveConfirmed(self, header, sub_result):
+    def _clearQueryRecursive(self, correlation_id):
+        # remove temporary query recursive state, returns the collector (None if already cleared)
+        collector = self.query_requests.pop(correlation_id, None)
+        if collector is None:
+            return None
 
-        @defer.inlineCallbacks
-        def createCQR(conn, children=None):
-            # can we make this generic?
-            c = conn
+        if collector.timeout_call is not None and collector.timeout_call.active():
+            collector.timeout_call.cancel()
+        for child_correlation_id in collector.children:
+            self.query_calls.pop(child_correlation_id, None)
+        return collector
 
-            source_stp = nsa.STP(c.source_network, c.source_port, c.source_label)
-            dest_stp = nsa.STP(c.dest_network, c.dest_port, c.dest_label)
 
-            schedule = nsa.Schedule(c.start_time, c.end_time)
-            sd = nsa.Point2PointService(source_stp, dest_stp, c.bandwidth, cnt.BIDIRECTIONAL, False, None, None)
+    def _createRecursiveConnectionInfo(self, conn, sub_connections, children):
+        # can we make this generic?
+        c = conn
 
-            criteria = nsa.QueryCriteria(c.revision, schedule, sd, children)
+        source_stp = nsa.STP(c.source_network, c.source_port, c.source_label)
+        dest_stp = nsa.STP(c.dest_network, c.dest_port, c.dest_label)
 
-            sub_conns = yield self.getSubConnectionsByConnectionKey(c.id)
-            if len(sub_conns) == 0: # apparently this can happen
-                data_plane_status = (False, 0, False)
-            else:
-                aggr_active     = all( [ sc.data_plane_active     for sc in sub_conns ] )
-                aggr_version    = max( [ sc.data_plane_version    for sc in sub_conns ] ) or 0 # can be None otherwise
-                aggr_consistent = all( [ sc.data_plane_consistent for sc in sub_conns ] )
-                data_plane_status = (aggr_active, aggr_version, aggr_consistent)
+        schedule = nsa.Schedule(c.start_time, c.end_time)
+        sd = nsa.Point2PointService(source_stp, dest_stp, c.bandwidth, cnt.BIDIRECTIONAL, False, None, None)
 
-            states = (c.reservation_state, c.provision_state, c.lifecycle_state, data_plane_status)
-            notification_id = self.getNotificationId()
-            result_id = notification_id
+        criteria = nsa.QueryCriteria(c.revision, schedule, sd, children)
 
-            ci = nsa.ConnectionInfo(c.connection_id, c.global_reservation_id, c.description, cnt.EVTS_AGOLE, [ criteria ],
-                                    self.nsa_.urn(), c.requester_nsa, states, notification_id, result_id)
-            defer.returnValue(ci)
+        data_plane_status = database.aggregateDataPlaneStatus(sub_connections)
 
-        # ---
+        states = (c.reservation_state, c.provision_state, c.lifecycle_state, data_plane_status)
+        notification_id = self.getNotificationId()
+        result_id = notification_id
 
-        log.msg('queryRecursiveConfirmed from %s.' % (header.provider_nsa,), system=LOG_SYSTEM)
+        return nsa.ConnectionInfo(c.connection_id, c.global_reservation_id, c.description, cnt.EVTS_AGOLE, [ criteria ],
+                                  self.nsa_.urn(), c.requester_nsa, states, notification_id, result_id)
 
-        if not header.correlation_id in self.query_calls:
-            log.msg('queryRecursiveConfirmed could not match correlation id %s' % header.correlation_id, system=LOG_SYSTEM)
+
+    @defer.inlineCallbacks
+    def _emitQueryRecursive(self, correlation_id):
+
+        collector = self._clearQueryRecursive(correlation_id)
+        if collector is None:
             return
 
-        cbh_correlation_id, res = self.query_calls[header.correlation_id]
-        if res:
-            log.msg('queryRecursiveConfirmed : Already have result for correlation id %s' % header.correlation_id, system=LOG_SYSTEM)
+        log.msg('QueryRecursive : Emitting to parent requester', system=LOG_SYSTEM)
+
+        sub_connections = yield self.getSubConnectionsByConnectionKeys( [ conn.id for conn in collector.connections ] )
+        results = [ self._createRecursiveConnectionInfo(conn, sub_connections.get(conn.id), collector.childResults(conn.id)) for conn in collector.connections ]
+        self.parent_requester.queryRecursiveConfirmed(collector.header, results)
+
+
+    def _queryRecursiveTimeout(self, correlation_id):
+
+        collector = self.query_requests.get(correlation_id)
+        if collector is None:
             return
 
-        # update temporary result structure
+        collector.timeout_call = None
+        missing = collector.missing()
+        log.msg('QueryRecursive : Timeout for %s, missing %i/%i child results, emitting partial result' % \
+                (correlation_id, len(missing), len(collector.children)), system=LOG_SYSTEM)
+        d = self._emitQueryRecursive(correlation_id)
+        d.addErrback(lambda err : log.msg('Error emitting partial queryRecursive result: %s' % err.getErrorMessage(), system=LOG_SYSTEM))
 
-        self.query_calls[header.correlation_id] = cbh_correlation_id, sub_result
 
-        # done updating
+    def queryRecursiveConfirmed(self, header, sub_result):
 
-        # check if all sub results have been received
-        cb_header, conn, count = self.query_requests[cbh_correlation_id]
-        scr = [ res[0] for cbhci, res in self.query_calls.values() if res and cbhci == cbh_correlation_id ]
+        log.msg('queryRecursiveConfirmed from %s.' % (header.provider_nsa,), system=LOG_SYSTEM)
 
-        if len(scr) == count:
-            # all results back, can emit
+        cbh_correlation_id = self.query_calls.get(header.correlation_id)
+        if cbh_correlation_id is None:
+            log.msg('queryRecursiveConfirmed could not match correlation id %s' % header.correlation_id, system=LOG_SYSTEM)
+            return defer.succeed(None)
 
-            # clear temporary structure
-            self.query_requests.pop(cbh_correlation_id)
-            for k,v in self.query_calls.items():
-                cbhci, res = v
-                if cbhci == cbh_correlation_id:
-                    self.query_calls.pop(k)
+        collector = self.query_requests[cbh_correlation_id]
+        if collector.hasResult(header.correlation_id):
+            log.msg('queryRecursiveConfirmed : Already have result for correlation id %s' % header.correlation_id, system=LOG_SYSTEM)
+            return defer.succeed(None)
 
-            log.msg('QueryRecursive : Emitting to parent requester', system=LOG_SYSTEM)
-            results = yield createCQR(conn, scr)
-            self.parent_requester.queryRecursiveConfirmed(cb_header, [ results ] )
+        # the child was queried for a single connection
+        if collector.addResult(header.correlation_id, sub_result[0]):
+            # all results back, can emit
+            return self._emitQueryRecursive(cbh_correlation_id)
 
-        else:
-            log.msg('QueryRecursive : Still neeed %i/%i results to emit result' % (count-len(scr), count), system=LOG_SYSTEM)
+        log.msg('QueryRecursive : Still neeed %i/%i results to emit result' % (len(collector.missing()), len(collector.children)), system=LOG_SYSTEM)
+        return defer.succeed(None)
 
 
+    @defer.inlineCallbacks
     def queryNotification(self, header, connection_id, start_notification, end_notification):
 
         log.msg('QueryNotification request from %s. CID: %s. %s-%s' % (header.requester_nsa, connection_id, start_notification, end_notification), system=LOG_SYSTEM)
-        raise NotImplementedError('queryNotification not yet implemented in aggregator')
+
+        conn = yield self.getConnection(connection_id)
+        if conn.requester_nsa != header.requester_nsa:
+            raise error.UnauthorizedError('Connection %s does not belong to requester %s' % (connection_id, header.requester_nsa))
+
+        notifications = yield self.notification_log.query(connection_id, start_notification, end_notification)
+        self.parent_requester.queryNotificationConfirmed(header, notifications)
 
     # --
     # Requester API
@@ -836,6 +1131,12 @@ class Aggregator:
 
         resv_info = self.reservations.pop(header.correlation_id)
 
+        conn = yield self.getConnectionByKey(resv_info['service_connection_id'])
+        if conn.lifecycle_state in (state.TERMINATING, state.TERMINATED):
+            # reservation failed at another child, and this one is being terminated
+            log.msg('Connection %s: reserveConfirmed from %s after reservation failure, ignoring' % (conn.connection_id, header.provider_nsa), system=LOG_SYSTEM)
+            return
+
         # gid and desc should be identical, not checking, same with bandwidth, schedule, etc
 
         sd = criteria.service_def
@@ -873,17 +1174,20 @@ class Aggregator:
 
         # figure out if we can aggregate upwards
 
-        conn = yield self.getConnectionByKey(sc.service_connection_id)
         sub_conns = yield self.getSubConnectionsByConnectionKey(conn.id)
 
+        # only write the labels, a full save could write a state another confirmation is switching to
+        labels = {}
         if sc.order_id == 0:
-            conn.source_label = sd.source_stp.label
+            labels['source_label'] = sd.source_stp.label
         if sc.order_id == len(sub_conns)-1:
-            conn.dest_label = sd.dest_stp.label
+            labels['dest_label'] = sd.dest_stp.label
 
-        yield conn.save()
+        if labels:
+            yield state.saveColumns(conn, labels)
+        self.query_cache.invalidate(conn.requester_nsa)
 
-        outstanding_calls = [ v for v in self.reservations.values() if v.get('service_connection_id') == resv_info['service_connection_id'] ]
+        outstanding_calls = self.reservations.outstanding(resv_info['service_connection_id'])
         if len(outstanding_calls) > 0:
             log.msg('Connection %s: Still missing %i reserveConfirmed call(s) to aggregate' % (conn.connection_id, len(outstanding_calls)), system=LOG_SYSTEM)
             return
@@ -925,6 +1229,11 @@ class Aggregator:
         service_connection_key = resv_info['service_connection_id']
 
         conn = yield self.getConnectionByKey(service_connection_key)
+        if conn.lifecycle_state in (state.TERMINATING, state.TERMINATED):
+            # reservation failed at another child, the requester has been told
+            log.msg('Connection %s: reserveFailed from %s after reservation failure, ignoring' % (conn.connection_id, header.provider_nsa), system=LOG_SYSTEM)
+            return
+
         if conn.reservation_state != state.RESERVE_FAILED: # since we can fail multiple times
             yield state.reserveFailed(conn)
 
@@ -939,8 +1248,7 @@ class Aggregator:
         log.msg('ReserveCommit Confirmed for sub connection %s. NSA %s ' % (connection_id, header.provider_nsa), system=LOG_SYSTEM)
 
         sub_connection = yield self.getSubConnection(header.provider_nsa, connection_id)
-        sub_connection.reservation_state = state.RESERVE_START
-        yield sub_connection.save()
+        yield state.saveColumns(sub_connection, { 'reservation_state' : state.RESERVE_START })
 
         conn = yield self.getConnectionByKey(sub_connection.service_connection_id)
         sub_conns = yield self.getSubConnectionsByConnectionKey(conn.id)
@@ -960,8 +1268,7 @@ class Aggregator:
         log.msg('ReserveAbort confirmed for sub connection %s. NSA %s ' % (connection_id, header.provider_nsa), system=LOG_SYSTEM)
 
         sub_connection = yield self.getSubConnection(header.provider_nsa, connection_id)
-        sub_connection.reservation_state = state.RESERVE_START
-        yield sub_connection.save()
+        yield state.saveColumns(sub_connection, { 'reservation_state' : state.RESERVE_START })
 
         conn = yield self.getConnectionByKey(sub_connection.service_connection_id)
         sub_conns = yield self.getSubConnectionsByConnectionKey(conn.id)
@@ -1015,8 +1322,7 @@ class Aggregator:
     def terminateConfirmed(self, header, connection_id):
 
         sub_connection = yield self.getSubConnection(header.provider_nsa, connection_id)
-        sub_connection.lifecycle_state = state.TERMINATED
-        yield sub_connection.save()
+        yield state.saveColumns(sub_connection, { 'lifecycle_state' : state.TERMINATED })
 
         conn = yield self.getConnectionByKey(sub_connection.service_connection_id)
         sub_conns = yield self.getSubConnectionsByConnectionKey(conn.id)
@@ -1024,6 +1330,7 @@ class Aggregator:
         # if we get responses very close, multiple requests can trigger this, so we check main state as well
         if all( [ sc.lifecycle_state == state.TERMINATED for sc in sub_conns ] ) and conn.lifecycle_state != state.TERMINATED:
             yield state.terminated(conn)
+            self.uncacheConnection(conn, sub_conns)
             header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn())
             self.parent_requester.terminateConfirmed(header, conn.connection_id)
             self.plugin.connectionTerminated(conn)
@@ -1031,17 +1338,26 @@ class Aggregator:
     # --
 
 
-    def doTimeout(self, conn, timeout_value, org_connection_id, org_nsa):
+    def doTimeout(self, conn, timeout_value, org_connection_id, org_nsa, timestamp=None):
         header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn(), reply_to=conn.requester_url)
-        now = datetime.datetime.utcnow()
-        self.parent_requester.reserveTimeout(header, conn.connection_id, 0, now, timeout_value, org_connection_id, org_nsa)
+        now = timestamp or datetime.datetime.utcnow()
+        notification_id = self.notification_log.append(conn.connection_id, notificationlog.RESERVE_TIMEOUT, now, (timeout_value, org_connection_id, org_nsa))
+        self.parent_requester.reserveTimeout(header, conn.connection_id, notification_id, now, timeout_value, org_connection_id, org_nsa)
 
 
-    def doErrorEvent(self, conn, notification_id, event, info, service_ex=None):
+    def doErrorEvent(self, conn, event, info, service_ex=None):
         header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn(), reply_to=conn.requester_url)
         now = datetime.datetime.utcnow()
+        notification_id = self.notification_log.append(conn.connection_id, notificationlog.ERROR_EVENT, now, (event, info, service_ex))
         self.parent_requester.errorEvent(header, conn.connection_id, notification_id, now, event, info, service_ex)
 
+
+    def doDataPlaneStateChange(self, conn, data_plane_status):
+        header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn(), reply_to=conn.requester_url)
+        now = datetime.datetime.utcnow()
+        notification_id = self.notification_log.append(conn.connection_id, notificationlog.DATA_PLANE_STATE_CHANGE, now, (data_plane_status,))
+        self.parent_requester.dataPlaneStateChange(header, conn.connection_id, notification_id, now, data_plane_status)
+
     # --
 
     @defer.inlineCallbacks
@@ -1060,8 +1376,7 @@ class Aggregator:
             log.msg("Connection %s: reserveTimeout: Connection has already failed, not notifying parent" % conn.connection_id, system=LOG_SYSTEM)
         elif sum ( [ 1 if sc.reservation_state == state.RESERVE_TIMEOUT else 0 for sc in sub_conns ] ) == 1:
             log.msg("Connection %s: reserveTimeout, first occurance, notifying parent" % conn.connection_id, system=LOG_SYSTEM)
-            header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn(), reply_to=conn.requester_url)
-            self.parent_requester.reserveTimeout(header, conn.connection_id, notification_id, timestamp, timeout_value, org_connection_id, org_nsa)
+            self.doTimeout(conn, timeout_value, org_connection_id, org_nsa, timestamp)
         else:
             log.msg("Connection %s: reserveTimeout: Second or later reserveTimeout, not notifying parent" % conn.connection_id, system=LOG_SYSTEM)
 
@@ -1075,14 +1390,11 @@ class Aggregator:
 
         sub_conn = yield self.getSubConnection(header.provider_nsa, connection_id)
 
-        sub_conn.data_plane_active      = active
-        sub_conn.data_plane_version     = version
-        sub_conn.data_plane_consistent  = consistent
-
-        yield sub_conn.save()
+        yield state.saveColumns(sub_conn, { 'data_plane_active' : active, 'data_plane_version' : version, 'data_plane_consistent' : consistent })
 
         conn = yield self.getConnectionByKey(sub_conn.service_connection_id)
         sub_conns = yield self.getSubConnectionsByConnectionKey(conn.id)
+        self.query_cache.invalidate(conn.requester_nsa) # aggregated data plane status is not saved on the connection
 
         # At some point we should check if data plane aggregated state actually changes and only emit for those that change
 
@@ -1092,14 +1404,12 @@ class Aggregator:
         aggr_version    = max( [ sc.data_plane_version    for sc in sub_conns ] )
         aggr_consistent = all( [ sc.data_plane_consistent for sc in sub_conns ] ) and all( [ a == actives[0] for a in actives ] ) # we need version here
 
-        header = nsa.NSIHeader(conn.requester_nsa, self.nsa_.urn(), reply_to=conn.requester_url)
-        now = datetime.datetime.utcnow()
         data_plane_status = (aggr_active, aggr_version, aggr_consistent)
 
         log.msg("Connection %s: Aggregated data plane status: Active %s, version %s, consistent %s" % \
             (conn.connection_id, aggr_active, aggr_version, aggr_consistent), system=LOG_SYSTEM)
 
-        self.parent_requester.dataPlaneStateChange(header, conn.connection_id, 0, now, data_plane_status)
+        self.doDataPlaneStateChange(conn, data_plane_status)
 
     #@defer.inlineCallbacks
     def error(self, header, nsa_id, connection_id, service_type, error_id, text, variables, child_ex):
@@ -1131,7 +1441,7 @@ class Aggregator:
 
         if len(sub_conns) == 1:
             log.msg("errorEvent: One sub connection for connection %s, notifying" % conn.connection_id, system=LOG_SYSTEM)
-            self.doErrorEvent(conn, notification_id, event, info, service_ex)
+            self.doErrorEvent(conn, event, info, service_ex)
         else:
             raise NotImplementedError('Cannot handle errorEvent for connection with more than one sub connection')
 
@@ -1140,6 +1450,12 @@ class Aggregator:
         raise NotImplementedError('querySummaryConfirmed is not yet implemented in aggregater')
 
 
+    def queryNotificationConfirmed(self, header, notifications):
+        # notifications from children are handled (and logged in the notification log of the aggregator) as they arrive,
+        # queryNotification is answered from that log, so the aggregator does not query children, and has no use for the result
+        log.msg('QueryNotification result from %s with %i notifications, ignoring' % (header.provider_nsa, len(notifications)), system=LOG_SYSTEM)
+
+
     def queryNotificationFailed(self, header, service_exception):
-        raise NotImplementedError('queryNotificationFailed is not yet implemented in aggregater')
+        log.msg('QueryNotification to %s failed: %s, ignoring' % (header.provider_nsa, service_exception), system=LOG_SYSTEM)
 
@@ -0,0 +1,112 @@
+"""
+Archiving of terminated connections.
+
+Terminated connections are never changed again, but they are read by every
+scan of the connection tables (querySummary without ids, the REST and web
+listings, and so on), which slows down as the history grows. The archiver
+moves connections which were terminated more than a while ago (the archive
+age) from the connection tables to archive tables with the same columns, in
+batches, in the background.
+
+Lookups of specific connections (by connection id, key, or global reservation
+id) fall back to the archive tables, see database.findByWithArchive and
+database.findInWithArchive, so archived connections can still be queried.
+Scans of all connections (of a requester) only see the connection tables.
+
+Connections terminated before the terminate time was recorded, are archived
+based on their end time (or reserve time, if they have no end time).
+
+Copyright: NORDUnet (2026)
+"""
+
+import datetime
+
+from twisted.python import log
+from twisted.internet import defer, task, reactor
+from twisted.application import service
+
+from twistar.registry import Registry
+
+from opennsa import state
+from opennsa.shared import metrics, querycache
+
+
+
+LOG_SYSTEM = 'Archive'
+
+DEFAULT_ARCHIVE_AGE = datetime.timedelta(days=30)
+ARCHIVE_INTERVAL    = 3600  # seconds
+BATCH_SIZE          = 500   # connections per transaction
+
+# table -> [ (child table, column referencing the table) ], children are moved along with their connection
+AGGREGATOR_TABLES   = ( 'service_connections', [ ('sub_connections', 'service_connection_id') ] )
+BACKEND_TABLES      = ( 'generic_backend_connections', [] )
+
+SELECT_SQL  = 'SELECT id FROM %s WHERE lifecycle_state = %%s AND coalesce(terminate_time, end_time, reserve_time) < %%s ' + \
+              'ORDER BY id LIMIT %%s FOR UPDATE SKIP LOCKED'
+MOVE_SQL    = 'WITH moved AS (DELETE FROM %s WHERE %s = ANY(%%s) RETURNING *) INSERT INTO %s_archive SELECT * FROM moved'
+
+
+
+def _archiveBatch(txn, table, children, cutoff, batch_size):
+
+    txn.execute(SELECT_SQL % table, (state.TERMINATED, cutoff, batch_size))
+    ids = [ row[0] for row in txn.fetchall() ]
+    if not ids:
+        return 0
+
+    for child, column in children:
+        txn.execute(MOVE_SQL % (child, column, child), (ids,))
+    txn.execute(MOVE_SQL % (table, 'id', table), (ids,))
+    return len(ids)
+
+
+
+class Archiver(service.Service):
+
+    def __init__(self, tables=(AGGREGATOR_TABLES, BACKEND_TABLES), archive_age=DEFAULT_ARCHIVE_AGE, interval=ARCHIVE_INTERVAL):
+        self.tables = tables
+        self.archive_age = archive_age
+        self.interval = interval
+        self.call = task.LoopingCall(self.archive)
+
+
+    def startService(self):
+        reactor.callWhenRunning(self.call.start, self.interval)
+        service.Service.startService(self)
+
+
+    def stopService(self):
+        if self.call.running:
+            self.call.stop()
+        service.Service.stopService(self)
+
+
+    @defer.inlineCallbacks
+    def archive(self):
+        """
+        Move the connections terminated before the archive age to the archive
+        tables. Returns a deferred with the number of archived connections.
+        """
+        cutoff = datetime.datetime.utcnow() - self.archive_age
+        total = 0
+
+        try:
+            for table, children in self.tables:
+                # one transaction per batch, so rows are not locked for long
+                while True:
+                    n = yield Registry.DBPOOL.runInteraction(_archiveBatch, table, children, cutoff, BATCH_SIZE)
+                    total += n
+                    metrics.increment('archive.' + table, n)
+                    if n < BATCH_SIZE:
+                        break
+        except Exception as e:
+            # keep going, the rest will be archived next time
+            log.msg('Error archiving connections: %s' % str(e), system=LOG_SYSTEM)
+
+        if total:
+            querycache.invalidate() # queries of all connections have changed
+            log.msg('Archived %i connections terminated before %s' % (total, cutoff.replace(microsecond=0)), system=LOG_SYSTEM)
+
+        defer.returnValue(total)
+
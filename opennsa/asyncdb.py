@@ -0,0 +1,275 @@
+"""
+Non-blocking PostgreSQL connection pool.
+
+The adbapi connection pool runs every query in a thread from its thread pool,
+so each query means two thread handoffs, and the number of queries in progress
+is limited by the (small) thread pool. This pool uses asynchronous psycopg2
+connections instead, which are polled from the reactor, like any other socket.
+
+Queries (runQuery / runOperation) are put in a queue, and sent as soon as one
+of the connections is idle, so up to the number of connections can be in
+progress at a time, without any threads involved. Async connections are always
+in autocommit mode, which is the same as the adbapi pool does for these
+(a transaction per query).
+
+Interactions (runInteraction) use blocking cursors, so they cannot be done on
+async connections, and still go through the adbapi thread pool. This is what
+twistar uses, so ORM operations are not affected. The adapters and composite
+casters (label, security_attribute, timestamps) are registered globally, and
+work on both kinds of connections.
+
+Copyright: NORDUnet (2026)
+"""
+
+from collections import deque
+
+from zope.interface import implements
+
+from twisted.python import log, failure
+from twisted.internet import reactor, defer
+from twisted.internet.interfaces import IReadDescriptor, IWriteDescriptor
+from twisted.enterprise import adbapi
+
+import psycopg2
+from psycopg2 import extensions
+
+
+
+LOG_SYSTEM = 'opennsa.AsyncDB'
+
+DEFAULT_CONNECTIONS = 10
+
+
+
+class AsyncConnection:
+    """
+    A single asynchronous psycopg2 connection, which can do one query at a
+    time.
+    """
+    implements(IReadDescriptor, IWriteDescriptor)
+
+    def __init__(self, reactor_=None):
+        self.reactor = reactor_ or reactor
+        self.connection = None
+        self.cursor = None
+        self._deferred = None   # fired when the current operation is done
+        self._reading = False
+        self._writing = False
+
+
+    def connect(self, **kwargs):
+
+        def connected(_):
+            self.cursor = self.connection.cursor()
+            return self
+
+        self.connection = psycopg2.connect(async_=True, **kwargs)
+        d = self._wait()
+        d.addCallback(connected)
+        return d
+
+
+    def execute(self, query, args=None):
+
+        def done(_):
+            # rows if the query returns any, like adbapi runQuery
+            if self.cursor.description is not None:
+                return self.cursor.fetchall()
+
+        try:
+            self.cursor.execute(query, args)
+        except Exception:
+            return defer.fail()
+
+        d = self._wait()
+        d.addCallback(done)
+        return d
+
+
+    def closed(self):
+        return self.connection is None or self.connection.closed != 0
+
+
+    def close(self):
+        self._stop()
+        if not self.closed():
+            self.connection.close()
+
+
+    # polling
+
+    def _wait(self):
+        d = self._deferred = defer.Deferred()
+        self._poll() # can fire the deferred right away
+        return d
+
+
+    def _fire(self, result):
+        self._stop()
+        d, self._deferred = self._deferred, None
+        if d is not None:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+    def _poll(self):
+        try:
+            state = self.connection.poll()
+        except Exception:
+            self._fire(failure.Failure())
+            return
+
+        if state == extensions.POLL_OK:
+            self._fire(None)
+        elif state == extensions.POLL_READ:
+            self._watch(read=True)
+        elif state == extensions.POLL_WRITE:
+            self._watch(write=True)
+        else:
+            self._fire(failure.Failure(psycopg2.OperationalError('Unexpected poll state: %s' % state)))
+
+
+    def _watch(self, read=False, write=False):
+        if read != self._reading:
+            (self.reactor.addReader if read else self.reactor.removeReader)(self)
+            self._reading = read
+        if write != self._writing:
+            (self.reactor.addWriter if write else self.reactor.removeWriter)(self)
+            self._writing = write
+
+
+    def _stop(self):
+        self._watch(read=False, write=False)
+
+
+    # descriptor interface
+
+    def fileno(self):
+        # -1 when closed (e.g., by the server), the reactor then finds the descriptor without it
+        if self.closed():
+            return -1
+        return self.connection.fileno()
+
+
+    def doRead(self):
+        self._poll()
+
+
+    def doWrite(self):
+        self._poll()
+
+
+    def connectionLost(self, reason):
+        self._fire(reason)
+
+
+    def logPrefix(self):
+        return LOG_SYSTEM
+
+
+
+class AsyncConnectionPool(adbapi.ConnectionPool):
+    """
+    Connection pool which does queries and operations on asynchronous
+    connections, and interactions in the adbapi thread pool. Can be used as
+    twistar Registry.DBPOOL.
+    """
+    def __init__(self, dbapiName, connections=DEFAULT_CONNECTIONS, **connkw):
+        adbapi.ConnectionPool.__init__(self, dbapiName, **connkw)
+
+        self.async_size = connections
+        self.connect_kwargs = dict( (k,v) for k,v in connkw.items() if not k.startswith('cp_') )
+
+        # the adbapi pool uses connections for its own (thread) connections
+        self.async_connections = []     # established connections
+        self.async_idle = []            # connections not doing anything
+        self.async_connecting = 0
+        self.async_queue = deque()      # (query, args, deferred) waiting for a connection
+        self.async_dispatching = False
+
+
+    def runQuery(self, query, args=None):
+        return self._enqueue(query, args)
+
+
+    def runOperation(self, query, args=None):
+        d = self._enqueue(query, args)
+        d.addCallback(lambda _ : None)
+        return d
+
+
+    def close(self):
+        adbapi.ConnectionPool.close(self)
+        for conn in self.async_connections:
+            conn.close()
+        self.async_connections = []
+        self.async_idle = []
+        while self.async_queue:
+            self.async_queue.popleft()[2].errback(psycopg2.InterfaceError('Connection pool closed'))
+
+
+    def _enqueue(self, query, args):
+        d = defer.Deferred()
+        self.async_queue.append( (query, args, d) )
+        self._dispatch()
+        return d
+
+
+    def _dispatch(self):
+
+        # queries can complete right away (and their callbacks do new queries), so this is not reentrant, the outer call will pick it up
+        if self.async_dispatching:
+            return
+        self.async_dispatching = True
+        try:
+            while self.async_queue and self.async_idle:
+                conn = self.async_idle.pop()
+                query, args, d = self.async_queue.popleft()
+                self._execute(conn, query, args, d)
+        finally:
+            self.async_dispatching = False
+
+        # open more connections if there are waiting queries
+        while len(self.async_queue) > self.async_connecting and len(self.async_connections) + self.async_connecting < self.async_size:
+            self._connect()
+
+
+    def _execute(self, conn, query, args, d):
+
+        def done(result):
+            if conn.closed():
+                # broken connection, a new one will be made if needed
+                log.msg('Database connection lost', system=LOG_SYSTEM)
+                self.async_connections.remove(conn)
+            else:
+                self.async_idle.append(conn)
+            self._dispatch()
+            return result
+
+        e = conn.execute(query, args)
+        e.addBoth(done)
+        e.chainDeferred(d)
+
+
+    def _connect(self):
+
+        def connected(conn):
+            self.async_connecting -= 1
+            self.async_connections.append(conn)
+            self.async_idle.append(conn)
+            self._dispatch()
+
+        def connectFailed(err):
+            self.async_connecting -= 1
+            log.msg('Error connecting to database: %s' % err.getErrorMessage(), system=LOG_SYSTEM)
+            if not self.async_connections and not self.async_connecting:
+                # nothing to run the waiting queries on
+                while self.async_queue:
+                    self.async_queue.popleft()[2].errback(err)
+
+        self.async_connecting += 1
+        d = defer.maybeDeferred(AsyncConnection().connect, **self.connect_kwargs)
+        d.addCallbacks(connected, connectFailed)
+
@@ -23,7 +23,8 @@ from twisted.application import service
 
 from opennsa.interface import INSIProvider
 
-from opennsa import constants as cnt, error, state, nsa, authz
+from opennsa import constants as cnt, error, state, nsa, authz, database, notificationlog
+from opennsa.shared import querycache, metrics
 from opennsa.backends.common import scheduler, calendar
 
 from twistar.dbobject import DBObject
@@ -34,6 +35,11 @@ class GenericBackendConnections(DBObject):
     pass
 
 
+# terminated connections are moved here after a while, see the archive module
+class GenericBackendConnectionsArchive(GenericBackendConnections):
+    TABLENAME = 'generic_backend_connections_archive'
+
+
 
 class GenericBackend(service.Service):
 
@@ -44,6 +50,8 @@ class GenericBackend(service.Service):
     # Yeah, it should be much less, but some NRMs are that slow
     TPC_TIMEOUT = 120 # seconds
 
+    QUERY_PAGE_SIZE = 1000 # connections read from the database at a time when querying
+
     def __init__(self, network, nrm_ports, connection_manager, parent_requester, log_system, minimum_duration=60):
 
         self.network            = network
@@ -52,19 +60,44 @@ class GenericBackend(service.Service):
         self.parent_requester   = parent_requester
         self.log_system         = log_system
         self.minimum_duration   = minimum_duration
+        self.provider_nsa       = None # identity in notifications, see setIdentity
 
-        self.notification_id = 0
+        self.notification_id = 0 # for query results, notifications get their id from the notification log
+        self.notification_log = notificationlog.NotificationLog('backend:' + network)
+        self.query_cache = querycache.QueryCache('backend.query_cache') # querySummary results, invalidated on state changes
 
         self.scheduler = scheduler.CallScheduler()
         self.calendar  = calendar.ReservationCalendar()
-        # need to build the calendar as well
 
-        # need to build schedule here
         self.restore_defer = defer.Deferred()
-        reactor.callWhenRunning(self.buildSchedule)
+
+
+    def setIdentity(self, provider_nsa, name):
+        """
+        Set the identity of the backend, for when several backends manage the
+        network. Notifications are then sent with the urn of the backend as
+        provider, and the backend gets its own notification log and query
+        cache. Must be called before the service is started.
+        """
+        self.provider_nsa = provider_nsa
+        self.notification_log = notificationlog.NotificationLog('backend:%s:%s' % (self.network, name))
+        metrics.unregisterGauge(self.query_cache.name + '.size')
+        self.query_cache = querycache.QueryCache('backend.%s.query_cache' % name)
+
+
+    def _notificationHeader(self, conn, correlation_id=None):
+        # without an identity, the nsa is both requester and provider in the backend, but this might be problematic without aggregator
+        provider_nsa = self.provider_nsa or conn.requester_nsa
+        return nsa.NSIHeader(conn.requester_nsa, provider_nsa, correlation_id=correlation_id)
 
 
     def startService(self):
+        # the calendar and schedule are built when the service starts, not when it is created, as only
+        # the leader runs the backend with multiple workers (and it can be restarted when leadership moves)
+        if self.restore_defer.called:
+            self.calendar = calendar.ReservationCalendar()
+            self.restore_defer = defer.Deferred()
+        reactor.callWhenRunning(self.buildSchedule)
         service.Service.startService(self)
 
 
@@ -72,9 +105,11 @@ class GenericBackend(service.Service):
         service.Service.stopService(self)
         if self.restore_defer.called:
             self.scheduler.cancelAllCalls()
-            return defer.succeed(None)
+            return self.notification_log.flush()
         else:
-            return self.restore_defer.addCallback( lambda _ : self.scheduler.cancelAllCalls() )
+            d = self.restore_defer.addCallback( lambda _ : self.scheduler.cancelAllCalls() )
+            d.addCallback( lambda _ : self.notification_log.flush() )
+            return d
 
 
     def getNotificationId(self):
@@ -86,8 +121,12 @@ class GenericBackend(service.Service):
     @defer.inlineCallbacks
     def buildSchedule(self):
 
+        yield self.notification_log.load() # before anything can send notifications
+
         conns = yield GenericBackendConnections.find(where=['lifecycle_state <> ?', state.TERMINATED])
         for conn in conns:
+            if not self._ownsConnection(conn):
+                continue # belongs to another backend in the network
             # avoid race with newly created connections
             if self.scheduler.hasScheduledCall(conn.connection_id):
                 continue
@@ -173,12 +212,18 @@ class GenericBackend(service.Service):
     def _getConnection(self, connection_id, requester_nsa):
         # add security check sometime
 
-        conns = yield GenericBackendConnections.findBy(connection_id=connection_id)
-        if len(conns) == 0:
+        conns = yield database.findByWithArchive(GenericBackendConnections, GenericBackendConnectionsArchive, connection_id=connection_id)
+        if len(conns) == 0 or not self._ownsConnection(conns[0]):
             raise error.ConnectionNonExistentError('No connection with id %s' % connection_id)
         defer.returnValue( conns[0] ) # we only get one, unique in db
 
 
+    def _ownsConnection(self, conn):
+        # several backends can manage ports in the same network (and share the connection table),
+        # each backend only handles the connections on its own ports
+        return conn.source_port in self.nrm_ports
+
+
     def _authorize(self, source_port, destination_port, header, request_info, start_time=None, end_time=None):
         """
         Checks if port usage is allowed from the credentials provided in the
@@ -371,9 +416,7 @@ class GenericBackend(service.Service):
             raise error.ConnectionGoneError('Connection %s has been terminated')
 
         # the switch to reserve start and allocated must be in same transaction
-        # state.reserveMultiSwitch will save the state, including the allocated flag
-        conn.allocated = True
-        yield state.reserveMultiSwitch(conn, state.RESERVE_COMMITTING, state.RESERVE_START)
+        yield state.reserveMultiSwitch(conn, state.RESERVE_COMMITTING, state.RESERVE_START, allocated=True)
 
         self.logStateUpdate(conn, 'COMMIT/RESERVED')
 
@@ -402,7 +445,7 @@ class GenericBackend(service.Service):
 
         yield self._doReserveRollback(conn)
 
-        header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
+        header = self._notificationHeader(conn)
         self.parent_requester.reserveAbortConfirmed(header, conn.connection_id)
 
 
@@ -509,7 +552,7 @@ class GenericBackend(service.Service):
             yield self._doFreeResource(conn)
 
         # here the reply will practially always come before the ack
-        header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
+        header = self._notificationHeader(conn)
         yield self.parent_requester.terminateConfirmed(header, conn.connection_id)
 
         yield state.terminated(conn)
@@ -520,7 +563,8 @@ class GenericBackend(service.Service):
     @defer.inlineCallbacks
     def querySummary(self, header, connection_ids=None, global_reservation_ids=None, request_info=None):
 
-        reservations = yield self._query(header, connection_ids, global_reservation_ids)
+        key = querycache.queryKey(header.requester_nsa, connection_ids, global_reservation_ids)
+        reservations = yield self.query_cache.get(key, lambda : self._query(header, connection_ids, global_reservation_ids))
         self.parent_requester.querySummaryConfirmed(header, reservations)
 
 
@@ -534,36 +578,57 @@ class GenericBackend(service.Service):
     @defer.inlineCallbacks
     def _query(self, header, connection_ids, global_reservation_ids, request_info=None):
         # generic query mechanism for summary and recursive
+        # without connection ids or global reservation ids, all connections of the requester are returned
 
         # TODO: Match stps/ports that can be used with credentials and return connections using these STPs
-        if connection_ids:
-            conns = yield GenericBackendConnections.find(where=['requester_nsa = ? AND connection_id IN ?', header.requester_nsa, tuple(connection_ids) ])
-        elif global_reservation_ids:
-            conns = yield GenericBackendConnections.find(where=['requester_nsa = ? AND global_reservation_ids IN ?', header.requester_nsa, tuple(global_reservation_ids) ])
-        else:
-            raise error.MissingParameterError('Must specify connectionId or globalReservationId')
-
+        if connection_ids or global_reservation_ids:
+            # specific connections can be archived
+            column, values = ('connection_id', connection_ids) if connection_ids else ('global_reservation_id', global_reservation_ids)
+            conns = yield database.findInWithArchive(GenericBackendConnections, GenericBackendConnectionsArchive, column, values,
+                                                     where=['requester_nsa = ?', header.requester_nsa], orderby='id')
+            defer.returnValue( [ self._connectionInfo(c) for c in conns if self._ownsConnection(c) ] )
+
+        # all connections (which are not archived), with keyset pagination, so large results are not read in one go,
+        # only one page of ORM rows is loaded at a time, but the result (one connection info per connection) is built in full
         reservations = []
-        for c in conns:
-            source_stp = nsa.STP(c.source_network, c.source_port, c.source_label)
-            dest_stp   = nsa.STP(c.dest_network, c.dest_port, c.dest_label)
-            schedule   = nsa.Schedule(c.start_time, c.end_time)
-            sd         = nsa.Point2PointService(source_stp, dest_stp, c.bandwidth, cnt.BIDIRECTIONAL, False, None)
-            criteria   = nsa.QueryCriteria(c.revision, schedule, sd)
-            data_plane_status = ( c.data_plane_active, c.revision, True )
-            states = (c.reservation_state, c.provision_state, c.lifecycle_state, data_plane_status)
-            notification_id = self.getNotificationId()
-            result_id = notification_id # whatever
-            provider_nsa = cnt.URN_OGF_PREFIX + self.network.replace('topology', 'nsa') # hack on
-            reservations.append( nsa.ConnectionInfo(c.connection_id, c.global_reservation_id, c.description, cnt.EVTS_AGOLE, [ criteria ],
-                                                    provider_nsa, c.requester_nsa, states, notification_id, result_id) )
+        last_id = 0
+        while True:
+            conns = yield GenericBackendConnections.find(where=[ 'requester_nsa = ? AND id > ?', header.requester_nsa, last_id ], orderby='id', limit=self.QUERY_PAGE_SIZE)
+            reservations.extend( self._connectionInfo(c) for c in conns if self._ownsConnection(c) )
+            if len(conns) < self.QUERY_PAGE_SIZE:
+                break
+            last_id = conns[-1].id
 
         defer.returnValue(reservations)
 
 
+    def _connectionInfo(self, c):
+
+        source_stp = nsa.STP(c.source_network, c.source_port, c.source_label)
+        dest_stp   = nsa.STP(c.dest_network, c.dest_port, c.dest_label)
+        schedule   = nsa.Schedule(c.start_time, c.end_time)
+        sd         = nsa.Point2PointService(source_stp, dest_stp, c.bandwidth, cnt.BIDIRECTIONAL, False, None)
+        criteria   = nsa.QueryCriteria(c.revision, schedule, sd)
+        data_plane_status = ( c.data_plane_active, c.revision, True )
+        states = (c.reservation_state, c.provision_state, c.lifecycle_state, data_plane_status)
+        notification_id = self.getNotificationId()
+        result_id = notification_id # whatever
+        provider_nsa = cnt.URN_OGF_PREFIX + self.network.replace('topology', 'nsa') # hack on
+        return nsa.ConnectionInfo(c.connection_id, c.global_reservation_id, c.description, cnt.EVTS_AGOLE, [ criteria ],
+                                  provider_nsa, c.requester_nsa, states, notification_id, result_id)
+
+
     @defer.inlineCallbacks
     def queryNotification(self, header, connection_id, start_notification=None, end_notification=None):
-        raise NotImplementedError('QueryNotification not implemented in generic backend.')
+
+        log.msg('QueryNotification request from %s. CID: %s. %s-%s' % (header.requester_nsa, connection_id, start_notification, end_notification), system=self.log_system)
+
+        conn = yield self._getConnection(connection_id, header.requester_nsa)
+        if conn.requester_nsa != header.requester_nsa:
+            raise error.UnauthorizedError('Connection %s does not belong to requester %s' % (connection_id, header.requester_nsa))
+
+        notifications = yield self.notification_log.query(connection_id, start_notification, end_notification)
+        self.parent_requester.queryNotificationConfirmed(header, notifications)
 
     # --
 
@@ -592,7 +657,7 @@ class GenericBackend(service.Service):
         sd = nsa.Point2PointService(sc_source_stp, sc_dest_stp, conn.bandwidth, cnt.BIDIRECTIONAL, False, None) # we fake some things due to db limitations
         crit = nsa.Criteria(conn.revision, schedule, sd)
 
-        header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa, correlation_id=correlation_id) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
+        header = self._notificationHeader(conn, correlation_id)
         yield self.parent_requester.reserveConfirmed(header, conn.connection_id, conn.global_reservation_id, conn.description, crit)
 
 
@@ -605,10 +670,10 @@ class GenericBackend(service.Service):
 
             yield self._doReserveRollback(conn)
 
-            header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
+            header = self._notificationHeader(conn)
             now = datetime.datetime.utcnow()
-            # the conn.requester_nsa is somewhat problematic - the backend should really know its identity
-            self.parent_requester.reserveTimeout(header, conn.connection_id, self.getNotificationId(), now, self.TPC_TIMEOUT, conn.connection_id, conn.requester_nsa)
+            notification_id = self.notification_log.append(conn.connection_id, notificationlog.RESERVE_TIMEOUT, now, (self.TPC_TIMEOUT, conn.connection_id, header.provider_nsa))
+            self.parent_requester.reserveTimeout(header, conn.connection_id, notification_id, now, self.TPC_TIMEOUT, conn.connection_id, header.provider_nsa)
 
         except Exception as e:
             log.msg('Error in reserveTimeout: %s: %s' % (type(e), e), system=self.log_system)
@@ -661,19 +726,18 @@ class GenericBackend(service.Service):
             #log.err(e) # note: this causes error in tests
             log.msg('Connection %s: Error activating data plane: %s' % (conn.connection_id, str(e)), system=self.log_system)
             # should include stack trace
-            conn.data_plane_active = False
-            yield conn.save()
+            yield state.saveNotify(conn, { 'data_plane_active' : False })
 
-            header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
+            header = self._notificationHeader(conn)
             now = datetime.datetime.utcnow()
             service_ex = None
-            self.parent_requester.errorEvent(header, conn.connection_id, self.getNotificationId(), now, 'activateFailed', None, service_ex)
+            notification_id = self.notification_log.append(conn.connection_id, notificationlog.ERROR_EVENT, now, ('activateFailed', None, service_ex))
+            self.parent_requester.errorEvent(header, conn.connection_id, notification_id, now, 'activateFailed', None, service_ex)
 
             defer.returnValue(None)
 
         try:
-            conn.data_plane_active = True
-            yield conn.save()
+            yield state.saveNotify(conn, { 'data_plane_active' : True })
             log.msg('Connection %s: Data plane activated' % (conn.connection_id), system=self.log_system)
 
             # we might have passed end time during activation...
@@ -690,8 +754,9 @@ class GenericBackend(service.Service):
 
             data_plane_status = (True, conn.revision, True) # active, version, consistent
             now = datetime.datetime.utcnow()
-            header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
-            self.parent_requester.dataPlaneStateChange(header, conn.connection_id, self.getNotificationId(), now, data_plane_status)
+            header = self._notificationHeader(conn)
+            notification_id = self.notification_log.append(conn.connection_id, notificationlog.DATA_PLANE_STATE_CHANGE, now, (data_plane_status,))
+            self.parent_requester.dataPlaneStateChange(header, conn.connection_id, notification_id, now, data_plane_status)
         except Exception, e:
             log.msg('Error in post-activation: %s: %s' % (type(e), e), system=self.log_system)
             log.err(e)
@@ -710,25 +775,25 @@ class GenericBackend(service.Service):
             # We need to mark failure in state machine here somehow....
             log.msg('Connection %s: Error deactivating data plane: %s' % (conn.connection_id, str(e)), system=self.log_system)
             # should include stack trace
-            conn.data_plane_active = False # technically we don't know, but for NSI that means not active
-            yield conn.save()
+            yield state.saveNotify(conn, { 'data_plane_active' : False }) # technically we don't know, but for NSI that means not active
 
-            header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
+            header = self._notificationHeader(conn)
             now = datetime.datetime.utcnow()
             service_ex = None
-            self.parent_requester.errorEvent(header, conn.connection_id, self.getNotificationId(), now, 'deactivateFailed', None, service_ex)
+            notification_id = self.notification_log.append(conn.connection_id, notificationlog.ERROR_EVENT, now, ('deactivateFailed', None, service_ex))
+            self.parent_requester.errorEvent(header, conn.connection_id, notification_id, now, 'deactivateFailed', None, service_ex)
 
             defer.returnValue(None)
 
         try:
-            conn.data_plane_active = False # technically we don't know, but for NSI that means not active
-            yield conn.save()
+            yield state.saveNotify(conn, { 'data_plane_active' : False }) # technically we don't know, but for NSI that means not active
             log.msg('Connection %s: Data planed deactivated' % (conn.connection_id), system=self.log_system)
 
             now = datetime.datetime.utcnow()
             data_plane_status = (False, conn.revision, True) # active, version, onsistent
-            header = nsa.NSIHeader(conn.requester_nsa, conn.requester_nsa) # The NSA is both requester and provider in the backend, but this might be problematic without aggregator
-            self.parent_requester.dataPlaneStateChange(header, conn.connection_id, self.getNotificationId(), now, data_plane_status)
+            header = self._notificationHeader(conn)
+            notification_id = self.notification_log.append(conn.connection_id, notificationlog.DATA_PLANE_STATE_CHANGE, now, (data_plane_status,))
+            self.parent_requester.dataPlaneStateChange(header, conn.connection_id, notification_id, now, data_plane_status)
 
         except Exception as e:
             log.msg('Error in post-deactivation: %s' % e)
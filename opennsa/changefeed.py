@@ -0,0 +1,253 @@
+"""
+Change feed for connection state changes.
+
+state.saveNotify publishes a small event for every connection it saves, and
+the listeners (added with addListener) get the events. The listener in the
+state module invalidates the query caches, and calls the subscribers of the
+connection (REST longpoll and auto commit).
+
+Without a feed service, events only go to the listeners in this process. With
+PostgreSQL storage, ChangeFeed publishes the events with NOTIFY as well, and
+LISTENs for events from other OpenNSA processes using the same database, so
+these see the state changes promptly, without polling. Events are delivered to
+the listeners in the publishing process right away, and skipped when they come
+back through the database.
+
+An event is a dict with the connection id, requester nsa, and the changed
+state columns (if any), e.g.:
+
+{ "connection_id" : "...", "requester_nsa" : "...", "reservation_state" : "ReserveHeld" }
+
+Listeners added with addRemoteListener only get the events from other
+processes. The aggregator uses this to invalidate its cached connections, which
+are stale after another process has changed them.
+
+The feed reconnects if the listen connection is lost. Events sent while it is
+down are lost, so listeners get an event without connection id after
+reconnecting, meaning anything can have changed.
+
+Copyright: NORDUnet (2026)
+"""
+
+import json
+import uuid
+
+from twisted.python import log, failure
+from twisted.internet import reactor
+from twisted.application import service
+
+from twistar.registry import Registry
+
+from opennsa import asyncdb
+from opennsa.shared import metrics
+
+
+
+LOG_SYSTEM = 'ChangeFeed'
+
+CHANNEL = 'opennsa_changes'
+RECONNECT_DELAY = 5 # seconds
+
+ORIGIN = uuid.uuid4().hex[:12] # identifies this process in published events
+
+EVENT_COLUMNS = ('reservation_state', 'provision_state', 'lifecycle_state', 'data_plane_active')
+
+_listeners = []
+_remote_listeners = []
+_feed = None # running ChangeFeed, if any
+
+
+
+def addListener(f):
+    _listeners.append(f)
+
+
+def removeListener(f):
+    _listeners.remove(f)
+
+
+def addRemoteListener(f):
+    _remote_listeners.append(f)
+
+
+def removeRemoteListener(f):
+    _remote_listeners.remove(f)
+
+
+def changeEvent(connection_id, requester_nsa=None, values=None):
+    """
+    Create an event for a connection. Values (column -> value) are the columns
+    that changed, only state columns are included.
+    """
+    event = { 'connection_id' : connection_id, 'requester_nsa' : requester_nsa }
+    for column in EVENT_COLUMNS:
+        if values and column in values:
+            event[column] = values[column]
+    return event
+
+
+def deliver(event, listeners=_listeners):
+    """
+    Call the listeners with an event.
+    """
+    for f in list(listeners):
+        try:
+            f(event)
+        except Exception as e:
+            log.msg('Error delivering change event: %s' % str(e), system=LOG_SYSTEM)
+
+
+def deliverRemote(event):
+    """
+    Call the listeners with an event from another process.
+    """
+    deliver(event, _remote_listeners)
+    deliver(event)
+
+
+def publish(event):
+    """
+    Deliver an event to the listeners in this process, and to other processes
+    if the feed service is running.
+    """
+    deliver(event)
+    if _feed is not None:
+        _feed.publish(event)
+
+
+
+class _ListenConnection(asyncdb.AsyncConnection):
+    """
+    Async connection which keeps reading notifications when it is not doing
+    a query.
+    """
+    def __init__(self, received, lost):
+        asyncdb.AsyncConnection.__init__(self)
+        self.received = received
+        self.lost = lost
+
+
+    def listen(self, channel):
+        d = self.execute('LISTEN %s' % channel)
+        d.addCallback(lambda _ : self._watch(read=True))
+        return d
+
+
+    def doRead(self):
+        if self._deferred is not None:
+            self._poll() # connecting or listening
+            return
+        try:
+            self.connection.poll()
+        except Exception:
+            self.close()
+            self.lost(failure.Failure())
+            return
+        while self.connection.notifies:
+            self.received(self.connection.notifies.pop(0).payload)
+
+
+    def connectionLost(self, reason):
+        if self._deferred is not None:
+            asyncdb.AsyncConnection.connectionLost(self, reason)
+        else:
+            self.close()
+            self.lost(reason)
+
+
+
+class ChangeFeed(service.Service):
+    """
+    Publishes change events with PostgreSQL NOTIFY, and delivers the events
+    of other processes to the listeners in this process.
+    """
+    def __init__(self, database, user, password=None, host=None, channel=CHANNEL, origin=ORIGIN, deliver=deliverRemote):
+        self.connect_kwargs = dict(database=database, user=user, password=password, host=host)
+        self.channel = channel
+        self.origin = origin
+        self.deliver = deliver
+        self.connection = None
+        self.connected = False # has been listening (to tell reconnects)
+        self.reconnect_call = None
+
+
+    def startService(self):
+        global _feed
+        _feed = self
+        service.Service.startService(self)
+        return self._connect()
+
+
+    def stopService(self):
+        global _feed
+        if _feed is self:
+            _feed = None
+        if self.reconnect_call is not None and self.reconnect_call.active():
+            self.reconnect_call.cancel()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        service.Service.stopService(self)
+
+
+    def publish(self, event):
+        event = dict(event, origin=self.origin)
+        d = Registry.DBPOOL.runOperation('SELECT pg_notify(%s, %s)', (self.channel, json.dumps(event)))
+        d.addCallbacks(lambda _ : metrics.increment('changefeed.published'),
+                       lambda err : log.msg('Error publishing change event: %s' % err.getErrorMessage(), system=LOG_SYSTEM))
+        return d
+
+
+    def _connect(self):
+
+        self.reconnect_call = None
+        conn = _ListenConnection(self._received, self._lost)
+
+        def listening(_):
+            if not self.running:
+                conn.close()
+                return
+            self.connection = conn
+            log.msg('Listening for change events on %s' % self.channel, system=LOG_SYSTEM)
+            if self.connected:
+                # events sent while disconnected are lost
+                self.deliver(changeEvent(None))
+            self.connected = True
+
+        def failed(err):
+            log.msg('Error listening for change events: %s' % err.getErrorMessage(), system=LOG_SYSTEM)
+            conn.close()
+            self._reconnect()
+
+        d = conn.connect(**self.connect_kwargs)
+        d.addCallback(lambda _ : conn.listen(self.channel))
+        d.addCallbacks(listening, failed)
+        return d
+
+
+    def _reconnect(self):
+        if self.running and self.reconnect_call is None:
+            self.reconnect_call = reactor.callLater(RECONNECT_DELAY, self._connect)
+
+
+    def _lost(self, reason):
+        log.msg('Change event connection lost: %s' % reason.getErrorMessage(), system=LOG_SYSTEM)
+        self.connection = None
+        self._reconnect()
+
+
+    def _received(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            log.msg('Invalid change event: %s' % payload, system=LOG_SYSTEM)
+            return
+
+        if event.pop('origin', None) == self.origin:
+            return # delivered when published
+
+        metrics.increment('changefeed.received')
+        # json gives unicode, opennsa uses str
+        event = dict( (str(k), v.encode('utf-8') if type(v) is unicode else v) for k, v in event.items() )
+        self.deliver(event)
+
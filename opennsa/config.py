@@ -6,9 +6,11 @@ Copyright: NORDUnet (2011)
 """
 
 import os
+import tempfile
 import ConfigParser
 
 from opennsa import constants as cnt
+from opennsa.protocols.shared import xmlbackend
 
 
 
@@ -21,6 +23,27 @@ DEFAULT_TCP_PORT        = 9080
 DEFAULT_TLS_PORT        = 9443
 DEFAULT_VERIFY          = True
 DEFAULT_CERTIFICATE_DIR = '/etc/ssl/certs' # This will work on most mordern linux distros
+DEFAULT_PRETTY_XML      = True
+DEFAULT_MAX_PAYLOAD_SIZE     = 16 * 1024 * 1024 # bytes
+DEFAULT_MAX_PAYLOAD_ELEMENTS = 500000
+DEFAULT_XML_WORKERS          = 4 # with lxml, the pool is disabled with etree
+DEFAULT_XML_WORKER_THRESHOLD = 256 * 1024 # bytes
+DEFAULT_CONNECTION_CACHE_SIZE = 10000
+DEFAULT_QUERY_CACHE_TTL  = 2.0 # seconds
+DEFAULT_REQUEST_RATE            = 10.0  # requests / second / requester
+DEFAULT_REQUEST_BURST           = 50
+DEFAULT_MAX_INFLIGHT_RESERVATIONS = 50  # per requester
+DEFAULT_MAX_CONCURRENT_REQUESTS = 100
+DEFAULT_MAX_QUEUED_REQUESTS     = 200   # per requester
+DEFAULT_DATABASE_STORAGE        = 'postgresql'
+DEFAULT_DATABASE_DRIVER         = 'threads'
+DEFAULT_DATABASE_POOL_SIZE      = 5
+DEFAULT_DATABASE_ASYNC_CONNECTIONS = 10
+DEFAULT_DATABASE_MIGRATE        = True
+DEFAULT_DATABASE_NOTIFY         = True
+DEFAULT_ARCHIVE_AGE             = 30    # days
+DEFAULT_SERVICE_ID_BLOCK        = 100
+DEFAULT_WORKERS                 = 1
 
 
 # config blocks and options
@@ -50,12 +73,37 @@ PEERS            = 'peers'
 POLICY           = 'policy'
 PLUGIN           = 'plugin'
 SERVICE_ID_START = 'serviceid_start'
+SERVICE_ID_BLOCK = 'serviceid_block'
+WORKERS          = 'workers'
+WORKER_SOCKET    = 'workersocket'
+XML_BACKEND      = 'xmlbackend'
+PRETTY_XML       = 'prettyxml'
+MAX_PAYLOAD_SIZE = 'maxpayloadsize'
+MAX_PAYLOAD_ELEMENTS = 'maxpayloadelements'
+XML_WORKERS      = 'xmlworkers'
+XML_WORKER_THRESHOLD = 'xmlworkerthreshold'
+CONNECTION_CACHE_SIZE = 'connectioncachesize'
+QUERY_CACHE_TTL  = 'querycachettl'
+
+# admission control
+REQUEST_RATE            = 'requestrate'
+REQUEST_BURST           = 'requestburst'
+MAX_INFLIGHT_RESERVATIONS = 'maxinflightreservations'
+MAX_CONCURRENT_REQUESTS = 'maxconcurrentrequests'
+MAX_QUEUED_REQUESTS     = 'maxqueuedrequests'
 
 # database
-DATABASE                = 'database'    # mandatory
-DATABASE_USER           = 'dbuser'      # mandatory
+DATABASE_STORAGE        = 'storage'
+DATABASE                = 'database'    # mandatory, except for memory storage
+DATABASE_USER           = 'dbuser'      # mandatory for postgresql storage
 DATABASE_PASSWORD       = 'dbpassword'  # can be none (os auth)
 DATABASE_HOST           = 'dbhost'      # can be none (local db)
+DATABASE_DRIVER         = 'dbdriver'
+DATABASE_POOL_SIZE      = 'dbpoolsize'
+DATABASE_ASYNC_CONNECTIONS = 'dbasyncconnections'
+DATABASE_MIGRATE        = 'dbmigrate'
+DATABASE_NOTIFY         = 'dbnotify'
+ARCHIVE_AGE             = 'archiveage'
 
 # tls
 KEY                     = 'key'         # mandatory, if tls is set
@@ -241,16 +289,107 @@ def readVerifyConfig(cfg):
     except ConfigParser.NoOptionError:
         vc[PLUGIN] = None
 
+    try:
+        xml_backend = cfg.get(BLOCK_SERVICE, XML_BACKEND)
+        if not xml_backend in xmlbackend.BACKENDS:
+            raise ConfigurationError('Invalid XML backend: %s (must be one of %s)' % (xml_backend, ', '.join(xmlbackend.BACKENDS)))
+        if xml_backend == xmlbackend.LXML and not xmlbackend.HAS_LXML:
+            raise ConfigurationError('XML backend lxml specified, but lxml is not installed')
+        vc[XML_BACKEND] = xml_backend
+    except ConfigParser.NoOptionError:
+        vc[XML_BACKEND] = None # lxml if available, etree otherwise
+
+    try:
+        vc[PRETTY_XML] = cfg.getboolean(BLOCK_SERVICE, PRETTY_XML)
+    except ConfigParser.NoOptionError:
+        vc[PRETTY_XML] = DEFAULT_PRETTY_XML
+
+    try:
+        vc[MAX_PAYLOAD_SIZE] = cfg.getint(BLOCK_SERVICE, MAX_PAYLOAD_SIZE)
+    except ConfigParser.NoOptionError:
+        vc[MAX_PAYLOAD_SIZE] = DEFAULT_MAX_PAYLOAD_SIZE
+
+    try:
+        vc[MAX_PAYLOAD_ELEMENTS] = cfg.getint(BLOCK_SERVICE, MAX_PAYLOAD_ELEMENTS)
+    except ConfigParser.NoOptionError:
+        vc[MAX_PAYLOAD_ELEMENTS] = DEFAULT_MAX_PAYLOAD_ELEMENTS
+
+    # the etree parser and serializer hold the gil, so worker threads cannot run while the reactor does
+    lxml_backend = (vc[XML_BACKEND] or xmlbackend.DEFAULT_BACKEND) == xmlbackend.LXML
+    try:
+        vc[XML_WORKERS] = cfg.getint(BLOCK_SERVICE, XML_WORKERS)
+        if vc[XML_WORKERS] < 0:
+            raise ConfigurationError('Number of XML workers cannot be negative')
+        if vc[XML_WORKERS] > 0 and not lxml_backend:
+            raise ConfigurationError('XML workers require the lxml XML backend (they give no speedup with etree)')
+    except ConfigParser.NoOptionError:
+        vc[XML_WORKERS] = DEFAULT_XML_WORKERS if lxml_backend else 0
+
+    try:
+        vc[XML_WORKER_THRESHOLD] = cfg.getint(BLOCK_SERVICE, XML_WORKER_THRESHOLD)
+    except ConfigParser.NoOptionError:
+        vc[XML_WORKER_THRESHOLD] = DEFAULT_XML_WORKER_THRESHOLD
+
+    try:
+        vc[CONNECTION_CACHE_SIZE] = cfg.getint(BLOCK_SERVICE, CONNECTION_CACHE_SIZE)
+        if vc[CONNECTION_CACHE_SIZE] < 1:
+            raise ConfigurationError('Connection cache size must be at least 1')
+    except ConfigParser.NoOptionError:
+        vc[CONNECTION_CACHE_SIZE] = DEFAULT_CONNECTION_CACHE_SIZE
+
+    try:
+        vc[QUERY_CACHE_TTL] = cfg.getfloat(BLOCK_SERVICE, QUERY_CACHE_TTL)
+        if vc[QUERY_CACHE_TTL] < 0:
+            raise ConfigurationError('Query cache TTL cannot be negative')
+    except ConfigParser.NoOptionError:
+        vc[QUERY_CACHE_TTL] = DEFAULT_QUERY_CACHE_TTL
+
+    # admission control, zero disables a limit
+    try:
+        vc[REQUEST_RATE] = cfg.getfloat(BLOCK_SERVICE, REQUEST_RATE)
+        if vc[REQUEST_RATE] < 0:
+            raise ConfigurationError('Request rate cannot be negative')
+    except ConfigParser.NoOptionError:
+        vc[REQUEST_RATE] = DEFAULT_REQUEST_RATE
+
+    try:
+        vc[REQUEST_BURST] = cfg.getint(BLOCK_SERVICE, REQUEST_BURST)
+        if vc[REQUEST_BURST] < 1:
+            raise ConfigurationError('Request burst must be at least 1')
+    except ConfigParser.NoOptionError:
+        vc[REQUEST_BURST] = DEFAULT_REQUEST_BURST
+
+    for option, default in ( (MAX_INFLIGHT_RESERVATIONS, DEFAULT_MAX_INFLIGHT_RESERVATIONS),
+                             (MAX_CONCURRENT_REQUESTS,   DEFAULT_MAX_CONCURRENT_REQUESTS),
+                             (MAX_QUEUED_REQUESTS,       DEFAULT_MAX_QUEUED_REQUESTS) ):
+        try:
+            vc[option] = cfg.getint(BLOCK_SERVICE, option)
+            if vc[option] < 0:
+                raise ConfigurationError('Option %s cannot be negative' % option)
+        except ConfigParser.NoOptionError:
+            vc[option] = default
+
     # database
+    try:
+        vc[DATABASE_STORAGE] = cfg.get(BLOCK_SERVICE, DATABASE_STORAGE)
+        if vc[DATABASE_STORAGE] not in ('postgresql', 'sqlite', 'memory'):
+            raise ConfigurationError('Invalid storage: %s (must be postgresql, sqlite, or memory)' % vc[DATABASE_STORAGE])
+    except ConfigParser.NoOptionError:
+        vc[DATABASE_STORAGE] = DEFAULT_DATABASE_STORAGE
+
     try:
         vc[DATABASE] = cfg.get(BLOCK_SERVICE, DATABASE)
     except ConfigParser.NoOptionError:
-        raise ConfigurationError('No database specified in configuration file (mandatory)')
+        if vc[DATABASE_STORAGE] != 'memory':
+            raise ConfigurationError('No database specified in configuration file (mandatory)')
+        vc[DATABASE] = None
 
     try:
         vc[DATABASE_USER] = cfg.get(BLOCK_SERVICE, DATABASE_USER)
     except ConfigParser.NoOptionError:
-        raise ConfigurationError('No database user specified in configuration file (mandatory)')
+        if vc[DATABASE_STORAGE] == 'postgresql':
+            raise ConfigurationError('No database user specified in configuration file (mandatory)')
+        vc[DATABASE_USER] = None
 
     try:
         vc[DATABASE_PASSWORD] = cfg.get(BLOCK_SERVICE, DATABASE_PASSWORD)
@@ -262,11 +401,71 @@ def readVerifyConfig(cfg):
     except ConfigParser.NoOptionError:
         vc[DATABASE_HOST] = None
 
+    try:
+        vc[DATABASE_DRIVER] = cfg.get(BLOCK_SERVICE, DATABASE_DRIVER)
+        if vc[DATABASE_DRIVER] not in ('threads', 'async'):
+            raise ConfigurationError('Invalid database driver: %s (must be threads or async)' % vc[DATABASE_DRIVER])
+    except ConfigParser.NoOptionError:
+        vc[DATABASE_DRIVER] = DEFAULT_DATABASE_DRIVER
+
+    for option, default in ( (DATABASE_POOL_SIZE,         DEFAULT_DATABASE_POOL_SIZE),
+                             (DATABASE_ASYNC_CONNECTIONS, DEFAULT_DATABASE_ASYNC_CONNECTIONS) ):
+        try:
+            vc[option] = cfg.getint(BLOCK_SERVICE, option)
+            if vc[option] < 1:
+                raise ConfigurationError('Option %s must be at least 1' % option)
+        except ConfigParser.NoOptionError:
+            vc[option] = default
+
+    try:
+        vc[DATABASE_MIGRATE] = cfg.getboolean(BLOCK_SERVICE, DATABASE_MIGRATE)
+    except ConfigParser.NoOptionError:
+        vc[DATABASE_MIGRATE] = DEFAULT_DATABASE_MIGRATE
+
+    try:
+        vc[DATABASE_NOTIFY] = cfg.getboolean(BLOCK_SERVICE, DATABASE_NOTIFY)
+    except ConfigParser.NoOptionError:
+        vc[DATABASE_NOTIFY] = DEFAULT_DATABASE_NOTIFY
+
+    try:
+        vc[ARCHIVE_AGE] = cfg.getfloat(BLOCK_SERVICE, ARCHIVE_AGE)
+        if vc[ARCHIVE_AGE] < 0:
+            raise ConfigurationError('Archive age cannot be negative')
+    except ConfigParser.NoOptionError:
+        vc[ARCHIVE_AGE] = DEFAULT_ARCHIVE_AGE
+
     try:
         vc[SERVICE_ID_START] = cfg.get(BLOCK_SERVICE, SERVICE_ID_START)
     except ConfigParser.NoOptionError:
         vc[SERVICE_ID_START] = None
 
+    try:
+        vc[SERVICE_ID_BLOCK] = cfg.getint(BLOCK_SERVICE, SERVICE_ID_BLOCK)
+        if vc[SERVICE_ID_BLOCK] < 1:
+            raise ConfigurationError('Option %s must be at least 1' % SERVICE_ID_BLOCK)
+    except ConfigParser.NoOptionError:
+        vc[SERVICE_ID_BLOCK] = DEFAULT_SERVICE_ID_BLOCK
+
+    try:
+        vc[WORKERS] = cfg.getint(BLOCK_SERVICE, WORKERS)
+        if vc[WORKERS] < 1:
+            raise ConfigurationError('Option %s must be at least 1' % WORKERS)
+    except ConfigParser.NoOptionError:
+        vc[WORKERS] = DEFAULT_WORKERS
+
+    if vc[WORKERS] > 1:
+        if vc[DATABASE_STORAGE] != 'postgresql':
+            raise ConfigurationError('Multiple workers require postgresql storage')
+        if vc[PEERS]:
+            raise ConfigurationError('Multiple workers cannot be used with peers (replies from peers can arrive at any worker)')
+        if not vc[DATABASE_NOTIFY]:
+            raise ConfigurationError('Multiple workers require %s (workers follow the changes of the others through it)' % DATABASE_NOTIFY)
+
+    try:
+        vc[WORKER_SOCKET] = cfg.get(BLOCK_SERVICE, WORKER_SOCKET)
+    except ConfigParser.NoOptionError:
+        vc[WORKER_SOCKET] = os.path.join(tempfile.gettempdir(), 'opennsa-%i.sock' % vc[PORT])
+
     # we always extract certdir and verify as we need that for performing https requests
     try:
         certdir = cfg.get(BLOCK_SERVICE, CERTIFICATE_DIR)
@@ -327,8 +526,20 @@ def readVerifyConfig(cfg):
                             BLOCK_CUSTOM_BACKEND, 'asyncfail'):
             backend_conf = dict( cfg.items(section) )
             backend_conf['_backend_type'] = backend_type
+            if NRM_MAP_FILE in backend_conf and not os.path.exists(backend_conf[NRM_MAP_FILE]):
+                raise ConfigurationError('Specified NRM mapping file for backend %s does not exist (%s)' % (section, backend_conf[NRM_MAP_FILE]))
             backends[name] = backend_conf
 
+    if len(backends) > 1:
+        # each backend manages the ports in its own nrm map, together they make up the network
+        if vc[NRM_MAP_FILE] is not None:
+            raise ConfigurationError('With multiple backends, the NRM mapping file must be specified for each backend, not in the service block')
+        for name, backend_conf in backends.items():
+            if not NRM_MAP_FILE in backend_conf:
+                raise ConfigurationError('No NRM mapping file specified for backend %s' % (name or backend_conf['_backend_type']))
+        if vc[WORKERS] > 1:
+            raise ConfigurationError('Multiple workers cannot be used with multiple backends')
+
     vc['backend'] = backends
 
     return vc
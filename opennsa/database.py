@@ -11,6 +11,7 @@ Copyright: NORDUnet (2011-2013)
 
 import datetime
 
+from twisted.internet import defer
 from twisted.enterprise import adbapi
 
 from psycopg2.extensions import adapt, register_adapter, AsIs
@@ -19,13 +20,29 @@ from psycopg2.extras import CompositeCaster, register_composite
 from twistar.registry import Registry
 from twistar.dbobject import DBObject
 
-from opennsa import nsa
+from opennsa import nsa, asyncdb, migrations, sqlitedb
 from opennsa.ext.iso8601 import iso8601
 
 
 
 LOG_SYSTEM = 'opennsa.Database'
 
+# drivers
+THREADS = 'threads' # adbapi, queries are done in a thread pool
+ASYNC   = 'async'   # queries are done with async connections on the reactor, interactions in a thread pool
+
+DEFAULT_POOL_SIZE = 5 # threads in the adbapi pool
+
+# storage
+POSTGRESQL  = 'postgresql'
+SQLITE      = 'sqlite'      # sqlite database file, for labs
+MEMORY      = 'memory'      # sqlite database in memory, gone on restart, for tests and demos
+
+CONNECTION_ID_START_SQL = 'INSERT INTO backend_connection_id (connection_id) VALUES (%s) ON CONFLICT DO NOTHING;'
+CONNECTION_ID_BLOCK_SQL = 'UPDATE backend_connection_id SET connection_id = connection_id + %s RETURNING connection_id;'
+
+DEFAULT_CONNECTION_ID_BLOCK = 100 # backend connection ids claimed from the database at a time
+
 
 # psycopg2 plumming to get automatic adaption
 def adaptLabel(label):
@@ -59,7 +76,11 @@ def castDatetime(value, cur):
 
 # setup
 
-def setupDatabase(database, user, password=None, host=None, connection_id_start=None):
+def setupDatabase(database, user, password=None, host=None, connection_id_start=None, driver=THREADS, pool_size=None, async_connections=None, migrate=False,
+                  connection_id_block=None):
+
+    if migrate:
+        migrations.migrateDatabase(database, user, password, host)
 
     # hack on, use psycopg2 connection to register postgres label -> nsa label adaptation
     import psycopg2
@@ -75,12 +96,45 @@ def setupDatabase(database, user, password=None, host=None, connection_id_start=
     psycopg2.extensions.register_type(DT)
 
     if connection_id_start:
-        r = cur.execute("INSERT INTO backend_connection_id (connection_id) VALUES (%s) ON CONFLICT DO NOTHING;", (connection_id_start,) )
+        r = cur.execute(CONNECTION_ID_START_SQL, (connection_id_start,) )
         conn.commit()
 
     conn.close()
 
-    Registry.DBPOOL = adbapi.ConnectionPool('psycopg2', user=user, password=password, database=database, host=host)
+    pool_size = pool_size or DEFAULT_POOL_SIZE
+    pool_args = dict(user=user, password=password, database=database, host=host, cp_min=min(3, pool_size), cp_max=pool_size)
+
+    if driver == ASYNC:
+        Registry.DBPOOL = asyncdb.AsyncConnectionPool('psycopg2', async_connections or asyncdb.DEFAULT_CONNECTIONS, **pool_args)
+    elif driver == THREADS:
+        Registry.DBPOOL = adbapi.ConnectionPool('psycopg2', **pool_args)
+    else:
+        raise ValueError('Invalid database driver: %s' % driver)
+
+    # twistar picks its configuration (and caches table columns) on first use
+    Registry.IMPL = None
+    Registry.SCHEMAS.clear()
+
+    _setConnectionIdBlock(connection_id_block)
+
+
+def setupSQLiteDatabase(database=sqlitedb.MEMORY, connection_id_start=None, connection_id_block=None):
+    """
+    Use a SQLite database instead of PostgreSQL. The database is a file name,
+    or sqlitedb.MEMORY. The schema is created if the database does not have
+    one.
+    """
+    def opened(conn):
+        if connection_id_start:
+            conn.cursor().execute(CONNECTION_ID_START_SQL, (connection_id_start,))
+            conn.commit()
+
+    # a single connection, sqlite does one write at a time anyway, and each in-memory connection is a database of its own
+    Registry.DBPOOL = adbapi.ConnectionPool('opennsa.sqlitedb', database, cp_min=1, cp_max=1, cp_openfun=opened)
+    Registry.IMPL = sqlitedb.SQLiteDBConfig()
+    Registry.SCHEMAS.clear()
+
+    _setConnectionIdBlock(connection_id_block)
 
 
 
@@ -101,30 +155,156 @@ class STPAuthz(DBObject):
     TABLENAME = 'stp_authz'
 
 
+# terminated connections are moved to these after a while, see the archive module
+class ServiceConnectionArchive(ServiceConnection):
+    TABLENAME = 'service_connections_archive'
+    HASMANY = []
+
+
+class SubConnectionArchive(SubConnection):
+    TABLENAME = 'sub_connections_archive'
+    BELONGSTO = []
+
+
+@defer.inlineCallbacks
+def findByWithArchive(klass, archive_klass, **attrs):
+    """
+    Like findBy, but looks in the archive table if nothing is found in the
+    table of the class.
+    """
+    rows = yield klass.findBy(**attrs)
+    if not rows:
+        rows = yield archive_klass.findBy(**attrs)
+    defer.returnValue(rows)
+
+
+@defer.inlineCallbacks
+def findInWithArchive(klass, archive_klass, column, values, where=None, orderby=None):
+    """
+    Find the rows where column is one of the values (and the where clause, if
+    given, holds). Values which are not found in the table of the class are
+    looked up in the archive table. Archived rows are returned after the others.
+    """
+    def find(k, vs):
+        clause = '%s IN ?' % column
+        w = [ where[0] + ' AND ' + clause ] + where[1:] + [ tuple(vs) ] if where else [ clause, tuple(vs) ]
+        return k.find(where=w, orderby=orderby)
+
+    rows = yield find(klass, values)
+    missing = set(values) - set( getattr(r, column) for r in rows )
+    if missing:
+        archived = yield find(archive_klass, missing)
+        rows = rows + archived
+    defer.returnValue(rows)
+
+
+def findSubConnections(service_connection_ids):
+    """
+    Fetch the sub connections for several service connections in a single
+    query, instead of one (or more) per service connection.
+
+    Returns a deferred with a dict: service connection id -> [ SubConnection ],
+    service connections without sub connections are not in the dict.
+    """
+    def gotSubConnections(sub_connections):
+        result = {}
+        for sc in sub_connections:
+            result.setdefault(sc.service_connection_id, []).append(sc)
+        return result
+
+    if not service_connection_ids:
+        return defer.succeed({})
+
+    d = findInWithArchive(SubConnection, SubConnectionArchive, 'service_connection_id', service_connection_ids, orderby='service_connection_id, order_id')
+    d.addCallback(gotSubConnections)
+    return d
+
+
+def aggregateDataPlaneStatus(sub_connections):
+    """
+    Create the aggregated data plane status (active, version, consistent) of a
+    service connection from its sub connections.
+    """
+    if not sub_connections: # apparently this can happen
+        return (False, 0, False)
+
+    aggr_active     = all( [ sc.data_plane_active     for sc in sub_connections ] )
+    aggr_version    = max( [ sc.data_plane_version    for sc in sub_connections ] ) or 0 # can be None otherwise
+    aggr_consistent = all( [ sc.data_plane_consistent for sc in sub_connections ] )
+    return (aggr_active, aggr_version, aggr_consistent)
+
+
+
 # Not really needed
 class BackendConnectionID(DBObject):
     TABLENAME = 'backend_connection_id'
 
-#@defer.inlineCallbacks
-def getBackendConnectionId():
+class ConnectionIdBlock:
+    """
+    Hands out backend connection ids from blocks claimed from the database.
+
+    The backend_connection_id row is a counter. Claiming a block increments it
+    by the block size, in one update, so no two blocks overlap, regardless of
+    how many OpenNSA processes use the database, or how often they restart.
+    The ids within a block are then handed out from memory, without a query.
+
+    The cost is gaps, and ordering: The ids left in a block when OpenNSA stops
+    are never used, so a restart can skip up to a block size of ids, and ids
+    from several processes are handed out in the order of their blocks, not
+    the order of reservations.
+    """
+    def __init__(self, size=DEFAULT_CONNECTION_ID_BLOCK):
+        if size < 1:
+            raise ValueError('Connection id block size must be at least 1')
+        self.size = size
+        self.next_id = None
+        self.last_id = None # last id in the current block
+        self.lock = defer.DeferredLock() # one claim at a time, callers waiting for it take from the new block
+
+
+    def _claim(self):
+
+        def gotResult(rows):
+            if len(rows) == 0:
+                return # no start value set
+            self.last_id = rows[0][0]
+            self.next_id = self.last_id - self.size + 1
+
+        return Registry.DBPOOL.runQuery(CONNECTION_ID_BLOCK_SQL, (self.size,)).addCallback(gotResult)
 
-#    rows = yield BackendConnectionID.find()
-#    if len(rows) == 0:
-#        defer.returnValue(0)
-#    else:
-#        connection_id = rows[0].connection_id
-#        rows[0].connection_id += 1
-#        rows[0].save()
-#        defer.returnValue(connection_id)
-
-    def gotResult(rows):
-        print 'rows', rows
-        if len(rows) == 0:
-            return None
-        else:
-            return rows[0][0]
-
-    return Registry.DBPOOL.runQuery('UPDATE backend_connection_id SET connection_id = connection_id + 1 RETURNING connection_id;').addCallback(gotResult)
+
+    @defer.inlineCallbacks
+    def _getId(self):
+        if self.next_id is None or self.next_id > self.last_id:
+            yield self._claim()
+            if self.next_id is None:
+                defer.returnValue(None)
+
+        connection_id = self.next_id
+        self.next_id += 1
+        defer.returnValue(connection_id)
+
+
+    def getId(self):
+        return self.lock.run(self._getId)
+
+
+
+_connection_id_block = ConnectionIdBlock()
+
+
+def _setConnectionIdBlock(size):
+    # new database, the current block (if any) is from another one
+    global _connection_id_block
+    _connection_id_block = ConnectionIdBlock(size or DEFAULT_CONNECTION_ID_BLOCK)
+
+
+def getBackendConnectionId():
+    """
+    Get a unique backend connection id. Returns a deferred with the id, or
+    None if the database has no start value (serviceid_start not set).
+    """
+    return _connection_id_block.getId()
 
 
 
@@ -2,9 +2,34 @@
 
 from xml.etree import ElementTree as ET
 
+
+def _children(element):
+    # single pass over the child elements, tag -> [ elements ]
+    children = {}
+    for e in element:
+        try:
+            children[e.tag].append(e)
+        except KeyError:
+            children[e.tag] = [ e ]
+    return children
+
+def _find(children, tag):
+    es = children.get(tag)
+    return None if es is None else es[0]
+
+def _findall(children, tag):
+    return children.get(tag, [])
+
+def _text(children, tag):
+    # same semantics as element.findtext, missing element -> None, empty element -> ''
+    es = children.get(tag)
+    return None if es is None else (es[0].text or '')
+
 # types
 
 class InterfaceType(object):
+    __slots__ = ( 'type_', 'href', 'describedBy' )
+
     def __init__(self, type_, href, describedBy):
         self.type_ = type_  # string
         self.href = href  # anyURI
@@ -12,10 +37,11 @@ class InterfaceType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return InterfaceType(
-                element.findtext('type'),
-                element.findtext('href'),
-                element.findtext('describedBy') if element.find('describedBy') is not None else None
+                _text(c, 'type'),
+                _text(c, 'href'),
+                _text(c, 'describedBy')
                )
 
     def xml(self, elementName):
@@ -28,6 +54,8 @@ class InterfaceType(object):
 
 
 class NsaType(object):
+    __slots__ = ( 'id_', 'version', 'expires', 'name', 'softwareVersion', 'startTime', 'networkId', 'interface', 'feature', 'peersWith', 'other' )
+
     def __init__(self, id_, version, expires, name, softwareVersion, startTime, networkId, interface, feature, peersWith, other):
         self.id_ = id_  # anyURI
         self.version = version  # dateTime
@@ -43,18 +71,19 @@ class NsaType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return NsaType(
                 element.get('id'),
                 element.get('version'),
                 element.get('expires'),
-                element.findtext('name') if element.find('name') is not None else None,
-                element.findtext('softwareVersion') if element.find('softwareVersion') is not None else None,
-                element.findtext('startTime') if element.find('startTime') is not None else None,
-                [ e.text for e in element.findall('networkId') ] if element.find('networkId') is not None else [],
-                [ InterfaceType.build(e) for e in element.findall('interface') ] if element.find('interface') is not None else None,
-                [ FeatureType.build(e) for e in element.findall('feature') ] if element.find('feature') is not None else None,
-                element.findtext('peersWith') if element.find('peersWith') is not None else None,
-                [ HolderType.build(e) for e in element.findall('other') ] if element.find('other') is not None else None
+                _text(c, 'name'),
+                _text(c, 'softwareVersion'),
+                _text(c, 'startTime'),
+                [ e.text for e in _findall(c, 'networkId') ] if 'networkId' in c else [],
+                [ InterfaceType.build(e) for e in _findall(c, 'interface') ] if 'interface' in c else None,
+                [ FeatureType.build(e) for e in _findall(c, 'feature') ] if 'feature' in c else None,
+                _text(c, 'peersWith'),
+                [ HolderType.build(e) for e in _findall(c, 'other') ] if 'other' in c else None
                )
 
     def xml(self, elementName):
@@ -83,6 +112,8 @@ class NsaType(object):
 
 
 class FeatureType(object):
+    __slots__ = ( 'type_', 'value' )
+
     def __init__(self, type_, value):
         self.type_ = type_
         self.value = value
@@ -101,14 +132,17 @@ class FeatureType(object):
 
 
 class HolderType(object):
+    __slots__ = ( 'topologyReachability', )
+
     def __init__(self, topologyReachability):
         self.topologyReachability = topologyReachability # [ Topology ]
 
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return HolderType(
-                [ Topology.build(e) for e in element.find(str(topology_reachability)) ] if element.find(str(topology_reachability)) is not None else None
+                [ Topology.build(e) for e in _find(c, str(topology_reachability)) ] if str(topology_reachability) in c else None
                )
 
     def xml(self, elementName):
@@ -122,7 +156,8 @@ class HolderType(object):
 
 
 # Created manually
-class Topology:
+class Topology(object):
+    __slots__ = ( 'uri', 'cost' )
 
     def __init__(self, uri, cost):
         self.uri = uri   # string
@@ -175,6 +175,11 @@ class ResourceUnavailableError(NSIError):
     errorId = '00600'
 
 
+class RequestThrottledError(ResourceUnavailableError): # request rejected by admission control, not an NSI error as such
+
+    errorId = '00600'
+
+
 class ServiceError(NSIError): # only use this if nothing else applies
 
     errorId = '00700'
@@ -0,0 +1,28 @@
+-- Tables for child reservations in progress and the notification log,
+-- for databases created before these were added to the schema
+
+CREATE TABLE IF NOT EXISTS pending_reservations (
+    id                      serial                      PRIMARY KEY,
+    correlation_id          text                        NOT NULL UNIQUE,
+    service_connection_id   integer                     NOT NULL REFERENCES service_connections(id) ON DELETE CASCADE,
+    provider_nsa            text                        NOT NULL,
+    order_id                integer                     NOT NULL,
+    source_network          text                        NOT NULL,
+    source_port             text                        NOT NULL,
+    dest_network            text                        NOT NULL,
+    dest_port               text                        NOT NULL,
+    dispatch_time           timestamp                   NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    id                      serial                      PRIMARY KEY,
+    source                  text                        NOT NULL,
+    connection_id           text                        NOT NULL,
+    notification_id         bigint                      NOT NULL,
+    notification_type       text                        NOT NULL,
+    timestamp               timestamp                   NOT NULL,
+    data                    text                        NOT NULL  -- json
+);
+
+CREATE INDEX IF NOT EXISTS notifications_connection_idx ON notifications (source, connection_id, notification_id);
+CREATE INDEX IF NOT EXISTS notifications_timestamp_idx ON notifications (source, timestamp);
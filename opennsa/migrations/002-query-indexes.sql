@@ -0,0 +1,21 @@
+-- Indexes for the query paths of the aggregator, the generic backend, and the REST interface
+
+-- querySummary / queryRecursive in the aggregator: requester_nsa = ? [ AND connection_id IN ? ]
+CREATE INDEX IF NOT EXISTS service_connections_requester_idx ON service_connections (requester_nsa, connection_id);
+
+-- querySummary by global reservation ids, most connections do not have one
+CREATE INDEX IF NOT EXISTS service_connections_global_id_idx ON service_connections (requester_nsa, global_reservation_id)
+    WHERE global_reservation_id IS NOT NULL;
+
+-- sub connections of service connections (aggregator queries and REST), ordered as the path
+CREATE INDEX IF NOT EXISTS sub_connections_service_connection_idx ON sub_connections (service_connection_id, order_id);
+
+-- deleting service connections cascades to pending reservations
+CREATE INDEX IF NOT EXISTS pending_reservations_service_connection_idx ON pending_reservations (service_connection_id);
+
+-- querySummary in the generic backend, paged by id: requester_nsa = ? AND id > ? ORDER BY id
+CREATE INDEX IF NOT EXISTS generic_backend_connections_requester_idx ON generic_backend_connections (requester_nsa, id);
+
+-- connections to schedule at backend startup, terminated connections are the bulk of the table
+CREATE INDEX IF NOT EXISTS generic_backend_connections_active_idx ON generic_backend_connections (id)
+    WHERE lifecycle_state <> 'Terminated';
@@ -0,0 +1,30 @@
+-- Archive tables for terminated connections (see opennsa/archive.py)
+-- Rows are moved with INSERT ... SELECT *, so the archive tables must have the same columns, in the same order, as
+-- the tables they archive. Migrations which change the columns of the tables must change the archive tables as well.
+
+-- when the connection was terminated, null for connections terminated before this was added
+ALTER TABLE service_connections ADD COLUMN terminate_time timestamp;
+ALTER TABLE generic_backend_connections ADD COLUMN terminate_time timestamp;
+
+CREATE TABLE service_connections_archive (
+    LIKE service_connections INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id),
+    UNIQUE (connection_id)
+);
+CREATE INDEX service_connections_archive_global_id_idx ON service_connections_archive (requester_nsa, global_reservation_id)
+    WHERE global_reservation_id IS NOT NULL;
+
+CREATE TABLE sub_connections_archive (
+    LIKE sub_connections INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id),
+    UNIQUE (provider_nsa, connection_id)
+);
+CREATE INDEX sub_connections_archive_service_connection_idx ON sub_connections_archive (service_connection_id, order_id);
+
+CREATE TABLE generic_backend_connections_archive (
+    LIKE generic_backend_connections INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id),
+    UNIQUE (connection_id)
+);
+CREATE INDEX generic_backend_connections_archive_global_id_idx ON generic_backend_connections_archive (requester_nsa, global_reservation_id)
+    WHERE global_reservation_id IS NOT NULL;
@@ -0,0 +1,146 @@
+"""
+Versioned database schema migrations.
+
+The schema changes are kept as numbered SQL files in this directory, named
+<version>-<name>.sql, e.g., 002-query-indexes.sql. The versions applied to a
+database are recorded in the schema_version table, and missing versions are
+applied in order, all in one transaction, so a failing migration leaves the
+database as it was.
+
+A new database is created with datafiles/schema.sql, which has the complete
+schema and records all versions in it as applied. A database created before
+versioning has no schema_version table, so all migrations are applied to it.
+The first migrations (up to 002) can therefore find some of their tables and
+indexes already there, and use CREATE ... IF NOT EXISTS.
+
+Migrations are applied at startup (see the dbmigrate option), or with:
+
+python -m opennsa.migrations [config file]
+
+The schema_version table is locked while migrating, so several services
+starting at the same time on the same database do not apply a migration twice.
+Note that creating an index blocks writes to the table while it is created.
+
+Copyright: NORDUnet (2026)
+"""
+
+import os
+import re
+
+from twisted.python import log
+
+
+LOG_SYSTEM = 'Migrations'
+
+MIGRATION_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MIGRATION_FILE = re.compile(r'^(\d+)-([\w-]+)\.sql$')
+
+VERSION_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS schema_version (
+    version                 integer                     PRIMARY KEY,
+    name                    text                        NOT NULL,
+    applied                 timestamp                   NOT NULL
+)'''
+LOCK_SQL    = 'LOCK TABLE schema_version IN EXCLUSIVE MODE'
+VERSION_SQL = 'SELECT version FROM schema_version'
+INSERT_SQL  = "INSERT INTO schema_version (version, name, applied) VALUES (%s, %s, now() at time zone 'utc')"
+
+
+
+class Migration:
+
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+
+    def sql(self):
+        with open(self.path) as f:
+            return f.read()
+
+
+    def __repr__(self):
+        return '<Migration %03i %s>' % (self.version, self.name)
+
+
+
+def findMigrations(directory=MIGRATION_DIRECTORY):
+    """
+    Get the migrations in a directory, ordered by version.
+    """
+    migrations = []
+    for filename in os.listdir(directory):
+        m = MIGRATION_FILE.match(filename)
+        if m:
+            migrations.append( Migration(int(m.group(1)), m.group(2), os.path.join(directory, filename)) )
+
+    migrations.sort(key=lambda m : m.version)
+    versions = [ m.version for m in migrations ]
+    if len(set(versions)) != len(versions):
+        raise ValueError('Duplicate migration versions in %s' % directory)
+
+    return migrations
+
+
+
+def appliedVersions(cursor):
+    """
+    Get the versions applied to the database (empty if it has no version
+    table).
+    """
+    cursor.execute("SELECT to_regclass('schema_version')")
+    if cursor.fetchone()[0] is None:
+        return []
+    cursor.execute(VERSION_SQL)
+    return sorted( row[0] for row in cursor.fetchall() )
+
+
+
+def migrate(cursor, migrations=None):
+    """
+    Apply the migrations not yet applied to the database. Uses a DB-API cursor,
+    and does not commit, so it can be used with a blocking connection or in a
+    (adbapi) interaction. Returns the applied migrations.
+    """
+    if migrations is None:
+        migrations = findMigrations()
+
+    cursor.execute(VERSION_TABLE_SQL)
+    cursor.execute(LOCK_SQL)
+    cursor.execute(VERSION_SQL)
+    applied = set( row[0] for row in cursor.fetchall() )
+
+    newer = [ v for v in applied if v > max( [0] + [ m.version for m in migrations ] ) ]
+    if newer:
+        log.msg('Database has schema versions not known by this version of OpenNSA: %s' % ', '.join( [ str(v) for v in sorted(newer) ] ), system=LOG_SYSTEM)
+
+    done = []
+    for m in migrations:
+        if m.version in applied:
+            continue
+        log.msg('Applying schema migration %03i: %s' % (m.version, m.name), system=LOG_SYSTEM)
+        cursor.execute(m.sql())
+        cursor.execute(INSERT_SQL, (m.version, m.name))
+        done.append(m)
+
+    return done
+
+
+
+def migrateDatabase(database, user, password=None, host=None):
+    """
+    Apply migrations with a blocking connection. For startup and the command
+    line.
+    """
+    import psycopg2
+    conn = psycopg2.connect(user=user, password=password, database=database, host=host)
+    try:
+        done = migrate(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+
+    if done:
+        log.msg('Database schema migrated to version %i' % done[-1].version, system=LOG_SYSTEM)
+    return done
+
@@ -0,0 +1,31 @@
+# Apply database schema migrations, using the database settings of an OpenNSA configuration file
+#
+# python -m opennsa.migrations [config file]
+
+import sys
+
+from twisted.python import log
+
+from opennsa import config
+from opennsa import migrations
+
+
+def main():
+
+    config_file = sys.argv[1] if len(sys.argv) > 1 else config.DEFAULT_CONFIG_FILE
+
+    log.startLogging(sys.stdout)
+
+    try:
+        vc = config.readVerifyConfig( config.readConfig(config_file) )
+    except config.ConfigurationError as e:
+        sys.stderr.write("Configuration error: %s\n" % e)
+        sys.exit(1)
+
+    done = migrations.migrateDatabase(vc[config.DATABASE], vc[config.DATABASE_USER], vc[config.DATABASE_PASSWORD], vc[config.DATABASE_HOST])
+    if not done:
+        log.msg('Database schema is up to date', system=migrations.LOG_SYSTEM)
+
+
+if __name__ == '__main__':
+    main()
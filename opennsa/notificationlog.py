@@ -0,0 +1,242 @@
+"""
+Notification log.
+
+Keeps the notifications (reserveTimeout, dataPlaneStateChange, errorEvent) sent
+to requesters, so requesters which have missed some of them, can get them with
+queryNotification, instead of polling with querySummary.
+
+The log assigns the notification ids, which are increasing for each log (and
+hence for each connection), and continue from where they were after a restart.
+
+The most recent notifications are kept in a ring buffer in memory, so queries
+for recent notifications do not need the database. All notifications are
+appended to the notifications table, in batches, written in the background (the
+last notifications before a crash can be lost). Batches which could not be
+written (e.g., the database is down) are written again after RETRY_DELAY.
+Notifications older than the
+retention time are removed from the table (compaction), this is done along with
+the writes, at most once per COMPACT_INTERVAL.
+
+Copyright: NORDUnet (2026)
+"""
+
+import json
+import datetime
+
+from collections import deque
+
+from twisted.python import log
+from twisted.internet import reactor, defer
+
+from twistar.registry import Registry
+
+from opennsa.shared import metrics
+
+
+
+LOG_SYSTEM = 'NotificationLog'
+
+# notification types
+RESERVE_TIMEOUT         = 'reserveTimeout'
+DATA_PLANE_STATE_CHANGE = 'dataPlaneStateChange'
+ERROR_EVENT             = 'errorEvent'
+
+DEFAULT_RING_SIZE   = 10000
+DEFAULT_RETENTION   = datetime.timedelta(days=30)
+
+FLUSH_DELAY         = 0.05  # seconds
+BATCH_SIZE          = 500
+RETRY_DELAY         = 5     # seconds, before writing again after a failed write
+COMPACT_INTERVAL    = datetime.timedelta(hours=1)
+
+INSERT_SQL  = 'INSERT INTO notifications (source, connection_id, notification_id, notification_type, timestamp, data) VALUES (%s, %s, %s, %s, %s, %s)'
+COMPACT_SQL = 'DELETE FROM notifications WHERE source = %s AND timestamp < %s'
+QUERY_SQL   = 'SELECT connection_id, notification_id, notification_type, timestamp, data FROM notifications ' + \
+              'WHERE source = %s AND connection_id = %s AND notification_id >= %s AND notification_id <= %s ORDER BY notification_id'
+RECENT_SQL  = 'SELECT connection_id, notification_id, notification_type, timestamp, data FROM notifications ' + \
+              'WHERE source = %s ORDER BY notification_id DESC LIMIT %s'
+
+MAX_NOTIFICATION_ID = 2**63 - 1
+
+
+
+class Notification:
+
+    def __init__(self, connection_id, notification_id, notification_type, timestamp, data):
+        self.connection_id      = connection_id
+        self.notification_id    = notification_id
+        self.notification_type  = notification_type
+        self.timestamp          = timestamp
+        self.data               = data # tuple, arguments of the notification after the timestamp
+
+
+    def __eq__(self, other):
+        return isinstance(other, Notification) and \
+               (self.connection_id, self.notification_id, self.notification_type, self.timestamp, self.data) == \
+               (other.connection_id, other.notification_id, other.notification_type, other.timestamp, other.data)
+
+
+    def __repr__(self):
+        return '<Notification %s %i %s>' % (self.connection_id, self.notification_id, self.notification_type)
+
+
+
+def _fromRow(row):
+    connection_id, notification_id, notification_type, timestamp, data = row
+    # json turns tuples into lists
+    data = tuple( tuple(d) if type(d) is list else d for d in json.loads(data) )
+    return Notification(connection_id, notification_id, notification_type, timestamp, data)
+
+
+
+class NotificationLog:
+
+    def __init__(self, source, ring_size=DEFAULT_RING_SIZE, retention=DEFAULT_RETENTION, persist=True):
+        # source identifies the log in the table, so several logs (aggregator, backends) can share it
+        self.source = source
+        self.retention = retention
+        self.persist = persist
+        self.clock = reactor
+
+        self.next_id = 1
+        self._ring = deque(maxlen=ring_size)
+        self._truncated = False     # if notifications have been evicted from the ring buffer (or not loaded)
+
+        self._pending = []          # notifications to write
+        self._flush_call = None
+        self._flushing = None
+        self._last_compact = datetime.datetime.utcnow()
+
+
+    @defer.inlineCallbacks
+    def load(self):
+        """
+        Load the most recent notifications into the ring buffer, and continue
+        the notification ids from there. Call at startup, and when taking over
+        the log from another process (which has continued the ids).
+        """
+        rows = yield Registry.DBPOOL.runQuery(RECENT_SQL, (self.source, self._ring.maxlen))
+        notifications = [ _fromRow(row) for row in reversed(rows) ]
+
+        # notifications in the ring which are not in the table (logged before load, or not written yet) are kept, their ids have been sent
+        loaded_ids = set( n.notification_id for n in notifications )
+        logged = [ n for n in self._ring if n.notification_id not in loaded_ids ]
+        self._ring.clear()
+        self._ring.extend( sorted(notifications + logged, key=lambda n : n.notification_id) )
+        self._truncated = len(rows) == self._ring.maxlen
+
+        if notifications:
+            self.next_id = max(self.next_id, notifications[-1].notification_id + 1)
+
+        log.msg('Notification log %s: Loaded %i notifications, next id: %i' % (self.source, len(rows), self.next_id), system=LOG_SYSTEM)
+        defer.returnValue(len(rows))
+
+
+    def nextId(self):
+        nid = self.next_id
+        self.next_id += 1
+        return nid
+
+
+    def append(self, connection_id, notification_type, timestamp, data):
+        """
+        Log a notification. Returns the notification id to use for it.
+        """
+        notification = Notification(connection_id, self.nextId(), notification_type, timestamp, tuple(data))
+
+        if len(self._ring) == self._ring.maxlen:
+            self._truncated = True
+        self._ring.append(notification)
+        metrics.increment('notifications.logged')
+
+        if self.persist:
+            self._pending.append(notification)
+            if len(self._pending) >= BATCH_SIZE:
+                self.flush()
+            elif self._flush_call is None and self._flushing is None:
+                self._flush_call = self.clock.callLater(FLUSH_DELAY, self.flush)
+
+        return notification.notification_id
+
+
+    def query(self, connection_id, start_notification=None, end_notification=None):
+        """
+        Get the notifications for a connection, with ids in the given range
+        (inclusive, None means unbounded). Returns a deferred with a list of
+        notifications, ordered by notification id.
+        """
+        start = start_notification or 0
+        end = end_notification if end_notification is not None else MAX_NOTIFICATION_ID
+
+        if not (self._truncated and self.persist) or (self._ring and start >= self._ring[0].notification_id):
+            metrics.increment('notifications.query.memory')
+            return defer.succeed( [ n for n in self._ring if n.connection_id == connection_id and start <= n.notification_id <= end ] )
+
+        metrics.increment('notifications.query.database')
+        d = self.flush() # make sure the table has everything
+        d.addCallback(lambda _ : Registry.DBPOOL.runQuery(QUERY_SQL, (self.source, connection_id, start, end)))
+        d.addCallback(lambda rows : [ _fromRow(row) for row in rows ])
+        return d
+
+
+    def flush(self):
+        """
+        Write logged notifications to the database. Returns a deferred, which
+        fires when they are written.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+        if self._flushing is not None:
+            # one write at a time, the rest will be written after
+            d = defer.Deferred()
+            self._flushing.addBoth(lambda _ : self.flush().chainDeferred(d))
+            return d
+
+        now = datetime.datetime.utcnow()
+        compact = now - self._last_compact > COMPACT_INTERVAL
+
+        if not (self._pending or compact):
+            return defer.succeed(None)
+
+        batch = self._pending
+        rows = [ (self.source, n.connection_id, n.notification_id, n.notification_type, n.timestamp, json.dumps(n.data, default=str)) for n in batch ]
+        self._pending = []
+        last_compact = self._last_compact
+        if compact:
+            self._last_compact = now
+
+        def write(txn):
+            if rows:
+                txn.executemany(INSERT_SQL, rows)
+            if compact:
+                txn.execute(COMPACT_SQL, (self.source, now - self.retention))
+                return txn.rowcount
+
+        def written(compacted):
+            metrics.increment('notifications.written', len(rows))
+            if compacted:
+                metrics.increment('notifications.compacted', compacted)
+                log.msg('Notification log %s: Removed %i notifications older than %s' % (self.source, compacted, self.retention), system=LOG_SYSTEM)
+
+        def writeFailed(err):
+            log.msg('Notification log %s: Error writing %i notifications, retrying in %i seconds: %s' % \
+                    (self.source, len(rows), RETRY_DELAY, err.getErrorMessage()), system=LOG_SYSTEM)
+            metrics.increment('notifications.write_failed')
+            # put the batch back in front of the notifications logged meanwhile, so they are written in order
+            self._pending = batch + self._pending
+            self._last_compact = last_compact
+            return True
+
+        def done(failed):
+            self._flushing = None
+            if self._pending and self._flush_call is None:
+                self._flush_call = self.clock.callLater(RETRY_DELAY if failed else FLUSH_DELAY, self.flush)
+
+        d = self._flushing = Registry.DBPOOL.runInteraction(write)
+        d.addCallbacks(written, writeFailed)
+        d.addBoth(done) # can fire right away
+        return d
+
@@ -0,0 +1,224 @@
+"""
+Pending (dispatched, but not yet confirmed) child reservations of the aggregator.
+
+When the aggregator sends a reserve request to a child, it needs to remember
+what the request was for (correlation id -> service connection, path segment),
+until the child replies with reserveConfirmed or reserveFailed. This is kept in
+memory, and written to the pending_reservations table, so the replies can still
+be handled after a restart, instead of leaving orphaned child reservations.
+
+Writes are done in the background, and batched: Changes are collected and
+written in a single transaction shortly after (or when a batch is full). Entries
+which are added and removed before they are written, never touch the database.
+This means that the last changes before a crash can be lost, but the reserve
+path does not wait for the database.
+
+Changes which could not be written (e.g., the database is down) are kept, and
+written again after RETRY_DELAY.
+
+Entries which have not gotten a reply within PENDING_TIMEOUT are removed.
+
+Copyright: NORDUnet (2026)
+"""
+
+import datetime
+
+from twisted.python import log
+from twisted.internet import reactor, defer
+
+from twistar.registry import Registry
+
+from opennsa.shared import metrics
+
+
+
+LOG_SYSTEM = 'PendingReservations'
+
+FLUSH_DELAY     = 0.05  # seconds, how long changes are collected before being written
+BATCH_SIZE      = 500   # changes, write right away when this many changes are waiting
+RETRY_DELAY     = 5     # seconds, before writing changes again after a failed write
+PENDING_TIMEOUT = datetime.timedelta(hours=1) # children that have not replied by then will not do so
+EXPIRE_INTERVAL = datetime.timedelta(minutes=5)
+
+FIELDS = ( 'service_connection_id', 'provider_nsa', 'order_id', 'source_network', 'source_port', 'dest_network', 'dest_port', 'dispatch_time' )
+
+INSERT_SQL = 'INSERT INTO pending_reservations (correlation_id, %s) VALUES (%s) ON CONFLICT (correlation_id) DO NOTHING' % \
+             (', '.join(FIELDS), ', '.join( ['%s'] * (len(FIELDS) + 1) ))
+DELETE_SQL = 'DELETE FROM pending_reservations WHERE correlation_id IN %s'
+SELECT_SQL = 'SELECT correlation_id, %s FROM pending_reservations' % ', '.join(FIELDS)
+
+
+
+class PendingReservations:
+    """
+    Dict-like (correlation id -> reservation info) store of pending child
+    reservations. The info is a dict with the keys in FIELDS.
+    """
+    def __init__(self, persist=True):
+        self.persist = persist
+        self.clock = reactor
+
+        self._entries = {}          # correlation id -> info
+        self._by_connection = {}    # service connection id -> set of correlation ids
+
+        self._added = set()         # correlation ids to write
+        self._removed = set()       # correlation ids to delete
+        self._flush_call = None
+        self._flushing = None       # deferred for flush in progress
+        self._last_expire = datetime.datetime.utcnow()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, correlation_id):
+        return correlation_id in self._entries
+
+
+    def __getitem__(self, correlation_id):
+        return self._entries[correlation_id]
+
+
+    def __setitem__(self, correlation_id, info):
+        info.setdefault('dispatch_time', datetime.datetime.utcnow())
+        self._entries[correlation_id] = info
+        self._by_connection.setdefault(info['service_connection_id'], set()).add(correlation_id)
+
+        if self.persist:
+            self._added.add(correlation_id)
+            self._scheduleFlush()
+
+        if info['dispatch_time'] - self._last_expire > EXPIRE_INTERVAL:
+            self.expire()
+
+
+    def pop(self, correlation_id, *default):
+
+        try:
+            info = self._entries.pop(correlation_id)
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+
+        ids = self._by_connection[info['service_connection_id']]
+        ids.discard(correlation_id)
+        if not ids:
+            del self._by_connection[info['service_connection_id']]
+
+        if self.persist:
+            if correlation_id in self._added:
+                self._added.discard(correlation_id) # never written, nothing to delete
+            else:
+                self._removed.add(correlation_id)
+                self._scheduleFlush()
+
+        return info
+
+
+    def outstanding(self, service_connection_id):
+        """
+        Returns the correlation ids of the pending reservations for a service connection.
+        """
+        return list(self._by_connection.get(service_connection_id, []))
+
+
+    def expire(self, now=None):
+        """
+        Remove entries which have been pending for longer than PENDING_TIMEOUT.
+        """
+        now = now or datetime.datetime.utcnow()
+        self._last_expire = now
+
+        expired = [ cid for cid, info in self._entries.items() if now - info['dispatch_time'] > PENDING_TIMEOUT ]
+        for cid in expired:
+            info = self.pop(cid)
+            log.msg('Pending reservation %s to %s (service connection key %s) expired, no reply from child' % \
+                    (cid, info['provider_nsa'], info['service_connection_id']), system=LOG_SYSTEM)
+        if expired:
+            metrics.increment('pending_reservations.expired', len(expired))
+        return expired
+
+
+    # database
+
+    @defer.inlineCallbacks
+    def load(self):
+        """
+        Load pending reservations from the database (at startup).
+        """
+        rows = yield Registry.DBPOOL.runQuery(SELECT_SQL)
+        for row in rows:
+            self._entries[row[0]] = dict(zip(FIELDS, row[1:]))
+            self._by_connection.setdefault(row[1], set()).add(row[0])
+
+        log.msg('Restored %i pending reservation(s)' % len(rows), system=LOG_SYSTEM)
+        self.expire()
+        defer.returnValue(len(rows))
+
+
+    def _scheduleFlush(self):
+
+        if len(self._added) + len(self._removed) >= BATCH_SIZE:
+            self.flush()
+        elif self._flush_call is None and self._flushing is None:
+            self._flush_call = self.clock.callLater(FLUSH_DELAY, self.flush)
+
+
+    def flush(self):
+        """
+        Write outstanding changes to the database. Returns a deferred, which
+        fires when the changes are written.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+        if self._flushing is not None:
+            # one write at a time, so changes are written in order, the rest will be written after
+            d = defer.Deferred()
+            self._flushing.addBoth(lambda _ : self.flush().chainDeferred(d))
+            return d
+
+        if not (self._added or self._removed):
+            return defer.succeed(None)
+
+        rows = [ (cid,) + tuple( self._entries[cid][f] for f in FIELDS ) for cid in self._added ]
+        removed = tuple(self._removed)
+        self._added = set()
+        self._removed = set()
+
+        def write(txn):
+            if removed:
+                txn.execute(DELETE_SQL, (removed,))
+            if rows:
+                txn.executemany(INSERT_SQL, rows)
+
+        def written(_):
+            metrics.increment('pending_reservations.written', len(rows))
+            metrics.increment('pending_reservations.deleted', len(removed))
+
+        def writeFailed(err):
+            log.msg('Error writing pending reservations (%i added, %i removed), retrying in %i seconds: %s' % \
+                    (len(rows), len(removed), RETRY_DELAY, err.getErrorMessage()), system=LOG_SYSTEM)
+            metrics.increment('pending_reservations.write_failed')
+            # put the changes back, entries removed meanwhile are in _removed, and must not be added
+            self._added.update( row[0] for row in rows if row[0] in self._entries )
+            self._removed.update(removed)
+            return True
+
+        def done(failed):
+            self._flushing = None
+            if self._added or self._removed:
+                if not failed:
+                    self._scheduleFlush()
+                elif self._flush_call is None:
+                    self._flush_call = self.clock.callLater(RETRY_DELAY, self.flush)
+
+        d = self._flushing = Registry.DBPOOL.runInteraction(write)
+        d.addCallbacks(written, writeFailed)
+        d.addBoth(done) # can fire right away
+        return d
+
@@ -14,9 +14,10 @@ from opennsa.protocols.nsi2 import providerservice, providerclient, provider, \
 
 
 
-def setupProvider(child_provider, top_resource, tls=False, ctx_factory=None, allowed_hosts=None):
+def setupProvider(child_provider, top_resource, tls=False, ctx_factory=None, allowed_hosts=None, max_payload_size=None, max_payload_elements=None):
 
-    soap_resource = soapresource.setupSOAPResource(top_resource, 'CS2', allowed_hosts=allowed_hosts)
+    soap_resource = soapresource.setupSOAPResource(top_resource, 'CS2', allowed_hosts=allowed_hosts,
+                                                   max_payload_size=max_payload_size, max_payload_elements=max_payload_elements)
 
     provider_client = providerclient.ProviderClient(ctx_factory)
 
@@ -36,13 +37,15 @@ def setupRequesterClient(top_resource, host, port, service_endpoint, resource_na
     return requester_client
 
 
-def setupRequesterPair(top_resource, host, port, service_endpoint, nsi_requester, resource_name=None, tls=False, ctx_factory=None):
+def setupRequesterPair(top_resource, host, port, service_endpoint, nsi_requester, resource_name=None, tls=False, ctx_factory=None,
+                       max_payload_size=None, max_payload_elements=None):
 
     resource_name = resource_name or 'RequesterService2'
 
     requester_client = setupRequesterClient(top_resource, host, port, service_endpoint, resource_name=resource_name, tls=tls, ctx_factory=ctx_factory)
 
-    soap_resource = soapresource.setupSOAPResource(top_resource, resource_name)
+    soap_resource = soapresource.setupSOAPResource(top_resource, resource_name,
+                                                   max_payload_size=max_payload_size, max_payload_elements=max_payload_elements)
     requesterservice.RequesterService(soap_resource, nsi_requester)
 
     return requester_client
@@ -61,6 +64,6 @@ def createRequester(host, port, service_endpoint, resource_name=None, tls=False,
     soap_resource = soapresource.setupSOAPResource(top_resource, resource_name)
     requesterservice.RequesterService(soap_resource, nsi_requester)
 
-    site = server.Site(top_resource, logPath='/dev/null')
+    site = server.Site(top_resource, requestFactory=soapresource.createRequestFactory(), logPath='/dev/null')
     return nsi_requester, site
 
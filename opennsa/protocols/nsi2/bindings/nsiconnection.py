@@ -1,10 +1,35 @@
 ## Generated by pyxsdgen
 
-from xml.etree import ElementTree as ET
+from opennsa.protocols.shared import xmlbackend as ET
+
+
+def _children(element):
+    # single pass over the child elements, tag -> [ elements ]
+    children = {}
+    for e in element:
+        try:
+            children[e.tag].append(e)
+        except KeyError:
+            children[e.tag] = [ e ]
+    return children
+
+def _find(children, tag):
+    es = children.get(tag)
+    return None if es is None else es[0]
+
+def _findall(children, tag):
+    return children.get(tag, [])
+
+def _text(children, tag):
+    # same semantics as element.findtext, missing element -> None, empty element -> ''
+    es = children.get(tag)
+    return None if es is None else (es[0].text or '')
 
 # types
 
 class DataPlaneStatusType(object):
+    __slots__ = ( 'active', 'version', 'versionConsistent' )
+
     def __init__(self, active, version, versionConsistent):
         self.active = active  # boolean
         self.version = version  # int
@@ -12,10 +37,11 @@ class DataPlaneStatusType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return DataPlaneStatusType(
-                True if element.findtext('active') == 'true' else False,
-                int(element.findtext('version')),
-                True if element.findtext('versionConsistent') == 'true' else False
+                True if _text(c, 'active') == 'true' else False,
+                int(_text(c, 'version')),
+                True if _text(c, 'versionConsistent') == 'true' else False
                )
 
     def xml(self, elementName):
@@ -27,13 +53,16 @@ class DataPlaneStatusType(object):
 
 
 class GenericErrorType(object):
+    __slots__ = ( 'serviceException', )
+
     def __init__(self, serviceException):
         self.serviceException = serviceException  # ServiceExceptionType
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return GenericErrorType(
-                ServiceExceptionType.build(element.find('serviceException'))
+                ServiceExceptionType.build(_find(c, 'serviceException'))
 
                )
 
@@ -44,6 +73,8 @@ class GenericErrorType(object):
 
 
 class ReserveType(object):
+    __slots__ = ( 'connectionId', 'globalReservationId', 'description', 'criteria' )
+
     def __init__(self, connectionId, globalReservationId, description, criteria):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.globalReservationId = globalReservationId  # GlobalReservationIdType -> anyURI
@@ -52,11 +83,12 @@ class ReserveType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ReserveType(
-                element.findtext('connectionId') if element.find('connectionId') is not None else None,
-                element.findtext('globalReservationId') if element.find('globalReservationId') is not None else None,
-                element.findtext('description') if element.find('description') is not None else None,
-                ReservationRequestCriteriaType.build(element.find('criteria'))
+                _text(c, 'connectionId'),
+                _text(c, 'globalReservationId'),
+                _text(c, 'description'),
+                ReservationRequestCriteriaType.build(_find(c, 'criteria'))
                )
 
     def xml(self, elementName):
@@ -72,6 +104,8 @@ class ReserveType(object):
 
 
 class MessageDeliveryTimeoutRequestType(object):
+    __slots__ = ( 'connectionId', 'notificationId', 'timeStamp', 'correlationId' )
+
     def __init__(self, connectionId, notificationId, timeStamp, correlationId):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.notificationId = notificationId  # NotificationIdType -> long
@@ -80,11 +114,12 @@ class MessageDeliveryTimeoutRequestType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return MessageDeliveryTimeoutRequestType(
-                element.findtext('connectionId'),
-                int(element.findtext('notificationId')),
-                element.findtext('timeStamp'),
-                element.findtext('correlationId')
+                _text(c, 'connectionId'),
+                int(_text(c, 'notificationId')),
+                _text(c, 'timeStamp'),
+                _text(c, 'correlationId')
                )
 
     def xml(self, elementName):
@@ -97,13 +132,16 @@ class MessageDeliveryTimeoutRequestType(object):
 
 
 class GenericConfirmedType(object):
+    __slots__ = ( 'connectionId', )
+
     def __init__(self, connectionId):
         self.connectionId = connectionId  # ConnectionIdType -> string
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return GenericConfirmedType(
-                element.findtext('connectionId')
+                _text(c, 'connectionId')
                )
 
     def xml(self, elementName):
@@ -113,6 +151,8 @@ class GenericConfirmedType(object):
 
 
 class ConnectionStatesType(object):
+    __slots__ = ( 'reservationState', 'provisionState', 'lifecycleState', 'dataPlaneStatus' )
+
     def __init__(self, reservationState, provisionState, lifecycleState, dataPlaneStatus):
         self.reservationState = reservationState  # ReservationStateEnumType -> string
         self.provisionState = provisionState  # ProvisionStateEnumType -> string
@@ -121,11 +161,12 @@ class ConnectionStatesType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ConnectionStatesType(
-                element.findtext('reservationState'),
-                element.findtext('provisionState') if element.find('provisionState') is not None else None,
-                element.findtext('lifecycleState'),
-                DataPlaneStatusType.build(element.find('dataPlaneStatus'))
+                _text(c, 'reservationState'),
+                _text(c, 'provisionState'),
+                _text(c, 'lifecycleState'),
+                DataPlaneStatusType.build(_find(c, 'dataPlaneStatus'))
                )
 
     def xml(self, elementName):
@@ -138,6 +179,8 @@ class ConnectionStatesType(object):
 
 
 class ReservationRequestCriteriaType(object):
+    __slots__ = ( 'version', 'schedule', 'serviceType', 'serviceDefinition' )
+
     def __init__(self, version, schedule, serviceType, serviceDefinition):
         self.version = version  # int
         self.schedule = schedule  # ScheduleType
@@ -147,13 +190,14 @@ class ReservationRequestCriteriaType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         # we do some manual stuff here
         from . import p2pservices
         service_defs = [ p2pservices.parseElement(e) for e in element if e.tag not in ('schedule', 'serviceType') ]
         return ReservationRequestCriteriaType(
                 element.get('version'),
-                ScheduleType.build(element.find('schedule')) if element.find('schedule') is not None else None,
-                element.findtext('serviceType') if element.find('serviceType') is not None else None,
+                ScheduleType.build(_find(c, 'schedule')) if 'schedule' in c else None,
+                _text(c, 'serviceType'),
                 service_defs[0]
                )
 
@@ -170,6 +214,8 @@ class ReservationRequestCriteriaType(object):
 
 
 class QuerySummaryResultType(object):
+    __slots__ = ( 'connectionId', 'globalReservationId', 'description', 'criteria', 'requesterNSA', 'connectionStates', 'notificationId', 'resultId' )
+
     def __init__(self, connectionId, globalReservationId, description, criteria, requesterNSA, connectionStates, notificationId, resultId):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.globalReservationId = globalReservationId  # GlobalReservationIdType -> anyURI
@@ -182,15 +228,16 @@ class QuerySummaryResultType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QuerySummaryResultType(
-                element.findtext('connectionId'),
-                element.findtext('globalReservationId') if element.find('globalReservationId') is not None else None,
-                element.findtext('description') if element.find('description') is not None else None,
-                [ QuerySummaryResultCriteriaType.build(e) for e in element.findall('criteria') ] if element.find('criteria') is not None else None,
-                element.findtext('requesterNSA'),
-                ConnectionStatesType.build(element.find('connectionStates')),
-                int(element.findtext('notificationId')) if element.find('notificationId') is not None else None,
-                int(element.findtext('resultId')) if element.find('resultId') is not None else None
+                _text(c, 'connectionId'),
+                _text(c, 'globalReservationId'),
+                _text(c, 'description'),
+                [ QuerySummaryResultCriteriaType.build(e) for e in _findall(c, 'criteria') ] if 'criteria' in c else None,
+                _text(c, 'requesterNSA'),
+                ConnectionStatesType.build(_find(c, 'connectionStates')),
+                int(_text(c, 'notificationId')) if 'notificationId' in c else None,
+                int(_text(c, 'resultId')) if 'resultId' in c else None
                )
 
     def xml(self, elementName):
@@ -214,13 +261,16 @@ class QuerySummaryResultType(object):
 
 
 class QuerySummaryConfirmedType(object):
+    __slots__ = ( 'reservations', )
+
     def __init__(self, reservations):
         self.reservations = reservations  # [ QuerySummaryResultType  ]
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QuerySummaryConfirmedType(
-                [ QuerySummaryResultType.build(e) for e in element.findall('reservation') ]
+                [ QuerySummaryResultType.build(e) for e in _findall(c, 'reservation') ]
                )
 
     def xml(self, elementName):
@@ -232,13 +282,16 @@ class QuerySummaryConfirmedType(object):
 
 
 class QueryRecursiveConfirmedType(object):
+    __slots__ = ( 'reservations', )
+
     def __init__(self, reservations):
         self.reservations = reservations  # [ QueryRecursiveResultType  ]
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QueryRecursiveConfirmedType(
-                [ QueryRecursiveResultType.build(e) for e in element.findall('reservation') ]
+                [ QueryRecursiveResultType.build(e) for e in _findall(c, 'reservation') ]
                )
 
     def xml(self, elementName):
@@ -250,6 +303,8 @@ class QueryRecursiveConfirmedType(object):
 
 
 class ReserveConfirmedType(object):
+    __slots__ = ( 'connectionId', 'globalReservationId', 'description', 'criteria' )
+
     def __init__(self, connectionId, globalReservationId, description, criteria):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.globalReservationId = globalReservationId  # GlobalReservationIdType -> anyURI
@@ -258,11 +313,12 @@ class ReserveConfirmedType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ReserveConfirmedType(
-                element.findtext('connectionId'),
-                element.findtext('globalReservationId') if element.find('globalReservationId') is not None else None,
-                element.findtext('description') if element.find('description') is not None else None,
-                ReservationConfirmCriteriaType.build(element.find('criteria'))
+                _text(c, 'connectionId'),
+                _text(c, 'globalReservationId'),
+                _text(c, 'description'),
+                ReservationConfirmCriteriaType.build(_find(c, 'criteria'))
                )
 
     def xml(self, elementName):
@@ -277,6 +333,8 @@ class ReserveConfirmedType(object):
 
 
 class GenericAcknowledgmentType(object):
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -290,13 +348,16 @@ class GenericAcknowledgmentType(object):
 
 
 class ReserveResponseType(object):
+    __slots__ = ( 'connectionId', )
+
     def __init__(self, connectionId):
         self.connectionId = connectionId  # ConnectionIdType -> string
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ReserveResponseType(
-                element.findtext('connectionId')
+                _text(c, 'connectionId')
                )
 
     def xml(self, elementName):
@@ -306,6 +367,8 @@ class ReserveResponseType(object):
 
 
 class DataPlaneStateChangeRequestType(object):
+    __slots__ = ( 'connectionId', 'notificationId', 'timeStamp', 'dataPlaneStatus' )
+
     def __init__(self, connectionId, notificationId, timeStamp, dataPlaneStatus):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.notificationId = notificationId  # NotificationIdType -> long
@@ -314,11 +377,12 @@ class DataPlaneStateChangeRequestType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return DataPlaneStateChangeRequestType(
-                element.findtext('connectionId'),
-                int(element.findtext('notificationId')),
-                element.findtext('timeStamp'),
-                DataPlaneStatusType.build(element.find('dataPlaneStatus'))
+                _text(c, 'connectionId'),
+                int(_text(c, 'notificationId')),
+                _text(c, 'timeStamp'),
+                DataPlaneStatusType.build(_find(c, 'dataPlaneStatus'))
                )
 
     def xml(self, elementName):
@@ -331,6 +395,8 @@ class DataPlaneStateChangeRequestType(object):
 
 
 class ErrorEventType(object):
+    __slots__ = ( 'connectionId', 'notificationId', 'timeStamp', 'event', 'originatingConnectionId', 'originatingNSA', 'additionalInfo', 'serviceException' )
+
     def __init__(self, connectionId, notificationId, timeStamp, event, originatingConnectionId, originatingNSA, additionalInfo, serviceException):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.notificationId = notificationId  # NotificationIdType -> long
@@ -343,15 +409,16 @@ class ErrorEventType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ErrorEventType(
-                element.findtext('connectionId'),
-                int(element.findtext('notificationId')),
-                element.findtext('timeStamp'),
-                element.findtext('event'),
-                element.findtext('originatingConnectionId'),
-                element.findtext('originatingNSA'),
-                [ TypeValuePairType.build(e) for e in element.find('additionalInfo') ] if element.find('additionalInfo') is not None else None,
-                ServiceExceptionType.build(element.find('serviceException')) if element.find('serviceException') is not None else None
+                _text(c, 'connectionId'),
+                int(_text(c, 'notificationId')),
+                _text(c, 'timeStamp'),
+                _text(c, 'event'),
+                _text(c, 'originatingConnectionId'),
+                _text(c, 'originatingNSA'),
+                [ TypeValuePairType.build(e) for e in _find(c, 'additionalInfo') ] if 'additionalInfo' in c else None,
+                ServiceExceptionType.build(_find(c, 'serviceException')) if 'serviceException' in c else None
                )
 
     def xml(self, elementName):
@@ -370,6 +437,8 @@ class ErrorEventType(object):
 
 
 class QueryResultResponseType(object):
+    __slots__ = ( 'resultId', 'correlationId', 'timeStamp', 'reserveConfirmed', 'reserveFailed', 'reserveCommitConfirmed', 'reserveCommitFailed', 'reserveAbortConfirmed', 'provisionConfirmed', 'releaseConfirmed', 'terminateConfirmed', 'error' )
+
     def __init__(self, resultId, correlationId, timeStamp, reserveConfirmed, reserveFailed, reserveCommitConfirmed, reserveCommitFailed, reserveAbortConfirmed, provisionConfirmed, releaseConfirmed, terminateConfirmed, error):
         self.resultId = resultId  # ResultIdType -> long
         self.correlationId = correlationId  # UuidType -> anyURI
@@ -386,19 +455,20 @@ class QueryResultResponseType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QueryResultResponseType(
-                int(element.findtext('resultId')),
-                element.findtext('correlationId'),
-                element.findtext('timeStamp'),
-                ReserveConfirmedType.build(element.find('reserveConfirmed')),
-                GenericFailedType.build(element.find('reserveFailed')),
-                GenericConfirmedType.build(element.find('reserveCommitConfirmed')),
-                GenericFailedType.build(element.find('reserveCommitFailed')),
-                GenericConfirmedType.build(element.find('reserveAbortConfirmed')),
-                GenericConfirmedType.build(element.find('provisionConfirmed')),
-                GenericConfirmedType.build(element.find('releaseConfirmed')),
-                GenericConfirmedType.build(element.find('terminateConfirmed')),
-                GenericErrorType.build(element.find('error'))
+                int(_text(c, 'resultId')),
+                _text(c, 'correlationId'),
+                _text(c, 'timeStamp'),
+                ReserveConfirmedType.build(_find(c, 'reserveConfirmed')),
+                GenericFailedType.build(_find(c, 'reserveFailed')),
+                GenericConfirmedType.build(_find(c, 'reserveCommitConfirmed')),
+                GenericFailedType.build(_find(c, 'reserveCommitFailed')),
+                GenericConfirmedType.build(_find(c, 'reserveAbortConfirmed')),
+                GenericConfirmedType.build(_find(c, 'provisionConfirmed')),
+                GenericConfirmedType.build(_find(c, 'releaseConfirmed')),
+                GenericConfirmedType.build(_find(c, 'terminateConfirmed')),
+                GenericErrorType.build(_find(c, 'error'))
                )
 
     def xml(self, elementName):
@@ -419,6 +489,8 @@ class QueryResultResponseType(object):
 
 
 class QueryNotificationType(object):
+    __slots__ = ( 'connectionId', 'startNotificationId', 'endNotificationId' )
+
     def __init__(self, connectionId, startNotificationId, endNotificationId):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.startNotificationId = startNotificationId  # NotificationIdType -> long
@@ -426,10 +498,11 @@ class QueryNotificationType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QueryNotificationType(
-                element.findtext('connectionId'),
-                int(element.findtext('startNotificationId')) if element.find('startNotificationId') is not None else None,
-                int(element.findtext('endNotificationId')) if element.find('endNotificationId') is not None else None
+                _text(c, 'connectionId'),
+                int(_text(c, 'startNotificationId')) if 'startNotificationId' in c else None,
+                int(_text(c, 'endNotificationId')) if 'endNotificationId' in c else None
                )
 
     def xml(self, elementName):
@@ -443,6 +516,8 @@ class QueryNotificationType(object):
 
 
 class ReserveTimeoutRequestType(object):
+    __slots__ = ( 'connectionId', 'notificationId', 'timeStamp', 'timeoutValue', 'originatingConnectionId', 'originatingNSA' )
+
     def __init__(self, connectionId, notificationId, timeStamp, timeoutValue, originatingConnectionId, originatingNSA):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.notificationId = notificationId  # NotificationIdType -> long
@@ -453,13 +528,14 @@ class ReserveTimeoutRequestType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ReserveTimeoutRequestType(
-                element.findtext('connectionId'),
-                int(element.findtext('notificationId')),
-                element.findtext('timeStamp'),
-                int(element.findtext('timeoutValue')),
-                element.findtext('originatingConnectionId'),
-                element.findtext('originatingNSA')
+                _text(c, 'connectionId'),
+                int(_text(c, 'notificationId')),
+                _text(c, 'timeStamp'),
+                int(_text(c, 'timeoutValue')),
+                _text(c, 'originatingConnectionId'),
+                _text(c, 'originatingNSA')
                )
 
     def xml(self, elementName):
@@ -474,15 +550,18 @@ class ReserveTimeoutRequestType(object):
 
 
 class ScheduleType(object):
+    __slots__ = ( 'startTime', 'endTime' )
+
     def __init__(self, startTime, endTime):
         self.startTime = startTime  # DateTimeType -> dateTime
         self.endTime = endTime  # DateTimeType -> dateTime
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ScheduleType(
-                element.findtext('startTime') if element.find('startTime') is not None else None,
-                element.findtext('endTime') if element.find('endTime') is not None else None
+                _text(c, 'startTime'),
+                _text(c, 'endTime')
                )
 
     def xml(self, elementName):
@@ -495,6 +574,8 @@ class ScheduleType(object):
 
 
 class ChildSummaryType(object):
+    __slots__ = ( 'order', 'connectionId', 'providerNSA', 'serviceType' )
+
     def __init__(self, order, connectionId, providerNSA, serviceType):
         self.order = order  # int
         self.connectionId = connectionId  # ConnectionIdType -> string
@@ -503,11 +584,12 @@ class ChildSummaryType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ChildSummaryType(
                 element.get('order'),
-                element.findtext('connectionId'),
-                element.findtext('providerNSA'),
-                element.findtext('serviceType')
+                _text(c, 'connectionId'),
+                _text(c, 'providerNSA'),
+                _text(c, 'serviceType')
                )
 
     def xml(self, elementName):
@@ -519,6 +601,8 @@ class ChildSummaryType(object):
 
 
 class QueryResultType(object):
+    __slots__ = ( 'connectionId', 'startResultId', 'endResultId' )
+
     def __init__(self, connectionId, startResultId, endResultId):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.startResultId = startResultId  # ResultIdType -> long
@@ -526,10 +610,11 @@ class QueryResultType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QueryResultType(
-                element.findtext('connectionId'),
-                int(element.findtext('startResultId')) if element.find('startResultId') is not None else None,
-                int(element.findtext('endResultId')) if element.find('endResultId') is not None else None
+                _text(c, 'connectionId'),
+                int(_text(c, 'startResultId')) if 'startResultId' in c else None,
+                int(_text(c, 'endResultId')) if 'endResultId' in c else None
                )
 
     def xml(self, elementName):
@@ -543,6 +628,8 @@ class QueryResultType(object):
 
 
 class ReservationConfirmCriteriaType(object):
+    __slots__ = ( 'version', 'schedule', 'serviceType', 'serviceDefinitionTag', 'serviceDefinition' )
+
     def __init__(self, version, schedule, serviceType, serviceDefinitionTag, serviceDefinition):
         self.version = version  # int
         self.schedule = schedule  # ScheduleType
@@ -552,14 +639,15 @@ class ReservationConfirmCriteriaType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         # This isn't quite done right. It should look up the tag name, and find the parser from there
         # However only a single service is currently supported, so this works
         from . import p2pservices
         service_defs = [ p2pservices.parseElement(e) for e in element if e.tag not in ('schedule', 'serviceType') ]
         return ReservationConfirmCriteriaType(
                 element.get('version'),
-                ScheduleType.build(element.find('schedule')),
-                element.findtext('serviceType'),
+                ScheduleType.build(_find(c, 'schedule')),
+                _text(c, 'serviceType'),
                 str(p2pservices.p2ps),
                 service_defs[0]
                )
@@ -574,13 +662,16 @@ class ReservationConfirmCriteriaType(object):
 
 
 class GenericRequestType(object):
+    __slots__ = ( 'connectionId', )
+
     def __init__(self, connectionId):
         self.connectionId = connectionId  # ConnectionIdType -> string
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return GenericRequestType(
-                element.findtext('connectionId')
+                _text(c, 'connectionId')
                )
 
     def xml(self, elementName):
@@ -590,6 +681,8 @@ class GenericRequestType(object):
 
 
 class TypeValuePairType(object):
+    __slots__ = ( 'type', 'namespace', 'value' )
+
     def __init__(self, type, namespace, value):
         self.type = type  # string
         self.namespace = namespace  # anyURI
@@ -597,10 +690,11 @@ class TypeValuePairType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return TypeValuePairType(
                 element.get('type'),
                 element.get('namespace'),
-                element.findtext('value') if element.find('value') is not None else None
+                _text(c, 'value')
                )
 
     def xml(self, elementName):
@@ -612,6 +706,8 @@ class TypeValuePairType(object):
 
 
 class QueryRecursiveResultType(object):
+    __slots__ = ( 'connectionId', 'globalReservationId', 'description', 'criteria', 'requesterNSA', 'connectionStates', 'notificationId', 'resultId' )
+
     def __init__(self, connectionId, globalReservationId, description, criteria, requesterNSA, connectionStates, notificationId, resultId):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.globalReservationId = globalReservationId  # GlobalReservationIdType -> anyURI
@@ -624,15 +720,16 @@ class QueryRecursiveResultType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QueryRecursiveResultType(
-                element.findtext('connectionId'),
-                element.findtext('globalReservationId') if element.find('globalReservationId') is not None else None,
-                element.findtext('description') if element.find('description') is not None else None,
-                [ QueryRecursiveResultCriteriaType.build(e) for e in element.findall('criteria') ] if element.find('criteria') is not None else None,
-                element.findtext('requesterNSA'),
-                ConnectionStatesType.build(element.find('connectionStates')),
-                int(element.findtext('notificationId')) if element.find('notificationId') is not None else None,
-                int(element.findtext('resultId')) if element.find('resultId') is not None else None
+                _text(c, 'connectionId'),
+                _text(c, 'globalReservationId'),
+                _text(c, 'description'),
+                [ QueryRecursiveResultCriteriaType.build(e) for e in _findall(c, 'criteria') ] if 'criteria' in c else None,
+                _text(c, 'requesterNSA'),
+                ConnectionStatesType.build(_find(c, 'connectionStates')),
+                int(_text(c, 'notificationId')) if 'notificationId' in c else None,
+                int(_text(c, 'resultId')) if 'resultId' in c else None
                )
 
     def xml(self, elementName):
@@ -654,6 +751,8 @@ class QueryRecursiveResultType(object):
 
 
 class ServiceExceptionType(object):
+    __slots__ = ( 'nsaId', 'connectionId', 'serviceType', 'errorId', 'text', 'variables', 'childException' )
+
     def __init__(self, nsaId, connectionId, serviceType, errorId, text, variables, childException):
         self.nsaId = nsaId  # NsaIdType -> anyURI
         self.connectionId = connectionId  # ConnectionIdType -> string
@@ -665,14 +764,15 @@ class ServiceExceptionType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ServiceExceptionType(
-                element.findtext('nsaId'),
-                element.findtext('connectionId') if element.find('connectionId') is not None else None,
-                element.findtext('serviceType') if element.find('serviceType') is not None else None,
-                element.findtext('errorId'),
-                element.findtext('text'),
-                [ TypeValuePairType.build(e) for e in element.find('variables') ] if element.find('variables') is not None else None,
-                [ ServiceExceptionType.build(e) for e in element.findall('childException') ] if element.find('childException') is not None else None
+                _text(c, 'nsaId'),
+                _text(c, 'connectionId'),
+                _text(c, 'serviceType'),
+                _text(c, 'errorId'),
+                _text(c, 'text'),
+                [ TypeValuePairType.build(e) for e in _find(c, 'variables') ] if 'variables' in c else None,
+                [ ServiceExceptionType.build(e) for e in _findall(c, 'childException') ] if 'childException' in c else None
                )
 
     def xml(self, elementName):
@@ -693,6 +793,8 @@ class ServiceExceptionType(object):
 
 
 class QueryNotificationConfirmedType(object):
+    __slots__ = ( 'errorEvent', 'reserveTimeout', 'dataPlaneStateChange', 'messageDeliveryTimeout' )
+
     def __init__(self, errorEvent, reserveTimeout, dataPlaneStateChange, messageDeliveryTimeout):
         self.errorEvent = errorEvent  # ErrorEventType
         self.reserveTimeout = reserveTimeout  # ReserveTimeoutRequestType
@@ -701,11 +803,12 @@ class QueryNotificationConfirmedType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QueryNotificationConfirmedType(
-                ErrorEventType.build(element.find('errorEvent')),
-                ReserveTimeoutRequestType.build(element.find('reserveTimeout')),
-                DataPlaneStateChangeRequestType.build(element.find('dataPlaneStateChange')),
-                MessageDeliveryTimeoutRequestType.build(element.find('messageDeliveryTimeout'))
+                ErrorEventType.build(_find(c, 'errorEvent')),
+                ReserveTimeoutRequestType.build(_find(c, 'reserveTimeout')),
+                DataPlaneStateChangeRequestType.build(_find(c, 'dataPlaneStateChange')),
+                MessageDeliveryTimeoutRequestType.build(_find(c, 'messageDeliveryTimeout'))
                )
 
     def xml(self, elementName):
@@ -718,6 +821,8 @@ class QueryNotificationConfirmedType(object):
 
 
 class QueryRecursiveResultCriteriaType(object):
+    __slots__ = ( 'version', 'schedule', 'serviceType', 'children', 'serviceDefinition' )
+
     def __init__(self, version, schedule, serviceType, children, serviceDefinition):
         self.version = version  # int
         self.schedule = schedule  # ScheduleType
@@ -727,13 +832,14 @@ class QueryRecursiveResultCriteriaType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         from . import p2pservices
         service_defs = [ p2pservices.parseElement(e) for e in element if e.tag not in ('schedule', 'serviceType', 'children') ]
         return QueryRecursiveResultCriteriaType(
                 element.get('version'),
-                ScheduleType.build(element.find('schedule')),
-                element.findtext('serviceType'),
-                [ ChildRecursiveType.build(e) for e in element.find('children') ] if element.find('children') is not None else None,
+                ScheduleType.build(_find(c, 'schedule')),
+                _text(c, 'serviceType'),
+                [ ChildRecursiveType.build(e) for e in _find(c, 'children') ] if 'children' in c else None,
                 service_defs[0]
                )
 
@@ -748,6 +854,8 @@ class QueryRecursiveResultCriteriaType(object):
 
 
 class GenericFailedType(object):
+    __slots__ = ( 'connectionId', 'connectionStates', 'serviceException' )
+
     def __init__(self, connectionId, connectionStates, serviceException):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.connectionStates = connectionStates  # ConnectionStatesType
@@ -755,10 +863,11 @@ class GenericFailedType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return GenericFailedType(
-                element.findtext('connectionId'),
-                ConnectionStatesType.build(element.find('connectionStates')),
-                ServiceExceptionType.build(element.find('serviceException'))
+                _text(c, 'connectionId'),
+                ConnectionStatesType.build(_find(c, 'connectionStates')),
+                ServiceExceptionType.build(_find(c, 'serviceException'))
                )
 
     def xml(self, elementName):
@@ -770,6 +879,8 @@ class GenericFailedType(object):
 
 
 class ChildRecursiveType(object):
+    __slots__ = ( 'order', 'connectionId', 'providerNSA', 'connectionStates', 'criteria' )
+
     def __init__(self, order, connectionId, providerNSA, connectionStates, criteria):
         self.order = order  # int
         self.connectionId = connectionId  # ConnectionIdType -> string
@@ -779,12 +890,13 @@ class ChildRecursiveType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ChildRecursiveType(
                 element.get('order'),
-                element.findtext('connectionId'),
-                element.findtext('providerNSA'),
-                ConnectionStatesType.build(element.find('connectionStates')),
-                [ QueryRecursiveResultCriteriaType.build(e) for e in element.findall('criteria') ] if element.find('criteria') is not None else None
+                _text(c, 'connectionId'),
+                _text(c, 'providerNSA'),
+                ConnectionStatesType.build(_find(c, 'connectionStates')),
+                [ QueryRecursiveResultCriteriaType.build(e) for e in _findall(c, 'criteria') ] if 'criteria' in c else None
                )
 
     def xml(self, elementName):
@@ -798,15 +910,18 @@ class ChildRecursiveType(object):
 
 
 class QueryType(object):
+    __slots__ = ( 'connectionId', 'globalReservationId' )
+
     def __init__(self, connectionId, globalReservationId):
         self.connectionId = connectionId  # [ ConnectionIdType -> string ]
         self.globalReservationId = globalReservationId  # [ GlobalReservationIdType -> anyURI ]
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return QueryType(
-                [ e.text for e in element.findall('connectionId') ],
-                [ e.text for e in element.findall('globalReservationId') ]
+                [ e.text for e in _findall(c, 'connectionId') ],
+                [ e.text for e in _findall(c, 'globalReservationId') ]
                )
 
     def xml(self, elementName):
@@ -821,6 +936,8 @@ class QueryType(object):
 
 
 class QuerySummaryResultCriteriaType(object):
+    __slots__ = ( 'version', 'schedule', 'serviceType', 'children', 'serviceDefinition' )
+
     def __init__(self, version, schedule, serviceType, children, serviceDefinition):
         self.version = version  # int
         self.schedule = schedule  # ScheduleType
@@ -830,13 +947,14 @@ class QuerySummaryResultCriteriaType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         from . import p2pservices
         service_defs = [ p2pservices.parseElement(e) for e in element if e.tag not in ('schedule', 'serviceType', 'children') ]
         return QuerySummaryResultCriteriaType(
                 element.get('version'),
-                ScheduleType.build(element.find('schedule')),
-                element.findtext('serviceType'),
-                [ ChildSummaryType.build(e) for e in element.find('children') ] if element.find('children') is not None else None,
+                ScheduleType.build(_find(c, 'schedule')),
+                _text(c, 'serviceType'),
+                [ ChildSummaryType.build(e) for e in _find(c, 'children') ] if 'children' in c else None,
                 service_defs[0]
                )
 
@@ -852,6 +970,8 @@ class QuerySummaryResultCriteriaType(object):
 
 
 class NotificationBaseType(object):
+    __slots__ = ( 'connectionId', 'notificationId', 'timeStamp' )
+
     def __init__(self, connectionId, notificationId, timeStamp):
         self.connectionId = connectionId  # ConnectionIdType -> string
         self.notificationId = notificationId  # NotificationIdType -> long
@@ -859,10 +979,11 @@ class NotificationBaseType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return NotificationBaseType(
-                element.findtext('connectionId'),
-                int(element.findtext('notificationId')),
-                element.findtext('timeStamp')
+                _text(c, 'connectionId'),
+                int(_text(c, 'notificationId')),
+                _text(c, 'timeStamp')
                )
 
     def xml(self, elementName):
@@ -1,11 +1,36 @@
 ## Generated by pyxsdgen
 
-from xml.etree import ElementTree as ET
+from opennsa.protocols.shared import xmlbackend as ET
+
+
+def _children(element):
+    # single pass over the child elements, tag -> [ elements ]
+    children = {}
+    for e in element:
+        try:
+            children[e.tag].append(e)
+        except KeyError:
+            children[e.tag] = [ e ]
+    return children
+
+def _find(children, tag):
+    es = children.get(tag)
+    return None if es is None else es[0]
+
+def _findall(children, tag):
+    return children.get(tag, [])
+
+def _text(children, tag):
+    # same semantics as element.findtext, missing element -> None, empty element -> ''
+    es = children.get(tag)
+    return None if es is None else (es[0].text or '')
 
 # types
 
 
 class CommonHeaderType(object):
+    __slots__ = ( 'protocolVersion', 'correlationId', 'requesterNSA', 'providerNSA', 'replyTo', 'sessionSecurityAttr', 'connectionTrace' )
+
     def __init__(self, protocolVersion, correlationId, requesterNSA, providerNSA, replyTo, sessionSecurityAttr, connectionTrace=None):
         self.protocolVersion = protocolVersion  # string
         self.correlationId = correlationId  # UuidType -> anyURI
@@ -17,17 +42,18 @@ class CommonHeaderType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         # build trace first, as it is a bit complicated
-        trace = [ ConnectionType.build(e) for e in element.find(str(ConnectionTrace)).findall('Connection') ] if element.find(str(ConnectionTrace)) is not None else None
+        trace = [ ConnectionType.build(e) for e in _find(c, str(ConnectionTrace)).findall('Connection') ] if str(ConnectionTrace) in c else None
         if trace:
             trace = [ ct.connectionId for ct in sorted(trace, key=lambda ct : ct.index ) ]
         return CommonHeaderType(
-                element.findtext('protocolVersion'),
-                element.findtext('correlationId'),
-                element.findtext('requesterNSA'),
-                element.findtext('providerNSA'),
-                element.findtext('replyTo') if element.find('replyTo') is not None else None,
-                [ SessionSecurityAttrType.build(e) for e in element.findall('sessionSecurityAttr') ] if element.find('sessionSecurityAttr') is not None else None,
+                _text(c, 'protocolVersion'),
+                _text(c, 'correlationId'),
+                _text(c, 'requesterNSA'),
+                _text(c, 'providerNSA'),
+                _text(c, 'replyTo'),
+                [ SessionSecurityAttrType.build(e) for e in _findall(c, 'sessionSecurityAttr') ] if 'sessionSecurityAttr' in c else None,
                 trace
                )
 
@@ -50,6 +76,8 @@ class CommonHeaderType(object):
 
 
 class TypeValuePairType(object):
+    __slots__ = ( 'type', 'namespace', 'value' )
+
     def __init__(self, type, namespace, value):
         self.type = type  # string
         self.namespace = namespace  # anyURI
@@ -57,10 +85,11 @@ class TypeValuePairType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return TypeValuePairType(
                 element.get('type'),
                 element.get('namespace'),
-                element.findtext('value') if element.find('value') is not None else None
+                _text(c, 'value')
                )
 
     def xml(self, elementName):
@@ -76,14 +105,17 @@ class TypeValuePairType(object):
 
 
 class AttributeStatementType(object):
+    __slots__ = ( 'Attribute', )
+
     def __init__(self, Attribute): #, EncryptedAttribute):
         self.Attribute = Attribute  # [ AttributeType ]
         #self.EncryptedAttribute = EncryptedAttribute  # EncryptedElementType
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return AttributeStatementType(
-                AttributeType.build(element.findall('Attribute'))
+                AttributeType.build(_findall(c, 'Attribute'))
                 #EncryptedElementType.build(element.find('EncryptedAttribute'))
                )
 
@@ -95,6 +127,8 @@ class AttributeStatementType(object):
 
 
 class AttributeType(object):
+    __slots__ = ( 'Name', 'NameFormat', 'FriendlyName', 'AttributeValue' )
+
     def __init__(self, Name, NameFormat, FriendlyName, AttributeValue):
         self.Name = Name  # string
         self.NameFormat = NameFormat  # anyURI
@@ -124,14 +158,17 @@ class AttributeType(object):
 
 
 class SessionSecurityAttrType(object):
+    __slots__ = ( 'Attributes', )
+
     def __init__(self, Attributes): #, EncryptedAttribute):
         self.Attributes = Attributes  # [ AttributeType ]
         #self.EncryptedAttribute = EncryptedAttribute  # [ EncryptedElementType ]
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return SessionSecurityAttrType(
-                [ AttributeType.build(e) for e in element.findall('{urn:oasis:names:tc:SAML:2.0:assertion}Attribute') ]
+                [ AttributeType.build(e) for e in _findall(c, '{urn:oasis:names:tc:SAML:2.0:assertion}Attribute') ]
                 #EncryptedElementType.build(element.find('EncryptedAttribute'))
                )
 
@@ -144,6 +181,8 @@ class SessionSecurityAttrType(object):
 
 
 class ServiceExceptionType(object):
+    __slots__ = ( 'nsaId', 'connectionId', 'serviceType', 'errorId', 'text', 'variables', 'childException' )
+
     def __init__(self, nsaId, connectionId, serviceType, errorId, text, variables, childException):
         self.nsaId = nsaId  # NsaIdType -> anyURI
         self.connectionId = connectionId  # ConnectionIdType -> string
@@ -155,14 +194,15 @@ class ServiceExceptionType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return ServiceExceptionType(
-                element.findtext('nsaId'),
-                element.findtext('connectionId') if element.find('connectionId') is not None else None,
-                element.findtext('serviceType') if element.find('serviceType') is not None else None,
-                element.findtext('errorId'),
-                element.findtext('text'),
-                [ TypeValuePairType.build(e) for e in element.find('variables') ] if element.find('variables') is not None else None,
-                [ ServiceExceptionType.build(e) for e in element.findall('childException') ] if element.find('childException') is not None else None
+                _text(c, 'nsaId'),
+                _text(c, 'connectionId'),
+                _text(c, 'serviceType'),
+                _text(c, 'errorId'),
+                _text(c, 'text'),
+                [ TypeValuePairType.build(e) for e in _find(c, 'variables') ] if 'variables' in c else None,
+                [ ServiceExceptionType.build(e) for e in _findall(c, 'childException') ] if 'childException' in c else None
                )
 
     def xml(self, elementName):
@@ -185,6 +225,8 @@ class ServiceExceptionType(object):
 
 
 class ConnectionType(object):
+    __slots__ = ( 'connectionId', 'index' )
+
     def __init__(self, connectionId, index):
         self.connectionId = connectionId  # string / anyURI
         self.index = index  # int
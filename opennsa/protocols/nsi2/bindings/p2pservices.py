@@ -1,19 +1,45 @@
 ## Generated by pyxsdgen
 
-from xml.etree import ElementTree as ET
+from opennsa.protocols.shared import xmlbackend as ET
+
+
+def _children(element):
+    # single pass over the child elements, tag -> [ elements ]
+    children = {}
+    for e in element:
+        try:
+            children[e.tag].append(e)
+        except KeyError:
+            children[e.tag] = [ e ]
+    return children
+
+def _find(children, tag):
+    es = children.get(tag)
+    return None if es is None else es[0]
+
+def _findall(children, tag):
+    return children.get(tag, [])
+
+def _text(children, tag):
+    # same semantics as element.findtext, missing element -> None, empty element -> ''
+    es = children.get(tag)
+    return None if es is None else (es[0].text or '')
 
 # types
 
 class OrderedStpType(object):
+    __slots__ = ( 'order', 'stp' )
+
     def __init__(self, order, stp):
         self.order = order  # int
         self.stp = stp  # StpIdType -> string
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return OrderedStpType(
                 element.get('order'),
-                element.findtext('stp')
+                _text(c, 'stp')
                )
 
     def xml(self, elementName):
@@ -23,6 +49,8 @@ class OrderedStpType(object):
 
 
 class TypeValueType(object):
+    __slots__ = ( 'type_', 'value' )
+
     def __init__(self, type_, value):
         self.type_ = type_
         self.value = value
@@ -41,6 +69,8 @@ class TypeValueType(object):
 
 
 class P2PServiceBaseType(object):
+    __slots__ = ( 'capacity', 'directionality', 'symmetricPath', 'sourceSTP', 'destSTP', 'ero', 'parameter' )
+
     def __init__(self, capacity, directionality, symmetricPath, sourceSTP, destSTP, ero, parameter):
         self.capacity = capacity  # long
         self.directionality = directionality  # DirectionalityType -> string
@@ -52,14 +82,15 @@ class P2PServiceBaseType(object):
 
     @classmethod
     def build(self, element):
+        c = _children(element)
         return P2PServiceBaseType(
-                int(element.findtext('capacity')),
-                element.findtext('directionality'),
-                True if element.findtext('symmetricPath') == 'true' else False if element.find('symmetricPath') is not None else None,
-                element.findtext('sourceSTP'),
-                element.findtext('destSTP'),
-                [ OrderedStpType.build(e) for e in element.find('ero') ] if element.find('ero') is not None else None,
-                [ TypeValueType.build(e) for e in element.findall('parameter') ] if element.find('parameter') is not None else None
+                int(_text(c, 'capacity')),
+                _text(c, 'directionality'),
+                True if _text(c, 'symmetricPath') == 'true' else False if 'symmetricPath' in c else None,
+                _text(c, 'sourceSTP'),
+                _text(c, 'destSTP'),
+                [ OrderedStpType.build(e) for e in _find(c, 'ero') ] if 'ero' in c else None,
+                [ TypeValueType.build(e) for e in _findall(c, 'parameter') ] if 'parameter' in c else None
                )
 
     def xml(self, elementName):
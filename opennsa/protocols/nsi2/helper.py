@@ -5,12 +5,12 @@ Author: Henrik Thostrup Jensen <htj@nordu.net>
 Copyright: NORDUnet (2012)
 """
 
-from xml.etree import ElementTree as ET
+from opennsa.protocols.shared import xmlbackend as ET
 
 from twisted.python import log, failure
 
 from opennsa import constants as cnt, nsa, error
-from opennsa.protocols.shared import minisoap
+from opennsa.protocols.shared import minisoap, soaptemplate
 from opennsa.protocols.nsi2.bindings import nsiframework, nsiconnection
 
 
@@ -71,10 +71,10 @@ def createRequesterHeader(requester_nsa_urn, provider_nsa_urn, reply_to=None, co
     return _createHeader(requester_nsa_urn, provider_nsa_urn, reply_to, correlation_id, security_attributes, connection_trace, protocol_type=cnt.CS2_REQUESTER)
 
 
-def _createGenericAcknowledgement(header, protocol_type=None):
+def _createGenericAcknowledgement(correlation_id, requester_nsa, provider_nsa, protocol_type=None):
 
     # we do not put reply to, security attributes or connection traces in the acknowledgement
-    soap_header_element = _createHeader(header.requester_nsa, header.provider_nsa, correlation_id=header.correlation_id, protocol_type=protocol_type)
+    soap_header_element = _createHeader(requester_nsa, provider_nsa, correlation_id=correlation_id, protocol_type=protocol_type)
 
     generic_confirm = nsiconnection.GenericAcknowledgmentType()
     generic_confirm_element = generic_confirm.xml(nsiconnection.acknowledgment)
@@ -83,11 +83,16 @@ def _createGenericAcknowledgement(header, protocol_type=None):
     return payload
 
 
+# acknowledgements are sent for every request, so they are rendered from templates
+_PROVIDER_ACKNOWLEDGEMENT  = soaptemplate.SOAPTemplate( lambda *v : _createGenericAcknowledgement(*v, protocol_type=cnt.CS2_PROVIDER) )
+_REQUESTER_ACKNOWLEDGEMENT = soaptemplate.SOAPTemplate( lambda *v : _createGenericAcknowledgement(*v, protocol_type=cnt.CS2_REQUESTER) )
+
+
 def createGenericProviderAcknowledgement(header):
-    return _createGenericAcknowledgement(header, cnt.CS2_PROVIDER)
+    return _PROVIDER_ACKNOWLEDGEMENT.render(header.correlation_id, header.requester_nsa, header.provider_nsa)
 
 def createGenericRequesterAcknowledgement(header):
-    return _createGenericAcknowledgement(header, cnt.CS2_REQUESTER)
+    return _REQUESTER_ACKNOWLEDGEMENT.render(header.correlation_id, header.requester_nsa, header.provider_nsa)
 
 
 
@@ -128,7 +133,12 @@ def createException(service_exception, provider_nsa):
 
 def parseRequest(soap_data):
 
-    headers, bodies = minisoap.parseSoapPayload(soap_data)
+    return parseRequestEnvelope( ET.fromstring(soap_data) )
+
+
+def parseRequestEnvelope(soap_envelope):
+
+    headers, bodies = minisoap.parseSoapEnvelope(soap_envelope)
 
     if headers is None:
         raise ValueError('No header specified in payload')
@@ -72,12 +72,14 @@ class Provider:
     def reserveFailed(self, nsi_header, connection_id, connection_states, err):
         try:
             nsi_header = self.notifications.pop( (connection_id, RESERVE_RESPONSE) )
-            d = self.provider_client.reserveFailed(nsi_header, connection_id, connection_states, err)
-            d.addErrback(logError, 'reserveFailed')
-            return d
         except KeyError:
-            log.msg('No entity to notify about reserveFailed for %s' % connection_id, system=LOG_SYSTEM)
-            return defer.succeed(None)
+            # the reserve request can be from before a restart, use the stored reply address then
+            if not nsi_header.reply_to:
+                log.msg('No entity to notify about reserveFailed for %s' % connection_id, system=LOG_SYSTEM)
+                return defer.succeed(None)
+        d = self.provider_client.reserveFailed(nsi_header, connection_id, connection_states, err)
+        d.addErrback(logError, 'reserveFailed')
+        return d
 
 
     def reserveCommit(self, nsi_header, connection_id, request_info):
@@ -185,7 +187,7 @@ class Provider:
         if not header.correlation_id:
             raise ValueError('Cannot perform querySummary request without a correlationId field in the header')
 
-        return self.service_provider.querySummary(header, connection_ids, global_reservation_ids)
+        return self.service_provider.querySummary(header, connection_ids, global_reservation_ids, request_info)
 
 
     def querySummarySync(self, header, connection_ids, global_reservation_ids, request_info):
@@ -198,8 +200,16 @@ class Provider:
         dc = defer.Deferred()
         self.notifications[(header.correlation_id, QUERY_SUMMARY_RESPONSE)] = dc
 
-        # returns a deferred, but we don't use it (indicates message receival only), should it be chained?
-        self.service_provider.querySummary(header, connection_ids, global_reservation_ids, request_info)
+        def queryFailed(err):
+            # request was not accepted (e.g., throttled), so no confirmation will come
+            if self.notifications.pop( (header.correlation_id, QUERY_SUMMARY_RESPONSE), None) is not None:
+                dc.errback(err)
+            else:
+                logError(err, 'querySummarySync')
+
+        # returns a deferred, but we only use it for errors (indicates message receival only)
+        d = self.service_provider.querySummary(header, connection_ids, global_reservation_ids, request_info)
+        d.addErrback(queryFailed)
         return dc
 
 
@@ -235,6 +245,28 @@ class Provider:
             return self.provider_client.queryRecursiveConfirmed(header.reply_to, header.requester_nsa, header.provider_nsa, header.correlation_id, reservations)
 
 
+    def queryNotificationConfirmed(self, header, notifications):
+
+        if header.reply_to is None:
+            log.msg('No reply url to send query notification result to. Skipping.', system=LOG_SYSTEM)
+            return defer.succeed(None)
+
+        d = self.provider_client.queryNotificationConfirmed(header.reply_to, header.requester_nsa, header.provider_nsa, header.correlation_id, notifications)
+        d.addErrback(logError, 'queryNotificationConfirmed')
+        return d
+
+
+    def queryNotificationFailed(self, header, service_exception):
+
+        if header.reply_to is None:
+            log.msg('No reply url to notify about failed query notification. Skipping notification.', system=LOG_SYSTEM)
+            return defer.succeed(None)
+
+        d = self.provider_client.queryNotificationFailed(header.reply_to, header.requester_nsa, header.provider_nsa, header.correlation_id, service_exception)
+        d.addErrback(logError, 'queryNotificationFailed')
+        return d
+
+
     # requester interface
 
     def reserveTimeout(self, header, connection_id, notification_id, timestamp, timeout_value, originating_connection_id, originating_nsa):
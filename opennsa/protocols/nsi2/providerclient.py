@@ -7,11 +7,94 @@ Author: Henrik Thostrup Jensen <htj@nordu.net>
 Copyright: NORDUnet (2011-2013)
 """
 
-from opennsa import constants as cnt
+import functools
+
+from opennsa import constants as cnt, notificationlog
 from opennsa.shared import xmlhelper
-from opennsa.protocols.shared import minisoap, httpclient
+from opennsa.protocols.shared import xmlbackend as ET, minisoap, httpclient, soaptemplate, workerpool
 from opennsa.protocols.nsi2 import helper, queryhelper
-from opennsa.protocols.nsi2.bindings import actions, nsiconnection, p2pservices
+from opennsa.protocols.nsi2.bindings import actions, nsiconnection, nsiframework, p2pservices
+
+
+
+def _createGenericConfirmed(element_name, correlation_id, requester_nsa, provider_nsa, connection_id):
+
+    header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
+
+    confirm = nsiconnection.GenericConfirmedType(connection_id)
+    body_element   = confirm.xml(element_name)
+
+    return minisoap.createSoapPayload(body_element, header_element)
+
+
+def _createGenericFailed(element_name, correlation_id, requester_nsa, provider_nsa, connection_id,
+                         reservation_state, provision_state, lifecycle_state, active, version, consistent,
+                         nsa_id, se_connection_id, service_type, error_id, text, variables=None):
+
+    header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
+
+    data_plane_state = nsiconnection.DataPlaneStatusType(active, version, consistent)
+    connection_states = nsiconnection.ConnectionStatesType(reservation_state, provision_state, lifecycle_state, data_plane_state)
+
+    se = nsiframework.ServiceExceptionType(nsa_id, se_connection_id, service_type, error_id, text, variables, None)
+
+    failure = nsiconnection.GenericFailedType(connection_id, connection_states, se)
+
+    body_element = failure.xml(element_name)
+
+    return minisoap.createSoapPayload(body_element, header_element)
+
+
+def _createErrorEvent(connection_id, notification_id, timestamp, event, service_ex):
+
+    if service_ex:
+        nsa_id, se_connection_id, error_id, text, variables, child_ex = service_ex
+        service_exception = nsiconnection.ServiceExceptionType(nsa_id, se_connection_id, None, error_id, text, None, None)
+    else:
+        service_exception = None
+
+    org_connection_id = None
+    org_nsa_id = None
+    additional_info = None
+    return nsiconnection.ErrorEventType(connection_id, notification_id, xmlhelper.createXMLTime(timestamp), event,
+                                        org_connection_id, org_nsa_id, additional_info, service_exception)
+
+
+def _createNotificationElement(notification):
+    # notification log entry -> element in queryNotificationConfirmed
+
+    n = notification
+    timestamp = xmlhelper.createXMLTime(n.timestamp)
+
+    if n.notification_type == notificationlog.RESERVE_TIMEOUT:
+        timeout_value, originating_connection_id, originating_nsa = n.data
+        rt = nsiconnection.ReserveTimeoutRequestType(n.connection_id, n.notification_id, timestamp, timeout_value, originating_connection_id, originating_nsa)
+        return rt.xml('reserveTimeout')
+
+    elif n.notification_type == notificationlog.DATA_PLANE_STATE_CHANGE:
+        (active, version, consistent), = n.data
+        data_plane_status = nsiconnection.DataPlaneStatusType(active, version, consistent)
+        dps = nsiconnection.DataPlaneStateChangeRequestType(n.connection_id, n.notification_id, timestamp, data_plane_status)
+        return dps.xml('dataPlaneStateChange')
+
+    elif n.notification_type == notificationlog.ERROR_EVENT:
+        event, info, service_ex = n.data
+        return _createErrorEvent(n.connection_id, n.notification_id, n.timestamp, event, service_ex).xml('errorEvent')
+
+    else:
+        raise ValueError('Unknown notification type: %s' % n.notification_type)
+
+
+# templates for the generic confirmed / failed messages, element name -> template
+_GENERIC_CONFIRMED = {}
+_GENERIC_FAILED    = {}
+
+for element_name in (nsiconnection.reserveCommitConfirmed, nsiconnection.reserveAbortConfirmed, nsiconnection.provisionConfirmed,
+                     nsiconnection.releaseConfirmed, nsiconnection.terminateConfirmed):
+    _GENERIC_CONFIRMED[element_name] = soaptemplate.SOAPTemplate( functools.partial(_createGenericConfirmed, element_name) )
+
+for element_name in (nsiconnection.reserveFailed, nsiconnection.reserveCommitFailed):
+    _GENERIC_FAILED[element_name] = soaptemplate.SOAPTemplate( functools.partial(_createGenericFailed, element_name) )
 
 
 
@@ -24,12 +107,7 @@ class ProviderClient:
 
     def _genericConfirm(self, element_name, requester_url, action, correlation_id, requester_nsa, provider_nsa, connection_id):
 
-        header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
-
-        confirm = nsiconnection.GenericConfirmedType(connection_id)
-        body_element   = confirm.xml(element_name)
-
-        payload = minisoap.createSoapPayload(body_element, header_element)
+        payload = _GENERIC_CONFIRMED[element_name].render(correlation_id, requester_nsa, provider_nsa, connection_id)
 
         def gotReply(data):
             # for now we just ignore this, as long as we get an okay
@@ -43,19 +121,19 @@ class ProviderClient:
     def _genericFailure(self, requester_url, action, message_name, requester_nsa, provider_nsa, correlation_id,
                         connection_id, connection_states, err):
 
-        header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
-
-        active, version, consistent = connection_states[3]
-        data_plane_state = nsiconnection.DataPlaneStatusType(active, version, consistent)
-        connection_states = nsiconnection.ConnectionStatesType(connection_states[0], connection_states[1], connection_states[2], data_plane_state)
+        reservation_state, provision_state, lifecycle_state, (active, version, consistent) = connection_states
 
         se = helper.createServiceException(err, provider_nsa)
 
-        failure = nsiconnection.GenericFailedType(connection_id, connection_states, se)
+        # active and consistent must be bools, as they are baked into the template
+        values = (correlation_id, requester_nsa, provider_nsa, connection_id, reservation_state, provision_state, lifecycle_state,
+                  bool(active), version, bool(consistent), se.nsaId, se.connectionId, se.serviceType, se.errorId, se.text)
 
-        body_element = failure.xml(message_name)
-
-        payload = minisoap.createSoapPayload(body_element, header_element)
+        if se.variables:
+            # variable list, cannot be templated
+            payload = _createGenericFailed(message_name, *values, variables=se.variables)
+        else:
+            payload = _GENERIC_FAILED[message_name].render(*values)
 
         def gotReply(data):
             # for now we just ignore this, as long as we get an okay
@@ -177,17 +255,7 @@ class ProviderClient:
 
         header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
 
-        if service_ex:
-            nsa_id, connection_id, error_id, text, variables, child_ex = service_ex
-            service_exception = nsiconnection.ServiceExceptionType(nsa_id, connection_id, error_id, text, None, None)
-        else:
-            service_exception = None
-
-        org_connection_id = None
-        org_nsa_id = None
-        additional_info = None
-        error_event = nsiconnection.ErrorEventType(connection_id, notification_id, xmlhelper.createXMLTime(timestamp), event,
-                                                   org_connection_id, org_nsa_id, additional_info, service_exception)
+        error_event = _createErrorEvent(connection_id, notification_id, timestamp, event, service_ex)
 
         body_element = error_event.xml(nsiconnection.errorEvent)
 
@@ -199,25 +267,54 @@ class ProviderClient:
 
     def querySummaryConfirmed(self, requester_url, requester_nsa, provider_nsa, correlation_id, reservations):
 
+        def encode():
+            header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
+            qs_reservations = queryhelper.buildQuerySummaryResultType(reservations)
+            qsct = nsiconnection.QuerySummaryConfirmedType(qs_reservations)
+            return minisoap.createSoapPayload(qsct.xml(nsiconnection.querySummaryConfirmed), header_element)
+
+        d = workerpool.run(len(reservations) * workerpool.QUERY_RESULT_SIZE, encode)
+        d.addCallback(lambda payload : httpclient.soapRequest(requester_url, actions.QUERY_SUMMARY_CONFIRMED, payload, ctx_factory=self.ctx_factory))
+        return d
+
+
+    def queryRecursiveConfirmed(self, requester_url, requester_nsa, provider_nsa, correlation_id, reservations):
+
+        def encode():
+            header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
+            qr_reservations = queryhelper.buildQueryRecursiveResultType(reservations)
+            qrct = nsiconnection.QueryRecursiveConfirmedType(qr_reservations)
+            return minisoap.createSoapPayload(qrct.xml(nsiconnection.queryRecursiveConfirmed), header_element)
+
+        d = workerpool.run(len(reservations) * workerpool.QUERY_RESULT_SIZE, encode)
+        d.addCallback(lambda payload : httpclient.soapRequest(requester_url, actions.QUERY_RECURSIVE_CONFIRMED, payload, ctx_factory=self.ctx_factory))
+        return d
+
+
+    def queryNotificationConfirmed(self, requester_url, requester_nsa, provider_nsa, correlation_id, notifications):
+
+        # the generated QueryNotificationConfirmedType only has room for one notification of each type
         header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
+        body_element = ET.Element(nsiconnection.queryNotificationConfirmed)
+        body_element.extend( [ _createNotificationElement(n) for n in notifications ] )
 
-        qs_reservations = queryhelper.buildQuerySummaryResultType(reservations)
-        qsct = nsiconnection.QuerySummaryConfirmedType(qs_reservations)
+        payload = minisoap.createSoapPayload(body_element, header_element)
 
-        payload = minisoap.createSoapPayload(qsct.xml(nsiconnection.querySummaryConfirmed), header_element)
-        d = httpclient.soapRequest(requester_url, actions.QUERY_SUMMARY_CONFIRMED, payload, ctx_factory=self.ctx_factory)
+        d = httpclient.soapRequest(requester_url, actions.QUERY_NOTIFICATION_CONFIRMED, payload, ctx_factory=self.ctx_factory)
         return d
 
 
-    def queryRecursiveConfirmed(self, requester_url, requester_nsa, provider_nsa, correlation_id, reservations):
+    def queryNotificationFailed(self, requester_url, requester_nsa, provider_nsa, correlation_id, err):
 
+        # nsi has no queryNotificationFailed, failed queries are reported with the generic error message
         header_element = helper.createRequesterHeader(requester_nsa, provider_nsa, correlation_id=correlation_id)
 
-        qr_reservations = queryhelper.buildQueryRecursiveResultType(reservations)
-        qrct = nsiconnection.QueryRecursiveConfirmedType(qr_reservations)
+        se = helper.createServiceException(err, provider_nsa)
+        body_element = nsiconnection.GenericErrorType(se).xml(nsiconnection.error)
+
+        payload = minisoap.createSoapPayload(body_element, header_element)
 
-        payload = minisoap.createSoapPayload(qrct.xml(nsiconnection.queryRecursiveConfirmed), header_element)
-        d = httpclient.soapRequest(requester_url, actions.QUERY_RECURSIVE_CONFIRMED, payload, ctx_factory=self.ctx_factory)
+        d = httpclient.soapRequest(requester_url, actions.ERROR, payload, ctx_factory=self.ctx_factory)
         return d
 
 
@@ -13,7 +13,7 @@ from twisted.python import log, failure
 
 from opennsa import nsa, error
 from opennsa.shared import xmlhelper
-from opennsa.protocols.shared import minisoap, soapresource
+from opennsa.protocols.shared import minisoap, soapresource, workerpool
 from opennsa.protocols.nsi2 import helper, queryhelper
 from opennsa.protocols.nsi2.bindings import actions, nsiconnection, p2pservices
 
@@ -55,11 +55,11 @@ class ProviderService:
         return soap_fault
 
 
-    def reserve(self, soap_data, request_info):
+    def reserve(self, soap_envelope, request_info):
 
         t_start = time.time()
 
-        header, reservation = helper.parseRequest(soap_data)
+        header, reservation = helper.parseRequestEnvelope(soap_envelope)
 
         # do some checking here
 
@@ -135,54 +135,53 @@ class ProviderService:
 
 
 
-    def reserveCommit(self, soap_data, request_info):
-        header, confirm = helper.parseRequest(soap_data)
+    def reserveCommit(self, soap_envelope, request_info):
+        header, confirm = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.reserveCommit(header, confirm.connectionId, request_info)
         d.addCallbacks(lambda _ : helper.createGenericProviderAcknowledgement(header), self._createSOAPFault, errbackArgs=(header.provider_nsa, confirm.connectionId))
         return d
 
 
-    def reserveAbort(self, soap_data, request_info):
-        header, request = helper.parseRequest(soap_data)
+    def reserveAbort(self, soap_envelope, request_info):
+        header, request = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.reserveAbort(header, request.connectionId, request_info)
         d.addCallbacks(lambda _ : helper.createGenericProviderAcknowledgement(header), self._createSOAPFault, errbackArgs=(header.provider_nsa, request.connectionId))
         return d
 
 
-    def provision(self, soap_data, request_info):
-        header, request = helper.parseRequest(soap_data)
+    def provision(self, soap_envelope, request_info):
+        header, request = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.provision(header, request.connectionId, request_info)
         d.addCallbacks(lambda _ : helper.createGenericProviderAcknowledgement(header), self._createSOAPFault, errbackArgs=(header.provider_nsa, request.connectionId))
         return d
 
 
-    def release(self, soap_data, request_info):
-        header, request = helper.parseRequest(soap_data)
+    def release(self, soap_envelope, request_info):
+        header, request = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.release(header, request.connectionId, request_info)
         d.addCallbacks(lambda _ : helper.createGenericProviderAcknowledgement(header), self._createSOAPFault, errbackArgs=(header.provider_nsa, request.connectionId))
         return d
 
 
-    def terminate(self, soap_data, request_info):
+    def terminate(self, soap_envelope, request_info):
 
-        header, request = helper.parseRequest(soap_data)
+        header, request = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.terminate(header, request.connectionId, request_info)
         d.addCallbacks(lambda _ : helper.createGenericProviderAcknowledgement(header), self._createSOAPFault, errbackArgs=(header.provider_nsa, request.connectionId))
         return d
 
 
-    def querySummary(self, soap_data, request_info):
+    def querySummary(self, soap_envelope, request_info):
 
-        header, query = helper.parseRequest(soap_data)
+        header, query = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.querySummary(header, query.connectionId, query.globalReservationId, request_info)
         d.addCallbacks(lambda _ : helper.createGenericProviderAcknowledgement(header), self._createSOAPFault, errbackArgs=(header.provider_nsa,))
         return d
 
 
-    def querySummarySync(self, soap_data, request_info):
+    def querySummarySync(self, soap_envelope, request_info):
 
-        def gotReservations(reservations, header):
-            # do reply inline
+        def encode(reservations, header):
             soap_header_element = helper.createProviderHeader(header.requester_nsa, header.provider_nsa, correlation_id=header.correlation_id)
 
             qs_reservations = queryhelper.buildQuerySummaryResultType(reservations)
@@ -192,15 +191,19 @@ class ProviderService:
             payload = minisoap.createSoapPayload(qsct.xml(nsiconnection.querySummarySyncConfirmed), soap_header_element)
             return payload
 
-        header, query = helper.parseRequest(soap_data)
+        def gotReservations(reservations, header):
+            # do reply inline (in the worker pool if the reply is large)
+            return workerpool.run(len(reservations) * workerpool.QUERY_RESULT_SIZE, encode, reservations, header)
+
+        header, query = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.querySummarySync(header, query.connectionId, query.globalReservationId, request_info)
         d.addCallbacks(gotReservations, self._createSOAPFault, callbackArgs=(header,), errbackArgs=(header.provider_nsa,))
         return d
 
 
-    def queryRecursive(self, soap_data, request_info):
+    def queryRecursive(self, soap_envelope, request_info):
 
-        header, query = helper.parseRequest(soap_data)
+        header, query = helper.parseRequestEnvelope(soap_envelope)
         d = self.provider.queryRecursive(header, query.connectionId, query.globalReservationId, request_info)
         d.addCallbacks(lambda _ : helper.createGenericProviderAcknowledgement(header), self._createSOAPFault, errbackArgs=(header.provider_nsa,))
         return d
@@ -7,6 +7,7 @@ Copyright: NORDUnet (2011)
 
 from opennsa import nsa
 from opennsa.shared import xmlhelper
+from opennsa.protocols.shared import workerpool
 from opennsa.protocols.nsi2 import helper, queryhelper
 from opennsa.protocols.nsi2.bindings import actions, p2pservices
 
@@ -48,9 +49,9 @@ class RequesterService:
         soap_resource.registerDecoder(actions.MESSAGE_DELIVERY_TIMEOUT, self.messageDeliveryTimeout)
 
 
-    def _parseGenericFailure(self, soap_data):
+    def _parseGenericFailure(self, soap_envelope):
 
-        header, generic_failure = helper.parseRequest(soap_data)
+        header, generic_failure = helper.parseRequestEnvelope(soap_envelope)
 
         rc = generic_failure.connectionStates
         rd = rc.dataPlaneStatus
@@ -62,9 +63,9 @@ class RequesterService:
         return header, generic_failure.connectionId, cs, ex
 
 
-    def reserveConfirmed(self, soap_data, request_info):
+    def reserveConfirmed(self, soap_envelope, request_info):
 
-        header, reservation = helper.parseRequest(soap_data)
+        header, reservation = helper.parseRequestEnvelope(soap_envelope)
 
         criteria = reservation.criteria
 
@@ -94,79 +95,91 @@ class RequesterService:
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def reserveFailed(self, soap_data, request_info):
-        header, connection_id, cs, err = self._parseGenericFailure(soap_data)
+    def reserveFailed(self, soap_envelope, request_info):
+        header, connection_id, cs, err = self._parseGenericFailure(soap_envelope)
         self.requester.reserveFailed(header, connection_id, cs, err)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def reserveCommitConfirmed(self, soap_data, request_info):
-        header, generic_confirm = helper.parseRequest(soap_data)
+    def reserveCommitConfirmed(self, soap_envelope, request_info):
+        header, generic_confirm = helper.parseRequestEnvelope(soap_envelope)
         self.requester.reserveCommitConfirmed(header, generic_confirm.connectionId)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def reserveCommitFailed(self, soap_data, request_info):
-        header, connection_id, cs, err = self._parseGenericFailure(soap_data)
+    def reserveCommitFailed(self, soap_envelope, request_info):
+        header, connection_id, cs, err = self._parseGenericFailure(soap_envelope)
         self.requester.reserveCommitFailed(header, connection_id, cs, err)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def reserveAbortConfirmed(self, soap_data, request_info):
-        header, generic_confirm = helper.parseRequest(soap_data)
+    def reserveAbortConfirmed(self, soap_envelope, request_info):
+        header, generic_confirm = helper.parseRequestEnvelope(soap_envelope)
         self.requester.reserveAbortConfirmed(header, generic_confirm.connectionId)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def provisionConfirmed(self, soap_data, request_info):
-        header, generic_confirm = helper.parseRequest(soap_data)
+    def provisionConfirmed(self, soap_envelope, request_info):
+        header, generic_confirm = helper.parseRequestEnvelope(soap_envelope)
         self.requester.provisionConfirmed(header, generic_confirm.connectionId)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def releaseConfirmed(self, soap_data, request_info):
-        header, generic_confirm = helper.parseRequest(soap_data)
+    def releaseConfirmed(self, soap_envelope, request_info):
+        header, generic_confirm = helper.parseRequestEnvelope(soap_envelope)
         self.requester.releaseConfirmed(header, generic_confirm.connectionId)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def terminateConfirmed(self, soap_data, request_info):
-        header, generic_confirm = helper.parseRequest(soap_data)
+    def terminateConfirmed(self, soap_envelope, request_info):
+        header, generic_confirm = helper.parseRequestEnvelope(soap_envelope)
         self.requester.terminateConfirmed(header, generic_confirm.connectionId)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def terminateFailed(self, soap_data, request_info):
-        header, connection_id, cs, err = self._parseGenericFailure(soap_data)
+    def terminateFailed(self, soap_envelope, request_info):
+        header, connection_id, cs, err = self._parseGenericFailure(soap_envelope)
         self.requester.terminateFailed(header, connection_id, cs, err)
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def querySummaryConfirmed(self, soap_data, request_info):
+    def querySummaryConfirmed(self, soap_envelope, request_info):
 
-        header, query_result = helper.parseRequest(soap_data)
+        def decode():
+            header, query_result = helper.parseRequestEnvelope(soap_envelope)
+            reservations = [ queryhelper.buildQueryResult(res, header.provider_nsa) for res in query_result.reservations ]
+            return header, reservations
 
-        reservations = [ queryhelper.buildQueryResult(res, header.provider_nsa) for res in query_result.reservations ]
+        def decoded(result):
+            header, reservations = result
+            self.requester.querySummaryConfirmed(header, reservations)
+            return helper.createGenericRequesterAcknowledgement(header)
 
-        self.requester.querySummaryConfirmed(header, reservations)
-
-        return helper.createGenericRequesterAcknowledgement(header)
+        d = workerpool.run(request_info.payload_size, decode)
+        d.addCallback(decoded)
+        return d
 
 
-    def queryRecursiveConfirmed(self, soap_data, request_info):
+    def queryRecursiveConfirmed(self, soap_envelope, request_info):
 
-        header, query_result = helper.parseRequest(soap_data)
+        def decode():
+            header, query_result = helper.parseRequestEnvelope(soap_envelope)
+            reservations = [ queryhelper.buildQueryResult(res, header.provider_nsa, include_children=True) for res in query_result.reservations ]
+            return header, reservations
 
-        reservations = [ queryhelper.buildQueryResult(res, header.provider_nsa, include_children=True) for res in query_result.reservations ]
+        def decoded(result):
+            header, reservations = result
+            self.requester.queryRecursiveConfirmed(header, reservations)
+            return helper.createGenericRequesterAcknowledgement(header)
 
-        self.requester.queryRecursiveConfirmed(header, reservations)
-
-        return helper.createGenericRequesterAcknowledgement(header)
+        d = workerpool.run(request_info.payload_size, decode)
+        d.addCallback(decoded)
+        return d
 
 
-    def error(self, soap_data, request_info):
+    def error(self, soap_envelope, request_info):
 
-        header, error = helper.parseRequest(soap_data)
+        header, error = helper.parseRequestEnvelope(soap_envelope)
         se = error.serviceException
         # service exception fields, we are not quite there yet...
         # nsaId  # NsaIdType -> anyURI
@@ -184,9 +197,9 @@ class RequesterService:
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def errorEvent(self, soap_data, request_info):
+    def errorEvent(self, soap_envelope, request_info):
 
-        header, error_event = helper.parseRequest(soap_data)
+        header, error_event = helper.parseRequestEnvelope(soap_envelope)
 
         #connection_id, notification_id, timestamp, event, info, service_ex = 
         ee = error_event
@@ -202,9 +215,9 @@ class RequesterService:
 
 
 
-    def dataPlaneStateChange(self, soap_data, request_info):
+    def dataPlaneStateChange(self, soap_envelope, request_info):
 
-        header, data_plane_state_change = helper.parseRequest(soap_data)
+        header, data_plane_state_change = helper.parseRequestEnvelope(soap_envelope)
 
         dpsc = data_plane_state_change
         dps = dpsc.dataPlaneStatus
@@ -214,9 +227,9 @@ class RequesterService:
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def reserveTimeout(self, soap_data, request_info):
+    def reserveTimeout(self, soap_envelope, request_info):
 
-        header, reserve_timeout = helper.parseRequest(soap_data)
+        header, reserve_timeout = helper.parseRequestEnvelope(soap_envelope)
 
         rt = reserve_timeout
         timestamp = xmlhelper.parseXMLTimestamp(rt.timeStamp)
@@ -225,6 +238,6 @@ class RequesterService:
         return helper.createGenericRequesterAcknowledgement(header)
 
 
-    def messageDeliveryTimeout(self, soap_data, request_info):
+    def messageDeliveryTimeout(self, soap_envelope, request_info):
         raise NotImplementedError('messageDeliveryTimeout not yet implemented in requester service')
 
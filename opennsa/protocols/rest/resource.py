@@ -24,6 +24,8 @@ RN = '\r\n'
 
 CONTENT_LENGTH = 'content-length' # twisted.web doesn't have this as a constant
 
+AUTO_COMMIT_TIMEOUT = 600 # seconds, subscriptions for auto commit/provision are removed after this
+
 # Connection Fields
 START_TIME = 'start_time'
 END_TIME = 'end_time'
@@ -47,7 +49,9 @@ def _finishRequest(request, code, payload, headers=None):
 
 
 def _errorCode(ex):
-    if isinstance(ex, error.NSIError):
+    if isinstance(ex, error.RequestThrottledError):
+        return 429 # Too Many Requests
+    elif isinstance(ex, error.NSIError):
         return 400 # Client Error
     else:
         return 500 # Server Error
@@ -63,8 +67,7 @@ def _createErrorResponse(err, request):
 
 
 
-@defer.inlineCallbacks
-def conn2dict(conn):
+def conn2dict(conn, sub_connections):
 
     def label(label):
         if label is None:
@@ -85,23 +88,17 @@ def conn2dict(conn):
     d['provision_state']   = conn.provision_state
     d['lifecycle_state']   = conn.lifecycle_state
 
-    # this really needs to be in the database module (aggregator uses this too)
-    df = database.SubConnection.findBy(service_connection_id=conn.id)
-    sub_conns = yield df
+    data_plane_status = database.aggregateDataPlaneStatus(sub_connections)
+    d['data_plane_active'] = conn.data_plane = data_plane_status[0]
 
-    # copied from aggregator, refactor sometime
-    if len(sub_conns) == 0: # apparently this can happen
-        data_plane_status = (False, 0, False)
-    else:
-        aggr_active     = all( [ sc.data_plane_active     for sc in sub_conns ] )
-        aggr_version    = max( [ sc.data_plane_version    for sc in sub_conns ] ) or 0 # can be None otherwise
-        aggr_consistent = all( [ sc.data_plane_consistent for sc in sub_conns ] )
-        data_plane_status = (aggr_active, aggr_version, aggr_consistent)
+    return d
 
-    d['data_plane_active'] = conn.data_plane = data_plane_status[0]
 
-    #return d
-    defer.returnValue(d)
+def conns2dicts(conns):
+    # sub connections for all the connections are fetched in one query
+    d = database.findSubConnections( [ conn.id for conn in conns ] )
+    d.addCallback(lambda sub_connections : [ conn2dict(conn, sub_connections.get(conn.id)) for conn in conns ] )
+    return d
 
 
 
@@ -126,11 +123,7 @@ class P2PBaseResource(resource.Resource):
 
         @defer.inlineCallbacks
         def gotConnections(conns):
-            res = []
-
-            for conn in conns:
-                d = yield conn2dict(conn)
-                res.append(d)
+            res = yield conns2dicts(conns)
 
             payload = json.dumps(res) + RN
 
@@ -230,17 +223,24 @@ class P2PBaseResource(resource.Resource):
                         return
 
                     conn = yield self.provider.getConnection(conn_id)
+                    committing = []
 
                     def stateUpdate():
                         log.msg('stateUpdate reservation_state: %s, provision_state: %s' % (str(conn.reservation_state), str(conn.provision_state)), debug=True, system=LOG_SYSTEM)
                         if conn.reservation_state == state.RESERVE_HELD:
+                            committing.append(True)
                             self.provider.reserveCommit(header, conn_id, request_info)
                         if conn.reservation_state == state.RESERVE_START and conn.provision_state == state.RELEASED and auto_provision:
                             self.provider.provision(header, conn_id, request_info)
-                        if conn.provision_state == state.PROVISIONED:
-                            state.desubscribe(conn_id, stateUpdate)
 
-                    state.subscribe(conn_id, stateUpdate)
+                        # nothing more to do, when done, or if the connection will not get there
+                        done = conn.provision_state == state.PROVISIONED or \
+                               (committing and conn.reservation_state == state.RESERVE_START and not auto_provision)
+                        gone = conn.lifecycle_state != state.CREATED or conn.reservation_state in (state.RESERVE_FAILED, state.RESERVE_TIMEOUT)
+                        if done or gone:
+                            subscription.cancel()
+
+                    subscription = state.subscribe(conn_id, stateUpdate, timeout=AUTO_COMMIT_TIMEOUT)
 
                 d.addCallback(connectionCreated)
 
@@ -282,7 +282,8 @@ class P2PConnectionResource(resource.Resource):
 
         @defer.inlineCallbacks
         def gotConnection(conn):
-            d = yield conn2dict(conn)
+            ds = yield conns2dicts( [ conn ] )
+            d = ds[0]
 
             payload = json.dumps(d) + RN
             _finishRequest(request, 200, payload, {'Content-Type': 'application/json'})
@@ -327,8 +328,17 @@ class P2PStatusResource(resource.Resource):
                 payload = json.dumps(d) + RN
                 request.write(payload)
 
+            try:
+                # the subscription ends when the client disconnects, or when the connection is terminated
+                subscription = state.subscribe(conn.connection_id, lambda : writeStatusPayload(), expired=request.finish)
+            except error.ResourceUnavailableError as e:
+                request.setResponseCode(503) # Service Unavailable
+                request.write(str(e) + RN)
+                request.finish()
+                return
+
             writeStatusPayload()
-            state.subscribe(conn.connection_id, lambda : writeStatusPayload() )
+            request.notifyFinish().addBoth(lambda _ : subscription.cancel())
             return server.NOT_DONE_YET
 
         def noConnection(err):
@@ -379,11 +389,10 @@ class P2PStatusResource(resource.Resource):
         def commandError(err):
             log.msg('Error during state switch: %s' % str(err), system=LOG_SYSTEM)
             payload = str(err.getErrorMessage()) + RN
-            if isinstance(err.value, error.NSIError):
-                _finishRequest(request, 400, payload) # Client Error
-            else:
+            error_code = _errorCode(err.value)
+            if error_code == 500:
                 log.err(err)
-                _finishRequest(request, 500, payload) # Server Error
+            _finishRequest(request, error_code, payload)
 
         d.addCallbacks(commandDone, commandError)
         return server.NOT_DONE_YET
@@ -5,7 +5,7 @@ Author: Henrik Thostrup Jensen <htj@nordu.net>
 Copyright: NORDUnet (2011-2012)
 """
 
-from xml.etree import ElementTree as ET
+from opennsa.protocols.shared import xmlbackend as ET
 
 
 LOG_SYSTEM = 'opennsa.protocols.soap'
@@ -27,23 +27,6 @@ ET.register_namespace('soap', SOAP_ENVELOPE_NS)
 
 
 
-def _indent(elem, level=0):
-    i = "\n" + level*"   "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "   "
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-        for elem in elem:
-            _indent(elem, level+1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
-
-
-
 def createSoapEnvelope():
 
     envelope = ET.Element(SOAP_ENV)
@@ -66,8 +49,7 @@ def createSoapPayload(body_element=None, header_element=None):
         else:
             body.append(body_element)
 
-    _indent(envelope)
-    payload = ET.tostring(envelope, 'utf-8')
+    payload = ET.tostring(envelope, 'utf-8', ET.pretty_print)
 
     return payload
 
@@ -104,7 +86,10 @@ def createSoapFault(fault_msg, detail_element=None):
 
 def parseSoapPayload(payload):
 
-    envelope = ET.fromstring(payload)
+    return parseSoapEnvelope( ET.fromstring(payload) )
+
+
+def parseSoapEnvelope(envelope):
 
     assert envelope.tag == SOAP_ENV, 'Top element in soap payload is not SOAP:Envelope (got %s)' % envelope.tag
 
@@ -154,7 +139,7 @@ def parseFault(payload):
 
     dt = fault.find('detail')
     if dt is not None:
-        dc = dt.getchildren()[0]
+        dc = list(dt)[0]
         if dc is not None:
             detail = ET.tostring(dc)
 
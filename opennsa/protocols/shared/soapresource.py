@@ -10,12 +10,17 @@ from twisted.internet import defer
 from twisted.web import resource, server
 
 from opennsa.shared.requestinfo import RequestInfo
-from opennsa.protocols.shared import minisoap
+from opennsa.protocols.shared import minisoap, xmlbackend, workerpool
 
 
 
 LOG_SYSTEM = 'protocol.SOAPResource'
 
+DEFAULT_MAX_PAYLOAD_SIZE     = 16 * 1024 * 1024 # bytes
+DEFAULT_MAX_PAYLOAD_ELEMENTS = 500000
+
+READ_CHUNK_SIZE = 64 * 1024
+
 
 
 class SOAPFault(Exception):
@@ -31,17 +36,147 @@ class SOAPFault(Exception):
 
 
 
+class PayloadRejected(Exception):
+
+    def __init__(self, response_code, message):
+        Exception.__init__(self, message)
+        self.response_code = response_code
+
+
+
+def parsePayload(content, max_size, max_elements):
+    """
+    Read and parse a SOAP payload from a file-like object, in chunks, feeding
+    them to the parser as they are read.
+
+    Each chunk is checked before it is given to the parser: The payload must
+    not be bigger than max_size, and not have more than max_elements elements.
+    Elements are counted by their start tags, which is cheap and does not
+    depend on the parser. The count is an upper bound, as a < in a CDATA
+    section, comment, or processing instruction is counted as a start tag as
+    well (in text and attributes it must be escaped). The payload must not have a DTD (SOAP does not allow
+    them, and they are needed for entity expansion attacks), this is checked by
+    the parser, as DTDs cannot be found reliably in the bytes (e.g., UTF-16).
+
+    Returns the payload size and the parsed envelope element. The payload is
+    not kept, it can be read again from content. Raises PayloadRejected if a
+    limit is exceeded, or a parser error if the payload is not valid XML.
+    """
+    parser = xmlbackend.XMLParser()
+
+    size = 0
+    elements = 0
+    last = '' # last character of previous chunk, so tags spanning chunks are counted
+
+    while True:
+        chunk = content.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        size += len(chunk)
+        if size > max_size:
+            raise PayloadRejected(413, 'Payload is larger than maximum size (%i bytes)' % max_size)
+
+        # start tags: all tags, minus end tags, comments / cdata / doctype (<!), and processing instructions (<?)
+        # a < is counted when the character after it is known, so the last character of the previous chunk is included
+        pair_data = last + chunk
+        elements += pair_data.count('<', 0, -1) - pair_data.count('</') - pair_data.count('<!') - pair_data.count('<?')
+        if elements > max_elements:
+            raise PayloadRejected(400, 'Payload has more than maximum number of elements (%i)' % max_elements)
+
+        try:
+            parser.feed(chunk)
+        except xmlbackend.DTDForbidden as e:
+            raise PayloadRejected(400, str(e))
+        last = chunk[-1]
+
+    try:
+        envelope = parser.close()
+    except xmlbackend.DTDForbidden as e:
+        raise PayloadRejected(400, str(e))
+    return size, envelope
+
+
+
+def readPayload(request):
+    request.content.seek(0)
+    return request.content.read()
+
+
+
+class PayloadLimitedRequest(server.Request):
+    """
+    Request which rejects bodies larger than max_payload_size while they are
+    received, instead of after twisted.web has received (and buffered) all of
+    it. This covers chunked bodies, and bodies without (or with a wrong)
+    content length. The client gets a 413 and is disconnected. Use
+    createRequestFactory to get one with a given maximum, for the site.
+
+    The limit applies to all requests of the site, the SOAP resources check
+    their own limits after this.
+    """
+    max_payload_size = DEFAULT_MAX_PAYLOAD_SIZE
+
+    content_received = 0
+    payload_rejected = False
+
+    def gotLength(self, length):
+        server.Request.gotLength(self, length)
+        if length is not None and length > self.max_payload_size:
+            self._rejectPayload('content length %i' % length)
+
+
+    def handleContentChunk(self, data):
+        if self.payload_rejected:
+            return
+        self.content_received += len(data)
+        if self.content_received > self.max_payload_size:
+            self._rejectPayload('more than %i bytes received' % self.max_payload_size)
+            return
+        server.Request.handleContentChunk(self, data)
+
+
+    def requestReceived(self, command, path, version):
+        if self.payload_rejected:
+            return # the connection is closed
+        server.Request.requestReceived(self, command, path, version)
+
+
+    def _rejectPayload(self, reason):
+        self.payload_rejected = True
+        log.msg('Rejecting request, payload is larger than maximum payload size (%s)' % reason, system=LOG_SYSTEM)
+        # the request has not been processed, so there is no response to write to, like the channel does for bad requests
+        self.channel.transport.write('HTTP/1.1 413 Request Entity Too Large\r\nConnection: close\r\n\r\n')
+        self.channel.loseConnection()
+
+
+
+def createRequestFactory(max_payload_size=None):
+    """
+    Create request factory (for server.Site) which rejects request bodies larger
+    than max_payload_size while they are received.
+    """
+    class Request(PayloadLimitedRequest):
+        pass
+    Request.max_payload_size = max_payload_size or DEFAULT_MAX_PAYLOAD_SIZE
+    return Request
+
+
+
 class SOAPResource(resource.Resource):
 
     isLeaf = True
 
-    def __init__(self, allowed_hosts=None):
+    def __init__(self, allowed_hosts=None, max_payload_size=None, max_payload_elements=None):
         resource.Resource.__init__(self)
         self.soap_actions = {}
         self.allowed_hosts = allowed_hosts # certificate dns
+        self.max_payload_size     = max_payload_size     or DEFAULT_MAX_PAYLOAD_SIZE
+        self.max_payload_elements = max_payload_elements or DEFAULT_MAX_PAYLOAD_ELEMENTS
 
 
     def registerDecoder(self, soap_action, decoder):
+        # decoder is called with the parsed soap envelope element and request info
 
         self.soap_actions[soap_action] = decoder
 
@@ -87,15 +222,35 @@ class SOAPResource(resource.Resource):
 
         soap_action = request.requestHeaders.getRawHeaders('soapaction',[None])[0]
 
-        soap_data = request.content.read()
-        log.msg(" -- Received payload --\n%s\n -- END. Received payload --" % soap_data, system=LOG_SYSTEM, payload=True)
-
+        # check action and size before reading anything
         if not soap_action in self.soap_actions:
             log.msg('Got request with unknown SOAP action: %s' % soap_action, system=LOG_SYSTEM)
             request.setResponseCode(406) # Not acceptable
             return 'Invalid SOAP Action for this resource\r\n'
 
-        log.msg('Received SOAP request. Action: %s. Length: %i' % (soap_action, len(soap_data)), system=LOG_SYSTEM, debug=True)
+        content_length = request.getHeader('content-length')
+        content_length = int(content_length) if content_length is not None and content_length.isdigit() else None
+        if content_length is not None and content_length > self.max_payload_size:
+            log.msg('Rejecting request, content length %i is larger than maximum payload size (%i)' % (content_length, self.max_payload_size), system=LOG_SYSTEM)
+            request.setResponseCode(413) # Request Entity Too Large
+            return 'Payload too large\r\n'
+
+        def payloadError(err):
+
+            if err.check(PayloadRejected):
+                log.msg('Rejecting request: %s' % err.value, system=LOG_SYSTEM)
+                request.setResponseCode(err.value.response_code)
+                request.write('%s\r\n' % err.value)
+                request.finish()
+                return
+
+            # invalid xml, reply with a soap fault, like other decoding errors
+            log.msg('Error parsing SOAP payload: %s' % err.getErrorMessage(), system=LOG_SYSTEM)
+            log.msg('SOAP Payload that caused error:\n%s\n' % readPayload(request))
+            request.setResponseCode(500) # Internal server error
+            request.setHeader('Content-Type', 'text/xml')
+            request.write( SOAPFault('Invalid XML payload: %s' % err.getErrorMessage()).createPayload() )
+            request.finish()
 
         def reply(reply_data):
 
@@ -112,11 +267,11 @@ class SOAPResource(resource.Resource):
             request.write(reply_data)
             request.finish()
 
-        def errorReply(err, soap_data):
+        def errorReply(err):
 
             log.msg('Failure during SOAP decoding/dispatch: %s' % err.getErrorMessage(), system=LOG_SYSTEM)
             log.err(err)
-            log.msg('SOAP Payload that caused error:\n%s\n' % soap_data)
+            log.msg('SOAP Payload that caused error:\n%s\n' % readPayload(request))
             error_payload = SOAPFault(err.getErrorMessage()).createPayload()
 
             log.msg(" -- Sending response (fault) --\n%s\n -- END: Sending response (fault) --" % error_payload, system=LOG_SYSTEM, payload=True)
@@ -126,15 +281,28 @@ class SOAPResource(resource.Resource):
             request.write(error_payload)
             request.finish()
 
-        decoder = self.soap_actions[soap_action]
-        d = defer.maybeDeferred(decoder, soap_data, request_info)
-        d.addCallbacks(reply, errorReply, errbackArgs=(soap_data,))
+        def dispatch(result):
+
+            payload_size, soap_envelope = result
+            request_info.payload_size = payload_size
+
+            log.msg(" -- Received payload --\n%s\n -- END. Received payload --" % readPayload(request), system=LOG_SYSTEM, payload=True)
+            log.msg('Received SOAP request. Action: %s. Length: %i' % (soap_action, payload_size), system=LOG_SYSTEM, debug=True)
+
+            decoder = self.soap_actions[soap_action]
+            d = defer.maybeDeferred(decoder, soap_envelope, request_info)
+            d.addCallbacks(reply, errorReply)
+            return d
+
+        # large payloads are parsed in the worker pool (if enabled), content length is used as size, as the body is not read yet
+        d = workerpool.run(content_length, parsePayload, request.content, self.max_payload_size, self.max_payload_elements)
+        d.addCallbacks(dispatch, payloadError)
 
         return server.NOT_DONE_YET
 
 
 
-def setupSOAPResource(top_resource, resource_name, subpath=None, allowed_hosts=None):
+def setupSOAPResource(top_resource, resource_name, subpath=None, allowed_hosts=None, max_payload_size=None, max_payload_elements=None):
 
     # Default path: NSI/services/{resource_name}
     if subpath is None:
@@ -153,7 +321,7 @@ def setupSOAPResource(top_resource, resource_name, subpath=None, allowed_hosts=N
     if resource_name in ir.children:
         raise AssertionError, 'Trying to insert several SOAP resource in same leaf. Go away.'
 
-    soap_resource = SOAPResource(allowed_hosts=allowed_hosts)
+    soap_resource = SOAPResource(allowed_hosts=allowed_hosts, max_payload_size=max_payload_size, max_payload_elements=max_payload_elements)
     ir.putChild(resource_name, soap_resource)
     return soap_resource
 
@@ -0,0 +1,80 @@
+"""
+Precompiled payload templates for fixed-shape SOAP messages.
+
+Acknowledgements and generic confirmed / failed messages only differ in a few
+values (correlation id, nsa ids, connection id, ...), so instead of building
+and serializing an element tree for every message, the payload is created once
+with marker values, and split into byte chunks at the markers. Rendering is then
+just joining the chunks with the escaped values.
+
+The template is created by the function which creates the payload normally, so
+the output is the same as without templates. Values which are None or a bool
+change the shape of the message (element left out, 'true' / 'false'), and are
+part of the template key instead of being substituted. Templates are also
+keyed on the XML backend and pretty-print setting.
+
+Copyright: NORDUnet (2026)
+"""
+
+import re
+
+from opennsa.protocols.shared import xmlbackend
+
+
+
+MARKER = '@tmpl%i@'
+MARKER_RX = re.compile('@tmpl(\d+)@')
+
+_SUBSTITUTE = object()
+
+
+
+def escape(value, backend=None):
+    # text content escaping, same as the serializer of the backend (lxml also escapes \r, etree does not)
+    if type(value) is unicode:
+        value = value.encode('utf-8')
+    elif type(value) is not str:
+        value = str(value)
+    value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    if (backend or xmlbackend.backend) == xmlbackend.LXML:
+        value = value.replace('\r', '&#13;')
+    return value
+
+
+
+class SOAPTemplate:
+
+    def __init__(self, create_payload):
+        # create_payload: function taking the values as positional arguments, returning the payload
+        self.create_payload = create_payload
+        self.templates = {} # (backend, pretty_print, shape) -> (chunks, value indexes)
+
+
+    def _compile(self, shape):
+
+        markers = [ MARKER % i if s is _SUBSTITUTE else s for i, s in enumerate(shape) ]
+        parts = MARKER_RX.split( self.create_payload(*markers) )
+
+        chunks  = parts[0::2]
+        indexes = [ int(i) for i in parts[1::2] ]
+        return chunks, indexes
+
+
+    def render(self, *values):
+
+        shape = tuple( v if v is None or type(v) is bool else _SUBSTITUTE for v in values )
+        backend = xmlbackend.backend
+        key = (backend, xmlbackend.pretty_print, shape)
+
+        try:
+            chunks, indexes = self.templates[key]
+        except KeyError:
+            chunks, indexes = self.templates[key] = self._compile(shape)
+
+        parts = [ chunks[0] ]
+        for idx, chunk in zip(indexes, chunks[1:]):
+            parts.append( escape(values[idx], backend) )
+            parts.append( chunk )
+
+        return ''.join(parts)
+
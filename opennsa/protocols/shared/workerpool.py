@@ -0,0 +1,123 @@
+"""
+Worker pool for decoding and encoding large XML payloads.
+
+Parsing a large payload (or building and serializing a large reply, e.g., a
+query summary with thousands of reservations) can block the reactor for a long
+time, stalling all other requests. When the pool is enabled, work on payloads
+above a size threshold is run in a thread pool, and the result is returned as a
+deferred. Smaller payloads are handled inline, as the thread hand-off costs
+more than it saves.
+
+Threads are used instead of processes, as the parsed elements and binding
+objects are not (cheaply) picklable. lxml releases the GIL while parsing and
+serializing, so the reactor keeps running while the workers are busy. The
+ElementTree backend holds the GIL while parsing and serializing, so the pool
+gives no speedup with it, and the configuration only allows it with lxml.
+
+Functions run in the pool must not touch the reactor or shared state, i.e., only
+parse, build, and serialize.
+
+Queue wait and execution time are recorded in the metrics module, as
+xmlworker.queue_wait and xmlworker.execution.
+
+Copyright: NORDUnet (2026)
+"""
+
+import time
+
+from twisted.python import log, threadpool
+from twisted.internet import reactor, defer, threads
+
+from opennsa.shared import metrics
+
+
+
+LOG_SYSTEM = 'XMLWorkerPool'
+
+DEFAULT_THRESHOLD = 256 * 1024 # bytes
+
+# estimated size of a reservation in a query result, used for estimating the size of replies before they are created
+QUERY_RESULT_SIZE = 2048 # bytes
+
+
+_pool = None
+_threshold = DEFAULT_THRESHOLD
+_pending = 0
+_shutdown_trigger = None
+
+
+
+def setup(threads, threshold=None):
+    """
+    Start the worker pool with the given number of threads. Zero threads
+    disables the pool, and all work is done inline.
+    """
+    global _pool, _threshold, _shutdown_trigger
+
+    shutdown()
+
+    if threshold is not None:
+        _threshold = threshold
+
+    if threads > 0:
+        _pool = threadpool.ThreadPool(0, threads, name='xmlworker')
+        _pool.start()
+        if _shutdown_trigger is None:
+            _shutdown_trigger = reactor.addSystemEventTrigger('during', 'shutdown', shutdown)
+        metrics.registerGauge('xmlworker.pending', lambda : _pending)
+        log.msg('XML worker pool started. Threads: %i, threshold: %i bytes' % (threads, _threshold), system=LOG_SYSTEM)
+
+
+def shutdown():
+    global _pool
+
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
+        metrics.unregisterGauge('xmlworker.pending')
+        log.msg('XML worker pool stopped', system=LOG_SYSTEM)
+
+
+def enabled():
+    return _pool is not None
+
+
+
+def run(size, f, *args, **kwargs):
+    """
+    Call f with args and kwargs, in the worker pool if it is enabled and size
+    (in bytes, possibly estimated) is above the threshold, otherwise inline.
+    Size None means unknown, and is done inline.
+
+    Returns a deferred with the result of f.
+    """
+    global _pending
+
+    if _pool is None or size is None or size < _threshold:
+        metrics.increment('xmlworker.inline')
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+    def work(queued):
+        # runs in worker thread, timings are recorded when back in the reactor
+        started = time.time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            timings.append( (started - queued, time.time() - started) )
+
+    def done(result):
+        global _pending
+        _pending -= 1
+        queue_wait, execution = timings[0]
+        metrics.observe('xmlworker.queue_wait', queue_wait)
+        metrics.observe('xmlworker.execution', execution)
+        return result
+
+    timings = []
+    _pending += 1
+    metrics.increment('xmlworker.pooled')
+
+    d = threads.deferToThreadPool(reactor, _pool, work, time.time())
+    d.addBoth(done)
+    return d
+
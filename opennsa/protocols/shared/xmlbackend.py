@@ -0,0 +1,241 @@
+"""
+XML backend for the SOAP stack.
+
+Provides the small subset of the ElementTree API used by minisoap and the NSI
+bindings (Element, SubElement, QName, fromstring, tostring, register_namespace,
+and XMLParser for incremental parsing with feed / close)
+on top of either lxml or ElementTree. lxml is used if it is available, as both
+its parser and serializer are in C, otherwise ElementTree is used (with the
+cElementTree parser when available).
+
+The backend and whether to pretty-print outgoing payloads can be changed with
+setBackend. The functions are module attributes which are rebound when
+switching, so there is no indirection per call.
+
+Both backends reject payloads with a DTD (DTDForbidden), SOAP does not allow
+them, and they are needed for entity expansion attacks. The check is done by
+expat / libxml2 while parsing, so it works for any encoding of the payload, and
+lxml does not resolve entities.
+
+Copyright: NORDUnet (2026)
+"""
+
+import threading
+
+from xml.parsers import expat
+
+from xml.etree import ElementTree as _pyET
+
+try:
+    from xml.etree import cElementTree as _cET
+except ImportError:
+    _cET = _pyET
+
+try:
+    from lxml import etree as _lxml
+except ImportError:
+    _lxml = None
+
+
+
+LXML    = 'lxml'
+ETREE   = 'etree'
+
+BACKENDS = (LXML, ETREE)
+
+HAS_LXML = _lxml is not None
+
+DEFAULT_BACKEND = LXML if HAS_LXML else ETREE
+
+
+
+# prefix -> namespace, used for nsmap on lxml elements so the prefixes stays readable
+_namespaces = {}
+
+backend = None
+pretty_print = True
+
+
+
+class DTDForbidden(ValueError):
+    pass
+
+
+def _rejectDTD(*args):
+    raise DTDForbidden('DTDs are not allowed in XML payloads')
+
+
+
+def QName(text_or_uri, tag=None):
+    # tags are plain strings in clark notation ({ns}tag), these can be used with all backends, and compared / hashed cheaply
+    if tag is None:
+        return str(text_or_uri)
+    return '{%s}%s' % (text_or_uri, tag)
+
+
+def register_namespace(prefix, uri):
+    _pyET.register_namespace(prefix, uri)
+    _namespaces[prefix] = uri
+
+
+
+def _indent(elem, level=0):
+    i = "\n" + level*"   "
+    if len(elem):
+        if not elem.text or not elem.text.strip():
+            elem.text = i + "   "
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+        for elem in elem:
+            _indent(elem, level+1)
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+    else:
+        if level and (not elem.tail or not elem.tail.strip()):
+            elem.tail = i
+
+
+
+# etree backend
+# elements are created with ElementTree, as cElementTree.Element in python 2 treats attrib= as an attribute named attrib
+
+class _PrologEnd(Exception):
+    pass
+
+
+class _DTDCheck:
+    # the cElementTree parser does not expose expat, so a separate expat parser is used to look for a DTD
+    # a DTD can only be in the prolog, so it stops at the first element, and the check is cheap
+
+    def __init__(self):
+        self.parser = expat.ParserCreate()
+        self.parser.StartDoctypeDeclHandler = _rejectDTD
+        self.parser.StartElementHandler = self._prologEnd
+        self.done = False
+
+    def _prologEnd(self, *args):
+        raise _PrologEnd()
+
+    def feed(self, data):
+        if self.done:
+            return
+        try:
+            self.parser.Parse(data, False)
+        except _PrologEnd:
+            self.done = True
+        except expat.ExpatError:
+            self.done = True # errors are reported by the element parser
+
+
+
+class _ETreeFeedParser:
+
+    def __init__(self):
+        self.check = _DTDCheck()
+        self.parser = _cET.XMLParser()
+
+    def feed(self, data):
+        self.check.feed(data)
+        self.parser.feed(data)
+
+    def close(self):
+        return self.parser.close()
+
+
+def _etreeFromstring(data):
+    _DTDCheck().feed(data)
+    return _cET.fromstring(data)
+
+
+def _etreeTostring(element, encoding='us-ascii', pretty=False):
+    if pretty:
+        _indent(element)
+    return _pyET.tostring(element, encoding)
+
+
+# lxml backend
+
+def _lxmlXMLParser():
+    # no entity resolving or network access, comments and processing instructions are dropped, so only elements are children
+    return _lxml.XMLParser(resolve_entities=False, no_network=True, remove_comments=True, remove_pis=True)
+
+# lxml parsers must not be shared between threads (payloads can be parsed in the worker pool)
+_lxml_parsers = threading.local()
+
+
+def _lxmlCheckDTD(element):
+    # entities are not resolved, so a DTD can be checked for after parsing
+    if element.getroottree().docinfo.doctype:
+        _rejectDTD()
+    return element
+
+
+class _LXMLFeedParser:
+
+    def __init__(self):
+        self.parser = _lxmlXMLParser()
+
+    def feed(self, data):
+        self.parser.feed(data)
+
+    def close(self):
+        return _lxmlCheckDTD( self.parser.close() )
+
+
+def _lxmlElement(tag, attrib=None):
+    # declare the registered namespaces, so the element gets the registered prefix, unused ones are removed in tostring
+    return _lxml.Element(tag, attrib, nsmap=_namespaces)
+
+
+def _lxmlFromstring(data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    try:
+        parser = _lxml_parsers.parser
+    except AttributeError:
+        parser = _lxml_parsers.parser = _lxmlXMLParser()
+    return _lxmlCheckDTD( _lxml.fromstring(data, parser) )
+
+
+def _lxmlTostring(element, encoding='us-ascii', pretty=False):
+    # move namespace declarations to the top element and remove unused ones
+    _lxml.cleanup_namespaces(element, top_nsmap=_namespaces)
+    return _lxml.tostring(element, encoding=encoding, xml_declaration=False, pretty_print=pretty)
+
+
+
+def setBackend(name=None, pretty=None):
+    """
+    Select XML backend (LXML or ETREE) and if outgoing payloads should be
+    pretty-printed. None leaves the setting unchanged (the backend defaults to
+    lxml if available).
+    """
+    global backend, pretty_print, Element, SubElement, fromstring, tostring, XMLParser
+
+    if name is None:
+        name = backend or DEFAULT_BACKEND
+
+    if name == LXML:
+        if not HAS_LXML:
+            raise ValueError('XML backend lxml selected, but lxml is not available')
+        Element     = _lxmlElement
+        SubElement  = _lxml.SubElement
+        fromstring  = _lxmlFromstring
+        tostring    = _lxmlTostring
+        XMLParser   = _LXMLFeedParser
+    elif name == ETREE:
+        Element     = _pyET.Element
+        SubElement  = _pyET.SubElement
+        fromstring  = _etreeFromstring
+        tostring    = _etreeTostring
+        XMLParser   = _ETreeFeedParser
+    else:
+        raise ValueError('Invalid XML backend: %s (must be one of %s)' % (name, ', '.join(BACKENDS)))
+
+    backend = name
+    if pretty is not None:
+        pretty_print = pretty
+
+
+setBackend()
+
@@ -22,6 +22,9 @@ class ProviderRegistry(object):
         self.providers = providers.copy()
         self.provider_factories = provider_factories # { provider_type : provider_spawn_func }
         self.provider_networks = {} # { provider_urn : [ network ] }
+        self.network_providers = {} # { network : provider_urn } , reverse index of provider_networks
+        self.spawned_providers = {} # { provider_urn : (service_type, endpoint, provider) } , reused across spawns
+        self.port_providers = {} # { (network, port) : provider_urn } , for local backends sharing a network
 
 
     def getProvider(self, nsi_agent_urn):
@@ -38,35 +41,82 @@ class ProviderRegistry(object):
         """
         Get the provider urn by specifying network.
         """
-        for provider, networks in self.provider_networks.items():
-            if network_id in networks:
-                return provider
-        else:
+        try:
+            return self.network_providers[network_id]
+        except KeyError:
             raise error.STPResolutionError('Could not resolve a provider for %s' % network_id)
 
 
-    def addProvider(self, nsi_agent_urn, provider, network_ids):
+    def getProviderByPort(self, network_id, port):
+        """
+        Get the provider urn for a port in a network. If no provider has been
+        added for the port, the provider of the network is returned.
+        """
+        try:
+            return self.port_providers[ (network_id, port) ]
+        except KeyError:
+            return self.getProviderByNetwork(network_id)
+
+
+    def addProvider(self, nsi_agent_urn, provider, network_ids, ports=None):
         """
         Directly add a provider. Probably only needed by setup.py
+
+        Ports are the names of the ports in the networks that the provider
+        manages, for when several (local) providers share a network.
         """
         if not nsi_agent_urn in self.providers:
             log.msg('Creating new provider for %s' % nsi_agent_urn, system=LOG_SYSTEM)
 
         self.providers[ nsi_agent_urn ] = provider
+        self._updateNetworks(nsi_agent_urn, network_ids)
+
+        for network_id in network_ids:
+            for port in ports or []:
+                owner = self.port_providers.get( (network_id, port) )
+                if owner not in (None, nsi_agent_urn):
+                    raise error.TopologyError('Port %s:%s is already managed by %s' % (network_id, port, owner))
+                self.port_providers[ (network_id, port) ] = nsi_agent_urn
+
+
+    def _updateNetworks(self, nsi_agent_urn, network_ids):
+        # keep the network -> provider index in sync with the networks of the provider
+
+        old_network_ids = self.provider_networks.get(nsi_agent_urn, [])
         self.provider_networks[ nsi_agent_urn ] = network_ids
 
+        for network_id in old_network_ids:
+            if network_id in network_ids or self.network_providers.get(network_id) != nsi_agent_urn:
+                continue
+            del self.network_providers[network_id]
+            # another provider might also claim the network (should not happen, but peers can be misconfigured)
+            for provider_urn, networks in self.provider_networks.items():
+                if network_id in networks:
+                    self.network_providers[network_id] = provider_urn
+                    break
+
+        for network_id in network_ids:
+            self.network_providers[network_id] = nsi_agent_urn
+
 
     def spawnProvider(self, nsi_agent, network_ids):
         """
         Create a new provider, from an NSI agent.
         ServiceType must exist on the NSI agent, and a factory for the type available.
         """
-        if nsi_agent.urn() in self.providers and self.provider_networks[nsi_agent.urn()] == network_ids:
+        service_type = nsi_agent.getServiceType()
+        spawned_type, spawned_endpoint, prov = self.spawned_providers.get(nsi_agent.urn(), (service_type, nsi_agent.endpoint, None))
+        agent_changed = (spawned_type, spawned_endpoint) != (service_type, nsi_agent.endpoint)
+
+        if nsi_agent.urn() in self.providers and self.provider_networks[nsi_agent.urn()] == network_ids and not agent_changed:
             log.msg('Skipping provider spawn for %s (no change)' % nsi_agent, debug=True, system=LOG_SYSTEM)
             return self.providers[nsi_agent.urn()]
 
-        factory = self.provider_factories[ nsi_agent.getServiceType() ]
-        prov = factory(nsi_agent)
+        # only create a new requester if the agent has changed, not when just the networks have
+        if prov is None or agent_changed:
+            factory = self.provider_factories[service_type]
+            prov = factory(nsi_agent)
+            self.spawned_providers[nsi_agent.urn()] = (service_type, nsi_agent.endpoint, prov)
 
         self.addProvider(nsi_agent.urn(), prov, network_ids)
 
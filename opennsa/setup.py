@@ -7,15 +7,18 @@ import datetime
 import importlib
 
 from twisted.python import log
+from twisted.internet import reactor
 from twisted.web import resource, server
 from twisted.application import internet, service as twistedservice
 
 from opennsa import __version__ as version
 
-from opennsa import config, logging, constants as cnt, nsa, provreg, database, aggregator, viewresource
+from opennsa import config, logging, constants as cnt, nsa, provreg, database, archive, changefeed, workers, aggregator, admission, viewresource
+from opennsa.backends.common import genericbackend
 from opennsa.topology import nrm, nml, linkvector, service as nmlservice
 from opennsa.protocols import rest, nsi2
-from opennsa.protocols.shared import httplog
+from opennsa.protocols.shared import httplog, xmlbackend, workerpool, soapresource
+from opennsa.shared import querycache
 from opennsa.discovery import service as discoveryservice, fetcher
 
 
@@ -87,10 +90,16 @@ def setupBackend(backend_cfg, network_name, nrm_ports, parent_requester):
 
 def setupTopology(nrm_map, network_name, base_name):
 
+    nrm_ports = nrm.parsePortSpec(nrm_map) if nrm_map is not None else None
+    return setupPortTopology(nrm_ports, network_name, base_name)
+
+
+
+def setupPortTopology(nrm_ports, network_name, base_name):
+
     link_vector = linkvector.LinkVector( [ network_name ] )
 
-    if nrm_map is not None:
-        nrm_ports = nrm.parsePortSpec(nrm_map)
+    if nrm_ports is not None:
         nml_network = nml.createNMLNetwork(nrm_ports, network_name, base_name)
 
         # route vectors
@@ -127,28 +136,32 @@ def setupTLSContext(vc):
 
 class CS2RequesterCreator:
 
-    def __init__(self, top_resource, aggregator, host, port, tls, ctx_factory):
+    def __init__(self, top_resource, aggregator, host, port, tls, ctx_factory, max_payload_size=None, max_payload_elements=None):
         self.top_resource = top_resource
         self.aggregator   = aggregator
         self.host         = host
         self.port         = port
         self.tls          = tls
         self.ctx_factory  = ctx_factory
+        self.max_payload_size     = max_payload_size
+        self.max_payload_elements = max_payload_elements
 
 
     def create(self, nsi_agent):
 
         resource_name = 'RequesterService2-' + hashlib.sha1(nsi_agent.urn() + nsi_agent.endpoint).hexdigest()
         return nsi2.setupRequesterPair(self.top_resource, self.host, self.port, nsi_agent.endpoint, self.aggregator,
-                                       resource_name, tls=self.tls, ctx_factory=self.ctx_factory)
+                                       resource_name, tls=self.tls, ctx_factory=self.ctx_factory,
+                                       max_payload_size=self.max_payload_size, max_payload_elements=self.max_payload_elements)
 
 
 
 class OpenNSAService(twistedservice.MultiService):
 
-    def __init__(self, vc):
+    def __init__(self, vc, worker_id=0):
         twistedservice.MultiService.__init__(self)
         self.vc = vc
+        self.worker_id = worker_id
 
 
     def startService(self):
@@ -157,6 +170,8 @@ class OpenNSAService(twistedservice.MultiService):
         There are a lot of things going on, but none of it it particular deep.
         """
         log.msg('OpenNSA service initializing')
+        if self.vc[config.WORKERS] > 1:
+            log.msg('Worker %i of %i' % (self.worker_id, self.vc[config.WORKERS]))
 
         vc = self.vc
 
@@ -167,8 +182,40 @@ class OpenNSAService(twistedservice.MultiService):
             import socket
             vc[config.HOST] = socket.getfqdn()
 
+        xmlbackend.setBackend(vc[config.XML_BACKEND], vc[config.PRETTY_XML])
+        log.msg('XML backend: %s, pretty printing: %s' % (xmlbackend.backend, xmlbackend.pretty_print))
+        workerpool.setup(vc[config.XML_WORKERS], vc[config.XML_WORKER_THRESHOLD])
+
         # database
-        database.setupDatabase(vc[config.DATABASE], vc[config.DATABASE_USER], vc[config.DATABASE_PASSWORD], vc[config.DATABASE_HOST], vc[config.SERVICE_ID_START])
+        storage = vc[config.DATABASE_STORAGE]
+        if storage == database.POSTGRESQL:
+            database.setupDatabase(vc[config.DATABASE], vc[config.DATABASE_USER], vc[config.DATABASE_PASSWORD], vc[config.DATABASE_HOST], vc[config.SERVICE_ID_START],
+                                   vc[config.DATABASE_DRIVER], vc[config.DATABASE_POOL_SIZE], vc[config.DATABASE_ASYNC_CONNECTIONS], vc[config.DATABASE_MIGRATE],
+                                   vc[config.SERVICE_ID_BLOCK])
+        elif storage == database.SQLITE:
+            database.setupSQLiteDatabase(vc[config.DATABASE], vc[config.SERVICE_ID_START], vc[config.SERVICE_ID_BLOCK])
+        else:
+            database.setupSQLiteDatabase(connection_id_start=vc[config.SERVICE_ID_START], connection_id_block=vc[config.SERVICE_ID_BLOCK])
+        log.msg('Storage: %s' % storage)
+
+        feed = None
+        if vc[config.DATABASE_NOTIFY] and storage == database.POSTGRESQL:
+            feed = changefeed.ChangeFeed(vc[config.DATABASE], vc[config.DATABASE_USER], vc[config.DATABASE_PASSWORD], vc[config.DATABASE_HOST])
+            feed.setServiceParent(self)
+
+        # with multiple workers, the backend and archiver are run by the leader
+        multiple_workers = vc[config.WORKERS] > 1
+        if multiple_workers:
+            election = workers.LeaderElection(workers.lockId(vc[config.NETWORK_NAME]),
+                                              vc[config.DATABASE], vc[config.DATABASE_USER], vc[config.DATABASE_PASSWORD], vc[config.DATABASE_HOST])
+            election.setServiceParent(self)
+            leader_services = election
+        else:
+            leader_services = self
+
+        if vc[config.ARCHIVE_AGE] and storage == database.POSTGRESQL:
+            archiver = archive.Archiver(archive_age=datetime.timedelta(days=vc[config.ARCHIVE_AGE]))
+            archiver.setServiceParent(leader_services)
 
         service_endpoints = []
 
@@ -187,9 +234,23 @@ class OpenNSAService(twistedservice.MultiService):
 
         ns_agent = nsa.NetworkServiceAgent(nsa_name, provider_endpoint, 'local')
 
-        # topology
-        nrm_map = open(vc[config.NRM_MAP_FILE]) if vc[config.NRM_MAP_FILE] is not None else None
-        nrm_ports, nml_network, link_vector = setupTopology(nrm_map, network_name, base_name)
+        # topology, when the backends have their own nrm map, the network is made up of their ports
+        backend_configs = vc['backend']
+        backend_ports = {} # backend name -> [ nrm port ]
+        for backend_name, backend_cfg in backend_configs.items():
+            if config.NRM_MAP_FILE in backend_cfg:
+                backend_ports[backend_name] = nrm.parsePortSpec( open(backend_cfg[config.NRM_MAP_FILE]) )
+
+        if backend_ports:
+            nrm_ports = [ port for backend_name in sorted(backend_ports) for port in backend_ports[backend_name] ]
+            port_names = [ port.name for port in nrm_ports ]
+            duplicate_ports = sorted( set( pn for pn in port_names if port_names.count(pn) > 1 ) )
+            if duplicate_ports:
+                raise config.ConfigurationError('Ports specified for more than one backend: %s' % ', '.join(duplicate_ports))
+            nrm_ports, nml_network, link_vector = setupPortTopology(nrm_ports, network_name, base_name)
+        else:
+            nrm_map = open(vc[config.NRM_MAP_FILE]) if vc[config.NRM_MAP_FILE] is not None else None
+            nrm_ports, nml_network, link_vector = setupTopology(nrm_map, network_name, base_name)
 
         # ssl/tls context
         ctx_factory = setupTLSContext(vc) # May be None
@@ -205,34 +266,80 @@ class OpenNSAService(twistedservice.MultiService):
 
         # the dance to setup dynamic providers right
         top_resource = resource.Resource()
-        requester_creator = CS2RequesterCreator(top_resource, None, vc[config.HOST], vc[config.PORT], vc[config.TLS], ctx_factory) # set aggregator later
+        requester_creator = CS2RequesterCreator(top_resource, None, vc[config.HOST], vc[config.PORT], vc[config.TLS], ctx_factory,
+                                                vc[config.MAX_PAYLOAD_SIZE], vc[config.MAX_PAYLOAD_ELEMENTS]) # set aggregator later
+
+        querycache.setDefaultTTL(vc[config.QUERY_CACHE_TTL]) # before the aggregator and backends are created
 
         provider_registry = provreg.ProviderRegistry({}, { cnt.CS2_SERVICE_TYPE : requester_creator.create } )
-        aggr = aggregator.Aggregator(network_name, ns_agent, nml_network, link_vector, None, provider_registry, vc[config.POLICY], plugin ) # set parent requester later
+        aggr = aggregator.Aggregator(network_name, ns_agent, nml_network, link_vector, None, provider_registry, vc[config.POLICY], plugin,
+                                     cache_size=vc[config.CONNECTION_CACHE_SIZE]) # set parent requester later
 
         requester_creator.aggregator = aggr
 
-        pc = nsi2.setupProvider(aggr, top_resource, ctx_factory=ctx_factory, allowed_hosts=vc.get(config.ALLOWED_HOSTS))
-        aggr.parent_requester = pc
+        # write pending child reservations and notifications before shutting down, they are picked up by restore on the next start
+        reactor.addSystemEventTrigger('before', 'shutdown', aggr.flush)
 
-        # setup backend(s) - for now we only support one
-        backend_configs = vc['backend']
+        if feed is not None:
+            # connections cached by the aggregator go stale when other processes change them
+            changefeed.addRemoteListener(aggr.connectionChanged)
+
+        if multiple_workers:
+            # the previous leader has continued the notification ids
+            election.addPromotionHook(aggr.notification_log.load)
+
+        # requests from requesters go through admission control, replies from children go directly to the aggregator
+        admission_control = admission.AdmissionControl(aggr, vc[config.REQUEST_RATE], vc[config.REQUEST_BURST], vc[config.MAX_INFLIGHT_RESERVATIONS],
+                                                       vc[config.MAX_CONCURRENT_REQUESTS], vc[config.MAX_QUEUED_REQUESTS])
+
+        pc = nsi2.setupProvider(admission_control, top_resource, ctx_factory=ctx_factory, allowed_hosts=vc.get(config.ALLOWED_HOSTS),
+                                max_payload_size=vc[config.MAX_PAYLOAD_SIZE], max_payload_elements=vc[config.MAX_PAYLOAD_ELEMENTS])
+        aggr.parent_requester = admission_control.requesterFilter(pc)
+
+        # pick up child reservations in progress and notifications from before restart (needs the parent requester)
+        # reservations interrupted before reaching the children are failed, other workers may be in the middle of creating some
+        aggr.restore(aggregator.INTERRUPTED_RESERVE_AGE if multiple_workers else None).addErrback(log.err)
+
+        # setup backend(s)
         if len(backend_configs) == 0:
             log.msg('No backend specified. Running in aggregator-only mode')
             if not cnt.AGGREGATOR in vc[config.POLICY]:
                 vc[config.POLICY].append(cnt.AGGREGATOR)
         elif len(backend_configs) > 1:
-            raise config.ConfigurationError('Only one backend supported for now. Multiple will probably come later.')
+            # each backend manages its own ports in the network, and has its own calendar and scheduler
+            # the aggregator creates a sub connection for each backend on the path, and talks to them directly
+            can_swap_label = True
+            for backend_name, backend_cfg in sorted(backend_configs.items()):
+                backend_urn = ns_agent.urn() + ':' + (backend_name or backend_cfg['_backend_type'])
+                backend_service = setupBackend(backend_cfg, network_name, backend_ports[backend_name], aggr)
+                if isinstance(backend_service, genericbackend.GenericBackend):
+                    # the backends share the network, so they must identify themselves in notifications, and keep them apart
+                    backend_service.setIdentity(backend_urn, backend_name)
+                backend_service.setServiceParent(self)
+                can_swap_label = can_swap_label and backend_service.connection_manager.canSwapLabel(cnt.ETHERNET_VLAN)
+                provider_registry.addProvider(backend_urn, backend_service, [ network_name ], [ port.name for port in backend_ports[backend_name] ])
+                log.msg('Backend %s manages %i ports' % (backend_urn, len(backend_ports[backend_name])))
         else: # 1 backend
             if not nrm_ports:
                 raise config.ConfigurationError('No NRM Map file specified. Cannot configure a backend without port spec.')
 
             backend_cfg = backend_configs.values()[0]
 
-            backend_service = setupBackend(backend_cfg, network_name, nrm_ports, aggr)
-            backend_service.setServiceParent(self)
+            if multiple_workers:
+                # replies go back to the worker which did the request
+                router = workers.ReplyRouter(aggr)
+                backend_service = setupBackend(backend_cfg, network_name, nrm_ports, router)
+                internet.UNIXServer(vc[config.WORKER_SOCKET], workers.LeaderFactory(backend_service, router), mode=0600, wantPID=True).setServiceParent(election)
+                leader_client = workers.LeaderClientFactory(aggr)
+                internet.UNIXClient(vc[config.WORKER_SOCKET], leader_client).setServiceParent(self)
+                provider = workers.BackendDispatcher(backend_service, election, leader_client)
+            else:
+                backend_service = setupBackend(backend_cfg, network_name, nrm_ports, aggr)
+                provider = backend_service
+
+            backend_service.setServiceParent(leader_services)
             can_swap_label = backend_service.connection_manager.canSwapLabel(cnt.ETHERNET_VLAN)
-            provider_registry.addProvider(ns_agent.urn(), backend_service, [ network_name ] )
+            provider_registry.addProvider(ns_agent.urn(), provider, [ network_name ] )
 
 
         # fetcher
@@ -256,12 +363,13 @@ class OpenNSAService(twistedservice.MultiService):
         # view resource
         vr = viewresource.ConnectionListResource()
         top_resource.children['NSI'].putChild('connections', vr)
+        top_resource.children['NSI'].putChild('metrics', viewresource.MetricsResource())
 
         # rest service
         if vc[config.REST]:
             rest_url = base_url + '/connections'
 
-            rest.setupService(aggr, top_resource, vc.get(config.ALLOWED_HOSTS))
+            rest.setupService(admission_control, top_resource, vc.get(config.ALLOWED_HOSTS))
 
             service_endpoints.append( ('REST', rest_url) )
             interfaces.append( (cnt.OPENNSA_REST, rest_url, None) )
@@ -293,10 +401,13 @@ class OpenNSAService(twistedservice.MultiService):
         for service_name, url in service_endpoints:
             log.msg('{:<12} URL: {}'.format(service_name, url))
 
-        factory = server.Site(top_resource)
+        # request bodies above the maximum payload size are rejected while they are received
+        factory = server.Site(top_resource, requestFactory=soapresource.createRequestFactory(vc[config.MAX_PAYLOAD_SIZE]))
         factory.log = httplog.logRequest # default logging is weird, so we do our own
 
-        if vc[config.TLS]:
+        if multiple_workers:
+            workers.SharedPort(vc[config.PORT], factory, ctx_factory if vc[config.TLS] else None).setServiceParent(self)
+        elif vc[config.TLS]:
             internet.SSLServer(vc[config.PORT], factory, ctx_factory).setServiceParent(self)
         else:
             internet.TCPServer(vc[config.PORT], factory).setServiceParent(self)
@@ -312,7 +423,7 @@ class OpenNSAService(twistedservice.MultiService):
 
 
 
-def createApplication(config_file=config.DEFAULT_CONFIG_FILE, debug=False, payload=False):
+def createApplication(config_file=config.DEFAULT_CONFIG_FILE, debug=False, payload=False, worker_id=None):
 
     application = twistedservice.Application('OpenNSA')
 
@@ -328,9 +439,14 @@ def createApplication(config_file=config.DEFAULT_CONFIG_FILE, debug=False, paylo
             import sys
             log_file = sys.stdout
 
-        nsa_service = OpenNSAService(vc)
+        nsa_service = OpenNSAService(vc, worker_id or 0)
         nsa_service.setServiceParent(application)
 
+        if worker_id is None and vc[config.WORKERS] > 1:
+            # this is the first worker, start the others
+            worker_processes = workers.WorkerProcesses(config_file, vc[config.WORKERS], debug, payload)
+            worker_processes.setServiceParent(application)
+
         application.setComponent(log.ILogObserver, logging.DebugLogObserver(log_file, debug, payload=payload).emit)
         return application
 
@@ -0,0 +1,161 @@
+"""
+Bounded identity map for ORM objects.
+
+Keeps a single in-memory object per database row, so concurrent updates to the
+same connection happen on the same object and do not overwrite each other. The
+map is bounded, when it grows above its maximum size the least recently used
+entries are evicted. Entries for which the pinned function returns true (e.g.,
+connections in the middle of a state transition) are never evicted, so the map
+can temporarily be larger than the maximum size if many entries are pinned.
+Pinned entries are moved to the most recently used end when skipped, and at
+most MAX_EVICT_SCAN are skipped per eviction, so adding stays cheap when many
+entries are pinned.
+
+When a row has been changed elsewhere (e.g., by another OpenNSA process), its
+entry is invalidated, so the object is loaded again on the next lookup.
+Invalidated entries which are pinned are kept until they are no longer pinned,
+as there are operations in progress on the object. The optional index function
+maps a key to a secondary key (e.g., the connection id of a composite key), so
+entries can be invalidated by it.
+
+Lookups, evictions, and size are recorded in the metrics module as
+<name>.hit, <name>.miss, <name>.evicted, and <name>.size.
+
+Copyright: NORDUnet (2026)
+"""
+
+from collections import OrderedDict
+
+from opennsa.shared import metrics
+
+
+
+DEFAULT_MAX_SIZE = 10000
+
+MAX_EVICT_SCAN = 100 # pinned entries skipped per eviction
+
+
+
+class IdentityMap:
+
+    def __init__(self, name, max_size=None, pinned=None, index=None):
+        self.name = name
+        self.max_size = max_size or DEFAULT_MAX_SIZE
+        self.pinned = pinned or (lambda obj : False)
+        self.index = index
+        self._entries = OrderedDict() # least recently used first
+        self._stale = set() # invalidated keys, with pinned objects
+        self._index = {} # index(key) -> set of keys
+
+        metrics.registerGauge(name + '.size', lambda : len(self._entries))
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def get(self, key, default=None):
+
+        try:
+            obj = self._entries.pop(key)
+        except KeyError:
+            metrics.increment(self.name + '.miss')
+            return default
+
+        if key in self._stale and not self.pinned(obj):
+            self._drop(key, obj)
+            metrics.increment(self.name + '.miss')
+            return default
+
+        self._entries[key] = obj # move to end (most recently used)
+        metrics.increment(self.name + '.hit')
+        return obj
+
+
+    def add(self, key, obj):
+        """
+        Add object to the map, unless there already is an object for the key,
+        in which case that object is kept. Returns the object in the map, which
+        should be used instead of obj.
+        """
+        existing = self._entries.get(key)
+        if existing is not None:
+            if not (key in self._stale and not self.pinned(existing)):
+                return existing
+            self._stale.discard(key) # obj is the fresh one
+
+        self._entries[key] = obj
+        if self.index is not None:
+            self._index.setdefault(self.index(key), set()).add(key)
+        if len(self._entries) > self.max_size:
+            self._evict()
+        return obj
+
+
+    def remove(self, key):
+        obj = self._entries.pop(key, None)
+        if obj is not None:
+            self._drop(key, obj)
+
+
+    def invalidate(self, key):
+        """
+        Drop the object for a key, as its row has been changed elsewhere. If the
+        object is pinned, it is dropped at the first lookup after it is unpinned.
+        """
+        obj = self._entries.get(key)
+        if obj is None:
+            return
+        if self.pinned(obj):
+            self._stale.add(key)
+        else:
+            self.remove(key)
+        metrics.increment(self.name + '.invalidated')
+
+
+    def invalidateIndexed(self, index_key):
+        """
+        Invalidate the entries with keys mapping to index_key.
+        """
+        for key in list(self._index.get(index_key, ())):
+            self.invalidate(key)
+
+
+    def invalidateAll(self):
+        for key in list(self._entries):
+            self.invalidate(key)
+
+
+    def _drop(self, key, obj):
+        # bookkeeping for an entry which has been taken out of _entries
+        self._stale.discard(key)
+        if self.index is not None:
+            index_key = self.index(key)
+            keys = self._index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[index_key]
+
+
+    def _evict(self):
+
+        excess = len(self._entries) - self.max_size
+        scan = min(len(self._entries), MAX_EVICT_SCAN)
+        evicted = 0
+        skipped = 0
+        while evicted < excess and skipped < scan:
+            key = next(iter(self._entries)) # least recently used
+            obj = self._entries.pop(key)
+            if self.pinned(obj):
+                self._entries[key] = obj # in use, so move to end and do not scan it again on the next add
+                skipped += 1
+            else:
+                self._drop(key, obj)
+                evicted += 1
+
+        metrics.increment(self.name + '.evicted', evicted)
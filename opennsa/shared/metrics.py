@@ -0,0 +1,64 @@
+"""
+In-process metrics for OpenNSA.
+
+Counters, timers and gauges, kept in module level dicts. Timers keep count,
+total and maximum, which is enough to get rates and averages by sampling. Gauges
+are functions which are called when a snapshot is taken.
+
+The metrics are not thread safe, and should only be updated from the reactor
+thread.
+
+Copyright: NORDUnet (2026)
+"""
+
+
+_counters = {}  # name -> value
+_timers   = {}  # name -> [ count, total, max ]
+_gauges   = {}  # name -> function
+
+
+
+def increment(name, value=1):
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    try:
+        timer = _timers[name]
+    except KeyError:
+        timer = _timers[name] = [ 0, 0.0, 0.0 ]
+    timer[0] += 1
+    timer[1] += seconds
+    if seconds > timer[2]:
+        timer[2] = seconds
+
+
+def registerGauge(name, function):
+    _gauges[name] = function
+
+
+def unregisterGauge(name):
+    _gauges.pop(name, None)
+
+
+def snapshot():
+    """
+    Return all metrics as a flat dict. Timers are expanded into name.count,
+    name.total and name.max (seconds).
+    """
+    result = dict(_counters)
+    for name, (count, total, max_) in _timers.items():
+        result[name + '.count'] = count
+        result[name + '.total'] = total
+        result[name + '.max']   = max_
+    for name, function in _gauges.items():
+        result[name] = function()
+    return result
+
+
+def reset():
+    # for testing
+    _counters.clear()
+    _timers.clear()
+    _gauges.clear()
+
@@ -0,0 +1,159 @@
+"""
+Short-lived cache for query results.
+
+Requesters (and dashboards) poll querySummary every few seconds, often with the
+same arguments. Each query means a database scan and building the result, so
+the results are cached for a short time (the TTL), keyed by the requester and
+the query arguments. Concurrent identical queries are collapsed into a single
+computation (single-flight), so the load from polling does not grow with the
+number of pollers.
+
+Entries are invalidated when a connection of the requester is saved through
+state.saveNotify (and can be invalidated explicitly for changes which do not go
+through it). Queries which are in progress when an invalidation happens still
+deliver their result to the requests waiting for them, but the result is not
+cached, and later queries do not join them.
+
+Hits, misses, and collapsed queries are recorded in the metrics module as
+<name>.hit, <name>.miss, and <name>.coalesced.
+
+Copyright: NORDUnet (2026)
+"""
+
+import weakref
+
+from collections import OrderedDict
+
+from twisted.internet import reactor, defer
+
+from opennsa.shared import metrics
+
+
+
+DEFAULT_TTL = 2.0       # seconds, 0 disables caching (but not single-flight)
+MAX_ENTRIES = 1000
+
+_caches = weakref.WeakSet() # for invalidation
+
+
+
+def setDefaultTTL(ttl):
+    """
+    Set the TTL for caches created after this call.
+    """
+    global DEFAULT_TTL
+    DEFAULT_TTL = ttl
+
+
+def invalidate(requester_nsa=None):
+    """
+    Invalidate the entries of a requester in all caches (all entries if no
+    requester is given).
+    """
+    for cache in list(_caches):
+        cache.invalidate(requester_nsa)
+
+
+def queryKey(requester_nsa, connection_ids, global_reservation_ids):
+    # order of ids does not matter for the result
+    return ( requester_nsa, tuple(sorted(connection_ids or [])), tuple(sorted(global_reservation_ids or [])) )
+
+
+
+class _Flight:
+    # a computation in progress, and the requests waiting for it
+    def __init__(self):
+        self.waiters = []
+
+
+
+class QueryCache:
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.clock = reactor
+
+        self._entries = OrderedDict()   # key -> (expiry time, result), oldest first
+        self._flights = {}              # key -> flight
+
+        metrics.registerGauge(name + '.size', lambda : len(self._entries))
+        _caches.add(self)
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, key, compute):
+        """
+        Get the result for a key (the first element of the key must be the
+        requester nsa). If there is no valid cached result, compute is called
+        (with no arguments) to get a deferred for it, unless a computation for
+        the same key is already in progress. Returns a deferred.
+        """
+        now = self.clock.seconds()
+
+        try:
+            expiry, result = self._entries[key]
+            if now < expiry:
+                metrics.increment(self.name + '.hit')
+                return defer.succeed(result)
+            del self._entries[key]
+        except KeyError:
+            pass
+
+        d = defer.Deferred()
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            metrics.increment(self.name + '.coalesced')
+            flight.waiters.append(d)
+            return d
+
+        metrics.increment(self.name + '.miss')
+        flight = self._flights[key] = _Flight()
+        flight.waiters.append(d)
+
+        def computed(result):
+            # only cache the result if nothing was invalidated during the computation
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+                if self.ttl:
+                    self._store(key, result)
+            for w in flight.waiters:
+                w.callback(result)
+
+        def computeFailed(err):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            for w in flight.waiters:
+                w.errback(err)
+
+        defer.maybeDeferred(compute).addCallbacks(computed, computeFailed)
+        return d
+
+
+    def _store(self, key, result):
+
+        now = self.clock.seconds()
+        self._entries[key] = (now + self.ttl, result)
+
+        if len(self._entries) > MAX_ENTRIES:
+            for k, (expiry, _) in self._entries.items():
+                if expiry <= now or len(self._entries) > MAX_ENTRIES:
+                    del self._entries[k]
+
+
+    def invalidate(self, requester_nsa=None):
+
+        if requester_nsa is None:
+            self._entries.clear()
+            self._flights.clear()
+            return
+
+        for key in [ k for k in self._entries if k[0] == requester_nsa ]:
+            del self._entries[key]
+        for key in [ k for k in self._flights if k[0] == requester_nsa ]:
+            del self._flights[key]
+
@@ -15,4 +15,5 @@ class RequestInfo:
     def __init__(self, cert_subject=None, cert_host_dn=None):
         self.cert_subject = cert_subject
         self.cert_host_dn = cert_host_dn
+        self.payload_size = None # size of the request payload in bytes, set when parsed
 
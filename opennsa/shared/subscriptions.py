@@ -0,0 +1,147 @@
+"""
+Registry for subscriptions to connection state changes.
+
+Subscribers (REST longpoll and auto commit) are functions called without
+arguments when a connection changes. Subscribing returns a handle, which
+removes the subscription when cancelled. Subscriptions are also removed when
+the connection reaches a terminal state (the subscriber is called one last time
+first), or when their timeout runs out, so subscribers which are never
+cancelled explicitly do not stay around forever. The expired function of a
+subscription (if any) is called when it is removed by the registry, but not
+when it is cancelled.
+
+Connections without subscribers are removed from the registry, and the number
+of subscribers per connection is capped, further subscriptions are rejected
+with ResourceUnavailableError.
+
+The number of connections and subscribers are recorded in the metrics module
+as <name>.connections and <name>.subscribers, and rejected and expired
+subscriptions as <name>.rejected and <name>.expired.
+
+Copyright: NORDUnet (2026)
+"""
+
+from twisted.python import log
+from twisted.internet import reactor
+
+from opennsa import error
+from opennsa.shared import metrics
+
+
+
+LOG_SYSTEM = 'opennsa.subscriptions'
+
+DEFAULT_MAX_SUBSCRIBERS = 100 # per connection
+
+
+
+class Subscription:
+
+    def __init__(self, registry, connection_id, function, expired=None):
+        self.registry = registry
+        self.connection_id = connection_id
+        self.function = function
+        self.expired = expired
+        self.timeout_call = None
+
+
+    @property
+    def active(self):
+        return self in self.registry._subscriptions.get(self.connection_id, [])
+
+
+    def cancel(self):
+        """
+        Remove the subscription. Can be called more than once.
+        """
+        self.registry._remove(self)
+
+
+
+class SubscriptionRegistry:
+
+    def __init__(self, name, max_subscribers=None):
+        self.name = name
+        self.max_subscribers = max_subscribers or DEFAULT_MAX_SUBSCRIBERS
+        self.clock = reactor
+
+        self._subscriptions = {} # connection_id -> [ subscription ], no empty lists
+
+        metrics.registerGauge(name + '.connections', lambda : len(self._subscriptions))
+        metrics.registerGauge(name + '.subscribers', lambda : sum( len(s) for s in self._subscriptions.values() ))
+
+
+    def subscribe(self, connection_id, function, timeout=None, expired=None):
+        """
+        Subscribe to changes of a connection. If timeout (seconds) is given, the
+        subscription is removed after that time. Returns the subscription.
+        """
+        subscriptions = self._subscriptions.get(connection_id, [])
+        if len(subscriptions) >= self.max_subscribers:
+            metrics.increment(self.name + '.rejected')
+            raise error.ResourceUnavailableError('Too many subscribers for connection %s (max %i)' % (connection_id, self.max_subscribers))
+
+        subscription = Subscription(self, connection_id, function, expired)
+        self._subscriptions.setdefault(connection_id, []).append(subscription)
+        if timeout is not None:
+            subscription.timeout_call = self.clock.callLater(timeout, self._expire, subscription)
+        return subscription
+
+
+    def unsubscribe(self, connection_id, function):
+        """
+        Remove the subscriptions of a function to a connection.
+        """
+        for subscription in list(self._subscriptions.get(connection_id, [])):
+            if subscription.function == function:
+                subscription.cancel()
+
+
+    def notify(self, connection_id, terminal=False):
+        """
+        Call the subscribers of a connection. If terminal is true, the
+        connection will not change anymore, and the subscriptions are removed.
+        """
+        # subscribers can cancel (themselves or others) when called
+        for subscription in list(self._subscriptions.get(connection_id, [])):
+            if not subscription.active:
+                continue
+            try:
+                subscription.function()
+            except Exception as e:
+                log.msg('Error during state notificaton: %s' % str(e), system=LOG_SYSTEM)
+
+        if terminal:
+            for subscription in list(self._subscriptions.get(connection_id, [])):
+                self._expire(subscription)
+
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+
+    def _expire(self, subscription):
+        if not subscription.active:
+            return
+        self._remove(subscription)
+        metrics.increment(self.name + '.expired')
+        if subscription.expired is not None:
+            try:
+                subscription.expired()
+            except Exception as e:
+                log.msg('Error during subscription expiry: %s' % str(e), system=LOG_SYSTEM)
+
+
+    def _remove(self, subscription):
+
+        if subscription.timeout_call is not None:
+            if subscription.timeout_call.active():
+                subscription.timeout_call.cancel()
+            subscription.timeout_call = None
+
+        subscriptions = self._subscriptions.get(subscription.connection_id)
+        if subscriptions is None or not subscription in subscriptions:
+            return
+        subscriptions.remove(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.connection_id]
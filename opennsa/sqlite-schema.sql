@@ -0,0 +1,130 @@
+-- OpenNSA SQL Schema (SQLite)
+-- Same tables and columns as the PostgreSQL schema (datafiles/schema.sql), see sqlitedb.py for the types
+-- ALL timestamps must be in utc
+
+CREATE TABLE service_connections (
+    id                      integer                     PRIMARY KEY AUTOINCREMENT,
+    connection_id           text                        NOT NULL UNIQUE,
+    revision                integer                     NOT NULL,
+    global_reservation_id   text,
+    description             text,
+    requester_nsa           text                        NOT NULL,
+    requester_url           text,
+    reserve_time            timestamp                   NOT NULL,
+    reservation_state       text                        NOT NULL,
+    provision_state         text                        NOT NULL,
+    lifecycle_state         text                        NOT NULL,
+    source_network          text                        NOT NULL,
+    source_port             text                        NOT NULL,
+    source_label            label,
+    dest_network            text                        NOT NULL,
+    dest_port               text                        NOT NULL,
+    dest_label              label,
+    start_time              timestamp,                            -- null = immediate start
+    end_time                timestamp,                            -- null = forever
+    symmetrical             boolean                     NOT NULL,
+    directionality          text                        NOT NULL CHECK (directionality IN ('Bidirectional', 'Unidirectional')),
+    bandwidth               integer                     NOT NULL, -- mbps
+    parameter               text_array,
+    security_attributes     security_attributes,
+    connection_trace        text_array,
+    terminate_time          timestamp,
+    CHECK ( start_time < end_time)
+);
+
+CREATE INDEX service_connections_requester_idx ON service_connections (requester_nsa, connection_id);
+CREATE INDEX service_connections_global_id_idx ON service_connections (requester_nsa, global_reservation_id) WHERE global_reservation_id IS NOT NULL;
+
+CREATE TABLE sub_connections (
+    id                      integer                     PRIMARY KEY AUTOINCREMENT,
+    service_connection_id   integer                     NOT NULL REFERENCES service_connections(id),
+    connection_id           text                        NOT NULL,
+    provider_nsa            text                        NOT NULL,
+    revision                integer                     NOT NULL,
+    order_id                integer                     NOT NULL,
+    reservation_state       text                        NOT NULL,
+    provision_state         text                        NOT NULL,
+    lifecycle_state         text                        NOT NULL,
+    data_plane_active       boolean                     NOT NULL,
+    data_plane_version      integer,
+    data_plane_consistent   boolean,
+    source_network          text                        NOT NULL,
+    source_port             text                        NOT NULL,
+    source_label            label,
+    dest_network            text                        NOT NULL,
+    dest_port               text                        NOT NULL,
+    dest_label              label,
+    UNIQUE (provider_nsa, connection_id)
+);
+
+CREATE INDEX sub_connections_service_connection_idx ON sub_connections (service_connection_id, order_id);
+
+CREATE TABLE pending_reservations (
+    id                      integer                     PRIMARY KEY AUTOINCREMENT,
+    correlation_id          text                        NOT NULL UNIQUE,
+    service_connection_id   integer                     NOT NULL REFERENCES service_connections(id) ON DELETE CASCADE,
+    provider_nsa            text                        NOT NULL,
+    order_id                integer                     NOT NULL,
+    source_network          text                        NOT NULL,
+    source_port             text                        NOT NULL,
+    dest_network            text                        NOT NULL,
+    dest_port               text                        NOT NULL,
+    dispatch_time           timestamp                   NOT NULL
+);
+
+CREATE INDEX pending_reservations_service_connection_idx ON pending_reservations (service_connection_id);
+
+CREATE TABLE notifications (
+    id                      integer                     PRIMARY KEY AUTOINCREMENT,
+    source                  text                        NOT NULL,
+    connection_id           text                        NOT NULL,
+    notification_id         integer                     NOT NULL,
+    notification_type       text                        NOT NULL,
+    timestamp               timestamp                   NOT NULL,
+    data                    text                        NOT NULL  -- json
+);
+
+CREATE INDEX notifications_connection_idx ON notifications (source, connection_id, notification_id);
+CREATE INDEX notifications_timestamp_idx ON notifications (source, timestamp);
+
+CREATE TABLE generic_backend_connections (
+    id                      integer                     PRIMARY KEY AUTOINCREMENT,
+    connection_id           text                        NOT NULL UNIQUE,
+    revision                integer                     NOT NULL,
+    global_reservation_id   text,
+    description             text,
+    requester_nsa           text                        NOT NULL,
+    reserve_time            timestamp                   NOT NULL,
+    reservation_state       text                        NOT NULL,
+    provision_state         text                        NOT NULL,
+    lifecycle_state         text                        NOT NULL,
+    data_plane_active       boolean                     NOT NULL,
+    source_network          text                        NOT NULL,
+    source_port             text                        NOT NULL,
+    source_label            label,
+    dest_network            text                        NOT NULL,
+    dest_port               text                        NOT NULL,
+    dest_label              label,
+    start_time              timestamp,                            -- null = immediate start
+    end_time                timestamp,                            -- null = forever
+    symmetrical             boolean                     NOT NULL,
+    directionality          text                        NOT NULL CHECK (directionality IN ('Bidirectional', 'Unidirectional')),
+    bandwidth               integer                     NOT NULL, -- mbps
+    parameter               text_array,
+    allocated               boolean                     NOT NULL, -- indicated if the resources are actually allocated
+    terminate_time          timestamp,
+    CHECK ( start_time < end_time)
+);
+
+CREATE INDEX generic_backend_connections_requester_idx ON generic_backend_connections (requester_nsa, id);
+CREATE INDEX generic_backend_connections_active_idx ON generic_backend_connections (id) WHERE lifecycle_state <> 'Terminated';
+
+CREATE TABLE backend_connection_id (
+    id                      integer                     PRIMARY KEY NOT NULL DEFAULT(1) CHECK (id = 1),
+    connection_id           integer                     NOT NULL
+);
+
+-- connections are not archived in SQLite, but lookups of specific connections look in the archive tables, so they must exist
+CREATE TABLE service_connections_archive AS SELECT * FROM service_connections WHERE 0;
+CREATE TABLE sub_connections_archive AS SELECT * FROM sub_connections WHERE 0;
+CREATE TABLE generic_backend_connections_archive AS SELECT * FROM generic_backend_connections WHERE 0;
@@ -0,0 +1,173 @@
+"""
+SQLite storage, as a DB-API module for the Twisted adbapi connection pool.
+
+OpenNSA uses PostgreSQL for storage, through Twistar and SQL queries written
+for psycopg2. For small, single node, deployments (labs) and tests, running
+PostgreSQL is a lot of overhead, so the connection tables can be kept in SQLite
+instead, either in a file, or in memory (gone when OpenNSA stops).
+
+This module wraps the sqlite3 module, so it accepts the same queries and values
+as psycopg2, i.e., the format (%s) parameter style, tuples for IN lists, and
+the OpenNSA types which are stored as composite types or arrays in PostgreSQL
+(labels, security attributes, connection traces). These are stored as JSON in
+SQLite, and turned back into objects based on the declared column type. See
+sqlite-schema.sql for the schema, which is created when a database is opened
+for the first time.
+
+SQLite databases are not migrated, nor archived, and there is only a single
+connection to a database, which does one thing at a time.
+
+Copyright: NORDUnet (2026)
+"""
+
+import os
+import re
+import json
+import datetime
+
+import sqlite3
+from sqlite3 import Warning, Error, InterfaceError, DatabaseError, DataError, OperationalError, IntegrityError, \
+                    InternalError, ProgrammingError, NotSupportedError
+
+from twistar.dbconfig.base import InteractionBase
+
+from opennsa import nsa
+
+
+
+apilevel     = '2.0'
+threadsafety = 1
+paramstyle   = 'format'
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sqlite-schema.sql')
+
+MEMORY = ':memory:'
+
+_PARAMETER = re.compile(r'%%|%s')
+
+
+
+# writing: python values -> sqlite values
+
+def _plain(value):
+    # json representation of the opennsa types
+    if isinstance(value, nsa.Label):
+        return [ value.type_, value.labelValue() ]
+    elif isinstance(value, nsa.SecurityAttribute):
+        return [ value.type_, value.value ]
+    return value
+
+
+def adapt(value):
+    if isinstance(value, (nsa.Label, nsa.SecurityAttribute)):
+        return json.dumps(_plain(value))
+    elif type(value) is list:
+        return json.dumps( [ _plain(v) for v in value ] )
+    elif isinstance(value, datetime.datetime) and value.utcoffset() is not None:
+        # timestamp columns are utc without time zone
+        return (value - value.utcoffset()).replace(tzinfo=None)
+    return value
+
+
+def translate(query, args):
+    """
+    Turn a psycopg2 query and arguments into a sqlite3 query and arguments.
+    """
+    if args is None:
+        return query, ()
+
+    args = iter(args)
+    values = []
+
+    def parameter(match):
+        if match.group(0) == '%%':
+            return '%'
+        value = next(args)
+        if type(value) is tuple: # IN list
+            values.extend( adapt(v) for v in value )
+            return '(' + ', '.join( [ '?' ] * len(value) ) + ')'
+        values.append(adapt(value))
+        return '?'
+
+    return _PARAMETER.sub(parameter, query), values
+
+
+# reading: declared column type -> python values
+
+def _str(value):
+    # json gives unicode, opennsa uses str
+    return value.encode('utf-8') if type(value) is unicode else value
+
+
+sqlite3.register_converter('boolean',               lambda v : bool(int(v)))
+sqlite3.register_converter('label',                 lambda v : nsa.Label( *[ _str(e) for e in json.loads(v) ] ))
+sqlite3.register_converter('security_attributes',   lambda v : [ nsa.SecurityAttribute(_str(t), _str(a)) for t, a in json.loads(v) ])
+sqlite3.register_converter('text_array',            lambda v : [ _str(e) for e in json.loads(v) ])
+# timestamp is converted by sqlite3
+
+
+
+class Cursor:
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+
+    def execute(self, query, args=None):
+        self._cursor.execute(*translate(query, args))
+        return self
+
+
+    def executemany(self, query, args_list):
+        for args in args_list:
+            self.execute(query, args)
+        return self
+
+
+    def __getattr__(self, name):
+        # fetch*, description, rowcount, lastrowid, close
+        return getattr(self._cursor, name)
+
+
+
+class Connection:
+
+    def __init__(self, connection):
+        self._connection = connection
+
+
+    def cursor(self):
+        return Cursor(self._connection.cursor())
+
+
+    def __getattr__(self, name):
+        # commit, rollback, close
+        return getattr(self._connection, name)
+
+
+
+def connect(database=MEMORY, schema=SCHEMA_FILE):
+    """
+    Open a database, creating the schema if it does not have one.
+    """
+    # the adbapi pool can connect in a different thread than the one using the connection
+    conn = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    conn.text_factory = str
+    conn.execute('PRAGMA foreign_keys = ON')
+
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'service_connections'").fetchall():
+        with open(schema) as f:
+            conn.executescript(f.read())
+
+    return Connection(conn)
+
+
+
+class SQLiteDBConfig(InteractionBase):
+    """
+    Twistar configuration for this module. Twistar picks its configuration
+    by the name of the DB-API module, and does not know this one, so it must
+    be set as Registry.IMPL.
+    """
+    includeBlankInInsert = False # use the column defaults
+
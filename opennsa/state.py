@@ -5,9 +5,12 @@ Author: Henrik Thostrup Jensen <htj@nordu.net>
 Copyright: NORDUnet (2011)
 """
 
-from twisted.python import log
+import datetime
 
-from opennsa import error
+from twistar.registry import Registry
+
+from opennsa import error, changefeed
+from opennsa.shared import querycache, subscriptions
 
 
 LOG_SYSTEM = 'opennsa.state'
@@ -67,129 +70,191 @@ LIFECYCLE_TRANSITIONS = {
     TERMINATED      : []
 }
 
-SUBSCRIPTIONS = {}
+SUBSCRIPTIONS = subscriptions.SubscriptionRegistry('state.subscriptions')
 
-def subscribe(connection_id, f):
-    global SUBSCRIPTIONS
-    SUBSCRIPTIONS.setdefault(connection_id, []).append(f)
+def subscribe(connection_id, f, timeout=None, expired=None):
+    """
+    Subscribe to state changes of a connection. The subscription is removed
+    when the connection is terminated, or after timeout seconds (if given).
+    Returns a subscription, which can be cancelled.
+    """
+    return SUBSCRIPTIONS.subscribe(connection_id, f, timeout, expired)
 
 def desubscribe(connection_id, f):
-    SUBSCRIPTIONS[connection_id].remove(f)
+    SUBSCRIPTIONS.unsubscribe(connection_id, f)
 
 
-def saveNotify(conn):
+def _changed(event):
+    # change events, from this process or others (see changefeed)
+    connection_id = event['connection_id']
+    if connection_id is None:
+        querycache.invalidate() # missed events, anything can have changed
+        return
 
-    def notify(conn):
-        try:
-            for f in SUBSCRIPTIONS[conn.connection_id]:
-                try:
-                    f()
-                except Exception as e:
-                    log.msg('Error during state notificaton: %s' % str(e), system=LOG_SYSTEM)
-        except KeyError as e:
-            #print 'Nothing to notify about %s (%s)' % (conn.connection_id, str(e))
-            pass
+    # cached query results for the requester are stale now
+    querycache.invalidate(event.get('requester_nsa'))
+    SUBSCRIPTIONS.notify(connection_id, terminal=event.get('lifecycle_state') == TERMINATED)
+
+changefeed.addListener(_changed)
+
+
+def saveNotify(conn, values=None, expected=None):
+    """
+    Save a connection and notify the subscribers of it (through the change
+    feed, so subscribers in other processes are notified as well).
 
+    If values (column -> value) is given, only those columns are written,
+    instead of the entire row. If expected (column -> value) is given as well,
+    the row is only updated if it still has those values, otherwise the
+    deferred fails with InvalidTransitionError.
+    """
+
+    def notify(conn):
+        changed = values if values is not None else dict( (c, getattr(conn, c, None)) for c in changefeed.EVENT_COLUMNS )
+        changefeed.publish( changefeed.changeEvent(conn.connection_id, getattr(conn, 'requester_nsa', None), changed) )
         return conn
 
-    d = conn.save()
+    if values is None:
+        d = conn.save()
+    else:
+        d = saveColumns(conn, values, expected)
     d.addCallback(notify)
     return d
 
 
+def saveColumns(conn, values, expected=None):
+    """
+    Set and write some columns of a connection (the others are left as they
+    are in the database). Connections which have not been saved yet are saved
+    in full. Returns a deferred firing with the connection. If the update
+    fails, all the columns get their old values back.
+    """
+    old_values = dict( (c, getattr(conn, c, None)) for c in values )
+    for column, value in values.items():
+        setattr(conn, column, value)
+
+    if getattr(conn, 'id', None) is None:
+        return conn.save()
+
+    expected = expected or {}
+    columns = sorted(values)
+    guards  = sorted(expected)
+
+    sql = 'UPDATE %s SET %s WHERE id = %%s' % (conn.tablename(), ', '.join( [ '%s = %%s' % c for c in columns ] ))
+    sql += ''.join( [ ' AND %s = %%s' % c for c in guards ] ) + ' RETURNING id'
+    args = [ values[c] for c in columns ] + [ conn.id ] + [ expected[c] for c in guards ]
+
+    def updated(rows):
+        if not rows:
+            raise error.InvalidTransitionError('Connection %s was changed concurrently (expected %s)' % \
+                    (conn.connection_id, ', '.join( [ '%s %s' % (c, expected[c]) for c in guards ] )), connection_id=conn.connection_id)
+        return conn
+
+    def updateFailed(err):
+        # the row was not written, so the object must not have the new values (they could be written by a later save)
+        for column, value in old_values.items():
+            setattr(conn, column, value)
+        return err
+
+    # a query rather than an interaction, so it can be done without a thread with the async driver
+    d = Registry.DBPOOL.runQuery(sql, args)
+    d.addCallback(updated)
+    d.addErrback(updateFailed)
+    return d
+
+
 def _switchState(transition_schema, old_state, new_state):
     if new_state in transition_schema[old_state]:
         return
     else:
         raise error.InternalServerError('Transition from state %s to %s not allowed' % (old_state, new_state))
 
-# Reservation
 
+# state -> (transition schema, column) of the state machines
+_MACHINES = {}
+for _schema, _column in ( (RESERVE_TRANSITIONS, 'reservation_state'), (PROVISION_TRANSITIONS, 'provision_state'), (LIFECYCLE_TRANSITIONS, 'lifecycle_state') ):
+    for _state in _schema:
+        _MACHINES[_state] = (_schema, _column)
+
+
+def multiSwitch(conn, *states, **columns):
+    """
+    Switch a connection through one or more states (of any of the state
+    machines) in order, and save the result, along with any extra columns, in a
+    single update. Only the changed columns are written, and only if the state
+    columns still have the values they had before the switch.
+    """
+    values = {}
+    expected = {}
+    for s in states:
+        schema, column = _MACHINES[s]
+        old_state = values.get(column, getattr(conn, column))
+        _switchState(schema, old_state, s)
+        expected.setdefault(column, old_state)
+        values[column] = s
+    values.update(columns)
+
+    # if the row has been changed by someone else, saveColumns restores the old values
+    return saveNotify(conn, values, expected)
+
+
+# Reservation
 
 def reserveChecking(conn):
-    _switchState(RESERVE_TRANSITIONS, conn.reservation_state, RESERVE_CHECKING)
-    conn.reservation_state = RESERVE_CHECKING
-    return saveNotify(conn)
+    return multiSwitch(conn, RESERVE_CHECKING)
 
 def reserveHeld(conn):
-    _switchState(RESERVE_TRANSITIONS, conn.reservation_state, RESERVE_HELD)
-    conn.reservation_state = RESERVE_HELD
-    return saveNotify(conn)
+    return multiSwitch(conn, RESERVE_HELD)
 
 def reserveFailed(conn):
-    _switchState(RESERVE_TRANSITIONS, conn.reservation_state, RESERVE_FAILED)
-    conn.reservation_state = RESERVE_FAILED
-    return saveNotify(conn)
+    return multiSwitch(conn, RESERVE_FAILED)
 
 def reserveCommit(conn):
-    _switchState(RESERVE_TRANSITIONS, conn.reservation_state, RESERVE_COMMITTING)
-    conn.reservation_state = RESERVE_COMMITTING
-    return saveNotify(conn)
+    return multiSwitch(conn, RESERVE_COMMITTING)
 
 def reserveAbort(conn):
-    _switchState(RESERVE_TRANSITIONS, conn.reservation_state, RESERVE_ABORTING)
-    conn.reservation_state = RESERVE_ABORTING
-    return saveNotify(conn)
+    return multiSwitch(conn, RESERVE_ABORTING)
 
 def reserveTimeout(conn):
-    _switchState(RESERVE_TRANSITIONS, conn.reservation_state, RESERVE_TIMEOUT)
-    conn.reservation_state = RESERVE_TIMEOUT
-    return saveNotify(conn)
+    return multiSwitch(conn, RESERVE_TIMEOUT)
 
 def reserved(conn):
-    _switchState(RESERVE_TRANSITIONS, conn.reservation_state, RESERVE_START)
-    conn.reservation_state = RESERVE_START
-    return saveNotify(conn)
+    return multiSwitch(conn, RESERVE_START)
 
-def reserveMultiSwitch(conn, *states):
-    # switch through multiple states in one go, note this does not save the state (because it is often needed with allocation switch)
+def reserveMultiSwitch(conn, *states, **columns):
+    # switch through multiple reservation states in one go, extra columns (e.g., allocation) are saved along with the state
     for s in states:
-        _switchState(RESERVE_TRANSITIONS, conn.reservation_state, s)
-        conn.reservation_state = s
-    return saveNotify(conn)
+        if _MACHINES[s][0] is not RESERVE_TRANSITIONS:
+            raise error.InternalServerError('%s is not a reservation state' % s)
+    return multiSwitch(conn, *states, **columns)
 
 
 # Provision
 
 def provisioning(conn):
-    _switchState(PROVISION_TRANSITIONS, conn.provision_state, PROVISIONING)
-    conn.provision_state = PROVISIONING
-    return saveNotify(conn)
+    return multiSwitch(conn, PROVISIONING)
 
 def provisioned(conn):
-    _switchState(PROVISION_TRANSITIONS, conn.provision_state, PROVISIONED)
-    conn.provision_state = PROVISIONED
-    return saveNotify(conn)
+    return multiSwitch(conn, PROVISIONED)
 
 def releasing(conn):
-    _switchState(PROVISION_TRANSITIONS, conn.provision_state, RELEASING)
-    conn.provision_state = RELEASING
-    return saveNotify(conn)
+    return multiSwitch(conn, RELEASING)
 
 def released(conn):
-    _switchState(PROVISION_TRANSITIONS, conn.provision_state, RELEASED)
-    conn.provision_state = RELEASED
-    return saveNotify(conn)
+    return multiSwitch(conn, RELEASED)
 
 # Lifecyle
 
 def passedEndtime(conn):
-    _switchState(LIFECYCLE_TRANSITIONS, conn.lifecycle_state, PASSED_ENDTIME)
-    conn.lifecycle_state = PASSED_ENDTIME
-    return saveNotify(conn)
+    return multiSwitch(conn, PASSED_ENDTIME)
 
 def failed(conn):
-    _switchState(LIFECYCLE_TRANSITIONS, conn.lifecycle_state, FAILED)
-    conn.lifecycle_state = FAILED
-    return saveNotify(conn)
+    return multiSwitch(conn, FAILED)
 
 def terminating(conn):
-    _switchState(LIFECYCLE_TRANSITIONS, conn.lifecycle_state, TERMINATING)
-    conn.lifecycle_state = TERMINATING
-    return saveNotify(conn)
+    return multiSwitch(conn, TERMINATING)
 
 def terminated(conn):
-    _switchState(LIFECYCLE_TRANSITIONS, conn.lifecycle_state, TERMINATED)
-    conn.lifecycle_state = TERMINATED
-    return saveNotify(conn)
+    # the terminate time is used for archiving
+    return multiSwitch(conn, TERMINATED, terminate_time=datetime.datetime.utcnow())
 
@@ -7,9 +7,12 @@ Author: Henrik Thostrup Jensen <htj@nordu.net>
 Copyright: NORDUnet (2012)
 """
 
+import json
+
 from twisted.web import resource, server
 
 from opennsa import database
+from opennsa.shared import metrics
 
 
 HTML_HEADER = """<!DOCTYPE html>
@@ -89,3 +92,14 @@ class ConnectionListResource(resource.Resource):
         request.finish()
         return server.NOT_DONE_YET
 
+
+
+class MetricsResource(resource.Resource):
+
+    isLeaf = True
+
+    def render_GET(self, request):
+
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(metrics.snapshot(), indent=2, sort_keys=True) + '\n'
+
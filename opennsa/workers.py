@@ -0,0 +1,507 @@
+"""
+Running OpenNSA as multiple worker processes.
+
+A single OpenNSA process does everything in one reactor, on one core: SOAP
+parsing and generation, the aggregator, queries, and the backend. With the
+workers option, OpenNSA starts that many processes (the one started by twistd
+and workers - 1 more), which share the listening port (SO_REUSEPORT, so the
+kernel spreads the connections between them), and the PostgreSQL database.
+All of them serve NSI and REST requests.
+
+The device backend, with its scheduled calls (activation, end time, reserve
+timeouts), and the archiver must only run once. The workers elect a leader
+with a PostgreSQL advisory lock, which is held for as long as the database
+session of the leader lives. The leader runs these services. The other workers
+forward the backend operations which change connections (reserve, commit,
+provision, etc.) to the leader, through a local RPC connection (AMP over a unix
+socket). Queries read the database, and are done in the worker. Replies from
+the backend go back to the worker which did the request (by correlation id),
+as its aggregator is waiting for them. Notifications from the backend (data
+plane changes, errors, timeouts) are handled by the aggregator of the leader.
+Connection state changes reach the other workers through the change feed (see
+changefeed, requires dbnotify).
+
+If the leader dies, or loses its database connection, another worker takes the
+lock (within the election interval) and starts the backend. Requests forwarded
+while there is no leader fail.
+
+Replies from remote providers (peers) can arrive at any worker, and not the one
+waiting for them, so multiple workers can only be used without peers.
+
+The RPC arguments and results are pickled, the unix socket is only accessible
+to the user running OpenNSA.
+
+Copyright: NORDUnet (2026)
+"""
+
+import os
+import sys
+import zlib
+import socket
+import pickle
+
+from twisted.python import log
+from twisted.internet import reactor, defer, task, protocol
+from twisted.protocols import amp
+from twisted.application import service
+
+from opennsa import error, asyncdb
+
+
+
+LOG_SYSTEM = 'Workers'
+
+ELECTION_INTERVAL   = 5     # seconds between leader checks
+KEEPALIVE_IDLE      = 5     # seconds, tcp keepalives of the election connection, so a dead peer is noticed
+KEEPALIVE_INTERVAL  = 2
+KEEPALIVE_COUNT     = 3
+RESTART_DELAY       = 5     # seconds before restarting a worker which stopped
+RECONNECT_MAX_DELAY = 10    # seconds, max delay between attempts to connect to the leader
+
+# backend operations which change connections, and are done by the leader
+FORWARDED_OPERATIONS = ('reserve', 'reserveCommit', 'reserveAbort', 'provision', 'release', 'terminate')
+
+# python -c, to start the other workers
+WORKER_CODE = 'from opennsa import workers; workers.runWorker(%r, %i, debug=%r, payload=%r)'
+
+
+
+def lockId(name):
+    # advisory lock key for an nsa, so several OpenNSA services can share a database
+    return zlib.crc32(name) & 0xffffffff
+
+
+
+# rpc
+
+class CallBackend(amp.Command):
+    # worker -> leader
+    arguments = [ ('method', amp.String()), ('arguments', amp.String()) ]
+    response  = [ ('result', amp.String()) ]
+
+
+class CallRequester(amp.Command):
+    # leader -> worker, replies from the backend
+    arguments = [ ('method', amp.String()), ('arguments', amp.String()) ]
+    response  = [ ('result', amp.String()) ]
+
+
+
+def _dumpArguments(args, kwargs):
+    return pickle.dumps( (args, kwargs), pickle.HIGHEST_PROTOCOL)
+
+
+def _dumpResult(status, value):
+    try:
+        return pickle.dumps( (status, value), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        if status == 'error':
+            return pickle.dumps( ('error', error.InternalServerError(str(value))), pickle.HIGHEST_PROTOCOL)
+        raise
+
+
+def _callLocal(f, arguments):
+    # call a local function with pickled arguments, and give an rpc response, with the result or exception
+    args, kwargs = pickle.loads(arguments)
+    d = defer.maybeDeferred(f, *args, **kwargs)
+    d.addCallbacks(lambda result : { 'result' : _dumpResult('ok', result) },
+                   lambda err    : { 'result' : _dumpResult('error', err.value) })
+    return d
+
+
+def _callRemote(proto, command, method, args, kwargs):
+
+    def gotResponse(response):
+        try:
+            status, value = pickle.loads(response['result'])
+        except Exception as e:
+            raise error.InternalServerError('Invalid result from %s: %s' % (method, str(e)))
+        if status == 'error':
+            raise value
+        return value
+
+    d = proto.callRemote(command, method=method, arguments=_dumpArguments(args, kwargs))
+    d.addCallback(gotResponse)
+    return d
+
+
+
+class LeaderProtocol(amp.AMP):
+    """
+    Leader side of the connection from a worker.
+    """
+    def __init__(self, backend, router):
+        amp.AMP.__init__(self)
+        self.backend = backend
+        self.router = router
+
+
+    @CallBackend.responder
+    def callBackend(self, method, arguments):
+        if method not in FORWARDED_OPERATIONS:
+            raise ValueError('Backend operation %s cannot be forwarded' % method)
+
+        header = pickle.loads(arguments)[0][0]
+        self.router.addRoute(header.correlation_id, self)
+
+        def failed(response):
+            # no reply will come
+            status, _ = pickle.loads(response['result'])
+            if status == 'error':
+                self.router.removeRoute(header.correlation_id)
+            return response
+
+        d = _callLocal(getattr(self.backend, method), arguments)
+        d.addCallback(failed)
+        return d
+
+
+    def connectionLost(self, reason):
+        self.router.removeProtocol(self)
+        amp.AMP.connectionLost(self, reason)
+
+
+
+class LeaderFactory(protocol.ServerFactory):
+
+    def __init__(self, backend, router):
+        self.backend = backend
+        self.router = router
+
+    def buildProtocol(self, addr):
+        return LeaderProtocol(self.backend, self.router)
+
+
+
+class WorkerProtocol(amp.AMP):
+    """
+    Worker side of the connection to the leader.
+    """
+    def __init__(self, requester):
+        amp.AMP.__init__(self)
+        self.requester = requester
+
+
+    @CallRequester.responder
+    def callRequester(self, method, arguments):
+        return _callLocal(getattr(self.requester, method), arguments)
+
+
+
+class LeaderClientFactory(protocol.ReconnectingClientFactory):
+
+    maxDelay = RECONNECT_MAX_DELAY
+
+    def __init__(self, requester):
+        self.requester = requester
+        self.proto = None
+
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        self.proto = WorkerProtocol(self.requester)
+        return self.proto
+
+
+    def clientConnectionLost(self, connector, reason):
+        self.proto = None
+        protocol.ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
+
+
+    def call(self, method, args, kwargs):
+        if self.proto is None:
+            return defer.fail(error.InternalServerError('No connection to the backend leader, cannot %s' % method))
+        return _callRemote(self.proto, CallBackend, method, args, kwargs)
+
+
+
+class ReplyRouter:
+    """
+    Parent requester of the backend. Replies to requests forwarded from other
+    workers go back to them, everything else to the local requester.
+    """
+    def __init__(self, requester):
+        self.requester = requester
+        self.routes = {} # correlation id -> protocol of worker
+
+
+    def addRoute(self, correlation_id, proto):
+        self.routes[correlation_id] = proto
+
+
+    def removeRoute(self, correlation_id):
+        self.routes.pop(correlation_id, None)
+
+
+    def removeProtocol(self, proto):
+        for correlation_id, p in self.routes.items():
+            if p is proto:
+                del self.routes[correlation_id]
+
+
+    def __getattr__(self, name):
+        local = getattr(self.requester, name)
+
+        def route(header, *args, **kwargs):
+            proto = self.routes.pop(header.correlation_id, None)
+            if proto is None:
+                return local(header, *args, **kwargs)
+            return _callRemote(proto, CallRequester, name, (header,) + args, kwargs)
+
+        return route
+
+
+
+class BackendDispatcher:
+    """
+    Provider for the local backend in a worker. Operations which change
+    connections are done by the backend in this process if it is the leader,
+    and forwarded to the leader otherwise. Everything else (queries) is done by
+    the backend in this process, which is not running unless it is the leader.
+    """
+    def __init__(self, backend, election, client):
+        self.backend = backend
+        self.election = election
+        self.client = client
+
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if name not in FORWARDED_OPERATIONS:
+            return attr
+
+        def dispatch(*args, **kwargs):
+            if self.election.leader:
+                return attr(*args, **kwargs)
+            return self.client.call(name, args, kwargs)
+
+        return dispatch
+
+
+
+# leader election
+
+class LeaderElection(service.MultiService):
+    """
+    Runs its sub services only while this process holds the leader lock.
+    Sub services must be added before the election is started.
+
+    A check which does not complete within the timeout (default: the
+    interval) counts as a lost connection, so a leader on a half-open
+    connection steps down, instead of waiting on it forever.
+    """
+    def __init__(self, lock_id, database, user, password=None, host=None, interval=ELECTION_INTERVAL, timeout=None):
+        service.MultiService.__init__(self)
+        self.lock_id = lock_id
+        self.connect_kwargs = dict(database=database, user=user, password=password, host=host,
+                                   keepalives=1, keepalives_idle=KEEPALIVE_IDLE, keepalives_interval=KEEPALIVE_INTERVAL, keepalives_count=KEEPALIVE_COUNT)
+        self.interval = interval
+        self.timeout = timeout or interval
+        self.leader = False
+        self.connection = None
+        self.promotion_hooks = []
+        self.call = task.LoopingCall(self.check)
+        self.clock = reactor
+
+
+    def addPromotionHook(self, f):
+        """
+        Add a function to call when becoming leader, before the services are
+        started. It can return a deferred.
+        """
+        self.promotion_hooks.append(f)
+
+
+    def privilegedStartService(self):
+        # sub services are started when becoming leader
+        service.Service.privilegedStartService(self)
+
+
+    def startService(self):
+        service.Service.startService(self)
+        self.call.start(self.interval)
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.call.running:
+            self.call.stop()
+        d = self._demote() if self.leader else defer.succeed(None)
+        d.addCallback(lambda _ : self._disconnect()) # releases the lock
+        return d
+
+
+    @defer.inlineCallbacks
+    def check(self):
+        try:
+            if self.connection is None or self.connection.closed():
+                self.connection = asyncdb.AsyncConnection()
+                yield self._withTimeout( self.connection.connect(**self.connect_kwargs) )
+
+            if self.leader:
+                yield self._withTimeout( self.connection.execute('SELECT 1') ) # the lock is held as long as the session is alive
+            else:
+                rows = yield self._withTimeout( self.connection.execute('SELECT pg_try_advisory_lock(%s)', (self.lock_id,)) )
+                if rows[0][0] and self.running:
+                    yield self._promote()
+
+        except Exception as e:
+            reason = 'No reply within %i seconds' % self.timeout if isinstance(e, defer.CancelledError) else str(e)
+            log.msg('Error checking leadership: %s' % reason, system=LOG_SYSTEM)
+            self._disconnect()
+            if self.leader:
+                log.msg('Lost database connection, someone else can become leader', system=LOG_SYSTEM)
+                yield self._demote()
+
+
+    def _withTimeout(self, d):
+        # the deferred is cancelled (failing it) if the database does not answer, the connection is then closed
+        call = self.clock.callLater(self.timeout, d.cancel)
+        def done(result):
+            if call.active():
+                call.cancel()
+            return result
+        return d.addBoth(done)
+
+
+    @defer.inlineCallbacks
+    def _promote(self):
+        log.msg('Became leader (pid %i), starting %i services' % (os.getpid(), len(self.services)), system=LOG_SYSTEM)
+        self.leader = True
+        # e.g., reload state the previous leader has continued, before the services use it
+        for f in self.promotion_hooks:
+            try:
+                yield f()
+            except Exception as e:
+                log.msg('Error in promotion hook: %s' % str(e), system=LOG_SYSTEM)
+        if not self.leader:
+            return # stopped meanwhile
+        for svc in self:
+            svc.privilegedStartService()
+            svc.startService()
+
+
+    def _demote(self):
+        log.msg('Stepping down as leader, stopping services', system=LOG_SYSTEM)
+        self.leader = False
+        ds = [ defer.maybeDeferred(svc.stopService) for svc in reversed(list(self)) ]
+        return defer.DeferredList(ds)
+
+
+    def _disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+
+# processes and sockets
+
+class SharedPort(service.Service):
+    """
+    Listens on a TCP port which other processes listen on as well.
+    """
+    def __init__(self, port, factory, ctx_factory=None):
+        self.port_number = port
+        self.factory = factory
+        self.ctx_factory = ctx_factory
+        self.port = None
+
+
+    def startService(self):
+        factory = self.factory
+        if self.ctx_factory is not None:
+            from twisted.protocols import tls
+            factory = tls.TLSMemoryBIOFactory(self.ctx_factory, False, factory)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_REUSEPORT', 15), 1) # not in the socket module of python 2, 15 on linux
+        sock.bind( ('', self.port_number) )
+        sock.listen(50)
+        sock.setblocking(False)
+        try:
+            self.port = reactor.adoptStreamPort(sock.fileno(), socket.AF_INET, factory)
+        finally:
+            sock.close() # the port has its own copy
+        service.Service.startService(self)
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.port is not None:
+            d, self.port = self.port.stopListening(), None
+            return d
+
+
+
+class _WorkerProcessProtocol(protocol.ProcessProtocol):
+
+    def __init__(self, processes, worker_id):
+        self.processes = processes
+        self.worker_id = worker_id
+
+    def processEnded(self, reason):
+        self.processes.workerEnded(self.worker_id, reason)
+
+
+
+class WorkerProcesses(service.Service):
+    """
+    Starts the other worker processes, and restarts them if they stop.
+    """
+    def __init__(self, config_file, workers, debug=False, payload=False):
+        self.config_file = config_file
+        self.worker_ids = range(1, workers)
+        self.debug = debug
+        self.payload = payload
+        self.processes = {} # worker id -> process transport
+
+
+    def startService(self):
+        service.Service.startService(self)
+        for worker_id in self.worker_ids:
+            self.spawnWorker(worker_id)
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        for process in self.processes.values():
+            try:
+                process.signalProcess('TERM')
+            except Exception:
+                pass # already gone
+
+
+    def spawnWorker(self, worker_id):
+        if not self.running:
+            return
+        code = WORKER_CODE % (os.path.abspath(self.config_file), worker_id, self.debug, self.payload)
+        self.processes[worker_id] = reactor.spawnProcess(_WorkerProcessProtocol(self, worker_id), sys.executable, [ sys.executable, '-c', code ],
+                                                         env=os.environ, childFDs={ 0 : 'w', 1 : 1, 2 : 2 })
+        log.msg('Started worker %i (pid %i)' % (worker_id, self.processes[worker_id].pid), system=LOG_SYSTEM)
+
+
+    def workerEnded(self, worker_id, reason):
+        self.processes.pop(worker_id, None)
+        if self.running:
+            log.msg('Worker %i stopped (%s), restarting in %i seconds' % (worker_id, reason.getErrorMessage(), RESTART_DELAY), system=LOG_SYSTEM)
+            reactor.callLater(RESTART_DELAY, self.spawnWorker, worker_id)
+
+
+
+def runWorker(config_file, worker_id, debug=False, payload=False):
+    """
+    Run a worker process (started by WorkerProcesses).
+    """
+    from opennsa import setup
+
+    application = setup.createApplication(config_file, debug=debug, payload=payload, worker_id=worker_id)
+    log.startLoggingWithObserver(application.getComponent(log.ILogObserver), setStdout=False)
+
+    svc = service.IService(application)
+    svc.privilegedStartService()
+    reactor.callWhenRunning(svc.startService)
+    reactor.addSystemEventTrigger('before', 'shutdown', svc.stopService)
+    reactor.run()
+
@@ -69,10 +69,13 @@ setup(name='opennsa',
                 'opennsa/protocols/shared',
                 'opennsa/ext',
                 'opennsa/ext/iso8601',
+                'opennsa/migrations',
                 'opennsa/shared',
                 'opennsa/topology',
                ],
 
+      package_data={'opennsa': ['sqlite-schema.sql'], 'opennsa/migrations': ['*.sql']},
+
       cmdclass = cmdclasses,
 
       data_files=[
@@ -19,8 +19,8 @@ class DUDRequester:
     def reserveConfirmed(self, *args):
         self.reserve_defer.callback(args)
 
-    def reserveFailed(self, *args):
-        self.reserve_defer.errback(args)
+    def reserveFailed(self, header, connection_id, connection_states, err):
+        self.reserve_defer.errback(err)
 
     def reserveCommitConfirmed(self, *args):
         self.reserve_commit_defer.callback(args)
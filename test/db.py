@@ -1,20 +1,35 @@
 # Common database stuff for test
+#
+# Tests use the PostgreSQL test database (see util/pg-test-run) if there is a
+# config file for it, otherwise an in-memory SQLite database. Set
+# OPENNSA_TEST_STORAGE to postgresql or memory to choose.
 
-
+import os
 import json
 
 from opennsa import database
 
 
-# Trial switches the work directory to <project>/_trial_temp, so we go up a notch
-CONFIG_FILE="../.opennsa-test.json"
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.opennsa-test.json')
 
+STORAGE = os.environ.get('OPENNSA_TEST_STORAGE') or (database.POSTGRESQL if os.path.exists(CONFIG_FILE) else database.MEMORY)
 
+# for tests of things which only exist with postgresql
+REQUIRES_POSTGRESQL = None if STORAGE == database.POSTGRESQL else 'Requires PostgreSQL test database (util/pg-test-run)'
 
-def setupDatabase(config_file=CONFIG_FILE):
 
-    tc = json.load( open(config_file) )
 
-    database.setupDatabase( tc['database'], tc['user'], tc['password'], host='127.0.0.1')
+def setupDatabase(config_file=CONFIG_FILE, driver=database.THREADS, async_connections=None):
+
+    if STORAGE == database.MEMORY:
+        database.setupSQLiteDatabase()
+        return
 
+    database.setupDatabase(driver=driver, async_connections=async_connections, migrate=True, **connectionArguments(config_file))
+
+
+def connectionArguments(config_file=CONFIG_FILE):
+    # for things which connect to the postgresql test database themselves
+    tc = json.load( open(config_file) )
+    return dict(database=tc['database'], user=tc['user'], password=tc['password'], host='127.0.0.1')
 
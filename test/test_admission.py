@@ -0,0 +1,171 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from opennsa import nsa, error, admission
+from opennsa.shared import metrics, requestinfo
+
+
+
+class SlowProvider:
+    # provider where requests are completed by the test
+
+    def __init__(self):
+        self.calls = []
+        self.connection_id = 0
+
+    def _call(self, name, header):
+        d = defer.Deferred()
+        self.calls.append( (name, header.requester_nsa, d) )
+        return d
+
+    def reserve(self, header, connection_id, global_reservation_id, description, criteria, request_info=None):
+        return self._call('reserve', header)
+
+    def querySummary(self, header, connection_ids=None, global_reservation_ids=None, request_info=None):
+        return self._call('querySummary', header)
+
+    def getConnection(self, connection_id):
+        return 'conn-' + connection_id
+
+    def complete(self, index=0):
+        name, requester, d = self.calls.pop(index)
+        if name == 'reserve':
+            self.connection_id += 1
+            d.callback('conn-%i' % self.connection_id)
+        else:
+            d.callback(None)
+        return requester
+
+
+
+class DummyRequester:
+
+    def __init__(self):
+        self.confirmed = []
+
+    def reserveConfirmed(self, header, connection_id, global_reservation_id, description, criteria):
+        self.confirmed.append(connection_id)
+
+    def provisionConfirmed(self, header, connection_id):
+        return connection_id
+
+
+
+class AdmissionControlTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.provider = SlowProvider()
+        self.clock = task.Clock()
+
+
+    def createAdmissionControl(self, **kwargs):
+        limits = dict(rate=0, burst=1, max_inflight_reservations=0, max_concurrent_requests=0, max_queued_requests=0)
+        limits.update(kwargs)
+        ac = admission.AdmissionControl(self.provider, **limits)
+        ac.clock = self.clock
+        return ac
+
+
+    def header(self, requester):
+        return nsa.NSIHeader(requester, 'urn:ogf:network:aruba.net:nsa')
+
+
+    def testRateLimit(self):
+
+        ac = self.createAdmissionControl(rate=2, burst=3)
+        h = self.header('a')
+
+        for _ in range(3):
+            ac.querySummary(h)
+        self.failureResultOf(ac.querySummary(h), error.RequestThrottledError)
+
+        # other requesters have their own bucket
+        ac.querySummary(self.header('b'))
+        self.assertEquals(len(self.provider.calls), 4)
+
+        self.clock.advance(0.5) # one token
+        ac.querySummary(h)
+        self.failureResultOf(ac.querySummary(h), error.RequestThrottledError)
+
+        self.assertEquals(metrics.snapshot()['admission.throttled.rate'], 2)
+
+
+    def testHostDNIdentifiesRequester(self):
+
+        ac = self.createAdmissionControl(rate=1, burst=1)
+        ri = requestinfo.RequestInfo(cert_host_dn='/CN=host.example.org')
+
+        ac.querySummary(self.header('a'), request_info=ri)
+        # same host, claiming to be another nsa
+        self.failureResultOf(ac.querySummary(self.header('b'), request_info=ri), error.RequestThrottledError)
+
+
+    def testFairQueue(self):
+
+        ac = self.createAdmissionControl(max_concurrent_requests=2, max_queued_requests=3)
+
+        ds = [ ac.querySummary(self.header('a')) for _ in range(5) ]
+        ds.append( ac.querySummary(self.header('b')) )
+        self.assertEquals(len(self.provider.calls), 2)
+
+        # third queued request is rejected
+        self.failureResultOf(ac.querySummary(self.header('a')), error.RequestThrottledError)
+
+        # b is served before the remaining requests from a
+        for _ in range(2):
+            self.provider.complete()
+        self.assertEquals( [ c[1] for c in self.provider.calls ], [ 'a', 'b' ])
+
+        while self.provider.calls:
+            self.provider.complete()
+        for d in ds:
+            self.successResultOf(d)
+
+        self.assertEquals(ac.active, 0)
+        self.assertEquals(len(ac.queues), 0)
+        snapshot = metrics.snapshot()
+        self.assertEquals(snapshot['admission.admitted'], 6)
+        self.assertEquals(snapshot['admission.queued'], 4)
+        self.assertEquals(snapshot['admission.throttled.queue'], 1)
+
+
+    def testInflightReservations(self):
+
+        ac = self.createAdmissionControl(max_inflight_reservations=2)
+        requester = DummyRequester()
+        parent_requester = ac.requesterFilter(requester)
+        h = self.header('a')
+
+        d1 = ac.reserve(h, None, None, None, None)
+        d2 = ac.reserve(h, None, None, None, None)
+        self.failureResultOf(ac.reserve(h, None, None, None, None), error.RequestThrottledError)
+
+        self.provider.complete()
+        connection_id = self.successResultOf(d1)
+        # acked, but not confirmed yet, so still in flight
+        self.failureResultOf(ac.reserve(h, None, None, None, None), error.RequestThrottledError)
+
+        parent_requester.reserveConfirmed(h, connection_id, None, None, None)
+        self.assertEquals(requester.confirmed, [ connection_id ])
+        ac.reserve(h, None, None, None, None)
+
+        # failed reserve requests are not in flight
+        self.provider.calls.pop(0)[2].errback(error.ConnectionCreateError('nope'))
+        self.failureResultOf(d2, error.ConnectionCreateError)
+        self.assertEquals(ac.inflight['a'], 1)
+
+        # reservations without outcome are eventually forgotten
+        self.provider.complete()
+        self.clock.advance(admission.INFLIGHT_TIMEOUT)
+        self.assertEquals(ac.inflight, {})
+
+        self.assertEquals(metrics.snapshot()['admission.throttled.inflight'], 2)
+
+
+    def testPassThrough(self):
+
+        ac = self.createAdmissionControl()
+        self.assertEquals(ac.getConnection('1'), 'conn-1')
+        self.assertEquals(ac.requesterFilter(DummyRequester()).provisionConfirmed(None, 'c'), 'c')
+
@@ -0,0 +1,287 @@
+import datetime
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from opennsa import nsa, error, aggregator, notificationlog, state, constants as cnt
+from opennsa.protocols.shared import minisoap, httpclient
+from opennsa.protocols.nsi2 import provider, providerclient
+from opennsa.protocols.nsi2.bindings import actions, nsiconnection
+
+
+
+REQUESTER = 'urn:ogf:network:aruba.net:nsa:requester'
+PROVIDER  = 'urn:ogf:network:aruba.net:nsa'
+CHILD_A   = 'urn:ogf:network:bonaire.net:nsa'
+CHILD_B   = 'urn:ogf:network:curacao.net:nsa'
+
+
+
+class Row:
+    # stand-in for orm objects
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def createConnection(key, connection_id):
+    end_time = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    return Row(id=key, connection_id=connection_id, revision=0, global_reservation_id=None, description=None, requester_nsa=REQUESTER, requester_url=None,
+               reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=state.CREATED,
+               source_network='aruba.net:topology', source_port='ps', source_label=None,
+               dest_network='curacao.net:topology', dest_port='ps', dest_label=None,
+               start_time=None, end_time=end_time, bandwidth=100)
+
+
+def createSubConnection(service_key, provider_nsa, connection_id):
+    return Row(service_connection_id=service_key, provider_nsa=provider_nsa, connection_id=connection_id,
+               reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=state.CREATED,
+               data_plane_active=False, data_plane_version=0, data_plane_consistent=True)
+
+
+def createChildResult(connection_id, provider_nsa):
+    return nsa.ConnectionInfo(connection_id, None, None, cnt.EVTS_AGOLE, [], provider_nsa, PROVIDER,
+                              (state.RESERVE_START, state.RELEASED, state.CREATED, (False, 0, True)), 0, 0)
+
+
+
+class ChildProvider:
+
+    def __init__(self):
+        self.queries = [] # (header, connection_ids)
+
+    def queryRecursive(self, header, connection_ids, global_reservation_ids, request_info=None):
+        self.queries.append( (header, connection_ids) )
+        return defer.succeed(None)
+
+
+
+class ParentRequester:
+
+    def __init__(self):
+        self.results = []
+        self.notifications = [] # (type, connection_id, notification_id)
+
+    def queryRecursiveConfirmed(self, header, results):
+        self.results.append( (header, results) )
+
+    def queryNotificationConfirmed(self, header, notifications):
+        self.results.append( (header, notifications) )
+
+    def reserveTimeout(self, header, connection_id, notification_id, timestamp, timeout_value, org_connection_id, org_nsa):
+        self.notifications.append( (notificationlog.RESERVE_TIMEOUT, connection_id, notification_id) )
+
+    def dataPlaneStateChange(self, header, connection_id, notification_id, timestamp, data_plane_status):
+        self.notifications.append( (notificationlog.DATA_PLANE_STATE_CHANGE, connection_id, notification_id) )
+
+
+
+class QueryRecursiveTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = task.Clock()
+        self.parent = ParentRequester()
+        self.children = { CHILD_A: ChildProvider(), CHILD_B: ChildProvider() }
+
+        self.connections = { 'conn-1': createConnection(1, 'conn-1'), 'conn-2': createConnection(2, 'conn-2'), 'conn-3': createConnection(3, 'conn-3') }
+        self.sub_connections = {
+            1: [ createSubConnection(1, CHILD_A, 'a-1'), createSubConnection(1, CHILD_B, 'b-1') ],
+            2: [ createSubConnection(2, CHILD_A, 'a-2') ]
+            # conn-3 has no sub connections
+        }
+
+        self.aggregator = aggregator.Aggregator('aruba.net:topology', nsa.NetworkServiceAgent(PROVIDER, 'http://localhost/NSI'),
+                                                None, None, self.parent, None, [], None)
+        self.aggregator.clock = self.clock
+        self.aggregator.getConnection = lambda connection_id : defer.succeed(self.connections[connection_id])
+        self.aggregator.getSubConnectionsByConnectionKeys = lambda keys : defer.succeed( dict( (k, self.sub_connections[k]) for k in keys if k in self.sub_connections ) )
+        self.aggregator.getProvider = lambda provider_nsa : self.children[provider_nsa]
+
+        self.header = nsa.NSIHeader(REQUESTER, PROVIDER)
+
+
+    def _reply(self, provider_nsa, idx=0):
+        header, connection_ids = self.children[provider_nsa].queries[idx]
+        reply_header = nsa.NSIHeader(PROVIDER, provider_nsa, header.correlation_id)
+        return self.aggregator.queryRecursiveConfirmed(reply_header, [ createChildResult(connection_ids[0], provider_nsa) ])
+
+
+    @defer.inlineCallbacks
+    def testMultipleConnections(self):
+
+        yield self.aggregator.queryRecursive(self.header, [ 'conn-1', 'conn-2' ], None)
+
+        self.assertEquals(len(self.children[CHILD_A].queries), 2)
+        self.assertEquals(len(self.children[CHILD_B].queries), 1)
+
+        yield self._reply(CHILD_A, 0)
+        yield self._reply(CHILD_A, 0) # duplicate, ignored
+        yield self._reply(CHILD_A, 1)
+        self.assertEquals(self.parent.results, [])
+
+        yield self._reply(CHILD_B)
+
+        self.assertEquals(len(self.parent.results), 1)
+        header, results = self.parent.results[0]
+        self.assertEquals(header.correlation_id, self.header.correlation_id)
+        self.assertEquals([ ci.connection_id for ci in results ], [ 'conn-1', 'conn-2' ])
+        self.assertEquals([ c.connection_id for c in results[0].criterias[0].children ], [ 'a-1', 'b-1' ])
+        self.assertEquals([ c.connection_id for c in results[1].criterias[0].children ], [ 'a-2' ])
+
+        # all temporary state cleared, and timeout cancelled
+        self.assertEquals(self.aggregator.query_requests, {})
+        self.assertEquals(self.aggregator.query_calls, {})
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+        # late reply
+        yield self._reply(CHILD_B)
+        self.assertEquals(len(self.parent.results), 1)
+
+
+    @defer.inlineCallbacks
+    def testTimeout(self):
+
+        yield self.aggregator.queryRecursive(self.header, [ 'conn-1' ], None)
+        yield self._reply(CHILD_A)
+
+        self.clock.advance(aggregator.QUERY_RECURSIVE_TIMEOUT)
+
+        # partial result
+        self.assertEquals(len(self.parent.results), 1)
+        header, results = self.parent.results[0]
+        self.assertEquals([ c.connection_id for c in results[0].criterias[0].children ], [ 'a-1' ])
+        self.assertEquals(self.aggregator.query_requests, {})
+        self.assertEquals(self.aggregator.query_calls, {})
+
+        yield self._reply(CHILD_B)
+        self.assertEquals(len(self.parent.results), 1)
+
+
+    @defer.inlineCallbacks
+    def testNoSubConnections(self):
+
+        yield self.aggregator.queryRecursive(self.header, [ 'conn-3' ], None)
+
+        self.assertEquals(len(self.parent.results), 1)
+        header, results = self.parent.results[0]
+        self.assertEquals(results[0].connection_id, 'conn-3')
+        self.assertEquals(results[0].criterias[0].children, [])
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+
+class QueryNotificationTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.parent = ParentRequester()
+        self.connections = { 'conn-1': createConnection(1, 'conn-1'), 'conn-2': createConnection(2, 'conn-2') }
+
+        self.aggregator = aggregator.Aggregator('aruba.net:topology', nsa.NetworkServiceAgent(PROVIDER, 'http://localhost/NSI'),
+                                                None, None, self.parent, None, [], None)
+        self.aggregator.notification_log = notificationlog.NotificationLog('aggregator', persist=False)
+        self.aggregator.getConnection = lambda connection_id : defer.succeed(self.connections[connection_id])
+
+        self.header = nsa.NSIHeader(REQUESTER, PROVIDER)
+
+
+    @defer.inlineCallbacks
+    def testQueryNotification(self):
+
+        c1, c2 = self.connections['conn-1'], self.connections['conn-2']
+        self.aggregator.doDataPlaneStateChange(c1, (True, 0, True))
+        self.aggregator.doDataPlaneStateChange(c2, (True, 0, True))
+        self.aggregator.doTimeout(c1, 120, 'conn-1', PROVIDER)
+
+        self.assertEquals(self.parent.notifications, [ (notificationlog.DATA_PLANE_STATE_CHANGE, 'conn-1', 1),
+                                                       (notificationlog.DATA_PLANE_STATE_CHANGE, 'conn-2', 2),
+                                                       (notificationlog.RESERVE_TIMEOUT, 'conn-1', 3) ])
+
+        yield self.aggregator.queryNotification(self.header, 'conn-1', None, None)
+        header, notifications = self.parent.results.pop()
+        self.assertEquals( [ n.notification_id for n in notifications ], [ 1, 3 ])
+        self.assertEquals(notifications[0].data, ( (True, 0, True), ))
+        self.assertEquals(notifications[1].data, (120, 'conn-1', PROVIDER))
+
+        yield self.aggregator.queryNotification(self.header, 'conn-1', 2, None)
+        header, notifications = self.parent.results.pop()
+        self.assertEquals( [ n.notification_id for n in notifications ], [ 3 ])
+
+
+    def testQueryOtherRequester(self):
+
+        header = nsa.NSIHeader('urn:ogf:network:example.net:nsa', PROVIDER)
+        d = self.aggregator.queryNotification(header, 'conn-1', None, None)
+        self.failureResultOf(d, error.UnauthorizedError)
+
+
+    @defer.inlineCallbacks
+    def testQueryNotificationSOAP(self):
+
+        # through the nsi provider, as in the service
+        requests = []
+        self.patch(httpclient, 'soapRequest', lambda url, action, payload, ctx_factory=None : requests.append( (url, action, payload) ) or defer.succeed(None))
+        self.aggregator.parent_requester = provider.Provider(self.aggregator, providerclient.ProviderClient())
+
+        c1 = self.connections['conn-1']
+        self.aggregator.doDataPlaneStateChange(c1, (True, 0, True))
+        self.aggregator.doTimeout(c1, 120, 'conn-1', PROVIDER)
+        self.aggregator.doErrorEvent(c1, 'activateFailed', None)
+        del requests[:] # the notifications themselves, sent as they happen
+
+        header = nsa.NSIHeader(REQUESTER, PROVIDER, reply_to='http://localhost/NSI/requester')
+        yield self.aggregator.queryNotification(header, 'conn-1', 2, None)
+
+        url, action, payload = requests.pop()
+        self.assertEquals(url, 'http://localhost/NSI/requester')
+        self.assertEquals(action, actions.QUERY_NOTIFICATION_CONFIRMED)
+        _, body = minisoap.parseSoapPayload(payload)
+        self.assertEquals(body[0].tag, nsiconnection.queryNotificationConfirmed)
+        self.assertEquals( [ e.tag for e in body[0] ], [ 'reserveTimeout', 'errorEvent' ])
+        self.assertEquals(nsiconnection.ReserveTimeoutRequestType.build(body[0][0]).notificationId, 2)
+        self.assertEquals(nsiconnection.ErrorEventType.build(body[0][1]).event, 'activateFailed')
+
+        self.aggregator.parent_requester.queryNotificationFailed(header, error.ConnectionNonExistentError('No connection with id conn-3'))
+        url, action, payload = requests.pop()
+        self.assertEquals(action, actions.ERROR)
+        _, body = minisoap.parseSoapPayload(payload)
+        self.assertEquals(nsiconnection.GenericErrorType.build(body[0]).serviceException.errorId, error.ConnectionNonExistentError.errorId)
+
+
+
+class ConnectionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.aggregator = aggregator.Aggregator('aruba.net:topology', nsa.NetworkServiceAgent(PROVIDER, 'http://localhost/NSI'),
+                                                None, None, ParentRequester(), None, [], None)
+        self.conn = self.aggregator.db_connections.add('conn-1', createConnection(1, 'conn-1'))
+        self.sub_a = self.aggregator.db_sub_connections.add( (CHILD_A, 'a-1'), createSubConnection(1, CHILD_A, 'a-1') )
+        self.sub_b = self.aggregator.db_sub_connections.add( (CHILD_B, 'b-1'), createSubConnection(1, CHILD_B, 'b-1') )
+
+
+    def testChangedByOtherProcess(self):
+
+        self.aggregator.connectionChanged( { 'connection_id' : 'conn-1', 'requester_nsa' : REQUESTER } )
+        self.aggregator.connectionChanged( { 'connection_id' : 'a-1', 'requester_nsa' : None } )
+
+        self.assertNotIn('conn-1', self.aggregator.db_connections)
+        self.assertNotIn( (CHILD_A, 'a-1'), self.aggregator.db_sub_connections)
+        self.assertIn( (CHILD_B, 'b-1'), self.aggregator.db_sub_connections)
+
+
+    def testInTransition(self):
+
+        self.conn.reservation_state = state.RESERVE_CHECKING
+        self.aggregator.connectionChanged( { 'connection_id' : 'conn-1', 'requester_nsa' : REQUESTER } )
+        self.assertIdentical(self.aggregator.db_connections.get('conn-1'), self.conn)
+
+        self.conn.reservation_state = state.RESERVE_START
+        self.assertEquals(self.aggregator.db_connections.get('conn-1'), None)
+
+
+    def testMissedEvents(self):
+
+        self.aggregator.connectionChanged( { 'connection_id' : None, 'requester_nsa' : None } )
+        self.assertEquals(len(self.aggregator.db_connections), 0)
+        self.assertEquals(len(self.aggregator.db_sub_connections), 0)
@@ -0,0 +1,129 @@
+import uuid
+import datetime
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from twistar.registry import Registry
+
+from opennsa import state, database, archive
+from opennsa.backends.common import genericbackend
+
+from . import db
+
+
+REQUESTER = 'urn:ogf:network:example.org:2017:nsa:archive-test'
+DAY = datetime.timedelta(days=1)
+
+
+
+def serviceConnection(lifecycle_state, terminate_time=None, global_reservation_id=None):
+    now = datetime.datetime.utcnow()
+    return database.ServiceConnection(connection_id=str(uuid.uuid1()), revision=0, global_reservation_id=global_reservation_id, requester_nsa=REQUESTER,
+                                      reserve_time=now - 100 * DAY, reservation_state=state.RESERVE_START, provision_state=state.RELEASED,
+                                      lifecycle_state=lifecycle_state, source_network='src-net', source_port='src-port', dest_network='dst-net', dest_port='dst-port',
+                                      symmetrical=False, directionality='Bidirectional', bandwidth=200, terminate_time=terminate_time)
+
+
+def subConnection(service_connection, order_id):
+    return database.SubConnection(service_connection_id=service_connection.id, connection_id=str(uuid.uuid1()), provider_nsa='urn:ogf:network:aruba.net:nsa',
+                                  revision=0, order_id=order_id, reservation_state=state.RESERVE_START, provision_state=state.RELEASED,
+                                  lifecycle_state=state.TERMINATED, data_plane_active=False,
+                                  source_network='src-net', source_port='src-port', dest_network='dst-net', dest_port='dst-port')
+
+
+def backendConnection(lifecycle_state, end_time):
+    return genericbackend.GenericBackendConnections(connection_id=str(uuid.uuid1()), revision=0, global_reservation_id=None, description='test',
+                    requester_nsa=REQUESTER, reserve_time=end_time - DAY,
+                    reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=lifecycle_state, data_plane_active=False,
+                    source_network='src-net', source_port='src-port', source_label=None, dest_network='dst-net', dest_port='dst-port', dest_label=None,
+                    start_time=None, end_time=end_time, symmetrical=False, directionality='Bidirectional', bandwidth=200, allocated=False)
+
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        db.setupDatabase()
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for table in ('sub_connections_archive', 'service_connections_archive', 'generic_backend_connections_archive', 'generic_backend_connections'):
+            column = 'service_connection_id IN (SELECT id FROM service_connections_archive WHERE requester_nsa = %s)' \
+                        if table == 'sub_connections_archive' else 'requester_nsa = %s'
+            yield Registry.DBPOOL.runOperation('DELETE FROM %s WHERE %s' % (table, column), (REQUESTER,))
+        yield Registry.DBPOOL.runOperation('DELETE FROM sub_connections WHERE service_connection_id IN (SELECT id FROM service_connections WHERE requester_nsa = %s)', (REQUESTER,))
+        yield Registry.DBPOOL.runOperation('DELETE FROM service_connections WHERE requester_nsa = %s', (REQUESTER,))
+        Registry.DBPOOL.close()
+
+
+    @defer.inlineCallbacks
+    def testArchiveServiceConnections(self):
+
+        now = datetime.datetime.utcnow()
+        old     = serviceConnection(state.TERMINATED, now - 40 * DAY, global_reservation_id='urn:uuid:archive-test')
+        recent  = serviceConnection(state.TERMINATED, now - DAY)
+        active  = serviceConnection(state.CREATED)
+        for conn in (old, recent, active):
+            yield conn.save()
+        for order_id in (0, 1):
+            yield subConnection(old, order_id).save()
+
+        archiver = archive.Archiver(tables=(archive.AGGREGATOR_TABLES,), archive_age=30 * DAY)
+        yield archiver.archive()
+
+        hot = yield database.ServiceConnection.findBy(requester_nsa=REQUESTER)
+        self.assertEquals(sorted( c.connection_id for c in hot ), sorted( [ recent.connection_id, active.connection_id ] ))
+        hot_subs = yield database.SubConnection.findBy(service_connection_id=old.id)
+        self.assertEquals(hot_subs, [])
+
+        # lookups of specific connections find the archived ones
+        conns = yield database.findByWithArchive(database.ServiceConnection, database.ServiceConnectionArchive, connection_id=old.connection_id)
+        self.assertEquals( [ c.id for c in conns ], [ old.id ])
+        conns = yield database.findInWithArchive(database.ServiceConnection, database.ServiceConnectionArchive, 'connection_id',
+                                                 [ old.connection_id, active.connection_id ], where=['requester_nsa = ?', REQUESTER])
+        self.assertEquals( [ c.id for c in conns ], [ active.id, old.id ])
+        conns = yield database.findInWithArchive(database.ServiceConnection, database.ServiceConnectionArchive, 'global_reservation_id',
+                                                 [ 'urn:uuid:archive-test' ], where=['requester_nsa = ?', REQUESTER])
+        self.assertEquals( [ c.id for c in conns ], [ old.id ])
+
+        sub_conns = yield database.findSubConnections( [ old.id, active.id ] )
+        self.assertEquals( [ sc.order_id for sc in sub_conns[old.id] ], [ 0, 1 ])
+
+    testArchiveServiceConnections.skip = db.REQUIRES_POSTGRESQL
+
+
+    @defer.inlineCallbacks
+    def testArchiveBackendConnectionsInBatches(self):
+
+        self.patch(archive, 'BATCH_SIZE', 2)
+
+        # no terminate time (terminated before it was recorded), so the end time is used
+        now = datetime.datetime.utcnow()
+        old = [ backendConnection(state.TERMINATED, now - 40 * DAY) for _ in range(5) ]
+        ended = backendConnection(state.PASSED_ENDTIME, now - 40 * DAY)
+        for conn in old + [ ended ]:
+            yield conn.save()
+
+        archiver = archive.Archiver(tables=(archive.BACKEND_TABLES,), archive_age=30 * DAY)
+        yield archiver.archive()
+
+        hot = yield genericbackend.GenericBackendConnections.findBy(requester_nsa=REQUESTER)
+        self.assertEquals( [ c.id for c in hot ], [ ended.id ])
+        archived = yield genericbackend.GenericBackendConnectionsArchive.findBy(requester_nsa=REQUESTER)
+        self.assertEquals(sorted( c.id for c in archived ), sorted( c.id for c in old ))
+
+    testArchiveBackendConnectionsInBatches.skip = db.REQUIRES_POSTGRESQL
+
+
+    @defer.inlineCallbacks
+    def testTerminateTime(self):
+
+        conn = serviceConnection(state.TERMINATING)
+        yield conn.save()
+        yield state.terminated(conn)
+
+        rows = yield Registry.DBPOOL.runQuery('SELECT terminate_time FROM service_connections WHERE id = %s', (conn.id,))
+        self.assertTrue( datetime.datetime.utcnow() - rows[0][0] < datetime.timedelta(minutes=1) )
+
@@ -0,0 +1,88 @@
+import uuid
+import datetime
+
+import psycopg2
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from twistar.registry import Registry
+
+from opennsa import nsa, state, database, constants as cnt
+from opennsa.backends.common import genericbackend
+
+from . import db
+
+
+
+class AsyncConnectionPoolTest(unittest.TestCase):
+
+    skip = db.REQUIRES_POSTGRESQL
+
+    def setUp(self):
+        db.setupDatabase(driver=database.ASYNC, async_connections=3)
+        self.pool = Registry.DBPOOL
+
+
+    def tearDown(self):
+        self.pool.close()
+
+
+    @defer.inlineCallbacks
+    def testConcurrentQueries(self):
+
+        results = yield defer.gatherResults( [ self.pool.runQuery('SELECT %s, pg_sleep(0.01)', (i,)) for i in range(20) ] )
+        self.assertEquals( [ r[0][0] for r in results ], range(20))
+        self.assertEquals(len(self.pool.async_connections), 3)
+        self.assertEquals(len(self.pool.async_idle), 3)
+
+        result = yield self.pool.runOperation('SELECT 1')
+        self.assertEquals(result, None)
+
+
+    @defer.inlineCallbacks
+    def testAdaptation(self):
+
+        label = nsa.Label(cnt.ETHERNET_VLAN, '1780-1782')
+        attribute = nsa.SecurityAttribute('user', 'alice')
+        rows = yield self.pool.runQuery('SELECT %s, %s', (label, attribute))
+
+        rl, ra = rows[0]
+        self.assertEquals( (rl.type_, rl.labelValue()), (label.type_, label.labelValue()) )
+        self.assertEquals( (ra.type_, ra.value), (attribute.type_, attribute.value) )
+
+
+    @defer.inlineCallbacks
+    def testQueryError(self):
+
+        try:
+            yield self.pool.runQuery('SELECT * FROM no_such_table')
+            self.fail('Should have raised ProgrammingError')
+        except psycopg2.ProgrammingError:
+            pass # expected
+
+        rows = yield self.pool.runQuery('SELECT 1')
+        self.assertEquals(rows, [ (1,) ])
+
+
+    @defer.inlineCallbacks
+    def testWithORM(self):
+
+        # twistar goes through the thread pool, state updates through the async connections
+        now = datetime.datetime.utcnow()
+        conn = genericbackend.GenericBackendConnections(connection_id=str(uuid.uuid1()), revision=0, global_reservation_id=None, description='test',
+                        requester_nsa='req-nsa', reserve_time=now,
+                        reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=state.CREATED, data_plane_active=False,
+                        source_network='src-net', source_port='src-port', source_label=nsa.Label(cnt.ETHERNET_VLAN, '1780'),
+                        dest_network='dst-net', dest_port='dst-port', dest_label=nsa.Label(cnt.ETHERNET_VLAN, '1781'),
+                        start_time=None, end_time=now + datetime.timedelta(hours=1),
+                        symmetrical=False, directionality='Bidirectional', bandwidth=200, allocated=False)
+        yield conn.save()
+        try:
+            yield state.reserveMultiSwitch(conn, state.RESERVE_CHECKING, state.RESERVE_HELD)
+
+            row = yield genericbackend.GenericBackendConnections.find(conn.id)
+            self.assertEquals(row.reservation_state, state.RESERVE_HELD)
+            self.assertEquals(row.source_label.labelValue(), '1780')
+        finally:
+            yield conn.delete()
@@ -0,0 +1,98 @@
+from twisted.trial import unittest
+
+from opennsa import nsa, constants as cnt
+from opennsa.protocols.shared import minisoap
+from opennsa.protocols.nsi2 import helper
+from opennsa.protocols.nsi2.bindings import nsiconnection, nsiframework, p2pservices
+
+
+REQUESTER = 'urn:ogf:network:aruba.net:nsa:requester'
+PROVIDER  = 'urn:ogf:network:aruba.net:nsa:provider'
+
+
+
+class BindingsTest(unittest.TestCase):
+
+
+    def _reservePayload(self, description):
+
+        header_element = helper.createProviderHeader(REQUESTER, PROVIDER, 'http://localhost/reply', 'urn:uuid:123',
+                                                     [ nsa.SecurityAttribute('user', 'alice') ], [ 'urn:trace:a', 'urn:trace:b' ])
+
+        service_def = p2pservices.P2PServiceBaseType(100, cnt.BIDIRECTIONAL, None, 'urn:ogf:network:aruba.net:topology:ps?vlan=1780',
+                                                     'urn:ogf:network:aruba.net:topology:bon?vlan=1780', None, [ p2pservices.TypeValueType('mtu', '9000') ])
+        schedule = nsiconnection.ScheduleType(None, '2017-05-04T12:00:00Z')
+        criteria = nsiconnection.ReservationRequestCriteriaType(2, schedule, cnt.EVTS_AGOLE, service_def)
+        reserve  = nsiconnection.ReserveType(None, 'urn:uuid:gid', description, criteria)
+
+        return minisoap.createSoapPayload(reserve.xml(nsiconnection.reserve), header_element)
+
+
+    def testReserveParsing(self):
+
+        header, reserve = helper.parseRequest( self._reservePayload('test') )
+
+        self.assertEquals(header.requester_nsa, REQUESTER)
+        self.assertEquals(header.provider_nsa, PROVIDER)
+        self.assertEquals(header.reply_to, 'http://localhost/reply')
+        self.assertEquals(header.connection_trace, [ 'urn:trace:a', 'urn:trace:b' ])
+        self.assertEquals( [ (sa.type_, sa.value) for sa in header.security_attributes ], [ ('user', 'alice') ])
+
+        self.assertEquals(reserve.connectionId, None)
+        self.assertEquals(reserve.globalReservationId, 'urn:uuid:gid')
+        self.assertEquals(reserve.description, 'test')
+        self.assertEquals(reserve.criteria.version, '2')
+        self.assertEquals(reserve.criteria.schedule.startTime, None)
+        self.assertEquals(reserve.criteria.schedule.endTime, '2017-05-04T12:00:00Z')
+
+        sd = reserve.criteria.serviceDefinition
+        self.assertEquals(sd.capacity, 100)
+        self.assertEquals(sd.symmetricPath, None)
+        self.assertEquals(sd.ero, None)
+        self.assertEquals( [ (p.type_, p.value) for p in sd.parameter ], [ ('mtu', '9000') ])
+
+
+    def testEmptyOptionalElement(self):
+        # element present but without text is an empty string, like findtext
+
+        header, reserve = helper.parseRequest( self._reservePayload('') )
+        self.assertEquals(reserve.description, '')
+
+
+    def testQuerySummaryConfirmedParsing(self):
+
+        header_element = helper.createRequesterHeader(REQUESTER, PROVIDER, correlation_id='urn:uuid:456')
+
+        data_plane_status = nsiconnection.DataPlaneStatusType(True, 2, False)
+        states = nsiconnection.ConnectionStatesType('ReserveStart', 'Provisioned', 'Created', data_plane_status)
+        service_def = p2pservices.P2PServiceBaseType(100, cnt.BIDIRECTIONAL, False, 'urn:ogf:network:aruba.net:topology:ps',
+                                                     'urn:ogf:network:aruba.net:topology:bon', None, [])
+        criteria = nsiconnection.QuerySummaryResultCriteriaType(0, nsiconnection.ScheduleType(None, None), cnt.EVTS_AGOLE, [], service_def)
+        results = [ nsiconnection.QuerySummaryResultType('conn-%i' % i, None, None, [ criteria ], REQUESTER, states, i, None) for i in range(3) ]
+
+        payload = minisoap.createSoapPayload(nsiconnection.QuerySummaryConfirmedType(results).xml(nsiconnection.querySummaryConfirmed), header_element)
+
+        header, qsc = helper.parseRequest(payload)
+
+        self.assertEquals(header.correlation_id, 'urn:uuid:456')
+        self.assertEquals(header.connection_trace, None)
+        self.assertEquals(len(qsc.reservations), 3)
+
+        for i, r in enumerate(qsc.reservations):
+            self.assertEquals(r.connectionId, 'conn-%i' % i)
+            self.assertEquals(r.globalReservationId, None)
+            self.assertEquals(r.notificationId, i)
+            self.assertEquals(r.resultId, None)
+            self.assertEquals(r.connectionStates.provisionState, 'Provisioned')
+            self.assertEquals(r.connectionStates.dataPlaneStatus.active, True)
+            self.assertEquals(r.connectionStates.dataPlaneStatus.version, 2)
+            self.assertEquals(r.connectionStates.dataPlaneStatus.versionConsistent, False)
+            self.assertEquals(len(r.criteria), 1)
+            self.assertEquals(r.criteria[0].serviceDefinition.sourceSTP, 'urn:ogf:network:aruba.net:topology:ps')
+
+
+    def testSlots(self):
+
+        se = nsiframework.ServiceExceptionType(PROVIDER, None, None, '00500', 'Error', None, None)
+        self.assertRaises(AttributeError, setattr, se, 'bogus', 1)
+
@@ -0,0 +1,149 @@
+import uuid
+import datetime
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from twistar.registry import Registry
+
+from opennsa import state, changefeed
+from opennsa.backends.common import genericbackend
+
+from . import db
+
+
+
+def createConnection():
+    now = datetime.datetime.utcnow()
+    return genericbackend.GenericBackendConnections(connection_id=str(uuid.uuid1()), revision=0, global_reservation_id=None, description='test',
+                    requester_nsa='req-nsa', reserve_time=now,
+                    reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=state.CREATED, data_plane_active=False,
+                    source_network='src-net', source_port='src-port', source_label=None, dest_network='dst-net', dest_port='dst-port', dest_label=None,
+                    start_time=None, end_time=now + datetime.timedelta(hours=1),
+                    symmetrical=False, directionality='Bidirectional', bandwidth=200, allocated=False)
+
+
+
+class Receiver:
+
+    def __init__(self):
+        self.events = []
+        self.waiting = []
+
+
+    def __call__(self, event):
+        self.events.append(event)
+        waiting, self.waiting = self.waiting, []
+        for d in waiting:
+            d.callback(event)
+
+
+    def next(self):
+        d = defer.Deferred()
+        self.waiting.append(d)
+        return d
+
+
+
+class ChangeFeedTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        db.setupDatabase()
+        self.conn = createConnection()
+        yield self.conn.save()
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.conn.delete()
+        Registry.DBPOOL.close()
+
+
+    @defer.inlineCallbacks
+    def testLocalDelivery(self):
+
+        receiver = Receiver()
+        changefeed.addListener(receiver)
+        self.addCleanup(changefeed.removeListener, receiver)
+
+        notified = []
+        subscriber = lambda : notified.append(self.conn.reservation_state)
+        state.subscribe(self.conn.connection_id, subscriber)
+        self.addCleanup(state.desubscribe, self.conn.connection_id, subscriber)
+
+        yield state.reserveChecking(self.conn)
+
+        self.assertEquals(notified, [ state.RESERVE_CHECKING ])
+        self.assertEquals(receiver.events, [ { 'connection_id' : self.conn.connection_id, 'requester_nsa' : 'req-nsa', 'reservation_state' : state.RESERVE_CHECKING } ])
+
+
+    @defer.inlineCallbacks
+    def testRemoteListener(self):
+
+        receiver = Receiver()
+        changefeed.addRemoteListener(receiver)
+        self.addCleanup(changefeed.removeRemoteListener, receiver)
+
+        yield state.reserveChecking(self.conn)
+        self.assertEquals(receiver.events, []) # changed by this process
+
+        changefeed.deliverRemote(changefeed.changeEvent('conn-other', 'req-nsa'))
+        self.assertEquals(receiver.events, [ { 'connection_id' : 'conn-other', 'requester_nsa' : 'req-nsa' } ])
+
+
+
+class PostgreSQLChangeFeedTest(unittest.TestCase):
+
+    skip = db.REQUIRES_POSTGRESQL
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        db.setupDatabase()
+        self.conn = createConnection()
+        yield self.conn.save()
+
+        # two processes, each with their feed
+        self.local_events = Receiver()
+        self.local = changefeed.ChangeFeed(origin='process-a', deliver=self.local_events, **db.connectionArguments())
+        self.remote_events = Receiver()
+        self.remote = changefeed.ChangeFeed(origin='process-b', deliver=self.remote_events, **db.connectionArguments())
+        yield self.remote.startService()
+        yield self.local.startService() # published events go through the last one started
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        self.local.stopService()
+        self.remote.stopService()
+        yield self.conn.delete()
+        Registry.DBPOOL.close()
+
+
+    @defer.inlineCallbacks
+    def testDeliveryToOtherProcess(self):
+
+        received = self.remote_events.next()
+        yield state.reserveChecking(self.conn)
+        event = yield received
+
+        self.assertEquals(event, { 'connection_id' : self.conn.connection_id, 'requester_nsa' : 'req-nsa', 'reservation_state' : state.RESERVE_CHECKING })
+        # already delivered locally, when published
+        self.assertEquals(self.local_events.events, [])
+
+
+    @defer.inlineCallbacks
+    def testReconnect(self):
+
+        self.patch(changefeed, 'RECONNECT_DELAY', 0)
+
+        resync = self.remote_events.next()
+        pid = self.remote.connection.connection.get_backend_pid()
+        yield Registry.DBPOOL.runOperation('SELECT pg_terminate_backend(%s)', (pid,))
+        event = yield resync
+        self.assertEquals(event['connection_id'], None) # events can have been missed
+
+        received = self.remote_events.next()
+        yield state.reserveChecking(self.conn)
+        event = yield received
+        self.assertEquals(event['reservation_state'], state.RESERVE_CHECKING)
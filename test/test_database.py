@@ -1,10 +1,14 @@
+import uuid
 import datetime
+import sqlite3
 import psycopg2
 
 from twisted.internet import defer
 from twisted.trial import unittest
 
-from opennsa import state
+from twistar.registry import Registry
+
+from opennsa import state, database
 from opennsa.backends.common import genericbackend
 
 from . import db
@@ -45,6 +49,66 @@ class DatabaseTest(unittest.TestCase):
         try:
             yield conn.save()
             self.fail('Should have gotten integrity error from database')
-        except psycopg2.IntegrityError as e:
+        except (psycopg2.IntegrityError, sqlite3.IntegrityError) as e:
             pass # intended
 
+
+    @defer.inlineCallbacks
+    def testFindSubConnections(self):
+
+        now = datetime.datetime.utcnow()
+
+        def createServiceConnection():
+            return database.ServiceConnection(connection_id=str(uuid.uuid1()), revision=0, requester_nsa='req-nsa', reserve_time=now,
+                                              reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=state.CREATED,
+                                              source_network='src-net', source_port='src-port', dest_network='dst-net', dest_port='dst-port',
+                                              symmetrical=False, directionality='Bidirectional', bandwidth=200).save()
+
+        def createSubConnection(service_connection, order_id, active, version, consistent):
+            return database.SubConnection(service_connection_id=service_connection.id, connection_id=str(uuid.uuid1()), provider_nsa='prov-nsa',
+                                          revision=0, order_id=order_id,
+                                          reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=state.CREATED,
+                                          data_plane_active=active, data_plane_version=version, data_plane_consistent=consistent,
+                                          source_network='src-net', source_port='src-port', dest_network='dst-net', dest_port='dst-port').save()
+
+        sc1 = yield createServiceConnection()
+        sc2 = yield createServiceConnection()
+        sc3 = yield createServiceConnection() # no sub connections
+
+        yield createSubConnection(sc1, 1, True, 2, True)
+        yield createSubConnection(sc1, 0, True, 3, True)
+        yield createSubConnection(sc2, 0, False, None, True)
+
+        sub_connections = yield database.findSubConnections( [ sc1.id, sc2.id, sc3.id ] )
+
+        self.assertEquals(sorted(sub_connections.keys()), [ sc1.id, sc2.id ])
+        self.assertEquals([ sc.order_id for sc in sub_connections[sc1.id] ], [ 0, 1 ])
+
+        self.assertEquals(database.aggregateDataPlaneStatus(sub_connections[sc1.id]), (True, 3, True))
+        self.assertEquals(database.aggregateDataPlaneStatus(sub_connections[sc2.id]), (False, 0, True))
+        self.assertEquals(database.aggregateDataPlaneStatus(sub_connections.get(sc3.id)), (False, 0, False))
+
+        sub_connections = yield database.findSubConnections( [] )
+        self.assertEquals(sub_connections, {})
+
+
+    @defer.inlineCallbacks
+    def testBackendConnectionIdBlocks(self):
+
+        yield Registry.DBPOOL.runOperation(database.CONNECTION_ID_START_SQL, (1900000,))
+        rows = yield Registry.DBPOOL.runQuery('SELECT connection_id FROM backend_connection_id')
+        start = rows[0][0]
+
+        # two processes sharing the database
+        block1 = database.ConnectionIdBlock(3)
+        block2 = database.ConnectionIdBlock(3)
+
+        ids = yield defer.gatherResults( [ block1.getId() for _ in range(2) ] ) # concurrent, one claim
+        self.assertEquals(ids, [ start + 1, start + 2 ])
+        ids = yield defer.gatherResults( [ block2.getId() for _ in range(2) ] )
+        self.assertEquals(ids, [ start + 4, start + 5 ])
+        ids = yield defer.gatherResults( [ block1.getId() for _ in range(2) ] )
+        self.assertEquals(ids, [ start + 3, start + 7 ])
+
+        rows = yield Registry.DBPOOL.runQuery('SELECT connection_id FROM backend_connection_id')
+        self.assertEquals(rows[0][0], start + 9) # three claims, ids left in the blocks are not used again
@@ -0,0 +1,141 @@
+from twisted.trial import unittest
+
+from opennsa.shared import metrics, identitymap
+
+
+
+class Obj:
+    def __init__(self, name, busy=False):
+        self.name = name
+        self.busy = busy
+
+
+
+class IdentityMapTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.imap = identitymap.IdentityMap('test.cache', 3, lambda obj : obj.busy)
+
+
+    def tearDown(self):
+        metrics.reset()
+
+
+    def testIdentity(self):
+
+        a = Obj('a')
+        self.assertIdentical(self.imap.add('a', a), a)
+        # a second object for the same key (e.g., loaded concurrently) gets the first one
+        self.assertIdentical(self.imap.add('a', Obj('a')), a)
+        self.assertIdentical(self.imap.get('a'), a)
+        self.assertEquals(self.imap.get('b'), None)
+
+        snapshot = metrics.snapshot()
+        self.assertEquals(snapshot['test.cache.hit'], 1)
+        self.assertEquals(snapshot['test.cache.miss'], 1)
+        self.assertEquals(snapshot['test.cache.size'], 1)
+
+
+    def testLRUEviction(self):
+
+        for key in 'abc':
+            self.imap.add(key, Obj(key))
+
+        self.imap.get('a') # a is now most recently used
+        self.imap.add('d', Obj('d'))
+
+        self.assertEquals(len(self.imap), 3)
+        self.assertNotIn('b', self.imap)
+        for key in 'acd':
+            self.assertIn(key, self.imap)
+        self.assertEquals(metrics.snapshot()['test.cache.evicted'], 1)
+
+
+    def testPinned(self):
+
+        self.imap.add('a', Obj('a', busy=True))
+        self.imap.add('b', Obj('b', busy=True))
+        self.imap.add('c', Obj('c'))
+        self.imap.add('d', Obj('d'))
+
+        self.assertNotIn('c', self.imap)
+        self.assertIn('a', self.imap)
+        self.assertIn('b', self.imap)
+
+        # d gets evicted, then all are pinned and the map grows above max size
+        for key in 'efg':
+            self.imap.add(key, Obj(key, busy=True))
+        self.assertNotIn('d', self.imap)
+        self.assertEquals(len(self.imap), 5)
+
+        self.imap.get('a').busy = False
+        self.imap.add('h', Obj('h', busy=True))
+        self.assertNotIn('a', self.imap)
+        self.assertEquals(len(self.imap), 5)
+
+
+    def testPinnedScan(self):
+
+        calls = []
+        def pinned(obj):
+            calls.append(obj.name)
+            return obj.busy
+
+        imap = identitymap.IdentityMap('test.scan', 10, pinned)
+        for i in range(2000):
+            imap.add(i, Obj(i, busy=True))
+
+        # the pinned entries are not all scanned on every add
+        del calls[:]
+        for i in range(2000, 2010):
+            imap.add(i, Obj(i))
+        self.assertEquals(len(calls), 10 * identitymap.MAX_EVICT_SCAN)
+        self.assertEquals(len(set(calls)), 10 * identitymap.MAX_EVICT_SCAN) # skipped entries are moved back
+        self.assertEquals(len(imap), 2010)
+
+        for key in range(2000):
+            imap.get(key).busy = False
+        imap.add('a', Obj('a'))
+        self.assertEquals(len(imap), 10)
+
+
+    def testCompositeKey(self):
+
+        a1 = self.imap.add( ('nsa1', 'conn-1'), Obj('a1') )
+        a2 = self.imap.add( ('nsa2', 'conn-1'), Obj('a2') )
+
+        self.assertIdentical(self.imap.get( ('nsa1', 'conn-1') ), a1)
+        self.assertIdentical(self.imap.get( ('nsa2', 'conn-1') ), a2)
+
+        self.imap.remove( ('nsa1', 'conn-1') )
+        self.imap.remove( ('nsa3', 'conn-1') ) # not there, no error
+        self.assertNotIn( ('nsa1', 'conn-1'), self.imap)
+        self.assertIn( ('nsa2', 'conn-1'), self.imap)
+
+
+
+    def testInvalidate(self):
+
+        imap = identitymap.IdentityMap('test.index_cache', 10, lambda obj : obj.busy, index=lambda key : key[1])
+        a1 = imap.add( ('nsa1', 'conn-1'), Obj('a1') )
+        a2 = imap.add( ('nsa2', 'conn-1'), Obj('a2', busy=True) )
+        b1 = imap.add( ('nsa1', 'conn-2'), Obj('b1') )
+
+        imap.invalidateIndexed('conn-1')
+        self.assertNotIn( ('nsa1', 'conn-1'), imap)
+        self.assertIdentical(imap.get( ('nsa1', 'conn-2') ), b1)
+
+        # pinned, kept while in use, and reloaded after
+        self.assertIdentical(imap.get( ('nsa2', 'conn-1') ), a2)
+        self.assertIdentical(imap.add( ('nsa2', 'conn-1'), Obj('a2') ), a2)
+        a2.busy = False
+        self.assertEquals(imap.get( ('nsa2', 'conn-1') ), None)
+        fresh = imap.add( ('nsa2', 'conn-1'), Obj('a2') )
+        self.failIfIdentical(fresh, a2)
+        self.assertIdentical(imap.get( ('nsa2', 'conn-1') ), fresh)
+
+        imap.invalidateAll()
+        self.assertEquals(len(imap), 0)
+        self.assertEquals(imap._index, {})
+        self.assertEquals(metrics.snapshot()['test.index_cache.invalidated'], 4)
@@ -0,0 +1,158 @@
+import os
+import re
+import json
+import shutil
+import tempfile
+
+import psycopg2
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from twistar.registry import Registry
+
+from opennsa import migrations
+
+from . import db
+
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'datafiles', 'schema.sql')
+
+# test data, shaped like a production database: many requesters, most connections terminated, few global reservation ids
+# done in the test transaction (and rolled back), the statistics are updated so the planner sees the shape
+FIXTURE = [
+    """INSERT INTO service_connections (connection_id, revision, global_reservation_id, requester_nsa, reserve_time, reservation_state, provision_state,
+                                      lifecycle_state, source_network, source_port, dest_network, dest_port, symmetrical, directionality, bandwidth)
+       SELECT 'mig-' || i, 0, CASE WHEN i % 10 = 0 THEN 'urn:uuid:' || i END, 'req-' || i % 20, now(), 'ReserveStart', 'Released',
+              CASE WHEN i % 10 = 0 THEN 'Created' ELSE 'Terminated' END, 'net', 'p1', 'net', 'p2', false, 'Bidirectional', 100
+       FROM generate_series(1, 5000) AS i""",
+    """INSERT INTO sub_connections (service_connection_id, connection_id, provider_nsa, revision, order_id, reservation_state, provision_state, lifecycle_state,
+                                  data_plane_active, source_network, source_port, dest_network, dest_port)
+       SELECT sc.id, sc.connection_id || '-' || o, 'prov', 0, o, 'ReserveStart', 'Released', 'Created', false, 'net', 'p1', 'net', 'p2'
+       FROM service_connections sc, generate_series(0, 1) AS o WHERE sc.connection_id LIKE 'mig-%'""",
+    """INSERT INTO pending_reservations (correlation_id, service_connection_id, provider_nsa, order_id, source_network, source_port, dest_network, dest_port, dispatch_time)
+       SELECT 'mig-' || sc.id, sc.id, 'prov', 0, 'net', 'p1', 'net', 'p2', now() FROM service_connections sc WHERE sc.connection_id LIKE 'mig-%'""",
+    """INSERT INTO generic_backend_connections (connection_id, revision, requester_nsa, reserve_time, reservation_state, provision_state, lifecycle_state,
+                                              data_plane_active, source_network, source_port, dest_network, dest_port, symmetrical, directionality, bandwidth, allocated)
+       SELECT 'mig-' || i, 0, 'req-' || i % 20, now(), 'ReserveStart', 'Released', CASE WHEN i % 10 = 0 THEN 'Created' ELSE 'Terminated' END,
+              false, 'net', 'p1', 'net', 'p2', false, 'Bidirectional', 100, false
+       FROM generate_series(1, 5000) AS i""",
+    """INSERT INTO notifications (source, connection_id, notification_id, notification_type, timestamp, data)
+       SELECT 'src-' || i % 2, 'mig-' || i % 500, i, 'dataPlaneStateChange', now(), '[]' FROM generate_series(1, 5000) AS i""",
+    "ANALYZE service_connections, sub_connections, pending_reservations, generic_backend_connections, notifications",
+]
+
+# hot queries, and the index each of them must use
+QUERY_PLANS = [
+    ( "SELECT * FROM service_connections WHERE requester_nsa = 'req-1' AND connection_id IN ('mig-1', 'mig-21')",       'service_connections_requester_idx'),
+    ( "SELECT * FROM service_connections WHERE requester_nsa = 'req-1'",                                               'service_connections_requester_idx'),
+    ( "SELECT * FROM service_connections WHERE requester_nsa = 'req-1' AND global_reservation_id IN ('urn:uuid:10', 'urn:uuid:30')",
+                                                                                                                        'service_connections_global_id_idx'),
+    ( "SELECT * FROM sub_connections WHERE service_connection_id IN (1, 2) ORDER BY service_connection_id, order_id",   'sub_connections_service_connection_idx'),
+    ( "SELECT * FROM pending_reservations WHERE service_connection_id = 1",                                           'pending_reservations_service_connection_idx'),
+    ( "SELECT * FROM generic_backend_connections WHERE requester_nsa = 'req-1' AND id > 0 ORDER BY id LIMIT 1000",      'generic_backend_connections_requester_idx'),
+    ( "SELECT * FROM generic_backend_connections WHERE lifecycle_state <> 'Terminated'",                             'generic_backend_connections_active_idx'),
+    ( "SELECT * FROM notifications WHERE source = 'src-1' AND connection_id = 'mig-1' AND notification_id >= 1 AND notification_id <= 10000 " + \
+      "ORDER BY notification_id",                                                                                        'notifications_connection_idx'),
+]
+
+
+
+def _nodes(plan):
+    # all nodes in a json plan
+    yield plan
+    for p in plan.get('Plans', []):
+        for n in _nodes(p):
+            yield n
+
+
+
+def _migrateTestDatabase():
+    tc = json.load( open(db.CONFIG_FILE) )
+    migrations.migrateDatabase(tc['database'], tc['user'], tc['password'], '127.0.0.1')
+
+
+
+class MigrationsTest(unittest.TestCase):
+
+    skip = db.REQUIRES_POSTGRESQL
+
+    def setUp(self):
+        # the test database can be from before versioning
+        _migrateTestDatabase()
+        tc = json.load( open(db.CONFIG_FILE) )
+        self.conn = psycopg2.connect(user=tc['user'], password=tc['password'], database=tc['database'], host='127.0.0.1')
+
+
+    def tearDown(self):
+        self.conn.rollback()
+        self.conn.close()
+
+
+    def testFindMigrations(self):
+
+        found = migrations.findMigrations()
+        self.assertEquals( [ m.version for m in found ], range(1, len(found) + 1))
+
+        # new databases get the full schema, which must include all migrations
+        schema = open(SCHEMA_FILE).read()
+        recorded = [ (int(v), n) for v, n in re.findall(r"\((\d+), '([\w-]+)',", schema) ]
+        self.assertEquals(recorded, [ (m.version, m.name) for m in found ])
+
+
+    def testMigrate(self):
+
+        cur = self.conn.cursor()
+        latest = migrations.findMigrations()[-1].version
+        self.assertEquals(migrations.appliedVersions(cur)[-1], latest)
+        self.assertEquals(migrations.migrate(cur), [])
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, '%03i-test-table.sql' % (latest + 1)), 'w') as f:
+            f.write('CREATE TABLE migration_test (id integer);')
+        with open(os.path.join(directory, 'README'), 'w') as f:
+            f.write('not a migration')
+
+        done = migrations.migrate(cur, migrations.findMigrations() + migrations.findMigrations(directory))
+        self.assertEquals( [ (m.version, m.name) for m in done ], [ (latest + 1, 'test-table') ])
+        self.assertEquals(migrations.appliedVersions(cur)[-1], latest + 1)
+        cur.execute('SELECT count(*) FROM migration_test')
+        # rolled back in tearDown
+
+
+    def testQueryPlans(self):
+
+        cur = self.conn.cursor()
+        for sql in FIXTURE:
+            cur.execute(sql)
+
+        for query, index in QUERY_PLANS:
+            cur.execute('EXPLAIN (FORMAT JSON) ' + query)
+            nodes = list(_nodes(cur.fetchone()[0][0]['Plan']))
+            self.assertIn(index, [ n.get('Index Name') for n in nodes ], 'Query does not use %s: %s' % (index, query))
+            self.assertNotIn('Seq Scan', [ n['Node Type'] for n in nodes ], 'Sequential scan in query: %s' % query)
+
+
+
+class MigrationsPoolTest(unittest.TestCase):
+
+    skip = db.REQUIRES_POSTGRESQL
+
+    def setUp(self):
+        _migrateTestDatabase()
+        db.setupDatabase()
+
+
+    def tearDown(self):
+        Registry.DBPOOL.close()
+
+
+    @defer.inlineCallbacks
+    def testMigrateInteraction(self):
+
+        done = yield Registry.DBPOOL.runInteraction(migrations.migrate)
+        self.assertEquals(done, [])
+        versions = yield Registry.DBPOOL.runInteraction(migrations.appliedVersions)
+        self.assertEquals(versions, [ m.version for m in migrations.findMigrations() ])
+
@@ -0,0 +1,107 @@
+import uuid
+import datetime
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from twistar.registry import Registry
+
+from opennsa import notificationlog
+
+from . import db
+
+
+
+class NotificationLogTest(unittest.TestCase):
+
+    def setUp(self):
+        db.setupDatabase()
+        self.source = 'test:' + str(uuid.uuid1()) # keep tests apart
+        self.now = datetime.datetime.utcnow().replace(microsecond=0)
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield Registry.DBPOOL.runOperation('DELETE FROM notifications WHERE source = %s', (self.source,))
+        Registry.DBPOOL.close()
+
+
+    @defer.inlineCallbacks
+    def testRestart(self):
+
+        nl = notificationlog.NotificationLog(self.source)
+        self.assertEquals(nl.append('conn-1', notificationlog.DATA_PLANE_STATE_CHANGE, self.now, [ (True, 1, True) ]), 1)
+        self.assertEquals(nl.append('conn-2', notificationlog.RESERVE_TIMEOUT, self.now, (120, 'conn-2', 'urn:nsa')), 2)
+        self.assertEquals(nl.append('conn-1', notificationlog.ERROR_EVENT, self.now, ('activateFailed', None, None)), 3)
+        yield nl.flush()
+
+        restarted = notificationlog.NotificationLog(self.source)
+        n = yield restarted.load()
+        self.assertEquals(n, 3)
+        self.assertEquals(restarted.append('conn-1', notificationlog.DATA_PLANE_STATE_CHANGE, self.now, [ (False, 1, True) ]), 4)
+
+        notifications = yield restarted.query('conn-1')
+        self.assertEquals( [ n.notification_id for n in notifications ], [ 1, 3, 4 ])
+        original = yield nl.query('conn-1', 1, 3)
+        self.assertEquals(notifications[:2], original)
+
+        yield restarted.flush()
+
+        # the first one takes over again, after the restarted one has logged
+        yield nl.load()
+        self.assertEquals(nl.append('conn-2', notificationlog.DATA_PLANE_STATE_CHANGE, self.now, [ (True, 1, True) ]), 5)
+        notifications = yield nl.query('conn-1')
+        self.assertEquals( [ n.notification_id for n in notifications ], [ 1, 3, 4 ]) # not duplicated
+        yield nl.flush()
+
+
+    @defer.inlineCallbacks
+    def testRingBuffer(self):
+
+        nl = notificationlog.NotificationLog(self.source, ring_size=3)
+        for i in range(5):
+            nl.append('conn-1', notificationlog.DATA_PLANE_STATE_CHANGE, self.now, [ (i % 2 == 0, i, True) ])
+
+        # recent notifications are in memory, older ones come from the database
+        notifications = yield nl.query('conn-1', 3)
+        self.assertEquals( [ n.notification_id for n in notifications ], [ 3, 4, 5 ])
+        self.assertNotEquals(nl._pending, []) # not written yet
+
+        notifications = yield nl.query('conn-1', 2, 4)
+        self.assertEquals( [ n.notification_id for n in notifications ], [ 2, 3, 4 ])
+        self.assertEquals(notifications[0].data, ( (False, 1, True), ))
+
+
+    @defer.inlineCallbacks
+    def testCompaction(self):
+
+        self.patch(notificationlog, 'COMPACT_INTERVAL', datetime.timedelta(0))
+
+        nl = notificationlog.NotificationLog(self.source, retention=datetime.timedelta(days=1))
+        nl.append('conn-1', notificationlog.DATA_PLANE_STATE_CHANGE, self.now - datetime.timedelta(days=2), [ (True, 0, True) ])
+        nl.append('conn-1', notificationlog.DATA_PLANE_STATE_CHANGE, self.now, [ (False, 0, True) ])
+        yield nl.flush() # writes, then compacts
+
+        rows = yield Registry.DBPOOL.runQuery('SELECT notification_id FROM notifications WHERE source = %s', (self.source,))
+        self.assertEquals(rows, [ (2,) ])
+
+
+    @defer.inlineCallbacks
+    def testWriteFailure(self):
+
+        nl = notificationlog.NotificationLog(self.source)
+        nl.clock = task.Clock()
+        nl.append('conn-1', notificationlog.DATA_PLANE_STATE_CHANGE, self.now, [ (True, 1, True) ])
+
+        database_down = self.patch(Registry.DBPOOL, 'runInteraction', lambda *args : defer.fail(Exception('Database is gone')))
+        yield nl.flush()
+
+        # the batch is kept, and written again later, along with the ones logged meanwhile
+        self.assertEquals( [ call.getTime() for call in nl.clock.getDelayedCalls() ], [ notificationlog.RETRY_DELAY ])
+        nl.append('conn-1', notificationlog.DATA_PLANE_STATE_CHANGE, self.now, [ (False, 1, True) ])
+        database_down.restore()
+        nl.clock.advance(notificationlog.RETRY_DELAY)
+        yield nl.flush()
+
+        rows = yield Registry.DBPOOL.runQuery('SELECT notification_id FROM notifications WHERE source = %s ORDER BY notification_id', (self.source,))
+        self.assertEquals(rows, [ (1,), (2,) ])
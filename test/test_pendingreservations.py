@@ -0,0 +1,116 @@
+import uuid
+import datetime
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from twistar.registry import Registry
+
+from opennsa import state, database, pendingreservations
+
+from . import db
+
+
+
+def createInfo(service_connection_id, order_id=0):
+    return { 'provider_nsa' : 'urn:ogf:network:aruba.net:nsa', 'service_connection_id' : service_connection_id, 'order_id' : order_id,
+             'source_network' : 'aruba.net:topology', 'source_port' : 'ps', 'dest_network' : 'aruba.net:topology', 'dest_port' : 'bon' }
+
+
+
+class PendingReservationsTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        db.setupDatabase()
+        now = datetime.datetime.utcnow()
+        self.conn = database.ServiceConnection(connection_id=str(uuid.uuid1()), revision=0, requester_nsa='req-nsa', reserve_time=now,
+                                               reservation_state=state.RESERVE_CHECKING, provision_state=state.RELEASED, lifecycle_state=state.CREATED,
+                                               source_network='src-net', source_port='src-port', dest_network='dst-net', dest_port='dst-port',
+                                               symmetrical=False, directionality='Bidirectional', bandwidth=200)
+        yield self.conn.save()
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.conn.delete() # cascades to pending reservations
+        Registry.DBPOOL.close()
+
+
+    @defer.inlineCallbacks
+    def testRestore(self):
+
+        pr = pendingreservations.PendingReservations()
+        pr['cid-1'] = createInfo(self.conn.id, 0)
+        pr['cid-2'] = createInfo(self.conn.id, 1)
+        pr['cid-3'] = createInfo(self.conn.id, 2)
+        pr.pop('cid-3') # never written
+        yield pr.flush()
+
+        restored = pendingreservations.PendingReservations()
+        n = yield restored.load()
+        self.assertEquals(n, 2)
+        self.assertEquals(sorted(restored.outstanding(self.conn.id)), [ 'cid-1', 'cid-2' ])
+        self.assertEquals(restored['cid-2'], pr['cid-2'])
+
+        restored.pop('cid-1')
+        yield restored.flush()
+
+        rows = yield Registry.DBPOOL.runQuery('SELECT correlation_id FROM pending_reservations')
+        self.assertEquals(rows, [ ('cid-2',) ])
+
+
+    @defer.inlineCallbacks
+    def testBatchedWrites(self):
+
+        self.patch(pendingreservations, 'BATCH_SIZE', 3)
+        pr = pendingreservations.PendingReservations()
+        pr['cid-1'] = createInfo(self.conn.id)
+        pr['cid-2'] = createInfo(self.conn.id)
+        self.assertEquals(pr._flushing, None) # waiting for more changes
+        pr['cid-3'] = createInfo(self.conn.id)
+        self.assertNotEquals(pr._flushing, None) # batch full
+
+        # changes done during a write, are written after it
+        pr.pop('cid-1')
+        yield pr.flush()
+
+        rows = yield Registry.DBPOOL.runQuery('SELECT correlation_id FROM pending_reservations ORDER BY correlation_id')
+        self.assertEquals(rows, [ ('cid-2',), ('cid-3',) ])
+
+
+    def testExpire(self):
+
+        pr = pendingreservations.PendingReservations(persist=False)
+        pr['cid-1'] = createInfo(self.conn.id)
+        pr['cid-2'] = createInfo(self.conn.id)
+        pr['cid-2']['dispatch_time'] -= pendingreservations.PENDING_TIMEOUT * 2
+
+        self.assertEquals(pr.expire(), [ 'cid-2' ])
+        self.assertEquals(pr.outstanding(self.conn.id), [ 'cid-1' ])
+        self.assertRaises(KeyError, pr.pop, 'cid-2')
+
+
+
+    @defer.inlineCallbacks
+    def testWriteFailure(self):
+
+        pr = pendingreservations.PendingReservations()
+        pr.clock = task.Clock()
+        pr['cid-1'] = createInfo(self.conn.id)
+        yield pr.flush()
+
+        database_down = self.patch(Registry.DBPOOL, 'runInteraction', lambda *args : defer.fail(Exception('Database is gone')))
+        pr.pop('cid-1')
+        pr['cid-2'] = createInfo(self.conn.id)
+        pr['cid-3'] = createInfo(self.conn.id)
+        yield pr.flush()
+
+        # the changes are kept, and written again later
+        self.assertEquals( [ call.getTime() for call in pr.clock.getDelayedCalls() ], [ pendingreservations.RETRY_DELAY ])
+        pr.pop('cid-3') # before the retry
+        database_down.restore()
+        yield pr.flush()
+
+        rows = yield Registry.DBPOOL.runQuery('SELECT correlation_id FROM pending_reservations')
+        self.assertEquals(rows, [ ('cid-2',) ])
@@ -4,7 +4,7 @@ import StringIO
 from twisted.trial import unittest
 from twisted.internet import reactor, defer, task
 
-from opennsa import nsa, provreg, database, error, setup, aggregator, config, plugin, constants as cnt
+from opennsa import nsa, provreg, database, error, setup, aggregator, config, plugin, state, constants as cnt
 from opennsa.topology import nrm
 from opennsa.backends import dud
 
@@ -68,6 +68,7 @@ class GenericProviderTest:
         self.header.newCorrelationId()
         try:
             yield self.provider.reserve(self.header, None, None, None, criteria)
+            yield self.requester.reserve_defer # the aggregator reports child failures with reserveFailed
             self.fail('Should have raised PayloadError') # Error type is somewhat debatable, but this what we use
         except error.PayloadError:
             pass # expected
@@ -318,6 +319,7 @@ class GenericProviderTest:
         self.requester.reserve_defer = defer.Deferred() # new defer for new reserve request
         try:
             acid2 = yield self.provider.reserve(self.header, None, None, None, criteria)
+            yield self.requester.reserve_defer # the aggregator reports child failures with reserveFailed
             self.fail('Should have raised STPUnavailableError')
         except error.STPUnavailableError:
             pass # we expect this
@@ -383,6 +385,32 @@ class GenericProviderTest:
         self.failUnlessEquals(dps[:2], (False, 0) )  # we cannot really expect a consistent result for consistent here
 
 
+    @defer.inlineCallbacks
+    def testQuerySummaryAll(self):
+
+        from opennsa.backends.common import genericbackend
+        self.patch(genericbackend.GenericBackend, 'QUERY_PAGE_SIZE', 2) # make backend queries span pages
+
+        source_stp  = nsa.STP(self.network, self.source_port, nsa.Label(cnt.ETHERNET_VLAN, '1781-1783') )
+        dest_stp    = nsa.STP(self.network, self.dest_port,   nsa.Label(cnt.ETHERNET_VLAN, '1781-1783') )
+        criteria    = nsa.Criteria(0, self.schedule, nsa.Point2PointService(source_stp, dest_stp, 100, 'Bidirectional', False, None) )
+
+        acids = []
+        for _ in range(3):
+            self.requester.reserve_defer = defer.Deferred()
+            self.header.newCorrelationId()
+            acid = yield self.provider.reserve(self.header, None, None, None, criteria)
+            yield self.requester.reserve_defer
+            acids.append(acid)
+
+        # no connection ids or global reservation ids means all connections
+        self.header.newCorrelationId()
+        yield self.provider.querySummary(self.header)
+        header, reservations = yield self.requester.query_summary_defer
+
+        self.failUnlessEquals(sorted( [ ci.connection_id for ci in reservations ] ), sorted(acids))
+
+
     @defer.inlineCallbacks
     def testActivation(self):
 
@@ -712,6 +740,7 @@ class GenericProviderTest:
         self.header.newCorrelationId()
         try:
             acid = yield self.provider.reserve(self.header, None, None, None, criteria)
+            yield self.requester.reserve_defer # the aggregator reports child failures with reserveFailed
             self.fail("Should have gotten topology error ")
         except error.NSIError:
             pass # expected
@@ -878,6 +907,9 @@ class AggregatorTest(GenericProviderTest, unittest.TestCase):
     @defer.inlineCallbacks
     def tearDown(self):
         from opennsa.backends.common import genericbackend
+        # write outstanding pending reservations and notifications, before clearing the tables
+        yield self.backend.stopService()
+        yield self.provider.flush()
         # keep it simple...
         yield genericbackend.GenericBackendConnections.deleteAll()
         yield database.SubConnection.deleteAll()
@@ -905,6 +937,201 @@ class AggregatorTest(GenericProviderTest, unittest.TestCase):
             self.fail('Should not have raised exception: %s' % str(e))
 
 
+    @defer.inlineCallbacks
+    def testAckBeforeChildReservations(self):
+
+        self.provider.clock = task.Clock()
+        reserves = []
+        backend_reserve = self.backend.reserve
+        self.backend.reserve = lambda *args : reserves.append(args) or backend_reserve(*args)
+
+        self.header.newCorrelationId()
+        acid = yield self.provider.reserve(self.header, None, None, None, self.criteria)
+        self.assertEquals(reserves, []) # acked before the path is created
+        self.assertEquals(len(self.provider.reservations), 0)
+
+        self.provider.clock.advance(0)
+        self.assertEquals(len(reserves), 1)
+        header, confirm_cid, gid, desc, criteria = yield self.requester.reserve_defer
+        self.assertEquals(acid, confirm_cid)
+
+
+    @defer.inlineCallbacks
+    def testRestartBeforeChildReservations(self):
+
+        self.provider.clock = task.Clock() # path creation never runs, as if the process stopped after the ack
+        self.header.newCorrelationId()
+        acid = yield self.provider.reserve(self.header, None, None, None, self.criteria)
+
+        p = self.provider
+        restarted = aggregator.Aggregator(self.network, self.provider_agent, p.network_topology, p.route_vectors, self.requester, p.provider_registry, [], p.plugin)
+        restarted.clock = task.Clock()
+        yield restarted.restore()
+
+        yield self.assertFailure(self.requester.reserve_defer, error.ConnectionCreateError)
+        conn = yield restarted.getConnection(acid)
+        self.assertEquals(conn.reservation_state, state.RESERVE_FAILED)
+        self.assertEquals(conn.lifecycle_state, state.TERMINATED)
+
+
+    @defer.inlineCallbacks
+    def testReservesBoundedPerProvider(self):
+
+        self.patch(aggregator, 'MAX_CONCURRENT_RESERVES', 1)
+        self.provider.clock = task.Clock()
+        pending = [] # (ack deferred, connection id), for reserves sent to the backend
+        def reserve(header, connection_id, *args):
+            d = defer.Deferred()
+            pending.append( (d, connection_id) )
+            return d
+        self.backend.reserve = reserve
+
+        for _ in range(2):
+            self.header.newCorrelationId()
+            yield self.provider.reserve(self.header, None, None, None, self.criteria)
+        self.provider.clock.advance(0)
+        self.assertEquals(len(pending), 1) # the second waits for the first to be acked
+
+        d, connection_id = pending.pop()
+        d.callback(connection_id)
+        self.assertEquals(len(pending), 1)
+        d, connection_id = pending.pop()
+        d.callback(connection_id)
+
+
+    @defer.inlineCallbacks
+    def testFailureAfterAck(self):
+
+        def getProvider(provider_urn):
+            raise ValueError('No provider %s' % provider_urn)
+        self.provider.getProvider = getProvider
+
+        self.header.newCorrelationId()
+        acid = yield self.provider.reserve(self.header, None, None, None, self.criteria)
+        yield self.failUnlessFailure(self.requester.reserve_defer, ValueError)
+
+        conn = yield self.provider.getConnection(acid)
+        self.assertEquals(conn.reservation_state, state.RESERVE_FAILED)
+        self.assertEquals(len(self.provider.reservations), 0)
+
+
+
+class MultipleBackendTest(unittest.TestCase):
+
+    network = 'aruba:topology'
+
+    requester_agent = nsa.NetworkServiceAgent('test-requester:nsa', 'dud_endpoint1')
+    provider_agent  = nsa.NetworkServiceAgent('aruba:nsa', 'dud_endpoint2')
+    header          = nsa.NSIHeader(requester_agent.urn(), provider_agent.urn(), connection_trace= [ requester_agent.urn() + ':1' ])
+
+    def setUp(self):
+
+        db.setupDatabase()
+
+        self.requester = common.DUDRequester()
+
+        ports_a = nrm.parsePortSpec( StringIO.StringIO(topology.ARUBA_BACKEND_A_TOPOLOGY) )
+        ports_b = nrm.parsePortSpec( StringIO.StringIO(topology.ARUBA_BACKEND_B_TOPOLOGY) )
+        nrm_ports, nml_network, link_vector = setup.setupPortTopology(ports_a + ports_b, self.network, 'aruba')
+
+        pl = plugin.BasePlugin()
+        pl.init( { config.NETWORK_NAME: self.network }, None )
+
+        pr = provreg.ProviderRegistry({}, {})
+        self.provider = aggregator.Aggregator(self.network, self.provider_agent, nml_network, link_vector, self.requester, pr, [], pl)
+
+        self.backends = {}
+        for name, ports in ( ('a', ports_a), ('b', ports_b) ):
+            urn = self.provider_agent.urn() + ':' + name
+            backend = dud.DUDNSIBackend(self.network, ports, self.provider, {})
+            backend.setIdentity(urn, name)
+            backend.startService()
+            pr.addProvider(urn, backend, [ self.network ], [ p.name for p in ports ])
+            self.backends[urn] = backend
+
+        start_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=2)
+        end_time   = datetime.datetime.utcnow() + datetime.timedelta(seconds=10)
+        self.schedule = nsa.Schedule(start_time, end_time)
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        from opennsa.backends.common import genericbackend
+        for backend in self.backends.values():
+            yield backend.stopService()
+        yield self.provider.flush()
+        yield genericbackend.GenericBackendConnections.deleteAll()
+        yield database.SubConnection.deleteAll()
+        yield database.ServiceConnection.deleteAll()
+        from twistar.registry import Registry
+        Registry.DBPOOL.close()
+
+
+    def _criteria(self, source_port, dest_port):
+        source_stp = nsa.STP(self.network, source_port, nsa.Label(cnt.ETHERNET_VLAN, '1782') )
+        dest_stp   = nsa.STP(self.network, dest_port,   nsa.Label(cnt.ETHERNET_VLAN, '1782') )
+        return nsa.Criteria(0, self.schedule, nsa.Point2PointService(source_stp, dest_stp, 100, cnt.BIDIRECTIONAL, False, None))
+
+
+    @defer.inlineCallbacks
+    def testPathAcrossBackends(self):
+
+        self.header.newCorrelationId()
+        acid = yield self.provider.reserve(self.header, None, None, None, self._criteria('ps', 'bon'))
+        yield self.requester.reserve_defer
+
+        conn = yield self.provider.getConnection(acid)
+        sub_conns = yield database.SubConnection.findBy(service_connection_id=conn.id)
+        links = sorted( (sc.order_id, sc.provider_nsa, sc.source_port, sc.dest_port) for sc in sub_conns )
+        self.assertEquals(links, [ (0, self.provider_agent.urn() + ':a', 'ps',     'to-b'),
+                                   (1, self.provider_agent.urn() + ':b', 'from-a', 'bon') ])
+
+        # each backend only has its own connection
+        for urn, backend in self.backends.items():
+            reservations = yield backend._query(nsa.NSIHeader(self.provider_agent.urn(), urn), None, None)
+            sub_conn = [ sc for sc in sub_conns if sc.provider_nsa == urn ][0]
+            self.assertEquals( [ r.connection_id for r in reservations ], [ sub_conn.connection_id ])
+
+        self.header.newCorrelationId()
+        yield self.provider.reserveCommit(self.header, acid)
+        yield self.requester.reserve_commit_defer
+
+        self.header.newCorrelationId()
+        yield self.provider.terminate(self.header, acid)
+        yield self.requester.terminate_defer
+
+
+    @defer.inlineCallbacks
+    def testPartialFailure(self):
+
+        backend_a, backend_b = [ self.backends[self.provider_agent.urn() + ':' + name] for name in 'ab' ]
+        backend_b.reserve = lambda *args : defer.fail( error.ConnectionCreateError('No resources') )
+        terminates = []
+        terminate = backend_a.terminate
+        backend_a.terminate = lambda header, connection_id, *args : terminates.append(header) or terminate(header, connection_id, *args)
+
+        header = nsa.NSIHeader(self.requester_agent.urn(), self.provider_agent.urn(), connection_trace=self.header.connection_trace,
+                               security_attributes=[ nsa.SecurityAttribute('user', 'testuser') ])
+        yield self.provider.reserve(header, None, None, None, self._criteria('ps', 'bon'))
+        yield self.failUnlessFailure(self.requester.reserve_defer, error.ConnectionCreateError)
+
+        # the sub connection which was reserved is terminated, on behalf of the requester
+        self.assertEquals(len(terminates), 1)
+        self.assertEquals(terminates[0].security_attributes, header.security_attributes)
+
+
+    @defer.inlineCallbacks
+    def testPathInOneBackend(self):
+
+        self.header.newCorrelationId()
+        acid = yield self.provider.reserve(self.header, None, None, None, self._criteria('from-a', 'bon'))
+        yield self.requester.reserve_defer
+
+        conn = yield self.provider.getConnection(acid)
+        sub_conns = yield database.SubConnection.findBy(service_connection_id=conn.id)
+        self.assertEquals( [ (sc.provider_nsa, sc.connection_id) for sc in sub_conns ], [ (self.provider_agent.urn() + ':b', acid) ])
+
+
 
 class RemoteProviderTest(GenericProviderTest, unittest.TestCase):
 
@@ -984,6 +1211,8 @@ class RemoteProviderTest(GenericProviderTest, unittest.TestCase):
         self.requester_iport.stopListening()
 
         from opennsa.backends.common import genericbackend
+        # write outstanding pending reservations and notifications, before clearing the tables
+        yield self.aggregator.flush()
         # keep it simple...
         yield genericbackend.GenericBackendConnections.deleteAll()
         yield database.SubConnection.deleteAll()
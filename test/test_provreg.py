@@ -43,3 +43,31 @@ class TestProviderRegistry(unittest.TestCase):
         self.failUnlessRaises(error.STPResolutionError, self.pr.getProviderByNetwork, 'testnetwork2')
 
 
+
+    def testMovedNetwork(self):
+        agent1 = nsa.NetworkServiceAgent('test1', 'http://example.org/nsi', cnt.CS2_SERVICE_TYPE)
+        agent2 = nsa.NetworkServiceAgent('test2', 'http://example.net/nsi', cnt.CS2_SERVICE_TYPE)
+
+        self.pr.spawnProvider(agent1, [ 'testnetwork', 'testnetwork2' ] )
+        self.pr.spawnProvider(agent2, [ 'testnetwork3' ] )
+
+        # network moved from one peer to another
+        self.pr.spawnProvider(agent1, [ 'testnetwork' ] )
+        self.pr.spawnProvider(agent2, [ 'testnetwork2', 'testnetwork3' ] )
+
+        self.failUnlessEqual(self.pr.getProviderByNetwork('testnetwork'),  cnt.URN_OGF_PREFIX + 'test1')
+        self.failUnlessEqual(self.pr.getProviderByNetwork('testnetwork2'), cnt.URN_OGF_PREFIX + 'test2')
+        self.failUnlessEqual(self.pr.getProviderByNetwork('testnetwork3'), cnt.URN_OGF_PREFIX + 'test2')
+
+
+    def testReuseSpawnedProvider(self):
+        agent = nsa.NetworkServiceAgent('test', 'http://example.org/nsi', cnt.CS2_SERVICE_TYPE)
+
+        provider1 = self.pr.spawnProvider(agent, [ 'testnetwork'] )
+        provider2 = self.pr.spawnProvider(agent, [ 'testnetwork', 'testnetwork2' ] )
+        self.failUnlessIdentical(provider1, provider2)
+
+        # new endpoint, new requester
+        moved_agent = nsa.NetworkServiceAgent('test', 'http://example.org/nsi2', cnt.CS2_SERVICE_TYPE)
+        provider3 = self.pr.spawnProvider(moved_agent, [ 'testnetwork', 'testnetwork2' ] )
+        self.failIfIdentical(provider1, provider3)
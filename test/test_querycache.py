@@ -0,0 +1,91 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from opennsa import error
+from opennsa.shared import metrics, querycache
+
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.clock = task.Clock()
+        self.cache = querycache.QueryCache('test.query_cache', ttl=2)
+        self.cache.clock = self.clock
+        self.computations = []
+
+
+    def compute(self):
+        d = defer.Deferred()
+        self.computations.append(d)
+        return d
+
+
+    def testSingleFlight(self):
+
+        key = querycache.queryKey('nsa-a', ['c2', 'c1'], None)
+        ds = [ self.cache.get(key, self.compute) for _ in range(3) ]
+        self.assertEquals(len(self.computations), 1)
+
+        self.computations.pop().callback( ['r1', 'r2'] )
+        for d in ds:
+            self.assertEquals(self.successResultOf(d), ['r1', 'r2'])
+
+        # cached, order of ids does not matter
+        d = self.cache.get(querycache.queryKey('nsa-a', ['c1', 'c2'], None), self.compute)
+        self.assertEquals(self.successResultOf(d), ['r1', 'r2'])
+        self.assertEquals(self.computations, [])
+
+        # expired
+        self.clock.advance(2)
+        self.cache.get(key, self.compute)
+        self.assertEquals(len(self.computations), 1)
+
+        snapshot = metrics.snapshot()
+        self.assertEquals(snapshot['test.query_cache.miss'], 2)
+        self.assertEquals(snapshot['test.query_cache.coalesced'], 2)
+        self.assertEquals(snapshot['test.query_cache.hit'], 1)
+
+
+    def testInvalidate(self):
+
+        key_a = querycache.queryKey('nsa-a', ['c1'], None)
+        key_b = querycache.queryKey('nsa-b', ['c1'], None)
+
+        self.cache.get(key_a, self.compute)
+        self.cache.get(key_b, self.compute)
+        for d in self.computations:
+            d.callback( [] )
+        self.computations = []
+
+        querycache.invalidate('nsa-a')
+        self.cache.get(key_b, self.compute)
+        self.assertEquals(self.computations, [])
+        d1 = self.cache.get(key_a, self.compute)
+        self.assertEquals(len(self.computations), 1)
+
+        # invalidated during computation, the waiting request gets the result, but it is not cached
+        querycache.invalidate('nsa-a')
+        d2 = self.cache.get(key_a, self.compute)
+        self.assertEquals(len(self.computations), 2)
+
+        self.computations.pop(0).callback( ['old'] )
+        self.assertEquals(self.successResultOf(d1), ['old'])
+        self.computations.pop(0).callback( ['new'] )
+        self.assertEquals(self.successResultOf(d2), ['new'])
+
+        self.assertEquals(self.successResultOf(self.cache.get(key_a, self.compute)), ['new'])
+
+
+    def testFailureNotCached(self):
+
+        key = querycache.queryKey('nsa-a', None, ['gid'])
+        d1 = self.cache.get(key, self.compute)
+        d2 = self.cache.get(key, self.compute)
+        self.computations.pop().errback(error.MissingParameterError('no'))
+        self.failureResultOf(d1, error.MissingParameterError)
+        self.failureResultOf(d2, error.MissingParameterError)
+
+        self.cache.get(key, self.compute)
+        self.assertEquals(len(self.computations), 1)
@@ -77,6 +77,8 @@ class RestInterfaceTest(unittest.TestCase):
         self.provider_service.stopService()
 
         from opennsa.backends.common import genericbackend
+        # write outstanding pending reservations and notifications, before clearing the tables
+        yield self.aggregator.flush()
         # keep it simple...
         yield genericbackend.GenericBackendConnections.deleteAll()
         yield database.SubConnection.deleteAll()
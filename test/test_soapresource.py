@@ -0,0 +1,227 @@
+from StringIO import StringIO
+
+from twisted.trial import unittest
+from twisted.web import resource, server
+from twisted.web.test.requesthelper import DummyRequest
+from twisted.test import proto_helpers
+
+from opennsa import nsa
+from opennsa.protocols.shared import minisoap, xmlbackend, soapresource
+from opennsa.protocols.nsi2 import helper
+from opennsa.protocols.nsi2.bindings import nsiconnection
+
+
+REQUESTER = 'urn:ogf:network:aruba.net:nsa:requester'
+PROVIDER  = 'urn:ogf:network:aruba.net:nsa:provider'
+
+ACTION = '"http://schemas.ogf.org/nsi/2013/12/connection/service/provision"'
+
+BACKENDS = xmlbackend.BACKENDS if xmlbackend.HAS_LXML else [ xmlbackend.ETREE ]
+
+
+
+def createPayload(connection_id='conn-1'):
+    header = helper.createProviderHeader(REQUESTER, PROVIDER, correlation_id='urn:uuid:123')
+    body = nsiconnection.GenericRequestType(connection_id).xml(nsiconnection.provision)
+    return minisoap.createSoapPayload(body, header)
+
+
+def createRequest(payload, soap_action=ACTION, content_length=None):
+    request = DummyRequest([''])
+    request.method = 'POST'
+    request.isSecure = lambda : False
+    request.content = StringIO(payload)
+    request.requestHeaders.addRawHeader('soapaction', soap_action)
+    request.requestHeaders.addRawHeader('content-length', str(len(payload) if content_length is None else content_length))
+    return request
+
+
+
+class ParsePayloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = xmlbackend.backend
+
+
+    def tearDown(self):
+        xmlbackend.setBackend(self.backend)
+
+
+    def testParse(self):
+
+        payload = createPayload()
+        for backend in BACKENDS:
+            xmlbackend.setBackend(backend)
+            for chunk_size in (7, 1024, 64 * 1024):
+                self.patch(soapresource, 'READ_CHUNK_SIZE', chunk_size)
+                payload_size, envelope = soapresource.parsePayload(StringIO(payload), 100000, 100)
+                self.assertEquals(payload_size, len(payload))
+                header, request = helper.parseRequestEnvelope(envelope)
+                self.assertEquals(header.correlation_id, 'urn:uuid:123')
+                self.assertEquals(request.connectionId, 'conn-1')
+
+
+    def testSizeLimit(self):
+
+        payload = createPayload()
+        soapresource.parsePayload(StringIO(payload), len(payload), 100)
+        e = self.assertRaises(soapresource.PayloadRejected, soapresource.parsePayload, StringIO(payload), len(payload) - 1, 100)
+        self.assertEquals(e.response_code, 413)
+
+
+    def testElementLimit(self):
+
+        payload = createPayload()
+        n_elements = len( list(xmlbackend.fromstring(payload).iter()) )
+
+        # chunk boundaries must not change the count
+        for chunk_size in (1, 2, 3, 5, 64 * 1024):
+            self.patch(soapresource, 'READ_CHUNK_SIZE', chunk_size)
+            soapresource.parsePayload(StringIO(payload), 100000, n_elements)
+            e = self.assertRaises(soapresource.PayloadRejected, soapresource.parsePayload, StringIO(payload), 100000, n_elements - 1)
+            self.assertEquals(e.response_code, 400)
+
+
+    def testDTDRejected(self):
+
+        payload = '<?xml version="1.0"?>\n<!DOCTYPE lolz [\n <!ENTITY lol "lol">\n <!ENTITY lol2 "&lol;&lol;&lol;&lol;">\n]>\n<lolz>&lol2;</lolz>'
+        # the doctype is not visible in the bytes of other encodings
+        utf16_payload = payload.replace('version="1.0"', 'version="1.0" encoding="UTF-16"').decode('ascii').encode('utf-16')
+
+        for backend in BACKENDS:
+            xmlbackend.setBackend(backend)
+            for data in (payload, utf16_payload):
+                for chunk_size in (4, 64 * 1024):
+                    self.patch(soapresource, 'READ_CHUNK_SIZE', chunk_size)
+                    e = self.assertRaises(soapresource.PayloadRejected, soapresource.parsePayload, StringIO(data), 100000, 100)
+                    self.assertEquals(e.response_code, 400)
+
+
+    def testInvalidXML(self):
+
+        for backend in BACKENDS:
+            xmlbackend.setBackend(backend)
+            self.assertRaises(Exception, soapresource.parsePayload, StringIO('<soap:Envelope><unclosed>'), 100000, 100)
+
+
+
+class SOAPResourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.decoded = []
+        self.soap_resource = soapresource.SOAPResource(max_payload_size=10000, max_payload_elements=50)
+        self.soap_resource.registerDecoder(ACTION, self.decoder)
+
+
+    def decoder(self, soap_envelope, request_info):
+        header, request = helper.parseRequestEnvelope(soap_envelope)
+        self.decoded.append(request.connectionId)
+        return helper.createGenericProviderAcknowledgement( nsa.NSIHeader(header.requester_nsa, header.provider_nsa, header.correlation_id) )
+
+
+    def testDispatch(self):
+
+        request = createRequest(createPayload())
+        self.assertEquals(self.soap_resource.render_POST(request), server.NOT_DONE_YET)
+        self.assertEquals(self.decoded, [ 'conn-1' ])
+        self.assertEquals(request.responseCode, None) # 200
+
+        header, ack = helper.parseRequest( ''.join(request.written) )
+        self.assertEquals(header.correlation_id, 'urn:uuid:123')
+
+
+    def testUnknownAction(self):
+
+        request = createRequest(createPayload(), soap_action='"bogus"')
+        self.soap_resource.render_POST(request)
+        self.assertEquals(request.responseCode, 406)
+        self.assertEquals(request.content.tell(), 0) # body not read
+        self.assertEquals(self.decoded, [])
+
+
+    def testContentLengthTooLarge(self):
+
+        request = createRequest(createPayload(), content_length=10001)
+        self.soap_resource.render_POST(request)
+        self.assertEquals(request.responseCode, 413)
+        self.assertEquals(request.content.tell(), 0) # body not read
+        self.assertEquals(self.decoded, [])
+
+
+    def testPayloadTooLarge(self):
+        # payload size is also checked while reading, content length can be missing or wrong
+
+        request = createRequest(createPayload('x' * 10000), content_length=100)
+        self.soap_resource.render_POST(request)
+        self.assertEquals(request.responseCode, 413)
+        self.assertEquals(self.decoded, [])
+
+
+    def testInvalidXML(self):
+
+        request = createRequest('<soap:Envelope>')
+        self.soap_resource.render_POST(request)
+        self.assertEquals(request.responseCode, 500)
+        fault_code, fault_string, detail = minisoap.parseFault( ''.join(request.written) )
+        self.assertIn('Invalid XML payload', fault_string)
+        self.assertEquals(self.decoded, [])
+
+
+
+
+class RecordingResource(resource.Resource):
+
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.bodies = []
+
+    def render_POST(self, request):
+        self.bodies.append(request.content.read())
+        return 'ok'
+
+
+
+class PayloadLimitedRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resource = RecordingResource()
+        site = server.Site(self.resource, requestFactory=soapresource.createRequestFactory(100))
+        self.transport = proto_helpers.StringTransport()
+        self.channel = site.buildProtocol(None)
+        self.channel.makeConnection(self.transport)
+
+
+    def tearDown(self):
+        self.channel.connectionLost(None)
+
+
+    def testSmallBody(self):
+
+        self.channel.dataReceived('POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\n\r\nhello')
+        self.assertEquals(self.resource.bodies, [ 'hello' ])
+        self.assertTrue(self.transport.value().startswith('HTTP/1.1 200'))
+
+
+    def testContentLengthTooLarge(self):
+
+        self.channel.dataReceived('POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 101\r\n\r\n')
+        self.assertTrue(self.transport.value().startswith('HTTP/1.1 413'))
+        self.assertTrue(self.transport.disconnecting)
+
+        self.channel.dataReceived('x' * 101)
+        self.assertEquals(self.resource.bodies, [])
+
+
+    def testChunkedBodyTooLarge(self):
+        # no content length, the body is counted as it is received
+
+        self.channel.dataReceived('POST / HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n')
+        self.channel.dataReceived('32\r\n' + 'x' * 50 + '\r\n')
+        self.assertEquals(self.transport.value(), '')
+
+        self.channel.dataReceived('33\r\n' + 'x' * 51 + '\r\n0\r\n\r\n')
+        self.assertTrue(self.transport.value().startswith('HTTP/1.1 413'))
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEquals(self.resource.bodies, [])
@@ -0,0 +1,96 @@
+from twisted.trial import unittest
+
+from opennsa import nsa, error, constants as cnt
+from opennsa.protocols.shared import xmlbackend, soaptemplate
+from opennsa.protocols.nsi2 import helper, providerclient
+from opennsa.protocols.nsi2.bindings import nsiconnection
+
+
+REQUESTER = 'urn:ogf:network:aruba.net:nsa:requester'
+PROVIDER  = 'urn:ogf:network:aruba.net:nsa:provider'
+
+BACKENDS = xmlbackend.BACKENDS if xmlbackend.HAS_LXML else [ xmlbackend.ETREE ]
+
+
+
+class SOAPTemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = xmlbackend.backend
+        self.pretty_print = xmlbackend.pretty_print
+
+
+    def tearDown(self):
+        xmlbackend.setBackend(self.backend, self.pretty_print)
+
+
+    def _assertSameAsElementPath(self, template, create, *values):
+        # template must give the exact same payload as creating it through the element tree
+        for backend in BACKENDS:
+            for pretty in (True, False):
+                xmlbackend.setBackend(backend, pretty)
+                self.assertEquals(template.render(*values), create(*values))
+
+
+    def testAcknowledgement(self):
+
+        for template, protocol_type in ( (helper._PROVIDER_ACKNOWLEDGEMENT, cnt.CS2_PROVIDER), (helper._REQUESTER_ACKNOWLEDGEMENT, cnt.CS2_REQUESTER) ):
+            create = lambda *v : helper._createGenericAcknowledgement(*v, protocol_type=protocol_type)
+            self._assertSameAsElementPath(template, create, 'urn:uuid:123', REQUESTER, PROVIDER)
+            self._assertSameAsElementPath(template, create, None, REQUESTER, PROVIDER)
+
+        header = nsa.NSIHeader(REQUESTER, PROVIDER, correlation_id='urn:uuid:123')
+        ack_header, ack = helper.parseRequest( helper.createGenericProviderAcknowledgement(header) )
+        self.assertEquals(ack_header.correlation_id, 'urn:uuid:123')
+        self.assertEquals(ack_header.requester_nsa, REQUESTER)
+        self.assertEquals(ack_header.provider_nsa, PROVIDER)
+        self.assertEquals(type(ack), nsiconnection.GenericAcknowledgmentType)
+
+
+    def testGenericConfirmed(self):
+
+        for element_name, template in providerclient._GENERIC_CONFIRMED.items():
+            create = lambda *v : providerclient._createGenericConfirmed(element_name, *v)
+            self._assertSameAsElementPath(template, create, 'urn:uuid:123', REQUESTER, PROVIDER, 'conn-1')
+            self._assertSameAsElementPath(template, create, 'urn:uuid:123', REQUESTER, PROVIDER, None)
+            self._assertSameAsElementPath(template, create, 'urn:uuid:123', REQUESTER, PROVIDER, 'conn-1\r\n&<>')
+
+
+    def testGenericFailed(self):
+
+        for element_name, template in providerclient._GENERIC_FAILED.items():
+            create = lambda *v : providerclient._createGenericFailed(element_name, *v)
+            for active, consistent in ( (True, True), (False, True), (True, False) ):
+                values = ('urn:uuid:123', REQUESTER, PROVIDER, 'conn-1', 'ReserveFailed', 'Released', 'Created', active, 3, consistent,
+                          PROVIDER, None, None, '00500', u'Error: \xe6\xf8\xe5')
+                self._assertSameAsElementPath(template, create, *values)
+
+
+    def testEscaping(self):
+
+        value = 'a & b <c> "d" \'e\''
+        for backend in BACKENDS:
+            xmlbackend.setBackend(backend)
+            payload = providerclient._GENERIC_CONFIRMED[nsiconnection.provisionConfirmed].render(value, REQUESTER, PROVIDER, value)
+            header, confirm = helper.parseRequest(payload)
+            self.assertEquals(header.correlation_id, value)
+            self.assertEquals(confirm.connectionId, value)
+
+        self.assertEquals(soaptemplate.escape('<a&b>\r', xmlbackend.ETREE), '&lt;a&amp;b&gt;\r')
+        self.assertEquals(soaptemplate.escape('<a&b>\r', xmlbackend.LXML), '&lt;a&amp;b&gt;&#13;')
+        self.assertEquals(soaptemplate.escape(u'\xe6'), '\xc3\xa6')
+        self.assertEquals(soaptemplate.escape(42), '42')
+
+
+    def testServiceExceptionVariables(self):
+        # failures with variables are not templated, check that they still come through
+
+        err = error.ConnectionNonExistentError('No connection', variables=[ ('connectionId', 'conn-1') ])
+        se = helper.createServiceException(err, PROVIDER)
+        payload = providerclient._createGenericFailed(nsiconnection.reserveFailed, 'urn:uuid:123', REQUESTER, PROVIDER, 'conn-1',
+                                                      'ReserveFailed', 'Released', 'Created', False, 0, True,
+                                                      se.nsaId, se.connectionId, se.serviceType, se.errorId, se.text, se.variables)
+        header, failure = helper.parseRequest(payload)
+        self.assertEquals(failure.serviceException.variables[0].type, 'connectionId')
+        self.assertEquals(failure.connectionStates.dataPlaneStatus.versionConsistent, True)
+
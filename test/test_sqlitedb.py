@@ -0,0 +1,78 @@
+import os
+import datetime
+import tempfile
+
+from twisted.trial import unittest
+
+from opennsa import nsa, sqlitedb
+from opennsa.ext.iso8601 import iso8601
+
+
+
+class SQLiteDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlitedb.connect()
+
+
+    def tearDown(self):
+        self.conn.close()
+
+
+    def testTranslate(self):
+
+        query, args = sqlitedb.translate('SELECT * FROM t WHERE a = %s AND b IN %s AND c LIKE %s', (1, ('x', 'y'), 'z%%'))
+        self.assertEquals(query, 'SELECT * FROM t WHERE a = ? AND b IN (?, ?) AND c LIKE ?')
+        self.assertEquals(args, [ 1, 'x', 'y', 'z%%' ])
+
+        query, args = sqlitedb.translate("SELECT '100%%'", None)
+        self.assertEquals(query, "SELECT '100%%'")
+        self.assertEquals(args, ())
+
+        query, args = sqlitedb.translate("SELECT '100%%' WHERE a = %s", (1,))
+        self.assertEquals(query, "SELECT '100%' WHERE a = ?")
+
+
+    def testAdaptation(self):
+
+        label = nsa.Label('vlan', '1780-1782')
+        attrs = [ nsa.SecurityAttribute('user', 'alice') ]
+        start = datetime.datetime(2017, 5, 4, 12, 0, 0, tzinfo=iso8601.TimeZone(datetime.timedelta(hours=2)))
+
+        cur = self.conn.cursor()
+        cur.execute('INSERT INTO service_connections (connection_id, revision, requester_nsa, reserve_time, reservation_state, provision_state, lifecycle_state, '
+                    'source_network, source_port, source_label, dest_network, dest_port, start_time, symmetrical, directionality, bandwidth, '
+                    'security_attributes, connection_trace) '
+                    'VALUES (%s, 0, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                    ('conn-1', 'urn:ogf:network:example.org:nsa', datetime.datetime.utcnow(), 'ReserveStart', 'Released', 'Created',
+                     'src-net', 'src-port', label, 'dst-net', 'dst-port', start, True, 'Bidirectional', 100, attrs, [ 'urn:a:nsa', 'urn:b:nsa' ]))
+
+        cur.execute('SELECT source_label, dest_label, start_time, symmetrical, security_attributes, connection_trace FROM service_connections WHERE connection_id = %s', ('conn-1',))
+        source_label, dest_label, start_time, symmetrical, security_attributes, connection_trace = cur.fetchone()
+
+        self.assertEquals( (source_label.type_, source_label.labelValue()), ('vlan', '1780-1782') )
+        self.assertEquals(dest_label, None)
+        self.assertEquals(start_time, datetime.datetime(2017, 5, 4, 10, 0, 0))
+        self.assertIs(symmetrical, True)
+        self.assertEquals( [ (a.type_, a.value) for a in security_attributes ], [ ('user', 'alice') ])
+        self.assertEquals(connection_trace, [ 'urn:a:nsa', 'urn:b:nsa' ])
+
+
+    def testSchemaCreatedOnce(self):
+
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        conn = sqlitedb.connect(path)
+        conn.cursor().execute('INSERT INTO backend_connection_id (connection_id) VALUES (%s)', (42,))
+        conn.commit()
+        conn.close()
+
+        # reopening keeps the data
+        conn = sqlitedb.connect(path)
+        cur = conn.cursor()
+        cur.execute('SELECT connection_id FROM backend_connection_id')
+        self.assertEquals(cur.fetchall(), [ (42,) ])
+        conn.close()
+
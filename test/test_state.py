@@ -0,0 +1,94 @@
+import uuid
+import datetime
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from twistar.registry import Registry
+
+from opennsa import state, error
+from opennsa.backends.common import genericbackend
+
+from . import db
+
+
+
+class StateTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        db.setupDatabase()
+        now = datetime.datetime.utcnow()
+        self.conn = genericbackend.GenericBackendConnections(connection_id=str(uuid.uuid1()), revision=0, global_reservation_id=None, description='test',
+                        requester_nsa='req-nsa', reserve_time=now,
+                        reservation_state=state.RESERVE_START, provision_state=state.RELEASED, lifecycle_state=state.CREATED, data_plane_active=False,
+                        source_network='src-net', source_port='src-port', source_label=None, dest_network='dst-net', dest_port='dst-port', dest_label=None,
+                        start_time=None, end_time=now + datetime.timedelta(hours=1),
+                        symmetrical=False, directionality='Bidirectional', bandwidth=200, allocated=False)
+        yield self.conn.save()
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.conn.delete()
+        Registry.DBPOOL.close()
+
+
+    def dbRow(self):
+        return genericbackend.GenericBackendConnections.find(self.conn.id)
+
+
+    @defer.inlineCallbacks
+    def testOnlyStateIsWritten(self):
+
+        self.conn.description = 'changed in memory only'
+        yield state.reserveChecking(self.conn)
+
+        row = yield self.dbRow()
+        self.assertEquals(row.reservation_state, state.RESERVE_CHECKING)
+        self.assertEquals(row.description, 'test')
+
+
+    @defer.inlineCallbacks
+    def testMultiSwitch(self):
+
+        yield state.reserveChecking(self.conn)
+        yield state.reserveMultiSwitch(self.conn, state.RESERVE_HELD, state.RESERVE_COMMITTING, state.RESERVE_START, allocated=True)
+        yield state.multiSwitch(self.conn, state.PROVISIONING, state.PROVISIONED, state.TERMINATING)
+
+        row = yield self.dbRow()
+        self.assertEquals( (row.reservation_state, row.provision_state, row.lifecycle_state, row.allocated),
+                           (state.RESERVE_START, state.PROVISIONED, state.TERMINATING, True) )
+
+        self.assertRaises(error.InternalServerError, state.multiSwitch, self.conn, state.RELEASED)
+        self.assertRaises(error.InternalServerError, state.reserveMultiSwitch, self.conn, state.RESERVE_CHECKING, state.RELEASING)
+
+
+    @defer.inlineCallbacks
+    def testConcurrentChange(self):
+
+        other = yield self.dbRow() # another object for the same row
+        yield state.reserveChecking(other)
+
+        try:
+            yield state.reserveChecking(self.conn)
+            self.fail('Should have raised InvalidTransitionError')
+        except error.InvalidTransitionError:
+            pass # expected
+        self.assertEquals(self.conn.reservation_state, state.RESERVE_START)
+
+
+    @defer.inlineCallbacks
+    def testConcurrentChangeExtraColumns(self):
+
+        other = yield self.dbRow()
+        yield state.reserveChecking(other)
+
+        try:
+            yield state.reserveMultiSwitch(self.conn, state.RESERVE_CHECKING, allocated=True)
+            self.fail('Should have raised InvalidTransitionError')
+        except error.InvalidTransitionError:
+            pass # expected
+        # the extra columns are restored as well, or a later save would write them
+        self.assertEquals(self.conn.reservation_state, state.RESERVE_START)
+        self.assertEquals(self.conn.allocated, False)
@@ -0,0 +1,85 @@
+from twisted.trial import unittest
+from twisted.internet import task
+
+from opennsa import error
+from opennsa.shared import metrics, subscriptions
+
+
+
+class SubscriptionRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.clock = task.Clock()
+        self.registry = subscriptions.SubscriptionRegistry('test.subscriptions', max_subscribers=2)
+        self.registry.clock = self.clock
+        self.notified = []
+
+
+    def testCancel(self):
+
+        s1 = self.registry.subscribe('conn-1', lambda : self.notified.append(1))
+        s2 = self.registry.subscribe('conn-1', lambda : self.notified.append(2))
+
+        self.registry.notify('conn-1')
+        self.assertEquals(self.notified, [1, 2])
+
+        s1.cancel()
+        s1.cancel()
+        self.registry.notify('conn-1')
+        self.assertEquals(self.notified, [1, 2, 2])
+
+        s2.cancel()
+        self.assertEquals(len(self.registry), 0) # no empty keys
+        self.failIf(s2.active)
+
+
+    def testUnsubscribeFromNotification(self):
+
+        def update():
+            self.notified.append(1)
+            subscription.cancel()
+
+        subscription = self.registry.subscribe('conn-1', update)
+        self.registry.notify('conn-1')
+        self.registry.notify('conn-1')
+        self.assertEquals(self.notified, [1])
+        self.assertEquals(len(self.registry), 0)
+
+
+    def testTerminal(self):
+
+        expired = []
+        self.registry.subscribe('conn-1', lambda : self.notified.append(1), expired=lambda : expired.append(1))
+
+        self.registry.notify('conn-1', terminal=True)
+        self.assertEquals(self.notified, [1]) # last notification before expiry
+        self.assertEquals(expired, [1])
+        self.assertEquals(len(self.registry), 0)
+
+
+    def testTimeout(self):
+
+        expired = []
+        s1 = self.registry.subscribe('conn-1', lambda : None, timeout=10, expired=lambda : expired.append(1))
+        s2 = self.registry.subscribe('conn-2', lambda : None, timeout=10)
+        s2.cancel()
+
+        self.clock.advance(10)
+        self.failIf(s1.active)
+        self.assertEquals(expired, [1])
+        self.assertEquals(len(self.registry), 0)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def testMaxSubscribers(self):
+
+        self.registry.subscribe('conn-1', lambda : None)
+        self.registry.subscribe('conn-1', lambda : None)
+        self.failUnlessRaises(error.ResourceUnavailableError, self.registry.subscribe, 'conn-1', lambda : None)
+        self.registry.subscribe('conn-2', lambda : None)
+
+        snapshot = metrics.snapshot()
+        self.assertEquals(snapshot['test.subscriptions.connections'], 2)
+        self.assertEquals(snapshot['test.subscriptions.subscribers'], 3)
+        self.assertEquals(snapshot['test.subscriptions.rejected'], 1)
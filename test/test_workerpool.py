@@ -0,0 +1,114 @@
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from opennsa import nsa
+from opennsa.shared import metrics
+from opennsa.protocols.shared import minisoap, soapresource, workerpool
+from opennsa.protocols.nsi2 import helper
+
+from . import test_soapresource
+
+
+
+def currentThread(value):
+    return value, threading.current_thread().name
+
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        workerpool.setup(2, 1000)
+
+
+    def tearDown(self):
+        workerpool.setup(0, workerpool.DEFAULT_THRESHOLD)
+        metrics.reset()
+
+
+    @defer.inlineCallbacks
+    def testInline(self):
+
+        d = workerpool.run(999, currentThread, 42)
+        self.assertTrue(d.called) # done before returning
+        value, thread_name = yield d
+        self.assertEquals(value, 42)
+        self.assertEquals(thread_name, threading.current_thread().name)
+
+        value, thread_name = yield workerpool.run(None, currentThread, 42)
+        self.assertEquals(thread_name, threading.current_thread().name)
+
+        self.assertEquals(metrics.snapshot()['xmlworker.inline'], 2)
+
+
+    @defer.inlineCallbacks
+    def testPooled(self):
+
+        values = yield defer.gatherResults( [ workerpool.run(1000, currentThread, i) for i in range(5) ] )
+
+        self.assertEquals([ v for v, _ in values ], range(5))
+        for _, thread_name in values:
+            self.assertNotEqual(thread_name, threading.current_thread().name)
+
+        snapshot = metrics.snapshot()
+        self.assertEquals(snapshot['xmlworker.pooled'], 5)
+        self.assertEquals(snapshot['xmlworker.pending'], 0)
+        self.assertEquals(snapshot['xmlworker.queue_wait.count'], 5)
+        self.assertEquals(snapshot['xmlworker.execution.count'], 5)
+        self.assertTrue(snapshot['xmlworker.execution.max'] <= snapshot['xmlworker.execution.total'])
+
+
+    def testPooledError(self):
+
+        d = workerpool.run(1000, int, 'not a number')
+        return self.assertFailure(d, ValueError)
+
+
+    def testDisabled(self):
+
+        workerpool.setup(0)
+        self.assertFalse(workerpool.enabled())
+        d = workerpool.run(10 ** 9, currentThread, 42)
+        self.assertEquals(d.result[1], threading.current_thread().name)
+        return d
+
+
+    @defer.inlineCallbacks
+    def testSOAPResource(self):
+        # parse and query result decoding in the pool
+
+        workerpool.setup(2, 0)
+
+        decoded = []
+        def decoder(soap_envelope, request_info):
+            d = workerpool.run(request_info.payload_size, helper.parseRequestEnvelope, soap_envelope)
+            d.addCallback(lambda (header, request) : decoded.append(request.connectionId) or \
+                            helper.createGenericProviderAcknowledgement( nsa.NSIHeader(header.requester_nsa, header.provider_nsa, header.correlation_id) ))
+            return d
+
+        soap_resource = soapresource.SOAPResource()
+        soap_resource.registerDecoder(test_soapresource.ACTION, decoder)
+
+        payload = test_soapresource.createPayload()
+        request = test_soapresource.createRequest(payload)
+        d = request.notifyFinish()
+        soap_resource.render_POST(request)
+        yield d
+
+        self.assertEquals(decoded, [ 'conn-1' ])
+        header, ack = helper.parseRequest( ''.join(request.written) )
+        self.assertEquals(header.correlation_id, 'urn:uuid:123')
+        self.assertEquals(metrics.snapshot()['xmlworker.pooled'], 2)
+
+        # invalid xml is still a soap fault
+        request = test_soapresource.createRequest('<soap:Envelope>')
+        d = request.notifyFinish()
+        soap_resource.render_POST(request)
+        yield d
+        self.assertEquals(request.responseCode, 500)
+        fault_code, fault_string, detail = minisoap.parseFault( ''.join(request.written) )
+        self.assertIn('Invalid XML payload', fault_string)
+
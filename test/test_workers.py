@@ -0,0 +1,211 @@
+import os
+import random
+import tempfile
+
+from twisted.internet import reactor, defer, task
+from twisted.trial import unittest
+from twisted.application import service
+
+from opennsa import nsa, error, workers
+
+from . import common, db
+
+
+
+class FakeBackend:
+
+    def __init__(self):
+        self.parent_requester = None
+        self.queries = []
+
+    def reserve(self, header, connection_id, global_reservation_id, description, criteria, request_info=None):
+        self.parent_requester.reserveConfirmed(header, 'conn-1', global_reservation_id, description, criteria)
+        return defer.succeed('conn-1')
+
+    def terminate(self, header, connection_id, request_info=None):
+        raise error.ConnectionNonExistentError('No connection with id %s' % connection_id)
+
+    def querySummary(self, header, connection_ids=None, global_reservation_ids=None, request_info=None):
+        self.queries.append(connection_ids)
+
+
+
+class Election:
+    leader = False
+
+
+
+class RPCTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+
+        socket_path = os.path.join(tempfile.mkdtemp(), 'opennsa-test.sock')
+
+        self.leader_requester = common.DUDRequester()
+        self.worker_requester = common.DUDRequester()
+
+        self.backend = FakeBackend()
+        self.router = workers.ReplyRouter(self.leader_requester)
+        self.backend.parent_requester = self.router
+        self.port = reactor.listenUNIX(socket_path, workers.LeaderFactory(self.backend, self.router))
+
+        self.client = workers.LeaderClientFactory(self.worker_requester)
+        self.connector = reactor.connectUNIX(socket_path, self.client)
+        while self.client.proto is None:
+            yield task.deferLater(reactor, 0.01, lambda : None)
+
+        self.election = Election()
+        self.dispatcher = workers.BackendDispatcher(self.backend, self.election, self.client)
+
+
+    def tearDown(self):
+        self.client.stopTrying()
+        self.connector.disconnect()
+        return self.port.stopListening()
+
+
+    @defer.inlineCallbacks
+    def testForwardedReserve(self):
+
+        header = nsa.NSIHeader('requester', 'provider')
+        connection_id = yield self.dispatcher.reserve(header, None, 'gid', 'desc', None)
+        self.assertEquals(connection_id, 'conn-1')
+
+        # the reply goes to the worker which did the request
+        reply = yield self.worker_requester.reserve_defer
+        self.assertEquals(reply[0].correlation_id, header.correlation_id)
+        self.assertEquals(reply[1:4], ('conn-1', 'gid', 'desc'))
+        self.assertFalse(self.leader_requester.reserve_defer.called)
+        self.assertEquals(self.router.routes, {})
+
+
+    @defer.inlineCallbacks
+    def testForwardedError(self):
+
+        try:
+            yield self.dispatcher.terminate(nsa.NSIHeader('requester', 'provider'), 'conn-2')
+            self.fail('Should have raised ConnectionNonExistentError')
+        except error.ConnectionNonExistentError as e:
+            self.assertIn('conn-2', str(e))
+        self.assertEquals(self.router.routes, {})
+
+
+    def testLocalOperations(self):
+
+        # queries are done locally, and so is everything when this process is the leader
+        self.dispatcher.querySummary(nsa.NSIHeader('requester', 'provider'), [ 'conn-3' ])
+        self.assertEquals(self.backend.queries, [ [ 'conn-3' ] ])
+
+        self.election.leader = True
+        self.dispatcher.reserve(nsa.NSIHeader('requester', 'provider'), None, None, None, None)
+        self.assertTrue(self.leader_requester.reserve_defer.called)
+
+
+    def testNotificationsGoToLeader(self):
+
+        # not a reply to a forwarded request
+        self.router.errorEvent(nsa.NSIHeader('requester', 'provider'), 'conn-4', 1, None, 'activateFailed', None, None)
+        self.assertTrue(self.leader_requester.error_event_defer.called)
+        self.assertFalse(self.worker_requester.error_event_defer.called)
+
+
+
+class LeaderElectionTest(unittest.TestCase):
+
+    skip = db.REQUIRES_POSTGRESQL
+
+    def setUp(self):
+        lock_id = random.randint(1, 2**31)
+        self.elections = []
+        self.services = []
+        for _ in range(2):
+            election = workers.LeaderElection(lock_id, interval=3600, **db.connectionArguments())
+            svc = service.Service()
+            svc.setServiceParent(election)
+            self.elections.append(election)
+            self.services.append(svc)
+
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for election in self.elections:
+            if election.running:
+                yield election.stopService()
+
+
+    @defer.inlineCallbacks
+    def testFailover(self):
+
+        first, second = self.elections
+        for election in self.elections:
+            service.Service.startService(election) # checks are done by the test, not periodically
+
+        yield first.check()
+        yield second.check()
+
+        self.assertTrue(first.leader)
+        self.assertFalse(second.leader)
+        self.assertEquals( [ svc.running for svc in self.services ], [ True, False ])
+
+        # still leader
+        yield first.check()
+        self.assertTrue(first.leader)
+
+        # leader stops, releasing the lock
+        yield first.stopService()
+        self.assertFalse(self.services[0].running)
+
+        yield second.check()
+        self.assertTrue(second.leader)
+        self.assertTrue(self.services[1].running)
+
+
+
+class HangingConnection:
+    # connection to a database which has gone away without closing (half-open)
+
+    def __init__(self):
+        self.open = True
+
+    def closed(self):
+        return not self.open
+
+    def execute(self, query, args=None):
+        return defer.Deferred()
+
+    def close(self):
+        self.open = False
+
+
+
+class LeaderCheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.election = workers.LeaderElection(1, 'opennsa', 'opennsa', interval=5)
+        self.election.clock = self.clock
+        self.svc = service.Service()
+        self.svc.setServiceParent(self.election)
+        service.Service.startService(self.election) # checks are done by the test
+
+
+    @defer.inlineCallbacks
+    def testStepDownOnTimeout(self):
+
+        hooks = []
+        self.election.addPromotionHook(lambda : hooks.append(1))
+        yield self.election._promote()
+        self.assertEquals(hooks, [1])
+        self.assertTrue(self.svc.running)
+
+        connection = self.election.connection = HangingConnection()
+        d = self.election.check()
+        self.assertNoResult(d)
+
+        self.clock.advance(5)
+        self.successResultOf(d)
+        self.assertFalse(self.election.leader)
+        self.assertFalse(self.svc.running)
+        self.assertTrue(connection.closed())
+        self.assertEquals(self.clock.getDelayedCalls(), [])
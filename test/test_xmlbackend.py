@@ -0,0 +1,208 @@
+from twisted.trial import unittest
+
+from opennsa import nsa, error, constants as cnt
+from opennsa.protocols.shared import minisoap, xmlbackend
+from opennsa.protocols.nsi2 import helper
+from opennsa.protocols.nsi2.bindings import nsiconnection, nsiframework, p2pservices
+
+
+REQUESTER = 'urn:ogf:network:aruba.net:nsa:requester'
+PROVIDER  = 'urn:ogf:network:aruba.net:nsa:provider'
+REPLY_TO  = 'http://localhost/reply'
+
+SOURCE_STP = 'urn:ogf:network:aruba.net:topology:ps?vlan=1780'
+DEST_STP   = 'urn:ogf:network:aruba.net:topology:bon?vlan=1780'
+TIMESTAMP  = '2017-05-04T10:00:00Z'
+
+BACKENDS = xmlbackend.BACKENDS if xmlbackend.HAS_LXML else [ xmlbackend.ETREE ]
+
+
+
+def createMessages():
+    # (header, body) for every message type in the bindings, elements must be created with the current backend
+
+    provider_header  = lambda : helper.createProviderHeader(REQUESTER, PROVIDER, REPLY_TO, 'urn:uuid:123',
+                                                            [ nsa.SecurityAttribute('user', 'alice') ], [ 'urn:trace:a', 'urn:trace:b' ])
+    requester_header = lambda : helper.createRequesterHeader(REQUESTER, PROVIDER, correlation_id='urn:uuid:456')
+
+    def serviceDef(parameters=None):
+        return p2pservices.P2PServiceBaseType(100, cnt.BIDIRECTIONAL, False, SOURCE_STP, DEST_STP, None, parameters or [])
+
+    def connectionStates():
+        return nsiconnection.ConnectionStatesType('ReserveStart', 'Provisioned', 'Created', nsiconnection.DataPlaneStatusType(True, 2, False))
+
+    def serviceException():
+        child = nsiconnection.ServiceExceptionType('urn:ogf:network:aruba.net:nsa:child', 'child-1', None, '00500', 'Child error', None, None)
+        variables = [ nsiconnection.TypeValuePairType('connectionId', 'http://example.org/ns', [ 'conn-1' ]) ]
+        return nsiconnection.ServiceExceptionType(PROVIDER, 'conn-1', str(p2pservices.p2ps), '00500', 'Error & <reason>', variables, [ child ])
+
+    schedule = nsiconnection.ScheduleType(TIMESTAMP, '2017-05-04T12:00:00Z')
+
+    reserve_criteria = nsiconnection.ReservationRequestCriteriaType(2, schedule, cnt.EVTS_AGOLE, serviceDef([ p2pservices.TypeValueType('mtu', '9000') ]))
+    confirm_criteria = nsiconnection.ReservationConfirmCriteriaType(2, schedule, cnt.EVTS_AGOLE, str(p2pservices.p2ps), serviceDef())
+    summary_criteria = nsiconnection.QuerySummaryResultCriteriaType(2, schedule, cnt.EVTS_AGOLE,
+                                                                    [ nsiconnection.ChildSummaryType(0, 'child-1', PROVIDER, cnt.EVTS_AGOLE) ], serviceDef())
+    recursive_child  = nsiconnection.ChildRecursiveType(0, 'child-1', PROVIDER, connectionStates(),
+                                                        [ nsiconnection.QueryRecursiveResultCriteriaType(1, schedule, str(p2pservices.p2ps), [], serviceDef()) ])
+    recursive_criteria = nsiconnection.QueryRecursiveResultCriteriaType(2, schedule, str(p2pservices.p2ps), [ recursive_child ], serviceDef())
+
+    summary_results   = [ nsiconnection.QuerySummaryResultType('conn-%i' % i, 'urn:uuid:gid', 'Test & <desc>', [ summary_criteria ],
+                                                               REQUESTER, connectionStates(), i, None) for i in range(3) ]
+    recursive_results = [ nsiconnection.QuerySummaryResultType('conn-1', None, None, [ recursive_criteria ], REQUESTER, connectionStates(), 1, None) ]
+
+    messages = [
+        ( provider_header,  nsiconnection.ReserveType(None, 'urn:uuid:gid', u'Test \xe6\xf8\xe5', reserve_criteria).xml(nsiconnection.reserve) ),
+        ( provider_header,  nsiconnection.GenericRequestType('conn-1').xml(nsiconnection.reserveCommit) ),
+        ( provider_header,  nsiconnection.GenericRequestType('conn-1').xml(nsiconnection.reserveAbort) ),
+        ( provider_header,  nsiconnection.GenericRequestType('conn-1').xml(nsiconnection.provision) ),
+        ( provider_header,  nsiconnection.GenericRequestType('conn-1').xml(nsiconnection.release) ),
+        ( provider_header,  nsiconnection.GenericRequestType('conn-1').xml(nsiconnection.terminate) ),
+        ( provider_header,  nsiconnection.QueryType([ 'conn-1', 'conn-2' ], [ 'urn:uuid:gid' ]).xml(nsiconnection.querySummary) ),
+        ( provider_header,  nsiconnection.QueryType([ 'conn-1' ], None).xml(nsiconnection.querySummarySync) ),
+        ( provider_header,  nsiconnection.QueryType([ 'conn-1' ], None).xml(nsiconnection.queryRecursive) ),
+        ( provider_header,  nsiconnection.QueryNotificationType('conn-1', 1, 10).xml(nsiconnection.queryNotification) ),
+        ( requester_header, nsiconnection.GenericAcknowledgmentType().xml(nsiconnection.acknowledgment) ),
+        ( requester_header, nsiconnection.ReserveResponseType('conn-1').xml(nsiconnection.reserveResponse) ),
+        ( requester_header, nsiconnection.ReserveConfirmedType('conn-1', 'urn:uuid:gid', 'Test', confirm_criteria).xml(nsiconnection.reserveConfirmed) ),
+        ( requester_header, nsiconnection.GenericFailedType('conn-1', connectionStates(), serviceException()).xml(nsiconnection.reserveFailed) ),
+        ( requester_header, nsiconnection.GenericFailedType('conn-1', connectionStates(), serviceException()).xml(nsiconnection.reserveCommitFailed) ),
+        ( requester_header, nsiconnection.GenericConfirmedType('conn-1').xml(nsiconnection.reserveCommitConfirmed) ),
+        ( requester_header, nsiconnection.GenericConfirmedType('conn-1').xml(nsiconnection.reserveAbortConfirmed) ),
+        ( requester_header, nsiconnection.GenericConfirmedType('conn-1').xml(nsiconnection.provisionConfirmed) ),
+        ( requester_header, nsiconnection.GenericConfirmedType('conn-1').xml(nsiconnection.releaseConfirmed) ),
+        ( requester_header, nsiconnection.GenericConfirmedType('conn-1').xml(nsiconnection.terminateConfirmed) ),
+        ( requester_header, nsiconnection.GenericErrorType(serviceException()).xml(nsiconnection.error) ),
+        ( requester_header, nsiconnection.ReserveTimeoutRequestType('conn-1', 2, TIMESTAMP, 120, 'conn-1', PROVIDER).xml(nsiconnection.reserveTimeout) ),
+        ( requester_header, nsiconnection.DataPlaneStateChangeRequestType('conn-1', 3, TIMESTAMP,
+                                                                          nsiconnection.DataPlaneStatusType(True, 1, True)).xml(nsiconnection.dataPlaneStateChange) ),
+        ( requester_header, nsiconnection.ErrorEventType('conn-1', 4, TIMESTAMP, 'forcedEnd', None, None, None, serviceException()).xml(nsiconnection.errorEvent) ),
+        ( requester_header, nsiconnection.MessageDeliveryTimeoutRequestType('conn-1', 5, TIMESTAMP, 'urn:uuid:789').xml(nsiconnection.messageDeliveryTimeout) ),
+        ( requester_header, nsiconnection.QuerySummaryConfirmedType(summary_results).xml(nsiconnection.querySummaryConfirmed) ),
+        ( requester_header, nsiconnection.QuerySummaryConfirmedType(summary_results).xml(nsiconnection.querySummarySyncConfirmed) ),
+        ( requester_header, nsiconnection.QueryRecursiveConfirmedType(recursive_results).xml(nsiconnection.queryRecursiveConfirmed) ),
+    ]
+
+    return [ (header(), body) for header, body in messages ]
+
+
+
+def dump(obj):
+    # binding / header objects -> nested tuples, so results from the backends can be compared
+    if type(obj) in (list, tuple):
+        return [ dump(o) for o in obj ]
+    if hasattr(obj, '__slots__'):
+        return ( obj.__class__.__name__, tuple( (s, dump(getattr(obj, s))) for s in obj.__slots__ ) )
+    if hasattr(obj, '__dict__'):
+        return ( obj.__class__.__name__, tuple( (k, dump(v)) for k, v in sorted(obj.__dict__.items()) ) )
+    return obj
+
+
+
+class XMLBackendParityTest(unittest.TestCase):
+
+    def setUp(self):
+        if not xmlbackend.HAS_LXML:
+            raise unittest.SkipTest('lxml not available')
+        self.backend = xmlbackend.backend
+        self.pretty_print = xmlbackend.pretty_print
+
+
+    def tearDown(self):
+        xmlbackend.setBackend(self.backend, self.pretty_print)
+
+
+    def _createPayloads(self, backend, pretty):
+        xmlbackend.setBackend(backend, pretty)
+        return [ minisoap.createSoapPayload(body, header) for header, body in createMessages() ]
+
+
+    def _parsePayloads(self, backend, payloads):
+        xmlbackend.setBackend(backend)
+        return [ dump(helper.parseRequest(payload)) for payload in payloads ]
+
+
+    def testMessageParity(self):
+
+        reference = self._parsePayloads(xmlbackend.ETREE, self._createPayloads(xmlbackend.ETREE, True))
+        self.assertEquals(len(reference), len(createMessages()))
+
+        for create_backend in xmlbackend.BACKENDS:
+            for pretty in (True, False):
+                payloads = self._createPayloads(create_backend, pretty)
+                for parse_backend in xmlbackend.BACKENDS:
+                    result = self._parsePayloads(parse_backend, payloads)
+                    for ref, res in zip(reference, result):
+                        self.assertEquals(ref, res, 'Mismatch, created with %s (pretty: %s), parsed with %s' % (create_backend, pretty, parse_backend))
+
+
+    def testValuesPreserved(self):
+
+        for backend in xmlbackend.BACKENDS:
+            payloads = self._createPayloads(backend, False)
+            header, reserve = helper.parseRequest(payloads[0])
+            self.assertEquals(header.security_attributes[0].value, 'alice')
+            self.assertEquals(reserve.description, u'Test \xe6\xf8\xe5')
+
+            header, failure = helper.parseRequest(payloads[13])
+            se = failure.serviceException
+            self.assertEquals(se.text, 'Error & <reason>')
+            self.assertEquals(se.variables[0].value, 'conn-1')
+            self.assertEquals(se.childException[0].connectionId, 'child-1')
+
+
+    def testPrettyPrint(self):
+
+        for backend in xmlbackend.BACKENDS:
+            payload = self._createPayloads(backend, True)[1]
+            self.assertIn('\n  ', payload)
+            self.assertIn('<soap:Envelope ', payload)
+
+            payload = self._createPayloads(backend, False)[1]
+            self.assertNotIn('\n', payload)
+            self.assertIn('<soap:Envelope ', payload)
+
+
+    def testFaultParity(self):
+
+        results = []
+        for backend in xmlbackend.BACKENDS:
+            for pretty in (True, False):
+                xmlbackend.setBackend(backend, pretty)
+                err = error.ConnectionNonExistentError('No connection with id conn-1')
+                se = helper.createServiceException(err, PROVIDER, 'conn-1')
+                fault = minisoap.createSoapFault(err.message, se.xml(nsiframework.serviceException))
+                for parse_backend in xmlbackend.BACKENDS:
+                    xmlbackend.setBackend(parse_backend)
+                    code, string, detail = minisoap.parseFault(fault)
+                    results.append( (code, string, dump(nsiframework.parse(detail))) )
+
+        for result in results:
+            self.assertEquals(result, results[0])
+        self.assertEquals(results[0][2][1][0], ('nsaId', PROVIDER))
+
+
+
+class XMLBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = xmlbackend.backend
+
+
+    def tearDown(self):
+        xmlbackend.setBackend(self.backend)
+
+
+    def testDTDRejected(self):
+
+        payload = '<!DOCTYPE a [ <!ENTITY b "c"> ]><a>&b;</a>'
+        for backend in BACKENDS:
+            xmlbackend.setBackend(backend)
+            self.assertRaises(xmlbackend.DTDForbidden, xmlbackend.fromstring, payload)
+            self.assertRaises(xmlbackend.DTDForbidden, xmlbackend.fromstring, '<!DOCTYPE a SYSTEM "http://example.org/a.dtd"><a/>')
+            self.assertEquals(xmlbackend.fromstring('<a>b</a>').text, 'b')
+
+
+    def testInvalidBackend(self):
+
+        self.assertRaises(ValueError, xmlbackend.setBackend, 'minidom')
+
@@ -29,3 +29,15 @@ ethernet     bon     bonaire#dom-(in|out)    vlan:1781-1782  100     em2    -
 ethernet     cur     curacao#dom-(in|out)    vlan:1783-1786  1000    em3    -
 """
 
+
+# Aruba split into two backends, connected by an internal link
+
+ARUBA_BACKEND_A_TOPOLOGY = """
+ethernet     ps      -                              vlan:1780-1789  1000    em0    -
+ethernet     to-b    aruba:topology#from-a-(in|out) vlan:1780-1789  1000    em1    -
+"""
+
+ARUBA_BACKEND_B_TOPOLOGY = """
+ethernet     from-a  aruba:topology#to-b-(in|out)   vlan:1780-1789  1000    em0    -
+ethernet     bon     bonaire#aru-(in|out)           vlan:1780-1789  1000    em1    -
+"""